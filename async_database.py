@@ -0,0 +1,225 @@
+import asyncio
+import os
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+from mysql.connector import Error
+from database import Database
+
+class _Connection:
+    """A pooled Database and the one thread that runs all of its statements
+    
+    Database serializes statements with a lock owned by the calling
+    thread (transaction() holds it for the whole block), so every call
+    for one connection, including the enter and exit of a transaction,
+    must run on the same thread.
+    """
+    
+    def __init__(self, index):
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix=f'async-db-{index}')
+        self.db = None
+
+class AsyncDatabase:
+    """Asyncio facade over a bounded pool of Database connections
+    
+    Every awaitable runs the blocking call on a pooled connection's own
+    worker thread, so the event loop never blocks and at most pool_size
+    statements run at once; further callers wait for a free connection.
+    The role logic is reused unchanged through run(), e.g. two reports
+    at the same time:
+        
+        async with AsyncDatabase() as adb:
+            spend, missing = await asyncio.gather(
+                adb.run(lambda db: Queries(db).supplier_spend('MFG002')),
+                adb.run(lambda db: Queries(db).manufacturers_not_supplied_by('21')))
+    
+    timeout (seconds, per call; None waits forever) can be set for the
+    pool and overridden per call. When a call times out or its task is
+    cancelled, the running statement is killed on the server
+    (Database.interrupt), the worker is allowed to finish,
+    and the connection goes back to the pool; the caller gets
+    asyncio.TimeoutError or CancelledError. Inside a transaction the
+    interrupted statement fails, so the block rolls back.
+    """
+    
+    def __init__(self, pool_size=None, timeout=None):
+        self.pool_size = pool_size or int(os.getenv('DB_POOL_SIZE', '4'))
+        self.timeout = timeout
+        self._connections = []
+        self._free = None
+    
+    async def open(self):
+        """Open the pool's connections (concurrently)"""
+        if self._free is not None:
+            return self
+        loop = asyncio.get_running_loop()
+        self._connections = [_Connection(i) for i in range(self.pool_size)]
+        try:
+            databases = await asyncio.gather(*(loop.run_in_executor(c.executor, Database)
+                                               for c in self._connections))
+        except BaseException:
+            await self.close()
+            raise
+        self._free = asyncio.Queue()
+        for connection, db in zip(self._connections, databases):
+            connection.db = db
+            self._free.put_nowait(connection)
+        return self
+    
+    async def close(self):
+        """Close every connection and stop the worker threads"""
+        loop = asyncio.get_running_loop()
+        for connection in self._connections:
+            if connection.db is not None:
+                await loop.run_in_executor(connection.executor, connection.db.close)
+                connection.db = None
+            connection.executor.shutdown(wait=True)
+        self._connections = []
+        self._free = None
+    
+    async def __aenter__(self):
+        return await self.open()
+    
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.close()
+    
+    async def execute(self, query, params=None, fetch=True, row_format='dict', timeout=None):
+        """Awaitable Database.execute on a pooled connection"""
+        async with self._acquire() as connection:
+            return await self._call(connection, timeout, connection.db.execute,
+                                    query, params, fetch, row_format)
+    
+    async def execute_many(self, query, seq_params, timeout=None):
+        """Awaitable Database.execute_many on a pooled connection"""
+        async with self._acquire() as connection:
+            return await self._call(connection, timeout, connection.db.execute_many,
+                                    query, seq_params)
+    
+    async def execute_procedure(self, procedure_name, params=None, timeout=None):
+        """Awaitable Database.execute_procedure on a pooled connection"""
+        async with self._acquire() as connection:
+            return await self._call(connection, timeout, connection.db.execute_procedure,
+                                    procedure_name, params)
+    
+    async def execute_iter(self, query, params=None, chunk_size=1000, row_format='dict',
+                           timeout=None):
+        """Async generator of row chunks (Database.execute_iter)
+        
+        The connection stays checked out until the generator is exhausted
+        or closed; timeout applies to each chunk.
+        """
+        async with self._acquire() as connection:
+            chunks = connection.db.execute_iter(query, params, chunk_size, row_format)
+            try:
+                while True:
+                    rows = await self._call(connection, timeout, next, chunks, None)
+                    if rows is None:
+                        break
+                    yield rows
+            finally:
+                # Drains the unread rows so the connection is clean for the next caller
+                await asyncio.get_running_loop().run_in_executor(connection.executor, chunks.close)
+    
+    async def run(self, work, *args, timeout=None):
+        """Run work(db, *args) on a pooled connection and return its result
+        
+        work is ordinary synchronous code (e.g. a Queries or GeneralViewer
+        method) and runs on the connection's worker thread.
+        """
+        async with self._acquire() as connection:
+            return await self._call(connection, timeout, work, connection.db, *args)
+    
+    async def run_transaction(self, work, timeout=None):
+        """Awaitable Database.run_transaction (work(db) re-run on deadlock)"""
+        async with self._acquire() as connection:
+            return await self._call(connection, timeout, connection.db.run_transaction, work)
+    
+    @asynccontextmanager
+    async def transaction(self, timeout=None):
+        """Hold one connection in a transaction for the block
+        
+        Yields an AsyncTransaction whose calls all run on that connection.
+        The block commits on exit and rolls back on any exception,
+        including cancellation.
+        """
+        async with self._acquire() as connection:
+            block = connection.db.transaction()
+            await self._call(connection, timeout, block.__enter__)
+            try:
+                yield AsyncTransaction(self, connection, timeout)
+            except BaseException as e:
+                # Rolls back; the exception is re-raised below
+                await self._finish(connection, block.__exit__, type(e), e, e.__traceback__)
+                raise
+            await self._finish(connection, block.__exit__, None, None, None)
+    
+    def stats(self):
+        """Database.stats() of every pooled connection"""
+        return [c.db.stats() for c in self._connections if c.db is not None]
+    
+    @asynccontextmanager
+    async def _acquire(self):
+        if self._free is None:
+            await self.open()
+        connection = await self._free.get()
+        try:
+            yield connection
+        finally:
+            self._free.put_nowait(connection)
+    
+    async def _call(self, connection, timeout, fn, *args):
+        # Run fn(*args) on the connection's thread; on timeout or
+        # cancellation, kill the statement and wait for the thread
+        loop = asyncio.get_running_loop()
+        future = loop.run_in_executor(connection.executor, fn, *args)
+        timeout = self.timeout if timeout is None else timeout
+        try:
+            return await asyncio.wait_for(asyncio.shield(future), timeout)
+        except (asyncio.TimeoutError, asyncio.CancelledError):
+            await self._interrupt(connection, future)
+            raise
+    
+    async def _finish(self, connection, fn, *args):
+        # Commit / rollback must complete even if the task is being cancelled
+        future = asyncio.get_running_loop().run_in_executor(connection.executor, fn, *args)
+        try:
+            return await asyncio.shield(future)
+        except asyncio.CancelledError:
+            await asyncio.wait([future])
+            raise
+    
+    async def _interrupt(self, connection, future):
+        if future.done():
+            return
+        try:
+            # On the loop's default executor: the connection's own thread is busy
+            await asyncio.get_running_loop().run_in_executor(None, connection.db.interrupt)
+        except Error as e:
+            print(f"Could not interrupt query: {e}")
+        # The worker sees the interrupted statement fail; wait for it so
+        # the connection is idle before it goes back to the pool
+        await asyncio.wait([future])
+        if not future.cancelled():
+            future.exception()
+
+class AsyncTransaction:
+    """Calls bound to the connection of an AsyncDatabase.transaction() block"""
+    
+    def __init__(self, adb, connection, timeout):
+        self._adb = adb
+        self._connection = connection
+        self._timeout = timeout
+    
+    async def execute(self, query, params=None, fetch=True, row_format='dict', timeout=None):
+        return await self._call(timeout, self._connection.db.execute, query, params, fetch, row_format)
+    
+    async def execute_many(self, query, seq_params, timeout=None):
+        return await self._call(timeout, self._connection.db.execute_many, query, seq_params)
+    
+    async def execute_procedure(self, procedure_name, params=None, timeout=None):
+        return await self._call(timeout, self._connection.db.execute_procedure, procedure_name, params)
+    
+    async def run(self, work, *args, timeout=None):
+        return await self._call(timeout, work, self._connection.db, *args)
+    
+    def _call(self, timeout, fn, *args):
+        return self._adb._call(self._connection, self._timeout if timeout is None else timeout, fn, *args)
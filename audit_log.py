@@ -0,0 +1,161 @@
+import atexit
+import json
+import queue
+import threading
+import time
+from datetime import datetime
+from database import Database
+from background import BackgroundWorker, home_database
+
+# Entries held in memory waiting for the writer
+DEFAULT_QUEUE_SIZE = 10000
+
+# Entries written per INSERT
+DEFAULT_BATCH_SIZE = 500
+
+# Longest an entry waits in the queue before its batch is written
+DEFAULT_FLUSH_SECONDS = 1.0
+
+# Seconds record() waits for room in a full queue before it drops the entry
+ENQUEUE_TIMEOUT_SECONDS = 0.5
+
+class AuditLog:
+    """Who did what: the AuditEntry trail of role session writes
+
+    record() only stamps the entry and puts it on a bounded in-memory
+    queue; a background thread with its own connection writes the queue
+    in multi-row INSERTs of up to batch_size entries, at the latest
+    flush_seconds after the first one arrived. When the writer falls so
+    far behind that the queue is full, record() waits briefly, then drops
+    the entry and counts it (dropped) rather than stall the session.
+
+    stop() writes everything still queued before returning, and start()
+    registers it to run at interpreter exit, so entries recorded before a
+    normal exit are not lost.
+
+    With DB_SHARDS the trail is still written to the home database: it
+    is one trail for sessions on every shard, keyed by the user ids that
+    live there as reference data.
+    """
+
+    _default = None
+    _default_lock = threading.Lock()
+
+    def __init__(self, db: Database = None, queue_size=DEFAULT_QUEUE_SIZE,
+                 batch_size=DEFAULT_BATCH_SIZE, flush_seconds=DEFAULT_FLUSH_SECONDS):
+        # Connection the writer uses; start() opens one when not given
+        self.db = db
+        self.batch_size = batch_size
+        self.flush_seconds = flush_seconds
+        self.written = 0
+        self.dropped = 0
+        self.failed = 0
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._write_lock = threading.Lock()
+        # Writes back to back: the next batch waits on the queue, not on a timer
+        self._worker = BackgroundWorker('audit-writer', self._write_next, 0, 'Audit log write',
+                                        connect=home_database, databases=[db] if db else None,
+                                        on_stop=self.flush)
+
+    @classmethod
+    def default(cls):
+        """The process-wide audit log, started on first use"""
+        with cls._default_lock:
+            if cls._default is None:
+                cls._default = cls()
+                cls._default.start()
+            return cls._default
+
+    @classmethod
+    def shutdown(cls):
+        """Stop the process-wide audit log (if started), writing what is queued"""
+        with cls._default_lock:
+            default, cls._default = cls._default, None
+        if default:
+            default.stop()
+
+    def record(self, user_id, role_code, operation, params=None, error=None):
+        """Queue one entry; params is a dict of the operation's arguments"""
+        entry = (
+            user_id,
+            role_code,
+            operation,
+            None if params is None else json.dumps(params, default=str, sort_keys=True),
+            'FAILED' if error else 'OK',
+            str(error)[:255] if error else None,
+            datetime.now(),
+        )
+        try:
+            self._queue.put(entry, timeout=ENQUEUE_TIMEOUT_SECONDS)
+        except queue.Full:
+            self.dropped += 1
+
+    def pending(self):
+        """Entries queued but not yet written"""
+        return self._queue.qsize()
+
+    def flush(self):
+        """Write every queued entry now, in the calling thread"""
+        while True:
+            batch = self._take(self.batch_size)
+            if not batch:
+                return
+            self._write(batch)
+
+    def start(self):
+        """Start the background writer"""
+        if self._worker.is_alive():
+            return
+        self._worker.start()
+        self.db = self._worker.databases[0]
+        atexit.register(self.stop)
+
+    def stop(self, timeout=5):
+        """Stop the background writer and write what is still queued"""
+        atexit.unregister(self.stop)
+        self._worker.stop(timeout)
+        if self._worker.databases is None:
+            # The writer's own connection is closed
+            self.db = None
+
+    def _write_next(self, db):
+        try:
+            first = self._queue.get(timeout=self.flush_seconds)
+        except queue.Empty:
+            return
+        batch = [first]
+        deadline = time.monotonic() + self.flush_seconds
+        while len(batch) < self.batch_size and not self._worker.stopping.is_set():
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        self._write(batch)
+
+    def _take(self, limit):
+        batch = []
+        while len(batch) < limit:
+            try:
+                batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _write(self, batch):
+        query = """
+            INSERT INTO AuditEntry
+                (user_id, role_code, operation, params, outcome, error, occurred_at)
+            VALUES (%s, %s, %s, %s, %s, %s, %s)
+        """
+        with self._write_lock:
+            try:
+                self.db.execute_many(query, batch)
+                self.written += len(batch)
+            except Exception as e:
+                # A batch that cannot be written is reported, not retried
+                # forever in front of the entries behind it
+                self.failed += len(batch)
+                print(f"Audit log write failed ({len(batch)} entries): {e}")
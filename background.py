@@ -0,0 +1,95 @@
+import threading
+
+class BackgroundWorker:
+    """Runs a job on a daemon thread every interval_seconds, on its own connections
+    
+    start() opens the connections before the thread starts, so connection
+    errors surface to the caller: connect() returns them (by default
+    service_databases(): every shard with DB_SHARDS, since that is where
+    the lots, batches and events live, otherwise the home database), or
+    the databases given are used as they are and left open by stop().
+    Each round calls job(db) for every connection, or job() once with
+    each_database=False. A job that raises is reported with description
+    (and the database) and runs again next round; the other databases
+    still get theirs. Without a job the worker only holds the
+    connections (in databases).
+    
+    stop() sets stopping, waits for the round in progress, calls
+    on_stop() and then closes the connections it opened.
+    """
+    
+    def __init__(self, name, job=None, interval_seconds=0, description=None, connect=None,
+                 databases=None, each_database=True, on_stop=None):
+        self.name = name
+        self.job = job
+        self.interval_seconds = interval_seconds
+        self.description = description or name
+        self.connect = connect or service_databases
+        self.each_database = each_database
+        self.on_stop = on_stop
+        self.databases = list(databases) if databases else None
+        self.stopping = threading.Event()
+        self._owns_databases = not databases
+        self._thread = None
+    
+    def is_alive(self):
+        return self._thread is not None and self._thread.is_alive()
+    
+    def start(self):
+        """Connect and start the thread (a no-op while it runs)"""
+        if self.is_alive():
+            return
+        if self._owns_databases and self.databases is None:
+            self.databases = self.connect()
+        self.stopping.clear()
+        if self.job is not None:
+            self._thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+            self._thread.start()
+    
+    def stop(self, timeout=5):
+        """Stop the thread after its current round and close the connections it opened"""
+        self.stopping.set()
+        if self._thread:
+            self._thread.join(timeout)
+            self._thread = None
+        if self.databases is None:
+            return
+        try:
+            if self.on_stop:
+                self.on_stop()
+        finally:
+            if self._owns_databases:
+                for db in self.databases:
+                    db.close()
+                self.databases = None
+    
+    def _run(self):
+        while not self.stopping.is_set():
+            if self.each_database:
+                for db in self.databases:
+                    try:
+                        self.job(db)
+                    except Exception as e:
+                        print(f"{self.description} failed on {db.database}: {e}")
+            else:
+                try:
+                    self.job()
+                except Exception as e:
+                    print(f"{self.description} failed: {e}")
+            self.stopping.wait(self.interval_seconds)
+
+def home_database():
+    """A new connection to the home database (DB_NAME), as a one-item list"""
+    # database imports metrics, which runs a worker
+    from database import Database
+    return [Database()]
+
+def service_databases():
+    """New connections to every DB_SHARDS shard, or to the home database without shards"""
+    # sharding imports the roles, whose services run workers
+    from database import Database
+    from sharding import ShardRouter
+    shards = ShardRouter.from_env()
+    if not shards:
+        return home_database()
+    return [Database(shard.host, shard.port, shard.database) for shard in shards.shards]
@@ -0,0 +1,1152 @@
+#!/usr/bin/env python3
+"""
+Benchmark Script
+Runs performance benchmarks against the configured database
+
+Usage:
+    python benchmarks.py            # run every benchmark
+    python benchmarks.py <name>...  # run the named benchmarks
+
+Benchmarks create their own rows (batch ids from BENCH_BATCH_BASE up)
+and remove them again when they finish.
+"""
+
+import asyncio
+import contextlib
+import gc
+import io
+import multiprocessing
+import os
+import random
+import statistics
+import subprocess
+import sys
+import threading
+import time
+import tracemalloc
+from datetime import datetime, timedelta
+from mysql.connector import Error
+from database import Database
+from inventory_summary import InventorySummary
+from fefo_allocator import FEFOAllocator
+from production_planner import ProductionPlanner
+from row_formats import ROW_FORMATS, format_rows
+from reservations import ReservationManager
+from idempotency import IdempotentCall, new_key
+from async_database import AsyncDatabase
+from queries import Queries
+from general_viewer import GeneralViewer
+from sharding import ShardRouter
+from audit_log import AuditLog
+from metrics import REGISTRY as METRICS, MetricsExporter
+
+# Batch ids used by benchmark rows, far above anything in the sample data
+BENCH_BATCH_BASE = 900000
+
+# Users and names of the rows _seed_fixture creates
+BENCH_MANUFACTURER = 'BENCH-MFG'
+BENCH_SUPPLIER = 'BENCH-SUP'
+BENCH_NAME = 'Benchmark'
+
+# MySQL errno of SIGNAL SQLSTATE '45000' (business rule rejections)
+SIGNAL_ERRNO = 1644
+
+def _contention_worker(args):
+    """Consume from the shared hot lots as fast as possible"""
+    worker_id, product_lots, hot_lots, ops, quantity = args
+    accepted = rejected = errors = 0
+    
+    # The procedure errors printed by Database would drown the report
+    with contextlib.redirect_stdout(io.StringIO()):
+        db = Database()
+        start = time.perf_counter()
+        for i in range(ops):
+            # Each (product lot, ingredient lot) pair is used once
+            product_lot = product_lots[i // len(hot_lots)]
+            lot = hot_lots[(i + worker_id) % len(hot_lots)]
+            try:
+                db.execute_procedure('ConsumeIngredientLot', (product_lot, lot, quantity, None))
+                accepted += 1
+            except Error as e:
+                if e.errno == SIGNAL_ERRNO:
+                    rejected += 1
+                else:
+                    errors += 1
+        elapsed = time.perf_counter() - start
+        retries = db.stats()['deadlock_retries']
+        db.close()
+    
+    return {'accepted': accepted, 'rejected': rejected, 'errors': errors,
+            'deadlock_retries': retries, 'elapsed': elapsed}
+
+def _seed_fixture(db):
+    """A manufacturer, supplier, product link and formulation of the benchmarks' own
+    
+    The shipped sample data has no manufacturer products and its lots
+    are too close to expiry to take, so benchmarks that write batches
+    or lots work on these rows. Returns their ids; _drop_fixture removes
+    them with every lot, batch and consumption made from them.
+    """
+    _drop_fixture(db)
+    db.execute("""
+        INSERT INTO UserDetails (id, first_name, last_name, role_code)
+        VALUES (%s, 'Benchmark', 'Manufacturer', 'MANUFACTURER'),
+               (%s, 'Benchmark', 'Supplier', 'SUPPLIER')
+    """, (BENCH_MANUFACTURER, BENCH_SUPPLIER), fetch=False)
+    db.execute("INSERT INTO Ingredient (name, type) VALUES (%s, 'ATOMIC')", (BENCH_NAME,), fetch=False)
+    ingredient_id = db.lastrowid
+    db.execute("""
+        INSERT INTO Product (name, number, category_id, standard_batch_units)
+        VALUES (%s, 'BENCH', NULL, 100)
+    """, (BENCH_NAME,), fetch=False)
+    product_id = db.lastrowid
+    db.execute("INSERT INTO ManufacturerProduct (manufacturer_id, product_id) VALUES (%s, %s)",
+               (BENCH_MANUFACTURER, product_id), fetch=False)
+    db.execute("""
+        INSERT INTO IngredientFormulation
+            (ingredient_id, supplier_id, version_number, unit_price, pack_size,
+             validity_start_date, validity_end_date)
+        VALUES (%s, %s, '1', 8.0, 8, %s, NULL)
+    """, (ingredient_id, BENCH_SUPPLIER, datetime.now().date() - timedelta(days=1)), fetch=False)
+    return {'manufacturer_id': BENCH_MANUFACTURER, 'supplier_id': BENCH_SUPPLIER,
+            'product_id': product_id, 'ingredient_id': ingredient_id, 'version': '1',
+            'standard_batch_units': 100}
+
+def _drop_fixture(db):
+    """Remove the _seed_fixture rows and everything made from them"""
+    db.execute("""
+        DELETE FROM IngredientConsumption
+        WHERE product_lot_number IN (
+            SELECT lot_number FROM ProductBatch WHERE manufacturer_id = %s
+        )
+        OR ingredient_lot_number IN (
+            SELECT lot_number FROM IngredientBatch WHERE supplier_id = %s
+        )
+    """, (BENCH_MANUFACTURER, BENCH_SUPPLIER), fetch=False)
+    db.execute("DELETE FROM LotReservation WHERE manufacturer_id = %s", (BENCH_MANUFACTURER,), fetch=False)
+    db.execute("DELETE FROM ProductBatch WHERE manufacturer_id = %s", (BENCH_MANUFACTURER,), fetch=False)
+    db.execute("DELETE FROM IngredientBatch WHERE supplier_id = %s", (BENCH_SUPPLIER,), fetch=False)
+    db.execute("DELETE FROM IngredientFormulation WHERE supplier_id = %s", (BENCH_SUPPLIER,), fetch=False)
+    db.execute("DELETE FROM UserDetails WHERE id IN (%s, %s)",
+               (BENCH_MANUFACTURER, BENCH_SUPPLIER), fetch=False)
+    db.execute("DELETE FROM Product WHERE name = %s AND number = 'BENCH'", (BENCH_NAME,), fetch=False)
+    db.execute("DELETE FROM Ingredient WHERE name = %s", (BENCH_NAME,), fetch=False)
+
+def lot_contention(workers=8, ops_per_worker=200, hot_lot_count=4,
+                   lot_quantity=500.0, consume_quantity=5.0):
+    """Many manufacturers consuming the same few lots at once
+    
+    Demand is set well above supply so the lots run dry under contention.
+    Passes when no lot goes negative, the consumed quantity matches the
+    quantity taken off the lots, and the on-hand summary still agrees.
+    """
+    if os.getenv('DB_BACKEND', 'mysql').lower() == 'sqlite' and \
+            os.getenv('DB_SQLITE_PATH', ':memory:') == ':memory:':
+        print("Skipped: the worker processes need a database file (set DB_SQLITE_PATH)")
+        return True
+    
+    db = Database()
+    fixture = _seed_fixture(db)
+    manufacturer_id = fixture['manufacturer_id']
+    product_id = fixture['product_id']
+    ingredient_id = fixture['ingredient_id']
+    supplier_id = fixture['supplier_id']
+    
+    today = datetime.now().date()
+    
+    # Hot lots every worker draws from
+    lot_rows = [
+        (ingredient_id, supplier_id, BENCH_BATCH_BASE + n, lot_quantity, 1.0,
+         today + timedelta(days=180))
+        for n in range(hot_lot_count)
+    ]
+    db.execute_many("""
+        INSERT INTO IngredientBatch
+            (ingredient_id, supplier_id, batch_id, quantity, per_unit_cost, expiration_date)
+        VALUES (%s, %s, %s, %s, %s, %s)
+    """, lot_rows)
+    hot_lots = [f"{ingredient_id}-{supplier_id}-{row[2]}" for row in lot_rows]
+    
+    # Product batches per worker, one per pass over the hot lots
+    batches_per_worker = -(-ops_per_worker // hot_lot_count)
+    jobs = []
+    for w in range(workers):
+        product_lots = []
+        for k in range(batches_per_worker):
+            batch_id = BENCH_BATCH_BASE + w * batches_per_worker + k
+            db.execute_procedure('RecordProductionBatch', (
+                manufacturer_id, product_id, batch_id, fixture['standard_batch_units'],
+                today, today + timedelta(days=90), None, None
+            ))
+            product_lots.append(f"{product_id}-{manufacturer_id}-{batch_id}")
+        jobs.append((w, product_lots, hot_lots, ops_per_worker, consume_quantity))
+    
+    print(f"\n{workers} workers x {ops_per_worker} consumptions of {consume_quantity} oz "
+          f"from {hot_lot_count} lots of {lot_quantity} oz")
+    
+    start = time.perf_counter()
+    with multiprocessing.Pool(workers) as pool:
+        results = pool.map(_contention_worker, jobs)
+    elapsed = time.perf_counter() - start
+    
+    totals = {key: sum(r[key] for r in results)
+              for key in ('accepted', 'rejected', 'errors', 'deadlock_retries')}
+    attempts = workers * ops_per_worker
+    
+    # Start a fresh read view; the setup reads above pinned an older one
+    db.connection.commit()
+    placeholders = ','.join(['%s'] * len(hot_lots))
+    lots = db.execute(f"""
+        SELECT MIN(quantity) as min_quantity, SUM(quantity) as remaining
+        FROM IngredientBatch
+        WHERE lot_number IN ({placeholders})
+    """, hot_lots)[0]
+    consumed = db.execute(f"""
+        SELECT COALESCE(SUM(consumed_quantity_oz), 0) as consumed, COUNT(*) as rows_written
+        FROM IngredientConsumption
+        WHERE ingredient_lot_number IN ({placeholders})
+    """, hot_lots)[0]
+    summary_mismatches = [m for m in InventorySummary(db).verify()
+                          if m['ingredient_id'] == ingredient_id]
+    
+    supply = lot_quantity * hot_lot_count
+    checks = {
+        'no lot below zero': lots['min_quantity'] >= 0,
+        'lots + consumption = supply': abs(lots['remaining'] + consumed['consumed'] - supply) < 1e-6,
+        'one consumption row per success': consumed['rows_written'] == totals['accepted'],
+        'demand beyond supply rejected': totals['accepted'] * consume_quantity <= supply,
+        'on-hand summary consistent': not summary_mismatches,
+    }
+    
+    print(f"Elapsed: {elapsed:.2f}s")
+    print(f"Attempts: {attempts} ({attempts / elapsed:.0f}/s)")
+    print(f"Accepted: {totals['accepted']} ({totals['accepted'] / elapsed:.0f}/s)")
+    print(f"Rejected (insufficient quantity): {totals['rejected']}")
+    print(f"Other errors: {totals['errors']}")
+    print(f"Deadlock retries: {totals['deadlock_retries']}")
+    print(f"Remaining in hot lots: {lots['remaining']} oz (min lot {lots['min_quantity']} oz)")
+    for name, ok in checks.items():
+        print(f"  [{'PASS' if ok else 'FAIL'}] {name}")
+    
+    _drop_fixture(db)
+    db.close()
+    return all(checks.values())
+
+def _linear_fefo(lots_by_ingredient, batches):
+    """Reference FEFO: scan each ingredient's date-sorted lot list from the front"""
+    remaining = {lot['lot_number']: lot['available_quantity']
+                 for lots in lots_by_ingredient.values() for lot in lots}
+    ordered = {i: sorted(lots, key=lambda l: (l['expiration_date'], l['lot_number']))
+               for i, lots in lots_by_ingredient.items()}
+    plan = {}
+    for key, requirements in batches:
+        available = {i: sum(remaining[l['lot_number']] for l in ordered.get(i, []))
+                     for i in requirements}
+        if any(q - available[i] > 1e-9 for i, q in requirements.items()):
+            continue
+        picks = []
+        for ingredient_id, needed in requirements.items():
+            for lot in ordered[ingredient_id]:
+                if needed <= 1e-9:
+                    break
+                left = remaining[lot['lot_number']]
+                if left <= 1e-9:
+                    continue
+                take = min(needed, left)
+                remaining[lot['lot_number']] = left - take
+                needed -= take
+                picks.append((ingredient_id, lot['lot_number'], take))
+        plan[key] = picks
+    return plan
+
+def fefo_allocation(batches=10000, ingredients=100, lots_per_ingredient=200,
+                    ingredients_per_batch=6, seed=42):
+    """Allocate many batches with FEFOAllocator on synthetic lots (no database)
+    
+    Compares against a linear scan of each ingredient's sorted lot list
+    and checks both produce the same picks and that no lot is
+    over-allocated.
+    """
+    rng = random.Random(seed)
+    today = datetime.now().date()
+    
+    lots = []
+    for ingredient_id in range(1, ingredients + 1):
+        for n in range(lots_per_ingredient):
+            lots.append({
+                'lot_number': f"{ingredient_id}-BENCH-{n}",
+                'ingredient_id': ingredient_id,
+                'available_quantity': float(rng.randint(50, 500)),
+                'expiration_date': today + timedelta(days=rng.randint(1, 365)),
+            })
+    initial = {lot['lot_number']: lot['available_quantity'] for lot in lots}
+    
+    requests = []
+    for b in range(batches):
+        chosen = rng.sample(range(1, ingredients + 1), ingredients_per_batch)
+        requests.append((b, {i: float(rng.randint(10, 100)) for i in chosen}))
+    
+    print(f"\n{batches} batches x {ingredients_per_batch} ingredients over "
+          f"{len(lots)} lots of {ingredients} ingredients")
+    
+    start = time.perf_counter()
+    allocator = FEFOAllocator(lots)
+    load_elapsed = time.perf_counter() - start
+    start = time.perf_counter()
+    plan = allocator.allocate_batches(requests)
+    elapsed = time.perf_counter() - start
+    pick_count = sum(len(p) for p in plan.picks.values())
+    
+    lots_by_ingredient = {}
+    for lot in lots:
+        lots_by_ingredient.setdefault(lot['ingredient_id'], []).append(lot)
+    start = time.perf_counter()
+    reference = _linear_fefo(lots_by_ingredient, requests)
+    reference_elapsed = time.perf_counter() - start
+    
+    allocated = {}
+    for picks in plan.picks.values():
+        for _, lot_number, quantity in picks:
+            allocated[lot_number] = allocated.get(lot_number, 0) + quantity
+    
+    checks = {
+        'same picks as linear scan': plan.picks.keys() == reference.keys() and all(
+            len(plan.picks[k]) == len(reference[k]) and all(
+                a[:2] == b[:2] and abs(a[2] - b[2]) < 1e-6
+                for a, b in zip(plan.picks[k], reference[k]))
+            for k in plan.picks),
+        'no lot over-allocated': all(q <= initial[lot] + 1e-6 for lot, q in allocated.items()),
+        'allocated + remaining = initial': all(
+            abs(allocated.get(lot, 0) + allocator.remaining(lot) - q) < 1e-6
+            for lot, q in initial.items()),
+    }
+    
+    print(f"Heap load: {load_elapsed * 1000:.1f} ms")
+    print(f"Allocated: {len(plan.picks)} batches, {len(plan.shortages)} short, {pick_count} picks")
+    print(f"Allocator: {elapsed:.3f}s ({len(requests) / elapsed:.0f} batches/s, "
+          f"{elapsed / max(pick_count, 1) * 1e6:.1f} us/pick)")
+    print(f"Linear scan: {reference_elapsed:.3f}s ({len(requests) / reference_elapsed:.0f} batches/s)")
+    for name, ok in checks.items():
+        print(f"  [{'PASS' if ok else 'FAIL'}] {name}")
+    return all(checks.values())
+
+def mrp_planning(products=500, ingredients=5000, bom_size=25, demand_lines=2000, seed=7):
+    """Plan a demand list over synthetic products and stock (no database)
+    
+    Checks that no ingredient is planned beyond its stock and that every
+    planned quantity is a whole number of standard batches.
+    """
+    rng = random.Random(seed)
+    product_rows = {
+        p: {'name': f"Product {p}", 'standard_batch_units': rng.choice((10, 50, 100))}
+        for p in range(1, products + 1)
+    }
+    boms = {
+        p: {i: rng.uniform(0.1, 2.0) for i in rng.sample(range(1, ingredients + 1), bom_size)}
+        for p in product_rows
+    }
+    available = {i: float(rng.randint(0, 20000)) for i in range(1, ingredients + 1)}
+    demand = [(rng.randint(1, products), rng.randint(1, 500)) for _ in range(demand_lines)]
+    
+    print(f"\n{demand_lines} demand lines over {products} products x {ingredients} ingredients "
+          f"(BOM size {bom_size})")
+    
+    start = time.perf_counter()
+    plan = ProductionPlanner(product_rows, boms, available).plan(demand)
+    elapsed = time.perf_counter() - start
+    
+    used = {}
+    for b in plan.batches:
+        for ingredient_id, per_unit in boms[b['product_id']].items():
+            used[ingredient_id] = used.get(ingredient_id, 0) + per_unit * b['quantity']
+    checks = {
+        'no ingredient over-planned': all(q <= available[i] + 1e-6 for i, q in used.items()),
+        'whole standard batches': all(
+            b['quantity'] == b['batch_count'] * product_rows[b['product_id']]['standard_batch_units']
+            for b in plan.batches),
+    }
+    
+    print(f"Planned: {len(plan.batches)} lines, {sum(b['batch_count'] for b in plan.batches)} batches")
+    print(f"Shortages: {len(plan.shortages)} rows over {len(plan.ingredient_shortages)} ingredients")
+    print(f"Elapsed: {elapsed:.3f}s")
+    for name, ok in checks.items():
+        print(f"  [{'PASS' if ok else 'FAIL'}] {name}")
+    return all(checks.values())
+
+def row_formats(rows=1000000, seed=3):
+    """Build a batch-cost-listing sized result in every row format (no database)
+    
+    Rows are produced as fresh tuples, as the connector hands them over,
+    and converted to each format; dict does what the dictionary cursor
+    does. Reports build time and retained memory per million rows and
+    checks every format holds the same values.
+    """
+    rng = random.Random(seed)
+    today = datetime.now().date()
+    columns = ('lot_number', 'product_id', 'product_name', 'produced_quantity',
+               'production_date', 'batch_total_cost', 'unit_cost')
+    names = [f"Product {i}" for i in range(200)]
+    dates = [today - timedelta(days=d) for d in range(365)]
+    values = [(rng.randint(1, 200), rng.choice(names), rng.randint(1, 50) * 100,
+               rng.choice(dates), rng.uniform(100, 5000)) for _ in range(1000)]
+    
+    def fetched():
+        # A new tuple (and lot number string) per row, like a real fetch
+        result = []
+        for n in range(rows):
+            product_id, name, quantity, date, cost = values[n % len(values)]
+            result.append((f"{product_id}-MFG001-{n}", product_id, name, quantity,
+                           date, cost, cost / quantity))
+        return result
+    
+    print(f"\n{rows} rows x {len(columns)} columns")
+    print(f"{'format':<10} {'build s/M rows':>15} {'MB/M rows':>10}")
+    
+    per_million = 1000000 / rows
+    results = {}
+    for row_format in ROW_FORMATS:
+        raw = fetched()
+        start = time.perf_counter()
+        formatted = format_rows(raw, columns, row_format)
+        elapsed = time.perf_counter() - start
+        del raw, formatted
+        
+        # Memory of what the caller keeps: the fetched tuples are garbage
+        # once converted, except for the tuple format which keeps them
+        tracemalloc.start()
+        formatted = format_rows(fetched(), columns, row_format)
+        memory = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        
+        results[row_format] = formatted
+        print(f"{row_format:<10} {elapsed * per_million:>15.3f} {memory * per_million / 2**20:>10.1f}")
+    
+    sample = [0, rows // 2, rows - 1]
+    expected = [tuple(results['dict'][i][c] for c in columns) for i in sample]
+    checks = {
+        'tuple rows match dict rows': [results['tuple'][i] for i in sample] == expected,
+        'record rows match dict rows': [
+            tuple(results['record'][i][c] for c in columns) for i in sample] == expected,
+        'columnar columns match dict rows': [
+            tuple(results['columnar'][c][i] for c in columns) for i in sample] == expected,
+        'every format has every row': all(
+            len(results[f]) == rows for f in ('dict', 'tuple', 'record')) and all(
+            len(col) == rows for col in results['columnar'].values()),
+    }
+    for name, ok in checks.items():
+        print(f"  [{'PASS' if ok else 'FAIL'}] {name}")
+    return all(checks.values())
+
+def statement_cache(iterations=5000, lots=20):
+    """Hot lookups with and without the prepared statement cache
+    
+    Repeats the FEFO lot lookup (over lots benchmark lots) and a product
+    ownership check, first as text queries (cache size 0), then through
+    the cache. Passes when both runs return the same rows and the cached
+    run hits the cache.
+    """
+    db = Database()
+    fixture = _seed_fixture(db)
+    expiration_date = datetime.now().date() + timedelta(days=180)
+    db.execute_many("""
+        INSERT INTO IngredientBatch
+            (ingredient_id, supplier_id, batch_id, quantity, per_unit_cost, expiration_date)
+        VALUES (%s, %s, %s, %s, %s, %s)
+    """, [(fixture['ingredient_id'], fixture['supplier_id'], BENCH_BATCH_BASE + n, 100.0, 1.0,
+          expiration_date + timedelta(days=n)) for n in range(lots)])
+    ingredients = [fixture['ingredient_id']]
+    owners = [{'manufacturer_id': fixture['manufacturer_id'], 'product_id': fixture['product_id']}]
+    
+    reservations = ReservationManager(db)
+    ownership = """
+        SELECT 1 FROM ManufacturerProduct 
+        WHERE manufacturer_id = %s AND product_id = %s
+    """
+    
+    def run():
+        results = []
+        start = time.perf_counter()
+        for i in range(iterations):
+            results.append(reservations.available_lots(ingredients[i % len(ingredients)]))
+            owner = owners[i % len(owners)]
+            results.append(db.execute(ownership, (owner['manufacturer_id'], owner['product_id'])))
+        return results, time.perf_counter() - start
+    
+    cache_size = db.statements.size
+    db.statements.size = 0
+    text_results, text_elapsed = run()
+    db.statements.size = cache_size or 64
+    cached_results, cached_elapsed = run()
+    stats = db.stats()
+    _drop_fixture(db)
+    db.close()
+    
+    statements = iterations * 2
+    print(f"\n{statements} statements ({iterations} FEFO lookups + {iterations} ownership checks)")
+    print(f"Text protocol: {text_elapsed:.3f}s ({statements / text_elapsed:.0f} statements/s)")
+    print(f"Prepared cache: {cached_elapsed:.3f}s ({statements / cached_elapsed:.0f} statements/s)")
+    print(f"Cache: {stats['statement_cache_hits']} hits, {stats['statement_cache_misses']} misses, "
+          f"hit rate {stats['statement_cache_hit_rate']:.1%}, "
+          f"~{stats['statement_parse_time_saved'] * 1000:.1f} ms parse time saved")
+    
+    checks = {
+        'same rows with and without the cache': text_results == cached_results,
+        'cached run hits the cache': stats['statement_cache_hits'] >= statements - 2,
+    }
+    for name, ok in checks.items():
+        print(f"  [{'PASS' if ok else 'FAIL'}] {name}")
+    return all(checks.values())
+
+def connection_recovery(duration=20.0, fault_after=5.0, write_every=5):
+    """Reads and keyed intakes across a dropped connection
+    
+    fault_after seconds into the workload the connection is killed from a
+    second session (KILL CONNECTION) or, when BENCH_MYSQL_RESTART_CMD is
+    set (e.g. "docker restart mysql"), the server is restarted with that
+    command. Reads must carry on transparently and every keyed intake,
+    retried through IdempotentCall, must be recorded exactly once.
+    Reports how long the workload stalled.
+    """
+    db = Database()
+    source = db.execute("""
+        SELECT ingredient_id, supplier_id, version_number
+        FROM IngredientFormulation
+        WHERE pack_size > 0
+        ORDER BY ingredient_id, supplier_id
+        LIMIT 1
+    """)
+    if not source:
+        print("Sample data missing: need an ingredient formulation")
+        db.close()
+        return False
+    ingredient_id = source[0]['ingredient_id']
+    supplier_id = source[0]['supplier_id']
+    version = str(source[0]['version_number'])
+    
+    def cleanup():
+        db.execute("""
+            DELETE FROM IngredientBatch
+            WHERE ingredient_id = %s AND supplier_id = %s AND batch_id >= %s
+        """, (ingredient_id, supplier_id, BENCH_BATCH_BASE), fetch=False)
+        db.execute("DELETE FROM IdempotencyKey WHERE idempotency_key LIKE 'bench-recovery-%'",
+                   fetch=False)
+    
+    cleanup()
+    restart_cmd = os.getenv('BENCH_MYSQL_RESTART_CMD')
+    fault = {'time': None}
+    
+    def inject():
+        fault['time'] = time.perf_counter()
+        if restart_cmd:
+            subprocess.run(restart_cmd, shell=True, check=False)
+            return
+        admin = Database()
+        admin.execute(f"KILL CONNECTION {connection_id}", fetch=False)
+        admin.close()
+    
+    connection_id = db.execute("SELECT CONNECTION_ID() as id")[0]['id']
+    reservations = ReservationManager(db)
+    intake = IdempotentCall(db)
+    expiration_date = datetime.now().date() + timedelta(days=180)
+    reads = writes = read_errors = write_errors = 0
+    acknowledged = []
+    max_stall_after_fault = 0.0
+    
+    print(f"\n{duration:.0f}s workload, fault after {fault_after:.0f}s "
+          f"({'restart: ' + restart_cmd if restart_cmd else 'KILL CONNECTION'})")
+    injector = threading.Timer(fault_after, inject)
+    injector.start()
+    start = time.perf_counter()
+    n = 0
+    while time.perf_counter() - start < duration:
+        op_start = time.perf_counter()
+        try:
+            if n % write_every == 0:
+                batch_id = BENCH_BATCH_BASE + n
+                intake.call('RecordIngredientIntake',
+                            (ingredient_id, supplier_id, batch_id, 1, expiration_date, version),
+                            f"bench-recovery-{new_key()}")
+                acknowledged.append(batch_id)
+                writes += 1
+            else:
+                reservations.available_lots(ingredient_id)
+                reads += 1
+        except Error:
+            if n % write_every == 0:
+                write_errors += 1
+            else:
+                read_errors += 1
+        op_end = time.perf_counter()
+        if fault['time'] is not None and op_end >= fault['time']:
+            max_stall_after_fault = max(max_stall_after_fault, op_end - max(op_start, fault['time']))
+        n += 1
+    elapsed = time.perf_counter() - start
+    injector.join()
+    
+    recorded = [r['batch_id'] for r in db.execute("""
+        SELECT batch_id FROM IngredientBatch
+        WHERE ingredient_id = %s AND supplier_id = %s AND batch_id >= %s
+    """, (ingredient_id, supplier_id, BENCH_BATCH_BASE))]
+    stats = db.stats()
+    
+    checks = {
+        'fault injected': fault['time'] is not None,
+        'connection re-established': stats['reconnects'] >= 1,
+        'no read failed': read_errors == 0,
+        'every acknowledged intake recorded once': sorted(recorded) == sorted(acknowledged),
+    }
+    
+    print(f"Operations: {reads} reads, {writes} intakes in {elapsed:.1f}s "
+          f"({(reads + writes) / elapsed:.0f}/s)")
+    print(f"Failed: {read_errors} reads, {write_errors} intakes")
+    print(f"Reconnects: {stats['reconnects']}, read retries: {stats['read_retries']}")
+    print(f"Reconnect time: {(stats['last_recovery_seconds'] or 0) * 1000:.0f} ms, "
+          f"longest stall after the fault: {max_stall_after_fault * 1000:.0f} ms")
+    for name, ok in checks.items():
+        print(f"  [{'PASS' if ok else 'FAIL'}] {name}")
+    
+    cleanup()
+    db.close()
+    return all(checks.values())
+
+def async_reports(rounds=20, pool_size=4, timeout=0.5):
+    """Read-only reports one after another vs concurrently through AsyncDatabase
+    
+    Runs the five required queries and the product catalog rounds times
+    on one connection, then the same calls with asyncio.gather over a
+    pool of pool_size connections. Passes when both return the same rows
+    and a SLEEP(5) with the given timeout is cut short and leaves the
+    pool usable.
+    """
+    reports = [
+        lambda db: Queries(db).last_batch_ingredients(100, 'MFG001'),
+        lambda db: Queries(db).supplier_spend('MFG002'),
+        lambda db: Queries(db).lot_unit_cost('100-MFG001-B0901'),
+        lambda db: Queries(db).lot_conflicts('100-MFG001-B0901'),
+        lambda db: Queries(db).manufacturers_not_supplied_by('21'),
+        lambda db: GeneralViewer(db).product_catalog(),
+    ]
+    calls = reports * rounds
+    
+    db = Database()
+    start = time.perf_counter()
+    sequential = [report(db) for report in calls]
+    sequential_elapsed = time.perf_counter() - start
+    db.close()
+    
+    async def concurrent():
+        async with AsyncDatabase(pool_size=pool_size) as adb:
+            start = time.perf_counter()
+            results = await asyncio.gather(*(adb.run(report) for report in calls))
+            elapsed = time.perf_counter() - start
+            
+            start = time.perf_counter()
+            timed_out = False
+            try:
+                await adb.execute("SELECT SLEEP(5)", timeout=timeout)
+            except asyncio.TimeoutError:
+                timed_out = True
+            cancel_elapsed = time.perf_counter() - start
+            
+            # Every connection must still answer after the interrupted query
+            alive = await asyncio.gather(*(adb.execute("SELECT 1 as ok") for _ in range(pool_size)))
+            return results, elapsed, timed_out, cancel_elapsed, alive
+    
+    results, elapsed, timed_out, cancel_elapsed, alive = asyncio.run(concurrent())
+    
+    print(f"\n{len(calls)} report calls ({len(reports)} reports x {rounds})")
+    print(f"Sequential: {sequential_elapsed:.3f}s ({len(calls) / sequential_elapsed:.0f} reports/s)")
+    print(f"Concurrent ({pool_size} connections): {elapsed:.3f}s "
+          f"({len(calls) / elapsed:.0f} reports/s, {sequential_elapsed / elapsed:.1f}x)")
+    print(f"SLEEP(5) with a {timeout}s timeout returned after {cancel_elapsed:.2f}s")
+    
+    checks = {
+        'same rows sequentially and concurrently': results == sequential,
+        'timed out query interrupted': timed_out and cancel_elapsed < timeout + 2,
+        'pool usable after the timeout': all(r == [{'ok': 1}] for r in alive),
+    }
+    for name, ok in checks.items():
+        print(f"  [{'PASS' if ok else 'FAIL'}] {name}")
+    return all(checks.values())
+
+def replica_routing(rounds=50):
+    """Reads routed to the replicas in DB_REPLICA_HOSTS, writes to the primary
+    
+    Runs the required queries rounds times with routing, then on the
+    primary only, records an intake and reads it straight back, reads
+    inside a transaction, and reads it from each replica once the sticky
+    window is over. Passes when the routed reads ran on a replica with the
+    primary's rows, the read-back and transaction reads ran on the
+    primary, and every replica then returned the intake. Skipped when no
+    replica is configured.
+    """
+    db = Database()
+    if not db.replicas:
+        print("DB_REPLICA_HOSTS not set; skipping")
+        db.close()
+        return True
+    
+    source = db.execute("""
+        SELECT ingredient_id, supplier_id, version_number
+        FROM IngredientFormulation
+        WHERE pack_size > 0
+        ORDER BY ingredient_id, supplier_id
+        LIMIT 1
+    """)
+    if not source:
+        print("Sample data missing: need an ingredient formulation")
+        db.close()
+        return False
+    ingredient_id = source[0]['ingredient_id']
+    supplier_id = source[0]['supplier_id']
+    version = str(source[0]['version_number'])
+    
+    queries = Queries(db)
+    reports = [
+        lambda: queries.supplier_spend('MFG002'),
+        lambda: queries.lot_unit_cost('100-MFG001-B0901'),
+        lambda: queries.lot_conflicts('100-MFG001-B0901'),
+        lambda: queries.manufacturers_not_supplied_by('21'),
+    ]
+    
+    def run():
+        start = time.perf_counter()
+        results = [report() for _ in range(rounds) for report in reports]
+        return results, time.perf_counter() - start
+    
+    before = db.stats()['replica_reads']
+    routed, routed_elapsed = run()
+    after_routed = db.stats()['replica_reads']
+    with db.use_primary():
+        primary, primary_elapsed = run()
+    after_primary = db.stats()['replica_reads']
+    
+    # Read-your-writes: the intake must be visible at once
+    batch_id = BENCH_BATCH_BASE + 1
+    db.execute("""
+        DELETE FROM IngredientBatch
+        WHERE ingredient_id = %s AND supplier_id = %s AND batch_id >= %s
+    """, (ingredient_id, supplier_id, BENCH_BATCH_BASE), fetch=False)
+    db.execute_procedure('RecordIngredientIntake',
+                         (ingredient_id, supplier_id, batch_id, 1,
+                          datetime.now().date() + timedelta(days=180), version, None))
+    lot_query = """
+        SELECT lot_number FROM IngredientBatch
+        WHERE ingredient_id = %s AND supplier_id = %s AND batch_id = %s
+    """
+    read_back = db.execute(lot_query, (ingredient_id, supplier_id, batch_id))
+    after_write = db.stats()['replica_reads']
+    
+    with db.transaction():
+        db.execute(lot_query, (ingredient_id, supplier_id, batch_id))
+    after_transaction = db.stats()['replica_reads']
+    
+    # Once the sticky window ends the replicas serve the intake too (each
+    # already answered reads before it, so a stale snapshot would show)
+    router = db.replicas
+    time.sleep(router.sticky_seconds)
+    deadline = time.monotonic() + max(router.max_lag, 0) + 5
+    while True:
+        replica_reads = db.stats()['replica_reads']
+        seen = [db.execute(lot_query, (ingredient_id, supplier_id, batch_id))
+                for _ in router.replicas]
+        after_sticky = db.stats()['replica_reads'] - replica_reads == len(router.replicas)
+        if (after_sticky and all(seen)) or time.monotonic() > deadline:
+            break
+        time.sleep(0.5)
+    
+    db.execute("""
+        DELETE FROM IngredientBatch
+        WHERE ingredient_id = %s AND supplier_id = %s AND batch_id >= %s
+    """, (ingredient_id, supplier_id, BENCH_BATCH_BASE), fetch=False)
+    stats = db.stats()
+    db.close()
+    
+    reads = rounds * len(reports)
+    print(f"\n{reads} report reads")
+    print(f"Routed: {routed_elapsed:.3f}s ({reads / routed_elapsed:.0f} reads/s), "
+          f"{after_routed - before} on replicas")
+    print(f"Primary only: {primary_elapsed:.3f}s ({reads / primary_elapsed:.0f} reads/s)")
+    print(f"Replica lag: {stats['replica_lag']}, lag skips: {stats['replica_lag_skips']}, "
+          f"errors: {stats['replica_errors']}, fallbacks: {stats['replica_fallbacks']}")
+    
+    checks = {
+        'report reads ran on replicas': after_routed - before >= reads,
+        'same rows on replicas and primary': routed == primary,
+        'use_primary() reads stayed on the primary': after_primary == after_routed,
+        'write read back at once from the primary': bool(read_back) and after_write == after_primary,
+        'transaction reads stayed on the primary': after_transaction == after_write,
+        'write visible on every replica after the sticky window': after_sticky and all(seen),
+    }
+    for name, ok in checks.items():
+        print(f"  [{'PASS' if ok else 'FAIL'}] {name}")
+    return all(checks.values())
+
+def shard_scatter(rounds=20):
+    """Query 5 scatter-gathered across the DB_SHARDS shards
+    
+    Expects shards set up from the sample data (ShardRouter.setup). Adds
+    a manufacturer of its own on every shard (the sample ones may all
+    hash to one), runs the cross-shard query rounds times shard by shard
+    and in parallel, and compares the merged rows with the same query on
+    the home database. Skipped when no shards are configured.
+    """
+    shards = ShardRouter.from_env()
+    if not shards:
+        print("DB_SHARDS not set; skipping")
+        return True
+    
+    # The first unmapped id hashing to each shard
+    fixture = []
+    for shard in shards.shards:
+        candidates = (f"{BENCH_MANUFACTURER}-{i}" for i in range(1000))
+        fixture.append(next(m for m in candidates if shards.shard_for(m) is shard))
+    placeholders = ','.join(['%s'] * len(fixture))
+    
+    def drop_fixture(db, shard=None):
+        db.execute(f"DELETE FROM UserDetails WHERE id IN ({placeholders})", fixture, fetch=False)
+    
+    db = Database()
+    db.execute_many("""
+        INSERT INTO UserDetails (id, first_name, last_name, role_code)
+        VALUES (%s, 'Benchmark', 'Manufacturer', 'MANUFACTURER')
+    """, [(m,) for m in fixture])
+    shards.sync_reference_data(db)
+    expected = Queries(db).manufacturers_not_supplied_by('21')
+    manufacturers = [r['id'] for r in db.execute(
+        "SELECT id FROM UserDetails WHERE role_code = 'MANUFACTURER'")]
+    
+    def sequential():
+        rows = []
+        for shard in shards.shards:
+            own = shards.manufacturers_on(shard)
+            rows.extend(r for r in Queries(shard.connect()).manufacturers_not_supplied_by('21')
+                        if r['manufacturer_id'] in own)
+        return sorted(rows, key=lambda r: r['manufacturer_id'])
+    
+    start = time.perf_counter()
+    for _ in range(rounds):
+        sequential_rows = sequential()
+    sequential_elapsed = time.perf_counter() - start
+    
+    start = time.perf_counter()
+    for _ in range(rounds):
+        scattered = shards.manufacturers_not_supplied_by('21')
+    scatter_elapsed = time.perf_counter() - start
+    
+    placement = {}
+    for m in manufacturers:
+        placement.setdefault(shards.shard_for(m).name, []).append(m)
+    
+    print(f"\n{len(shards.shards)} shards: " +
+          ", ".join(f"{name} ({len(ids)} manufacturers)" for name, ids in placement.items()))
+    print(f"Shard by shard: {sequential_elapsed / rounds * 1000:.1f} ms per query")
+    print(f"Scatter-gather: {scatter_elapsed / rounds * 1000:.1f} ms per query "
+          f"({sequential_elapsed / scatter_elapsed:.1f}x)")
+    
+    checks = {
+        'every manufacturer placed on one shard': sum(len(ids) for ids in placement.values()) == len(manufacturers),
+        'manufacturers routed to their shard': all(
+            shards.db_for(m) is shards.shard_for(m).db for m in manufacturers),
+        'manufacturers on every shard': len(placement) == len(shards.shards),
+        'scatter-gather matches the home database': scattered == expected,
+        'parallel matches shard by shard': scattered == sequential_rows,
+    }
+    shards.scatter(drop_fixture)
+    drop_fixture(db)
+    db.close()
+    shards.close()
+    for name, ok in checks.items():
+        print(f"  [{'PASS' if ok else 'FAIL'}] {name}")
+    return all(checks.values())
+
+def audit_log(records=5000):
+    """Audit entries written synchronously vs queued for the batched writer
+    
+    Times records INSERTs committed one by one (what a synchronous audit
+    would add to every write), then the same entries through AuditLog,
+    both the caller's record() calls and the writer until stop() returns.
+    A child process then records entries and exits without stop(). Passes
+    when every entry is written, including the child's, and record() is
+    cheaper than a synchronous INSERT.
+    """
+    db = Database()
+    params = {'product_id': 100, 'batch_id': BENCH_BATCH_BASE, 'produced_quantity': 100}
+    insert = """
+        INSERT INTO AuditEntry
+            (user_id, role_code, operation, params, outcome, error, occurred_at)
+        VALUES (%s, %s, %s, %s, 'OK', NULL, %s)
+    """
+    
+    start = time.perf_counter()
+    for _ in range(records):
+        db.execute(insert, ('MFG001', 'MANUFACTURER', 'bench_audit_sync', str(params), datetime.now()),
+                   fetch=False)
+    sync_elapsed = time.perf_counter() - start
+    
+    audit = AuditLog(Database())
+    audit.start()
+    start = time.perf_counter()
+    for _ in range(records):
+        audit.record('MFG001', 'MANUFACTURER', 'bench_audit_async', params)
+    record_elapsed = time.perf_counter() - start
+    audit.stop()
+    total_elapsed = time.perf_counter() - start
+    
+    # Flush on exit: a separate process that never calls stop()
+    in_memory = os.getenv('DB_BACKEND', 'mysql').lower() == 'sqlite' and \
+        os.getenv('DB_SQLITE_PATH', ':memory:') == ':memory:'
+    exit_records = 0 if in_memory else 200
+    if exit_records:
+        subprocess.run([sys.executable, '-c', (
+            "from audit_log import AuditLog\n"
+            f"for _ in range({exit_records}):\n"
+            "    AuditLog.default().record('MFG001', 'MANUFACTURER', 'bench_audit_exit', {})\n"
+        )], check=True, stdout=subprocess.DEVNULL)
+    
+    counts = {r['operation']: r['entries'] for r in db.execute("""
+        SELECT operation, COUNT(*) as entries FROM AuditEntry
+        WHERE operation LIKE 'bench_audit_%%'
+        GROUP BY operation
+    """)}
+    db.execute("DELETE FROM AuditEntry WHERE operation LIKE 'bench_audit_%%'", fetch=False)
+    db.close()
+    
+    print(f"\n{records} audit entries")
+    print(f"Synchronous INSERT per write: {sync_elapsed:.3f}s ({sync_elapsed / records * 1e6:.1f} us/write)")
+    print(f"AuditLog.record() per write: {record_elapsed:.3f}s ({record_elapsed / records * 1e6:.1f} us/write), "
+          f"{total_elapsed:.3f}s until written ({audit.written} written, {audit.dropped} dropped)")
+    if not exit_records:
+        print("Flush on exit not checked: the child process needs a database file (set DB_SQLITE_PATH)")
+    
+    checks = {
+        'every queued entry written': counts.get('bench_audit_async', 0) == records and not audit.dropped,
+        'entries flushed at process exit': counts.get('bench_audit_exit', 0) == exit_records,
+        'record() cheaper than a synchronous INSERT': record_elapsed < sync_elapsed,
+    }
+    for name, ok in checks.items():
+        print(f"  [{'PASS' if ok else 'FAIL'}] {name}")
+    return all(checks.values())
+
+def sqlite_locking(duration=3.0, readers=3, hold=0.005):
+    """Concurrent readers and a writer transaction on the SQLite backend
+    
+    A writer keeps opening transactions (hold seconds apart) that insert
+    an ingredient, hold the write lock for hold seconds, read the table
+    back and update the row, while readers query the same table on their
+    own connections, outside a transaction and (hold seconds apart)
+    inside one. On an
+    in-memory database the connections share one cache with table-level
+    locks, so each side must wait for the other rather than fail. Passes
+    when nothing fails with a lock error and every committed
+    transaction's row is there. Skipped unless DB_BACKEND=sqlite.
+    """
+    if os.getenv('DB_BACKEND', 'mysql').lower() != 'sqlite':
+        print("Skipped: needs DB_BACKEND=sqlite")
+        return True
+    
+    name_prefix = f"{BENCH_NAME} lock "
+    db = Database()
+    db.execute("DELETE FROM Ingredient WHERE name LIKE %s", (name_prefix + '%',), fetch=False)
+    stop = threading.Event()
+    counts = {'writes': 0, 'reads': 0, 'transaction_reads': 0}
+    lock_errors = {'writes': 0, 'reads': 0, 'transaction_reads': 0}
+    other_errors = []
+    count_query = "SELECT COUNT(*) as n FROM Ingredient WHERE name LIKE %s"
+    
+    def writer():
+        conn = Database()
+        n = 0
+        while not stop.is_set():
+            name = f"{name_prefix}{n}"
+            try:
+                with conn.transaction():
+                    conn.execute("INSERT INTO Ingredient (name, type) VALUES (%s, 'ATOMIC')",
+                                 (name,), fetch=False)
+                    time.sleep(hold)
+                    conn.execute(count_query, (name_prefix + '%',))
+                    conn.execute("UPDATE Ingredient SET type = 'ATOMIC' WHERE name = %s", (name,), fetch=False)
+                counts['writes'] += 1
+            except Error as e:
+                if e.errno == 1205:
+                    lock_errors['writes'] += 1
+                else:
+                    other_errors.append(e)
+            n += 1
+            # Leave a gap for the reader waiting to begin a transaction
+            time.sleep(hold)
+        conn.close()
+    
+    def reader(kind):
+        conn = Database()
+        while not stop.is_set():
+            try:
+                if kind == 'transaction_reads':
+                    with conn.transaction():
+                        conn.execute(count_query, (name_prefix + '%',))
+                    # Nor should it keep the writer out
+                    time.sleep(hold)
+                else:
+                    conn.execute(count_query, (name_prefix + '%',))
+                counts[kind] += 1
+            except Error as e:
+                if e.errno == 1205:
+                    lock_errors[kind] += 1
+                else:
+                    other_errors.append(e)
+        conn.close()
+    
+    # Database prints every error; the counts report them
+    with contextlib.redirect_stdout(io.StringIO()):
+        threads = [threading.Thread(target=writer)]
+        threads += [threading.Thread(target=reader, args=('reads',)) for _ in range(readers)]
+        threads.append(threading.Thread(target=reader, args=('transaction_reads',)))
+        for thread in threads:
+            thread.start()
+        time.sleep(duration)
+        stop.set()
+        for thread in threads:
+            thread.join()
+    
+    written = db.execute(count_query, (name_prefix + '%',))[0]['n']
+    db.execute("DELETE FROM Ingredient WHERE name LIKE %s", (name_prefix + '%',), fetch=False)
+    db.close()
+    
+    location = os.getenv('DB_SQLITE_PATH', ':memory:')
+    print(f"\n{duration:.0f}s, 1 writer holding its transaction {hold * 1e3:.0f} ms, "
+          f"{readers} readers + 1 reading in transactions ({location})")
+    for kind in counts:
+        print(f"{kind.replace('_', ' ').capitalize()}: {counts[kind]} ({lock_errors[kind]} lock errors)")
+    
+    checks = {
+        'no lock errors on writes': lock_errors['writes'] == 0,
+        'no lock errors on reads': lock_errors['reads'] == 0 and lock_errors['transaction_reads'] == 0,
+        'no other errors': not other_errors,
+        'every committed write kept': written == counts['writes'],
+        'both sides made progress': counts['writes'] > 0 and counts['reads'] > 0
+            and counts['transaction_reads'] > 0,
+    }
+    for name, ok in checks.items():
+        print(f"  [{'PASS' if ok else 'FAIL'}] {name}")
+    return all(checks.values())
+
+def metrics_overhead(iterations=10000, budget=0.01):
+    """Cost of the operation metrics on the benchmarks' stored procedure calls
+    
+    Replays the instrumented calls of the other benchmarks (a keyed
+    intake as in connection_recovery, then a production batch and a
+    consumption from that lot as in lot_contention) with the metrics
+    registry disabled and enabled in turn: pairs of iterations, in
+    disabled/enabled and enabled/disabled order alternately so the
+    tables growing over the run favour neither side, with the garbage
+    collector off. The overhead is the mean extra time of the enabled
+    iteration of a pair (the 1% most and least extra trimmed) over the
+    mean disabled iteration, reported with twice its standard error.
+    Passes when it is under budget, the histogram counts every enabled
+    call and the exporter renders both the operation series and the
+    inventory gauges.
+    """
+    db = Database()
+    fixture = _seed_fixture(db)
+    intake = IdempotentCall(db)
+    today = datetime.now().date()
+    procedures = ('RecordIngredientIntake', 'RecordProductionBatch', 'ConsumeIngredientLot')
+    
+    def run(n):
+        batch_id = BENCH_BATCH_BASE + n
+        start = time.perf_counter()
+        outcome = intake.call('RecordIngredientIntake',
+                              (fixture['ingredient_id'], fixture['supplier_id'], batch_id, 100,
+                               today + timedelta(days=180), fixture['version']),
+                              f"bench-metrics-{new_key()}")
+        db.execute_procedure('RecordProductionBatch', (
+            fixture['manufacturer_id'], fixture['product_id'], batch_id,
+            fixture['standard_batch_units'], today, today + timedelta(days=90), None, None
+        ))
+        db.execute_procedure('ConsumeIngredientLot', (
+            f"{fixture['product_id']}-{fixture['manufacturer_id']}-{batch_id}",
+            outcome['lot_number'], 5.0, None
+        ))
+        return time.perf_counter() - start
+    
+    before = {name: METRICS.snapshot().get(('procedure', name), (None, 0, 0, 0))[2]
+              for name in procedures}
+    enabled = METRICS.enabled
+    disabled_elapsed, enabled_elapsed = [], []
+    gc.disable()
+    try:
+        for n in range(0, iterations, 2):
+            order = (False, True) if n % 4 == 0 else (True, False)
+            for offset, on in enumerate(order):
+                METRICS.enabled = on
+                (enabled_elapsed if on else disabled_elapsed).append(run(n + offset))
+    finally:
+        METRICS.enabled = enabled
+        gc.enable()
+    counted = min(METRICS.snapshot()[('procedure', name)][2] - before[name] for name in procedures)
+    
+    text = METRICS.render()
+    gauges = MetricsExporter(METRICS).collect_gauges(db)
+    db.execute("DELETE FROM IdempotencyKey WHERE idempotency_key LIKE 'bench-metrics-%'", fetch=False)
+    _drop_fixture(db)
+    db.close()
+    
+    differences = sorted(on - off for on, off in zip(enabled_elapsed, disabled_elapsed))
+    trim = len(differences) // 100
+    differences = differences[trim:len(differences) - trim]
+    baseline = sum(disabled_elapsed) / len(disabled_elapsed)
+    overhead = sum(differences) / len(differences) / baseline
+    spread = 2 * statistics.stdev(differences) / len(differences) ** 0.5 / baseline
+    
+    print(f"\n{iterations} iterations of {', '.join(procedures)}, metrics disabled and enabled in turn")
+    print(f"Metrics disabled: {baseline * 1e3:.3f} ms/iteration")
+    print(f"Metrics enabled: {sum(enabled_elapsed) / len(enabled_elapsed) * 1e3:.3f} ms/iteration")
+    print(f"Overhead: {overhead:+.3%} (±{spread:.3%}), budget {budget:.0%}")
+    
+    checks = {
+        f'overhead under {budget:.0%}': overhead < budget,
+        'every enabled call counted': counted == len(enabled_elapsed),
+        'procedure series rendered': 'operation="ConsumeIngredientLot"' in text
+            and 'inventory_operation_duration_seconds_bucket' in text,
+        'inventory gauges rendered': 'inventory_live_lots ' in gauges
+            and 'inventory_consumption_rows_per_second ' in gauges,
+    }
+    for name, ok in checks.items():
+        print(f"  [{'PASS' if ok else 'FAIL'}] {name}")
+    return all(checks.values())
+
+BENCHMARKS = {
+    'lot_contention': lot_contention,
+    'fefo_allocation': fefo_allocation,
+    'mrp_planning': mrp_planning,
+    'row_formats': row_formats,
+    'statement_cache': statement_cache,
+    'connection_recovery': connection_recovery,
+    'async_reports': async_reports,
+    'replica_routing': replica_routing,
+    'shard_scatter': shard_scatter,
+    'audit_log': audit_log,
+    'sqlite_locking': sqlite_locking,
+    'metrics_overhead': metrics_overhead,
+}
+
+if __name__ == "__main__":
+    names = sys.argv[1:] or list(BENCHMARKS)
+    unknown = [name for name in names if name not in BENCHMARKS]
+    if unknown:
+        print(f"Unknown benchmark(s): {', '.join(unknown)}")
+        print(f"Available: {', '.join(BENCHMARKS)}")
+        exit(1)
+    
+    failed = []
+    for name in names:
+        print("\n" + "="*60)
+        print(f"BENCHMARK: {name}")
+        print("="*60)
+        if not BENCHMARKS[name]():
+            failed.append(name)
+    
+    if failed:
+        print(f"\n❌ Failed: {', '.join(failed)}")
+        exit(1)
+    print("\n✅ All benchmarks passed")
@@ -0,0 +1,244 @@
+import json
+import time
+from database import Database
+from compatibility import CompatibilityMatrix
+
+class BulkProductImport:
+    """Imports products, recipe plan versions and BOM lines from JSON
+    
+    The input is a JSON list of products (or {"products": [...]}) or a
+    JSON-lines file with one product per line:
+        
+        {"name": "Veggie Lasagna", "number": "P-300", "category": "Dinners",
+         "standard_batch_units": 100,
+         "recipes": [[{"ingredient": "Tomato Sauce", "quantity": 6.0}, ...], ...]}
+    
+    category and ingredient may be ids or names; "recipe" is shorthand for
+    a single version. Each recipe becomes a new RecipePlan version with
+    its BOM snapshot, exactly as Products -> Recipe Plans would create it.
+    
+    Products are applied in chunks, one transaction per chunk, with
+    multi-row statements for every table; a failing chunk is rolled back
+    on its own. The incompatibility check runs once per chunk as a single
+    query over the flattened BOMs of all its products.
+    """
+    
+    def __init__(self, db: Database, manufacturer_id, chunk_size=200):
+        self.db = db
+        self.manufacturer_id = manufacturer_id
+        self.chunk_size = chunk_size
+    
+    def read(self, path):
+        """Read products from a .json or .jsonl file"""
+        with open(path, encoding='utf-8') as f:
+            if path.endswith('.jsonl'):
+                return [json.loads(line) for line in f if line.strip()]
+            data = json.load(f)
+        if isinstance(data, dict):
+            data = data.get('products', [])
+        if not isinstance(data, list):
+            raise ValueError("Expected a list of products")
+        return data
+    
+    def run(self, products):
+        """Import product dicts and return the report
+        
+        The report has one 'products' entry per distinct product (status
+        IMPORTED, REJECTED or FAILED, the created plan versions and any
+        incompatible ingredient pairs) and the throughput 'totals'.
+        """
+        start = time.perf_counter()
+        entries = self._validate(products)
+        valid = [e for e in entries if e['status'] is None]
+        
+        imported_ids = []
+        for i in range(0, len(valid), self.chunk_size):
+            chunk = valid[i:i + self.chunk_size]
+            try:
+                self.db.run_transaction(lambda db: self._apply_chunk(db, chunk))
+            except Exception as e:
+                for entry in chunk:
+                    entry.update(status='FAILED', reason=str(e), product_id=None, versions=[],
+                                 conflicts=[])
+                continue
+            for entry in chunk:
+                entry['status'] = 'IMPORTED'
+                imported_ids.append(entry['product_id'])
+        
+        # One matrix refresh for the whole import instead of one per plan
+        CompatibilityMatrix(self.db).refresh_products(imported_ids)
+        
+        elapsed = time.perf_counter() - start
+        imported = [e for e in entries if e['status'] == 'IMPORTED']
+        plans = sum(len(e['versions']) for e in imported)
+        lines = sum(len(r) for e in imported for r in e['recipes'])
+        totals = {
+            'products': len(imported),
+            'rejected': sum(1 for e in entries if e['status'] == 'REJECTED'),
+            'failed': sum(1 for e in entries if e['status'] == 'FAILED'),
+            'plans': plans,
+            'bom_lines': lines,
+            'conflicting_products': sum(1 for e in imported if e['conflicts']),
+            'elapsed': elapsed,
+            'products_per_sec': len(imported) / elapsed if elapsed > 0 else 0.0,
+            'rows_per_sec': (len(imported) + plans + lines) / elapsed if elapsed > 0 else 0.0,
+        }
+        return {'products': entries, 'totals': totals}
+    
+    def _validate(self, products):
+        # Resolve names once, merge repeated products and reject bad entries
+        categories = {}
+        for r in self.db.execute("SELECT id, name FROM Category"):
+            categories[str(r['id'])] = r['id']
+            categories[str(r['name']).lower()] = r['id']
+        ingredients = {}
+        for r in self.db.execute("SELECT id, name FROM Ingredient"):
+            ingredients[str(r['id'])] = r['id']
+            if r['name']:
+                ingredients[r['name'].lower()] = r['id']
+        
+        entries = {}
+        for index, p in enumerate(products):
+            key = (str(p.get('name', '')).strip(), str(p.get('number', '')).strip())
+            entry = entries.get((key[0].lower(), key[1].lower()))
+            if entry is None:
+                entry = {'index': index, 'name': key[0], 'number': key[1], 'status': None,
+                         'reason': None, 'product_id': None, 'recipes': [], 'versions': [],
+                         'conflicts': []}
+                entries[(key[0].lower(), key[1].lower())] = entry
+            if entry['status'] == 'REJECTED':
+                continue
+            
+            problem = None
+            category_id = categories.get(str(p.get('category', p.get('category_id', ''))).lower())
+            try:
+                units = int(p.get('standard_batch_units', 0))
+            except (TypeError, ValueError):
+                units = 0
+            if not key[0] or not key[1]:
+                problem = "name and number are required"
+            elif category_id is None:
+                problem = f"Unknown category '{p.get('category', p.get('category_id'))}'"
+            elif units <= 0:
+                problem = "standard_batch_units must be a positive integer"
+            
+            recipes = p.get('recipes') or ([p['recipe']] if p.get('recipe') else [])
+            resolved = []
+            for recipe in recipes:
+                if problem:
+                    break
+                lines = {}
+                for line in recipe:
+                    ingredient_id = ingredients.get(str(line.get('ingredient', '')).lower())
+                    try:
+                        quantity = float(line.get('quantity'))
+                    except (TypeError, ValueError):
+                        quantity = -1
+                    if ingredient_id is None:
+                        problem = f"Unknown ingredient '{line.get('ingredient')}'"
+                    elif quantity < 0:
+                        problem = f"Invalid quantity for ingredient '{line.get('ingredient')}'"
+                    if problem:
+                        break
+                    lines[ingredient_id] = quantity
+                if not lines and not problem:
+                    problem = "A recipe has no ingredients"
+                resolved.append(lines)
+            
+            if problem:
+                entry.update(status='REJECTED', reason=problem, recipes=[])
+                continue
+            entry['category_id'] = category_id
+            entry['standard_batch_units'] = units
+            entry['recipes'].extend(resolved)
+        return list(entries.values())
+    
+    def _apply_chunk(self, db, chunk):
+        # Products (matched on name + number, as in create_update_product)
+        db.execute_many("""
+            INSERT INTO Product (name, number, category_id, standard_batch_units)
+            VALUES (%s, %s, %s, %s)
+            ON DUPLICATE KEY UPDATE category_id = VALUES(category_id),
+                                    standard_batch_units = VALUES(standard_batch_units)
+        """, [(e['name'], e['number'], e['category_id'], e['standard_batch_units']) for e in chunk])
+        
+        pairs = ','.join(['(%s, %s)'] * len(chunk))
+        # Keys are compared case-insensitively, like the UNIQUE (name, number) index
+        ids = {(r['name'].lower(), r['number'].lower()): r['id'] for r in db.execute(
+            f"SELECT id, name, number FROM Product WHERE (name, number) IN ({pairs})",
+            [v for e in chunk for v in (e['name'], e['number'])])}
+        for e in chunk:
+            e['product_id'] = ids[(e['name'].lower(), e['number'].lower())]
+            e['versions'] = []
+            e['conflicts'] = []
+        
+        db.execute_many("""
+            INSERT IGNORE INTO ManufacturerProduct (manufacturer_id, product_id)
+            VALUES (%s, %s)
+        """, [(self.manufacturer_id, e['product_id']) for e in chunk])
+        
+        product_ids = [e['product_id'] for e in chunk]
+        placeholders = ','.join(['%s'] * len(product_ids))
+        latest = {r['product_id']: r['max_version'] or 0 for r in db.execute(f"""
+            SELECT product_id, MAX(version_number) as max_version
+            FROM RecipePlan
+            WHERE product_id IN ({placeholders})
+            GROUP BY product_id
+        """, product_ids)}
+        
+        # Round k creates the k-th new version of every product that has one
+        rounds = max((len(e['recipes']) for e in chunk), default=0)
+        for k in range(rounds):
+            batch = [e for e in chunk if len(e['recipes']) > k]
+            
+            # BOM lines are merged into ProductBOM, as manage_recipe_plans does
+            db.execute_many("""
+                INSERT INTO ProductBOM (product_id, ingredient_id, quantity)
+                VALUES (%s, %s, %s)
+                ON DUPLICATE KEY UPDATE quantity = VALUES(quantity)
+            """, [(e['product_id'], ingredient_id, quantity)
+                  for e in batch for ingredient_id, quantity in e['recipes'][k].items()])
+            
+            plan_rows = []
+            for e in batch:
+                latest[e['product_id']] = latest.get(e['product_id'], 0) + 1
+                plan_rows.append((e['product_id'], latest[e['product_id']]))
+            db.execute_many("""
+                INSERT INTO RecipePlan (product_id, version_number, creation_date)
+                VALUES (%s, %s, CURDATE())
+            """, plan_rows)
+            
+            pairs = ','.join(['(%s, %s)'] * len(plan_rows))
+            plan_ids = [r['plan_id'] for r in db.execute(
+                f"SELECT plan_id FROM RecipePlan WHERE (product_id, version_number) IN ({pairs})",
+                [v for row in plan_rows for v in row])]
+            
+            # Set-based equivalent of SnapshotRecipePlan for all the new plans
+            plan_placeholders = ','.join(['%s'] * len(plan_ids))
+            db.execute(f"""
+                INSERT INTO RecipePlanBOM (plan_id, ingredient_id, quantity)
+                SELECT rp.plan_id, pb.ingredient_id, pb.quantity
+                FROM RecipePlan rp
+                JOIN ProductBOM pb ON pb.product_id = rp.product_id
+                WHERE rp.plan_id IN ({plan_placeholders})
+            """, plan_ids, fetch=False)
+            
+            for e, (_, version) in zip(batch, plan_rows):
+                e['versions'].append(version)
+        
+        # Incompatible pairs in the flattened BOM of every product of the chunk
+        by_product = {e['product_id']: e for e in chunk}
+        conflicts = db.execute(f"""
+            SELECT DISTINCT pb1.product_id, i1.name as name_a, i2.name as name_b
+            FROM ProductBOM pb1
+            JOIN IngredientClosure c1 ON c1.ancestor_id = pb1.ingredient_id
+            JOIN ProductBOM pb2 ON pb2.product_id = pb1.product_id
+            JOIN IngredientClosure c2 ON c2.ancestor_id = pb2.ingredient_id
+            JOIN IngredientIncompatibility ii
+                ON ii.ingredient_a = c1.descendant_id AND ii.ingredient_b = c2.descendant_id
+            JOIN Ingredient i1 ON i1.id = ii.ingredient_a
+            JOIN Ingredient i2 ON i2.id = ii.ingredient_b
+            WHERE pb1.product_id IN ({placeholders})
+        """, product_ids)
+        for r in conflicts:
+            by_product[r['product_id']]['conflicts'].append((r['name_a'], r['name_b']))
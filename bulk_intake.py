@@ -0,0 +1,192 @@
+import csv
+from datetime import datetime, timedelta
+from database import Database
+
+# Columns of an intake CSV (header row required); version may be blank
+# for the supplier's latest active formulation
+INTAKE_COLUMNS = ['ingredient', 'batch_id', 'packs', 'expiration_date', 'version']
+
+# Columns of the per-row report
+REPORT_COLUMNS = ['line', 'status', 'lot_number', 'ingredient_id', 'batch_id',
+                  'quantity', 'per_unit_cost', 'expiration_date', 'version', 'reason']
+
+# Days of shelf life required at intake (trg_ingredient_batch_pre_insert)
+MIN_SHELF_LIFE_DAYS = 90
+
+class BulkIntake:
+    """Receives many ingredient lots for one supplier from a CSV file
+    
+    All rows are validated in one pass against the supplier's
+    formulations and existing lots (two queries for the whole file), then
+    the accepted rows are inserted with multi-row INSERTs in a single
+    transaction. The result is a per-row report: each row is either
+    ACCEPTED with its lot number or REJECTED with the reason.
+    
+    The checks mirror RecordIngredientIntake and the IngredientBatch
+    triggers, which still run on every inserted row.
+    """
+    
+    def __init__(self, db: Database, supplier_id, chunk_size=500):
+        self.db = db
+        self.supplier_id = supplier_id
+        self.chunk_size = chunk_size
+    
+    def read_csv(self, path):
+        """Read an intake CSV into a list of row dicts (with their line number)"""
+        with open(path, newline='', encoding='utf-8') as f:
+            reader = csv.DictReader(f)
+            missing = [c for c in INTAKE_COLUMNS if c != 'version' and c not in (reader.fieldnames or [])]
+            if missing:
+                raise ValueError(f"Missing columns: {', '.join(missing)}")
+            rows = []
+            for row in reader:
+                row = {k.strip(): (v or '').strip() for k, v in row.items() if k}
+                row['line'] = reader.line_num
+                rows.append(row)
+        return rows
+    
+    def validate(self, rows):
+        """Check every row and return the report (one dict per row, in file order)"""
+        ingredients, formulations = self._load_formulations()
+        today = datetime.now().date()
+        min_expiration = today + timedelta(days=MIN_SHELF_LIFE_DAYS)
+        
+        report = []
+        for row in rows:
+            entry = {'line': row['line'], 'status': 'REJECTED', 'lot_number': None,
+                     'ingredient_id': None, 'batch_id': None, 'quantity': None,
+                     'per_unit_cost': None, 'expiration_date': None,
+                     'version': row.get('version') or None, 'reason': None}
+            report.append(entry)
+            
+            ingredient = row.get('ingredient', '')
+            ingredient_id = int(ingredient) if ingredient.isdigit() else ingredients.get(ingredient.lower())
+            if ingredient_id is None:
+                entry['reason'] = f"Unknown ingredient '{ingredient}'"
+                continue
+            entry['ingredient_id'] = ingredient_id
+            
+            try:
+                entry['batch_id'] = int(row.get('batch_id', ''))
+                packs = float(row.get('packs', ''))
+                entry['expiration_date'] = datetime.strptime(row.get('expiration_date', ''), '%Y-%m-%d').date()
+            except ValueError:
+                entry['reason'] = "Invalid batch_id, packs or expiration_date"
+                continue
+            
+            if packs <= 0:
+                entry['reason'] = "Packs received must be positive"
+                continue
+            if entry['expiration_date'] < min_expiration:
+                entry['reason'] = f"Expiration date must be at least {MIN_SHELF_LIFE_DAYS} days from today"
+                continue
+            
+            versions = formulations.get(ingredient_id)
+            if not versions:
+                entry['reason'] = "No formulation of this ingredient for this supplier"
+                continue
+            if entry['version']:
+                form = versions['all'].get(entry['version'])
+                if form is None:
+                    entry['reason'] = f"No formulation version {entry['version']}"
+                    continue
+            else:
+                form = versions['active']
+                if form is None:
+                    entry['reason'] = "No active formulation (give a version)"
+                    continue
+                entry['version'] = form['version_number']
+            
+            entry['quantity'] = form['pack_size'] * packs
+            entry['per_unit_cost'] = form['unit_price'] / form['pack_size']
+            entry['lot_number'] = f"{ingredient_id}-{self.supplier_id}-{entry['batch_id']}"
+            entry['status'] = 'ACCEPTED'
+        
+        self._reject_duplicates(report)
+        return report
+    
+    def load(self, report):
+        """Insert the ACCEPTED rows of a report in one transaction; return the count
+        
+        If any insert fails (e.g. a lot created concurrently), nothing is
+        inserted and the error is raised.
+        """
+        values = [(e['ingredient_id'], self.supplier_id, e['batch_id'], e['quantity'],
+                   e['per_unit_cost'], e['expiration_date'])
+                  for e in report if e['status'] == 'ACCEPTED']
+        # executemany rewrites this into multi-row INSERT statements;
+        # lot_number is set by trg_ingredient_batch_pre_insert
+        insert = """
+            INSERT INTO IngredientBatch
+                (ingredient_id, supplier_id, batch_id, quantity, per_unit_cost, expiration_date)
+            VALUES (%s, %s, %s, %s, %s, %s)
+        """
+        
+        def work(db):
+            for i in range(0, len(values), self.chunk_size):
+                db.execute_many(insert, values[i:i + self.chunk_size])
+            return len(values)
+        
+        if not values:
+            return 0
+        return self.db.run_transaction(work)
+    
+    def receive(self, path):
+        """Validate and load a CSV file; return the per-row report"""
+        report = self.validate(self.read_csv(path))
+        self.load(report)
+        return report
+    
+    @staticmethod
+    def write_report(report, path):
+        """Write a report as CSV"""
+        with open(path, 'w', newline='', encoding='utf-8') as f:
+            writer = csv.DictWriter(f, fieldnames=REPORT_COLUMNS)
+            writer.writeheader()
+            writer.writerows(report)
+    
+    def _load_formulations(self):
+        # {lower name: id} and {ingredient_id: {'all': {version: row}, 'active': row}}
+        query = """
+            SELECT i.id as ingredient_id, i.name, f.version_number, f.pack_size, f.unit_price,
+                   (f.validity_start_date <= CURDATE()
+                    AND (f.validity_end_date IS NULL OR f.validity_end_date >= CURDATE())) as active
+            FROM Ingredient i
+            LEFT JOIN IngredientFormulation f
+                ON f.ingredient_id = i.id AND f.supplier_id = %s AND f.pack_size > 0
+            ORDER BY i.id, f.version_number
+        """
+        ingredients = {}
+        formulations = {}
+        for r in self.db.execute(query, (self.supplier_id,)):
+            if r['name']:
+                ingredients[r['name'].lower()] = r['ingredient_id']
+            if r['version_number'] is None:
+                continue
+            versions = formulations.setdefault(r['ingredient_id'], {'all': {}, 'active': None})
+            versions['all'][str(r['version_number'])] = r
+            # Latest active version, as in receive_ingredient_batch
+            if r['active']:
+                versions['active'] = r
+        return ingredients, formulations
+    
+    def _reject_duplicates(self, report):
+        accepted = [e for e in report if e['status'] == 'ACCEPTED']
+        if not accepted:
+            return
+        
+        batch_ids = sorted({e['batch_id'] for e in accepted})
+        placeholders = ','.join(['%s'] * len(batch_ids))
+        query = f"""
+            SELECT lot_number FROM IngredientBatch
+            WHERE supplier_id = %s AND batch_id IN ({placeholders})
+        """
+        existing = {r['lot_number'] for r in self.db.execute(query, [self.supplier_id] + batch_ids)}
+        
+        seen = set()
+        for e in accepted:
+            if e['lot_number'] in existing:
+                e['status'], e['reason'] = 'REJECTED', f"Lot {e['lot_number']} already exists"
+            elif e['lot_number'] in seen:
+                e['status'], e['reason'] = 'REJECTED', f"Lot {e['lot_number']} appears earlier in the file"
+            seen.add(e['lot_number'])
@@ -0,0 +1,255 @@
+import os
+import threading
+from datetime import datetime
+from database import Database
+from background import BackgroundWorker
+
+# Events read per consumer and poll
+DEFAULT_BATCH_SIZE = 500
+
+# Seconds a hole in the event ids is waited on before it is skipped. An
+# id is taken when the event is written but only visible once its
+# transaction commits, so a later event can show up first; a hole that
+# stays open this long is taken for a rolled back write. It must outlast
+# the longest write transaction, or that transaction's events are
+# skipped for good: a statement can wait innodb_lock_wait_timeout (50s
+# by default) for a lock before it fails, so allow well over one wait.
+# Deadlock retries re-run the work in a new transaction with new ids,
+# so they do not lengthen a hole.
+DEFAULT_GAP_TIMEOUT_SECONDS = int(os.getenv('CHANGE_STREAM_GAP_TIMEOUT_SECONDS', '120'))
+
+# Days handled events are kept (purged by the expiry sweeper)
+DEFAULT_RETENTION_DAYS = 30
+
+EVENT_TYPES = ('INTAKE', 'PRODUCTION', 'CONSUMPTION', 'CONSUMPTION_REVERSED')
+
+class Subscription:
+    """One in-process consumer of the change stream and its cursor"""
+    
+    def __init__(self, consumer, handler, event_types=None, from_start=True):
+        self.consumer = consumer
+        self.handler = handler
+        self.event_types = set(event_types) if event_types else None
+        self.from_start = from_start
+        # Last event_id handled per Database (each loaded from its own
+        # ChangeStreamCursor: every shard has its own outbox and ids)
+        self.positions = {}
+        self.delivered = 0
+        self.failures = 0
+        self.last_error = None
+
+class ChangeStream:
+    """Delivers the InventoryEvent outbox to in-process subscribers
+    
+    The intake, production and consumption triggers write one event per
+    change in the same transaction as the change. Each subscriber has a
+    named cursor in ChangeStreamCursor and receives the events after it,
+    in event_id order and in batches: handler(events) gets a list of
+    event dicts. The cursor moves past a batch only after the handler
+    returns, so delivery is at-least-once: a handler that raises, or a
+    process that stops before the cursor is saved, sees the batch again.
+    Handlers should be idempotent (event_id identifies an event).
+    
+    poll() delivers one batch to every subscriber; start() polls on a
+    background thread with its own database connection every
+    poll_seconds until caught up, then waits. With DB_SHARDS the thread
+    polls every shard: each has its own outbox and cursors, so a handler
+    gets batches from one shard at a time and event_id identifies an
+    event within its shard only.
+    """
+    
+    def __init__(self, db: Database = None, batch_size=DEFAULT_BATCH_SIZE, poll_seconds=1.0,
+                 gap_timeout_seconds=DEFAULT_GAP_TIMEOUT_SECONDS):
+        self.db = db
+        self.batch_size = batch_size
+        self.poll_seconds = poll_seconds
+        self.gap_timeout_seconds = gap_timeout_seconds
+        self.subscriptions = {}
+        self._lock = threading.Lock()
+        self._worker = BackgroundWorker('change-stream', self.drain, poll_seconds, 'Change stream poll')
+    
+    def subscribe(self, consumer, handler, event_types=None, from_start=True):
+        """Register handler under the cursor named consumer
+        
+        event_types limits the events handed to it (the cursor still moves
+        past the others). A consumer without a saved cursor starts at the
+        oldest event kept, or with from_start=False at the newest.
+        """
+        unknown = set(event_types or ()) - set(EVENT_TYPES)
+        if unknown:
+            raise ValueError(f"Unknown event type(s): {', '.join(sorted(unknown))}")
+        subscription = Subscription(consumer, handler, event_types, from_start)
+        if self.db is not None:
+            subscription.positions[self.db] = self._load_position(self.db, consumer, from_start)
+        with self._lock:
+            self.subscriptions[consumer] = subscription
+        return subscription
+    
+    def unsubscribe(self, consumer):
+        """Stop delivering to consumer (its cursor is kept)"""
+        with self._lock:
+            self.subscriptions.pop(consumer, None)
+    
+    def read(self, after_event_id=0, limit=None, db: Database = None):
+        """Events with event_id above after_event_id, oldest first"""
+        db = db or self.db
+        query = """
+            SELECT event_id, event_type, lot_number, ingredient_lot_number,
+                   ingredient_id, supplier_id, product_id, manufacturer_id,
+                   quantity, created_at
+            FROM InventoryEvent
+            WHERE event_id > %s
+            ORDER BY event_id
+            LIMIT %s
+        """
+        # Replicas can lag behind the cursor; the outbox is read where it is written
+        with db.use_primary():
+            return db.execute(query, (after_event_id, limit or self.batch_size))
+    
+    def position(self, consumer, db: Database = None):
+        """The last event_id consumer has handled (None without a cursor)"""
+        db = db or self.db
+        with db.use_primary():
+            result = db.execute("SELECT last_event_id FROM ChangeStreamCursor WHERE consumer = %s",
+                                (consumer,))
+        return result[0]['last_event_id'] if result else None
+    
+    def seek(self, consumer, event_id, db: Database = None):
+        """Move consumer's cursor, e.g. back to 0 to replay every event kept"""
+        db = db or self.db
+        self._save_position(db, consumer, event_id)
+        with self._lock:
+            subscription = self.subscriptions.get(consumer)
+        if subscription:
+            subscription.positions[db] = event_id
+    
+    def lag(self, db: Database = None):
+        """Events not yet handled, per consumer"""
+        db = db or self.db
+        query = """
+            SELECT c.consumer, c.last_event_id,
+                   (SELECT COUNT(*) FROM InventoryEvent e
+                    WHERE e.event_id > c.last_event_id) as pending_events
+            FROM ChangeStreamCursor c
+            ORDER BY c.consumer
+        """
+        with db.use_primary():
+            return db.execute(query)
+    
+    def poll(self, db: Database = None):
+        """Deliver at most one batch to every subscriber
+        
+        Returns the number of events the cursors moved past (0 when every
+        subscriber is caught up or its handler failed).
+        """
+        db = db or self.db
+        with self._lock:
+            subscriptions = list(self.subscriptions.values())
+        
+        # Subscribers at the same position share one read
+        by_position = {}
+        for subscription in subscriptions:
+            if db not in subscription.positions:
+                subscription.positions[db] = self._load_position(
+                    db, subscription.consumer, subscription.from_start)
+            by_position.setdefault(subscription.positions[db], []).append(subscription)
+        
+        moved = 0
+        for position, group in by_position.items():
+            events = self._committed(db, self.read(position, self.batch_size, db), position)
+            if not events:
+                continue
+            for subscription in group:
+                if self._deliver(db, subscription, events):
+                    moved += len(events)
+        return moved
+    
+    def drain(self, db: Database = None):
+        """Poll until every subscriber has caught up (or its handler fails)"""
+        total = 0
+        while True:
+            moved = self.poll(db)
+            if not moved:
+                return total
+            total += moved
+    
+    def purge(self, retention_days, db: Database = None):
+        """Delete events older than retention_days that every cursor has passed"""
+        db = db or self.db
+        query = """
+            DELETE FROM InventoryEvent
+            WHERE created_at < DATE_SUB(NOW(), INTERVAL %s DAY)
+            AND NOT EXISTS (
+                SELECT 1 FROM ChangeStreamCursor c
+                WHERE c.last_event_id < InventoryEvent.event_id
+            )
+        """
+        return db.execute(query, (retention_days,), fetch=False)
+    
+    def start(self):
+        """Start delivering on a background thread with a dedicated connection"""
+        self._worker.start()
+    
+    def stop(self, timeout=5):
+        """Stop the background thread (after the batch in progress)"""
+        self._worker.stop(timeout)
+    
+    def _committed(self, db, events, position):
+        # The events up to the first hole in the ids that may still be
+        # filled by a transaction in flight. The missing event was written
+        # before the one after the hole, so that one's age, on the server
+        # clock that stamped created_at, is a lower bound for the hole's
+        expected = position + 1
+        for i, event in enumerate(events):
+            if event['event_id'] != expected:
+                with db.use_primary():
+                    age = db.execute("""
+                        SELECT TIMESTAMPDIFF(SECOND, created_at, NOW()) as age_seconds
+                        FROM InventoryEvent
+                        WHERE event_id = %s
+                    """, (event['event_id'],))
+                if not age or age[0]['age_seconds'] < self.gap_timeout_seconds:
+                    return events[:i]
+            expected = event['event_id'] + 1
+        return events
+    
+    def _deliver(self, db, subscription, events):
+        batch = events
+        if subscription.event_types is not None:
+            batch = [e for e in events if e['event_type'] in subscription.event_types]
+        if batch:
+            try:
+                subscription.handler(batch)
+            except Exception as e:
+                # The cursor stays put: the batch is delivered again next poll
+                subscription.failures += 1
+                subscription.last_error = e
+                print(f"Change stream consumer '{subscription.consumer}' failed: {e}")
+                return False
+        last_event_id = events[-1]['event_id']
+        self._save_position(db, subscription.consumer, last_event_id)
+        subscription.positions[db] = last_event_id
+        subscription.delivered += len(batch)
+        return True
+    
+    def _load_position(self, db, consumer, from_start):
+        position = self.position(consumer, db)
+        if position is not None:
+            return position
+        with db.use_primary():
+            if from_start:
+                start = db.execute("SELECT COALESCE(MIN(event_id) - 1, 0) as event_id FROM InventoryEvent")
+            else:
+                start = db.execute("SELECT COALESCE(MAX(event_id), 0) as event_id FROM InventoryEvent")
+        position = start[0]['event_id']
+        self._save_position(db, consumer, position)
+        return position
+    
+    def _save_position(self, db, consumer, event_id):
+        db.execute("""
+            INSERT INTO ChangeStreamCursor (consumer, last_event_id, updated_at)
+            VALUES (%s, %s, %s)
+            ON DUPLICATE KEY UPDATE
+                last_event_id = VALUES(last_event_id),
+                updated_at = VALUES(updated_at)
+        """, (consumer, event_id, datetime.now()), fetch=False)
@@ -0,0 +1,149 @@
+from database import Database
+
+class CompatibilityMatrix:
+    """All-pairs product conflict matrix stored in ProductConflict
+    
+    Every product's flattened ingredient set is encoded as an integer
+    bitset (one bit per ingredient), so testing a product pair for a
+    conflict is a single AND of two bitsets instead of a round of queries.
+    """
+    
+    def __init__(self, db: Database):
+        self.db = db
+    
+    def load_ingredient_sets(self):
+        """Flattened ingredient id set for every product"""
+        products = self.db.execute("SELECT id FROM Product")
+        ingredient_sets = {p['id']: set() for p in products}
+        
+        # Every ingredient reachable from the BOM, compounds included
+        query = """
+            SELECT DISTINCT pb.product_id, c.descendant_id as ingredient_id
+            FROM ProductBOM pb
+            JOIN IngredientClosure c ON c.ancestor_id = pb.ingredient_id
+        """
+        for row in self.db.execute(query):
+            ingredient_sets.setdefault(row['product_id'], set()).add(row['ingredient_id'])
+        return ingredient_sets
+    
+    def load_incompatibilities(self):
+        """All do-not-combine pairs as (ingredient_a, ingredient_b) tuples"""
+        rows = self.db.execute("SELECT ingredient_a, ingredient_b FROM IngredientIncompatibility")
+        return [(r['ingredient_a'], r['ingredient_b']) for r in rows]
+    
+    @staticmethod
+    def compute(ingredient_sets, incompatibilities, product_ids=None):
+        """Return conflict rows (product_a, product_b, ingredient_a, ingredient_b)
+        
+        Only pairs involving product_ids are computed (all products when None).
+        Rows are returned in both directions.
+        """
+        # Assign one bit per ingredient that appears in any product
+        bit = {}
+        for ids in ingredient_sets.values():
+            for ing_id in ids:
+                if ing_id not in bit:
+                    bit[ing_id] = len(bit)
+        
+        masks = {}
+        for prod_id, ids in ingredient_sets.items():
+            mask = 0
+            for ing_id in ids:
+                mask |= 1 << bit[ing_id]
+            masks[prod_id] = mask
+        
+        # partner_mask[i] has a bit set for every ingredient i must not meet
+        partners = {}
+        partner_mask = {}
+        for a, b in incompatibilities:
+            if a not in bit or b not in bit:
+                continue
+            partners.setdefault(a, set()).add(b)
+            partners.setdefault(b, set()).add(a)
+            partner_mask[a] = partner_mask.get(a, 0) | (1 << bit[b])
+            partner_mask[b] = partner_mask.get(b, 0) | (1 << bit[a])
+        
+        targets = ingredient_sets.keys() if product_ids is None else product_ids
+        rows = set()
+        for prod_a in targets:
+            ids_a = ingredient_sets.get(prod_a, ())
+            conflict_mask = 0
+            for ing_id in ids_a:
+                conflict_mask |= partner_mask.get(ing_id, 0)
+            if not conflict_mask:
+                continue
+            
+            for prod_b, mask_b in masks.items():
+                if not conflict_mask & mask_b:
+                    continue
+                # Expand the matching bits into ingredient pairs
+                ids_b = ingredient_sets[prod_b]
+                for ing_a in ids_a:
+                    if not partner_mask.get(ing_a, 0) & mask_b:
+                        continue
+                    for ing_b in partners[ing_a] & ids_b:
+                        rows.add((prod_a, prod_b, ing_a, ing_b))
+                        rows.add((prod_b, prod_a, ing_b, ing_a))
+        return sorted(rows)
+    
+    def rebuild(self):
+        """Recompute and store the full matrix"""
+        rows = self.compute(self.load_ingredient_sets(), self.load_incompatibilities())
+        self.db.execute("DELETE FROM ProductConflict", fetch=False)
+        self._store(rows)
+        return len(rows)
+    
+    def refresh_products(self, product_ids):
+        """Recompute the matrix rows of the given products only"""
+        product_ids = list(set(product_ids))
+        if not product_ids:
+            return 0
+        ingredient_sets = self.load_ingredient_sets()
+        product_ids = [p for p in product_ids if p in ingredient_sets]
+        rows = self.compute(ingredient_sets, self.load_incompatibilities(), product_ids)
+        
+        placeholders = ','.join(['%s'] * len(product_ids))
+        delete_query = f"""
+            DELETE FROM ProductConflict
+            WHERE product_a IN ({placeholders}) OR product_b IN ({placeholders})
+        """
+        self.db.execute(delete_query, product_ids * 2, fetch=False)
+        self._store(rows)
+        return len(rows)
+    
+    def refresh_ingredients(self, ingredient_ids):
+        """Recompute rows of every product whose flattened set uses the ingredients
+        
+        Used after a formulation or do-not-combine change.
+        """
+        ingredient_ids = set(ingredient_ids)
+        affected = [
+            prod_id for prod_id, ids in self.load_ingredient_sets().items()
+            if ids & ingredient_ids
+        ]
+        return self.refresh_products(affected)
+    
+    def conflicts_for_product(self, product_id):
+        """Stored conflicts between product_id and every product (itself included)"""
+        query = """
+            SELECT pc.product_b, p.name as product_name,
+                   pc.ingredient_a, pc.ingredient_b,
+                   i1.name as name_a, i2.name as name_b
+            FROM ProductConflict pc
+            JOIN Product p ON pc.product_b = p.id
+            JOIN Ingredient i1 ON pc.ingredient_a = i1.id
+            JOIN Ingredient i2 ON pc.ingredient_b = i2.id
+            WHERE pc.product_a = %s
+            ORDER BY p.name, i1.name, i2.name
+        """
+        return self.db.execute(query, (product_id,))
+    
+    def _store(self, rows):
+        """Insert conflict rows in chunks"""
+        insert_query = """
+            INSERT IGNORE INTO ProductConflict (product_a, product_b, ingredient_a, ingredient_b)
+            VALUES (%s, %s, %s, %s)
+        """
+        chunk_size = 1000
+        for start in range(0, len(rows), chunk_size):
+            self.db.execute_many(insert_query, rows[start:start + chunk_size])
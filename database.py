@@ -1,79 +1,577 @@
 import mysql.connector
 from mysql.connector import Error
 import os
+import random
+import threading
+import time
+from contextlib import contextmanager
 from dotenv import load_dotenv
+from row_formats import ROW_FORMATS, format_rows
+from statement_cache import StatementCache
+from replicas import ReplicaRouter
+from metrics import REGISTRY as METRICS
 
 # Load environment variables from .env file
 load_dotenv()
 
+# Server errors after which the whole transaction can safely be re-run:
+# 1213 = deadlock (transaction rolled back), 1205 = lock wait timeout
+RETRYABLE_ERRNOS = (1213, 1205)
+
+# Client errors meaning the connection is gone: 2003 = cannot connect,
+# 2006 = server has gone away, 2013 / 2055 = lost connection during query
+CONNECTION_ERRNOS = (2003, 2006, 2013, 2055)
+
+# Statements that only read, and so can be re-run after a reconnect
+READ_KEYWORDS = ('SELECT', 'WITH', 'SHOW', 'DESCRIBE', 'EXPLAIN')
+
+class RetryableError(Error):
+    """A write failed because the connection dropped
+    
+    The statement (or the transaction it belonged to) may or may not have
+    been applied. The connection has been re-established, so the caller
+    can retry, safely so if the write carries an idempotency key (see
+    idempotency.IdempotentCall). errno is the original client error.
+    """
+
 class Database:
-    def __init__(self):
+    def __init__(self, host=None, port=None, database=None):
+        # Connection target; defaults to DB_HOST / DB_PORT / DB_NAME
+        # (another server or schema, e.g. a shard, can be given instead)
+        self.host = host or os.getenv('DB_HOST', 'localhost')
+        self.port = int(port or os.getenv('DB_PORT', '3306'))
+        self.database = database or os.getenv('DB_NAME', 'inventory_management')
+        # mysql (default) or sqlite: an embedded database for offline runs
+        # and tests (see sqlite_backend)
+        self.backend = os.getenv('DB_BACKEND', 'mysql').lower()
         self.connection = None
         self.cursor = None
+        # Plain (tuple) cursor for the non-dict row formats
+        self.tuple_cursor = None
+        # Cursor of the last execute() (see lastrowid)
+        self.last_cursor = None
+        self.statements = StatementCache(int(os.getenv('DB_STATEMENT_CACHE_SIZE', '64')))
+        # Read replicas (DB_REPLICA_HOSTS) of the default database; without
+        # any, or for another target, everything runs on the primary
+        if host or port or database or self.backend == 'sqlite':
+            self.replicas = ReplicaRouter([])
+        else:
+            self.replicas = ReplicaRouter.from_env(self.statements.size)
+        self.in_transaction = False
+        # Reads stay on the primary until then (read-your-writes after a
+        # write) and while use_primary() blocks are open
+        self._primary_until = 0.0
+        self._primary_depth = 0
+        # Connection running the current statement, if not the primary (see interrupt)
+        self._active = None
+        # Failed connection attempts are retried this many times with
+        # exponential backoff; reads are re-run this many times after a reconnect
+        self.connect_retries = int(os.getenv('DB_CONNECT_RETRIES', '5'))
+        self.read_retries = int(os.getenv('DB_READ_RETRIES', '3'))
+        # One statement at a time per connection (the keepalive thread shares it)
+        self._lock = threading.RLock()
+        self._last_used = time.monotonic()
+        self._keepalive = None
+        self._keepalive_stop = threading.Event()
+        self._stats = {
+            'transactions': 0,
+            'commits': 0,
+            'rollbacks': 0,
+            'deadlock_retries': 0,
+            'reconnects': 0,
+            'read_retries': 0,
+            'keepalive_pings': 0,
+            'last_recovery_seconds': None,
+            'replica_reads': 0,
+            'replica_fallbacks': 0,
+        }
         self.connect()
+        self.start_keepalive(int(os.getenv('DB_KEEPALIVE_SECONDS', '60')))
     
-    def connect(self):
-        """Establish database connection"""
-        try:
-            self.connection = mysql.connector.connect(
-                host=os.getenv('DB_HOST', 'localhost'),
-                database=os.getenv('DB_NAME', 'inventory_management'),
-                user=os.getenv('DB_USER', 'root'),
-                password=os.getenv('DB_PASSWORD', ''),
-                port=int(os.getenv('DB_PORT', '3306'))
-            )
-            if self.connection.is_connected():
-                self.cursor = self.connection.cursor(dictionary=True)
-                print("Connected to database successfully")
-        except Error as e:
-            print(f"Error connecting to database: {e}")
-            raise
+    def connect(self, retries=None):
+        """Establish database connection
+        
+        Failed attempts are retried with exponential backoff (up to
+        connect_retries times) before the error is raised.
+        """
+        # Prepared statements live on the old connection
+        self.statements.clear()
+        self.last_cursor = None
+        retries = self.connect_retries if retries is None else retries
+        attempt = 0
+        while True:
+            try:
+                if self.backend == 'sqlite':
+                    self.connection = self._connect_sqlite()
+                else:
+                    self.connection = mysql.connector.connect(
+                        host=self.host,
+                        database=self.database,
+                        user=os.getenv('DB_USER', 'root'),
+                        password=os.getenv('DB_PASSWORD', ''),
+                        port=self.port
+                    )
+                if self.connection.is_connected():
+                    self.cursor = self.connection.cursor(dictionary=True)
+                    self.tuple_cursor = self.connection.cursor()
+                    self._last_used = time.monotonic()
+                    print("Connected to database successfully")
+                return
+            except Error as e:
+                if attempt >= retries:
+                    print(f"Error connecting to database: {e}")
+                    raise
+                delay = min(0.5 * (2 ** attempt), 10.0)
+                print(f"Error connecting to database: {e} (retrying in {delay:.1f}s)")
+                time.sleep(delay + random.uniform(0, delay / 2))
+                attempt += 1
+    
+    def _connect_sqlite(self):
+        # An embedded database is created (schema, triggers, sample data)
+        # by the first connection to it
+        import sqlite_backend
+        
+        connection = sqlite_backend.connect(self.database)
+        with sqlite_backend.setup_lock:
+            if not connection.has_schema():
+                from database_setup import DatabaseSetup
+                if not DatabaseSetup(database_name=self.database).load_sqlite(connection):
+                    # Not an Error: connecting again would not help
+                    connection.reset()
+                    connection.close()
+                    raise RuntimeError(f"Could not create SQLite database '{self.database}' "
+                                       f"(see the errors above)")
+        return connection
+    
+    def reconnect(self):
+        """Drop the current connection and connect again (with backoff)"""
+        with self._lock:
+            start = time.monotonic()
+            if self.connection is not None:
+                try:
+                    self.connection.close()
+                except Error:
+                    # Already dead; nothing to close on the server
+                    pass
+            self.connection = None
+            self.connect()
+            self._stats['reconnects'] += 1
+            self._stats['last_recovery_seconds'] = time.monotonic() - start
     
     def get_connection(self):
         """Get the database connection"""
         if self.connection is None or not self.connection.is_connected():
-            self.connect()
+            self.reconnect()
         return self.connection
     
-    def execute(self, query, params=None, fetch=True):
-        """Execute a query and return results"""
-        try:
-            if params:
-                self.cursor.execute(query, params)
+    def execute(self, query, params=None, fetch=True, row_format='dict'):
+        """Execute a query and return results
+        
+        row_format selects how rows are returned (see row_formats): dict
+        (default), tuple, record or columnar. The compact formats skip the
+        per-row dicts, which dominate large scans.
+        
+        Parameterized statements run as server-side prepared statements
+        from an LRU cache of DB_STATEMENT_CACHE_SIZE entries (default 64,
+        0 disables it), so repeated SQL is parsed once per connection.
+        
+        If the connection drops, reads outside a transaction reconnect
+        and run again; anything else reconnects and raises RetryableError.
+        
+        With read replicas configured (see replicas.ReplicaRouter), reads
+        outside a transaction run on a replica, unless this session wrote
+        recently, is inside use_primary(), or no replica is close enough
+        to the primary. Writes and CALLs always run on the primary.
+        """
+        if row_format not in ROW_FORMATS:
+            raise ValueError(f"Unknown row format '{row_format}'")
+        
+        if fetch and self._use_replica(query):
+            rows = self._read_replica(query, params, row_format)
+            if rows is not None:
+                return rows
+        
+        def run():
+            if self.statements.cacheable(query, params):
+                cursor = self.statements.execute(self.connection, query, params)
             else:
-                self.cursor.execute(query)
+                cursor = self.cursor if row_format == 'dict' else self.tuple_cursor
+                if params:
+                    cursor.execute(query, params)
+                else:
+                    cursor.execute(query)
+            self.last_cursor = cursor
             
             if fetch:
-                return self.cursor.fetchall()
+                if cursor is self.cursor:
+                    return cursor.fetchall()
+                return format_rows(cursor.fetchall(), cursor.column_names, row_format)
+            else:
+                self._commit()
+                return cursor.rowcount
+        
+        return self._run(run, self._is_read(query), "Database error")
+    
+    @property
+    def lastrowid(self):
+        """AUTO_INCREMENT id generated by the last execute()"""
+        return self.last_cursor.lastrowid if self.last_cursor else None
+    
+    def execute_iter(self, query, params=None, chunk_size=1000, row_format='dict'):
+        """Stream the rows of a query in chunks of chunk_size
+        
+        Rows are read from the server as they are consumed, so large result
+        sets never sit in memory at once. The connection cannot run other
+        statements until the generator is exhausted or closed. Each chunk
+        is in row_format (see execute). A dropped connection is not
+        retried here, since part of the result was already handed out.
+        Reads are routed to a replica like execute's.
+        """
+        if row_format not in ROW_FORMATS:
+            raise ValueError(f"Unknown row format '{row_format}'")
+        self._last_used = time.monotonic()
+        if self.connection is None:
+            self.reconnect()
+        connection = self.connection
+        if self._use_replica(query):
+            with self._lock:
+                replica = self.replicas.pick()
+            if replica is not None:
+                connection = self._active = replica.connection
+                self._stats['replica_reads'] += 1
+            else:
+                self._stats['replica_fallbacks'] += 1
+        cursor = connection.cursor(dictionary=(row_format == 'dict'))
+        try:
+            if params:
+                cursor.execute(query, params)
             else:
-                self.connection.commit()
-                return self.cursor.rowcount
+                cursor.execute(query)
+            while True:
+                rows = cursor.fetchmany(chunk_size)
+                if not rows:
+                    break
+                if row_format != 'dict':
+                    rows = format_rows(rows, cursor.column_names, row_format)
+                self._last_used = time.monotonic()
+                yield rows
         except Error as e:
-            self.connection.rollback()
             print(f"Database error: {e}")
             raise
+        finally:
+            # Drain anything left unread (early exit) before closing the cursor
+            if connection.is_connected():
+                connection.consume_results()
+            cursor.close()
+            self._active = None
+    
+    def execute_many(self, query, seq_params):
+        """Execute a statement once per parameter tuple and commit once"""
+        def run():
+            self.cursor.executemany(query, seq_params)
+            self._commit()
+            return self.cursor.rowcount
+        
+        return self._run(run, False, "Database error")
     
     def execute_procedure(self, procedure_name, params=None):
-        """Execute a stored procedure"""
+        """Execute a stored procedure
+        
+        Outside a transaction the call commits on its own and is re-run if
+        the server aborts it with a deadlock or lock wait timeout.
+        """
+        start = time.perf_counter()
         try:
+            if self.in_transaction:
+                result = self._call_procedure(procedure_name, params)
+            else:
+                result = self.run_transaction(lambda db: db._call_procedure(procedure_name, params))
+        except Error as e:
+            METRICS.observe('procedure', procedure_name, time.perf_counter() - start, error=True)
+            print(f"Procedure error: {e}")
+            raise
+        except BaseException:
+            METRICS.observe('procedure', procedure_name, time.perf_counter() - start, error=True)
+            raise
+        METRICS.observe('procedure', procedure_name, time.perf_counter() - start)
+        return result
+    
+    def _call_procedure(self, procedure_name, params=None):
+        def run():
             if params:
                 placeholders = ','.join(['%s'] * len(params))
                 query = f"CALL {procedure_name}({placeholders})"
                 self.cursor.execute(query, params)
             else:
                 self.cursor.execute(f"CALL {procedure_name}()")
-            
-            self.connection.commit()
             return self.cursor.fetchall()
-        except Error as e:
+        
+        # Errors are reported by execute_procedure
+        return self._run(run, False, None)
+    
+    def _run(self, statement, read_only, error_label):
+        # Run statement() under the connection lock, recovering from a dropped connection
+        with self._lock:
+            attempt = 0
+            while True:
+                try:
+                    if self.connection is None or not self.cursor:
+                        self.reconnect()
+                    result = statement()
+                    self._last_used = time.monotonic()
+                    if not read_only:
+                        self._wrote()
+                    return result
+                except Error as e:
+                    if not self._connection_error(e):
+                        self._rollback()
+                        if error_label:
+                            print(f"{error_label}: {e}")
+                        raise
+                    if error_label:
+                        print(f"{error_label}: {e}")
+                    if read_only and not self.in_transaction and attempt < self.read_retries:
+                        attempt += 1
+                        self._stats['read_retries'] += 1
+                        self.reconnect()
+                        continue
+                    self._recover()
+                    raise RetryableError(msg=f"Connection lost, outcome unknown: {e.msg}",
+                                         errno=e.errno) from e
+    
+    @contextmanager
+    def transaction(self):
+        """Group statements into one transaction
+        
+        execute/execute_many/execute_procedure inside the block do not
+        commit; the block commits on exit and rolls back on any exception.
+        Nested blocks join the outer transaction. If the connection drops,
+        the block raises RetryableError: the server has discarded the
+        transaction, unless the drop hit the commit itself.
+        """
+        if self.in_transaction:
+            yield self
+            return
+        
+        with self._lock:
+            self.in_transaction = True
+            self._stats['transactions'] += 1
+            try:
+                if self.backend == 'sqlite':
+                    # SQLite would only start the transaction at the first
+                    # write, after the reads MySQL locks with FOR UPDATE
+                    self.connection.begin()
+                yield self
+                try:
+                    self.connection.commit()
+                except Error as e:
+                    if not self._connection_error(e):
+                        raise
+                    self._recover()
+                    raise RetryableError(msg=f"Connection lost during commit: {e.msg}",
+                                         errno=e.errno) from e
+                self._stats['commits'] += 1
+                self._wrote()
+            except BaseException:
+                try:
+                    if self.connection is not None:
+                        self.connection.rollback()
+                except Error:
+                    # A dead connection: the server rolled the transaction back
+                    pass
+                self._stats['rollbacks'] += 1
+                raise
+            finally:
+                self.in_transaction = False
+                self._last_used = time.monotonic()
+    
+    def run_transaction(self, work, retries=5, base_delay=0.05):
+        """Run work(db) in a transaction, re-running it on deadlock
+        
+        work must be safe to repeat: every attempt starts from a rolled
+        back transaction. Retries back off exponentially with jitter so
+        the competing transactions do not collide again in lockstep.
+        RetryableError (dropped connection) is not retried here, since
+        the transaction may have committed; see IdempotentCall.run.
+        """
+        if self.in_transaction:
+            # The outer transaction owns the retry
+            return work(self)
+        
+        attempt = 0
+        while True:
+            try:
+                with self.transaction():
+                    return work(self)
+            except Error as e:
+                if e.errno not in RETRYABLE_ERRNOS or attempt >= retries:
+                    raise
+                self._stats['deadlock_retries'] += 1
+                delay = base_delay * (2 ** attempt)
+                time.sleep(delay + random.uniform(0, delay))
+                attempt += 1
+    
+    @contextmanager
+    def use_primary(self):
+        """Send every read in the block to the primary (session stickiness)"""
+        self._primary_depth += 1
+        try:
+            yield self
+        finally:
+            self._primary_depth -= 1
+    
+    def interrupt(self):
+        """Kill the statement this connection is running (call from another thread)
+        
+        Sends KILL QUERY over a short-lived connection to the server
+        running it, primary or replica; the interrupted call then fails.
+        Used by AsyncDatabase for timeouts and cancellation.
+        """
+        target = self._active or self.connection
+        if target is None:
+            return
+        if self.backend == 'sqlite':
+            # Embedded: the connection is in this process
+            target.interrupt()
+            return
+        killer = mysql.connector.connect(
+            host=target.server_host,
+            port=target.server_port,
+            user=os.getenv('DB_USER', 'root'),
+            password=os.getenv('DB_PASSWORD', ''),
+            connection_timeout=5
+        )
+        try:
+            cursor = killer.cursor()
+            cursor.execute(f"KILL QUERY {int(target.connection_id)}")
+            cursor.close()
+        finally:
+            killer.close()
+    
+    def start_keepalive(self, interval):
+        """Ping the server from a background thread after interval idle seconds
+        
+        Keeps idle connections (e.g. a menu session waiting on input) from
+        being dropped, and reconnects at once if one was. 0 disables it.
+        """
+        if interval <= 0 or (self._keepalive and self._keepalive.is_alive()):
+            return
+        self._keepalive_stop.clear()
+        self._keepalive = threading.Thread(target=self._keepalive_loop, args=(interval,),
+                                           name='db-keepalive', daemon=True)
+        self._keepalive.start()
+    
+    def stop_keepalive(self, timeout=5):
+        """Stop the keepalive thread"""
+        self._keepalive_stop.set()
+        if self._keepalive and self._keepalive is not threading.current_thread():
+            self._keepalive.join(timeout)
+        self._keepalive = None
+    
+    def _keepalive_loop(self, interval):
+        while not self._keepalive_stop.wait(interval):
+            if time.monotonic() - self._last_used < interval:
+                continue
+            # Never wait for (or interrupt) a statement in progress
+            if not self._lock.acquire(blocking=False):
+                continue
+            try:
+                if self.in_transaction or self.connection is None:
+                    continue
+                try:
+                    self.connection.ping(reconnect=False)
+                    self._stats['keepalive_pings'] += 1
+                    self._last_used = time.monotonic()
+                except Error:
+                    self._recover()
+            finally:
+                self._lock.release()
+    
+    def stats(self):
+        """Counters of this connection's transaction, statement cache and recovery activity"""
+        stats = dict(self._stats)
+        stats.update(self.statements.stats())
+        stats.update(self.replicas.stats())
+        return stats
+    
+    @staticmethod
+    def _is_read(query):
+        words = query.lstrip().split(None, 1)
+        return bool(words) and words[0].upper() in READ_KEYWORDS
+    
+    def _connection_error(self, error, connection=None):
+        if error.errno in CONNECTION_ERRNOS:
+            return True
+        if error.errno and not 2000 <= error.errno < 3000:
+            # The server answered, so the connection is alive
+            return False
+        connection = connection or self.connection
+        try:
+            return connection is None or not connection.is_connected()
+        except Error:
+            return True
+    
+    def _use_replica(self, query):
+        return (bool(self.replicas) and not self.in_transaction and not self._primary_depth
+                and time.monotonic() >= self._primary_until
+                and self._is_read(query) and self.replicas.replica_safe(query))
+    
+    def _read_replica(self, query, params, row_format):
+        # Run a read on a replica; None sends it to the primary instead
+        with self._lock:
+            for _ in range(len(self.replicas.replicas)):
+                replica = self.replicas.pick()
+                if replica is None:
+                    break
+                self._active = replica.connection
+                try:
+                    rows = replica.execute(query, params, row_format)
+                    self._stats['replica_reads'] += 1
+                    return rows
+                except Error as e:
+                    if not self._connection_error(e, replica.connection):
+                        print(f"Database error: {e}")
+                        raise
+                    self.replicas.mark_down(replica, e)
+                finally:
+                    self._active = None
+            self._stats['replica_fallbacks'] += 1
+            return None
+    
+    def _wrote(self):
+        # Read-your-writes: the replicas may not have this write yet
+        if self.replicas:
+            self._primary_until = time.monotonic() + self.replicas.sticky_seconds
+    
+    def _recover(self):
+        # Reconnect after a dropped connection; if the server is still away,
+        # the next statement tries again
+        try:
+            self.reconnect()
+        except Error:
+            self.connection = None
+            self.cursor = None
+    
+    def _commit(self):
+        # Statements inside transaction() are committed by the block
+        if not self.in_transaction:
+            self.connection.commit()
+            self._stats['commits'] += 1
+    
+    def _rollback(self):
+        if not self.in_transaction:
             self.connection.rollback()
-            print(f"Procedure error: {e}")
-            raise
+            self._stats['rollbacks'] += 1
     
     def close(self):
         """Close database connection"""
+        self.stop_keepalive()
+        self.replicas.close()
         if self.cursor:
             self.cursor.close()
+        if self.tuple_cursor:
+            self.tuple_cursor.close()
+        self.statements.clear()
         if self.connection and self.connection.is_connected():
             self.connection.close()
-            print("Database connection closed")
\ No newline at end of file
+            print("Database connection closed")
@@ -9,12 +9,13 @@ import time
 load_dotenv()
 
 class DatabaseSetup:
-    def __init__(self):
-        self.host = os.getenv('DB_HOST', 'localhost')
+    def __init__(self, host=None, port=None, database_name=None):
+        self.host = host or os.getenv('DB_HOST', 'localhost')
         self.user = os.getenv('DB_USER', 'root')
         self.password = os.getenv('DB_PASSWORD', '')
-        self.port = int(os.getenv('DB_PORT', '3306'))
-        self.database_name = os.getenv('DB_NAME', 'inventory_management')
+        self.port = int(port or os.getenv('DB_PORT', '3306'))
+        self.database_name = database_name or os.getenv('DB_NAME', 'inventory_management')
+        self.backend = os.getenv('DB_BACKEND', 'mysql').lower()
         self.connection = None
     
     def connect_without_db(self):
@@ -135,19 +136,113 @@ class DatabaseSetup:
                 print(f"   ✅ {description} executed successfully ({executed} statements)")
             
             return True
-            
+        
         except Exception as e:
             print(f"   ❌ Error executing {description}: {e}")
             import traceback
             print(f"   Traceback: {traceback.format_exc()}")
             return False
     
+    def build_derived_tables(self):
+        """Populate tables computed from the loaded data (closure, conflict matrix)"""
+        from database import Database
+        from ingredient_closure import IngredientFlattener
+        from compatibility import CompatibilityMatrix
+        
+        print("   📄 Building derived tables...")
+        db = None
+        try:
+            db = Database(self.host, self.port, self.database_name)
+            closure_rows = IngredientFlattener(db).rebuild()
+            conflict_rows = CompatibilityMatrix(db).rebuild()
+            print(f"   ✅ Derived tables built ({closure_rows} closure rows, {conflict_rows} conflict rows)")
+            return True
+        except Exception as e:
+            print(f"   ❌ Error building derived tables: {e}")
+            return False
+        finally:
+            if db:
+                db.close()
+    
+    def load_sqlite(self, connection):
+        """Create the schema, triggers and sample data on an empty SQLite database
+        
+        The stored procedures are the Python ports in sqlite_procedures,
+        so stored_procedures.sql is not loaded.
+        """
+        self.connection = connection
+        sql_files = [
+            ('inventory-management.sql', 'Database Schema'),
+            ('triggers_sqlite.sql', 'Database Triggers'),
+            ('sample-data.sql', 'Sample Data')
+        ]
+        # Databases are created on first connect, from whatever directory
+        # the program runs in
+        sql_dir = os.path.dirname(os.path.abspath(__file__))
+        success_count = 0
+        for filename, description in sql_files:
+            if self.execute_sql_file(os.path.join(sql_dir, filename), description):
+                success_count += 1
+        if success_count == len(sql_files):
+            self.build_derived_tables()
+        return success_count == len(sql_files)
+    
+    def setup_sqlite(self):
+        """setup_database for the embedded SQLite backend (DB_BACKEND=sqlite)"""
+        import sqlite_backend
+        from sqlite_procedures import PROCEDURES
+        
+        print("\n[1/3] Opening SQLite database...")
+        path, memory = sqlite_backend.location(self.database_name)
+        try:
+            connection = sqlite_backend.connect(self.database_name)
+        except Error as e:
+            print(f"   ❌ Error opening SQLite database: {e}")
+            return False
+        print(f"   ✅ Opened {'in-memory database' if memory else path}")
+        
+        print("\n[2/3] Loading schema, triggers and sample data...")
+        print("-" * 60)
+        with sqlite_backend.setup_lock:
+            connection.reset()
+            loaded = self.load_sqlite(connection)
+        print("-" * 60)
+        if not loaded:
+            print("   ⚠️  Some SQL files failed to load")
+        
+        print("\n[3/3] Verifying database setup...")
+        tables = [row[0] for row in connection.query(
+            "SELECT name FROM sqlite_master WHERE type = 'table' AND name NOT LIKE 'sqlite_%' ORDER BY name")]
+        trigger_count = connection.query("SELECT COUNT(*) FROM sqlite_master WHERE type = 'trigger'")[0][0]
+        connection.close()
+        
+        print(f"   📊 Database Statistics:")
+        print(f"      • Tables: {len(tables)}")
+        print(f"      • Stored Procedures: {len(PROCEDURES)} (sqlite_procedures)")
+        print(f"      • Triggers: {trigger_count}")
+        if tables:
+            print(f"\n   📋 Created Tables:")
+            for table in tables:
+                print(f"      • {table}")
+        
+        print("\n" + "="*60)
+        print("🎉 DATABASE SETUP COMPLETE!")
+        print("="*60)
+        print(f"\n✅ Database '{self.database_name}' is ready to use!")
+        if memory:
+            print("   ⚠️  In-memory database: it lasts until this program exits")
+        print("   You can now run the application with: python main.py\n")
+        return True
+    
     def setup_database(self):
         """Main setup function"""
         print("\n" + "="*60)
         print("🗄️  DATABASE SETUP & INITIALIZATION")
         print("="*60)
         
+        if self.backend == 'sqlite':
+            return self.setup_sqlite()
+        
         # Step 1: Connect to MySQL server
         print("\n[1/6] Connecting to MySQL server...")
         if not self.connect_without_db():
@@ -205,6 +300,9 @@ class DatabaseSetup:
                 success_count += 1
             time.sleep(0.2)
         
+        if success_count == len(sql_files):
+            self.build_derived_tables()
+        
         print("-" * 60)
         if success_count == len(sql_files):
             print(f"   ✅ All {success_count} SQL files executed successfully")
@@ -261,7 +359,7 @@ class DatabaseSetup:
                 print(f"\n   ✅ Database setup verified successfully!")
             else:
                 print(f"\n   ⚠️  Warning: No tables found!")
-            
+        
         except Error as e:
             print(f"   ⚠️  Verification error: {e}")
         
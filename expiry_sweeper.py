@@ -0,0 +1,77 @@
+from database import Database
+from background import BackgroundWorker
+from idempotency import DEFAULT_RETENTION_DAYS
+from change_stream import ChangeStream, DEFAULT_RETENTION_DAYS as EVENT_RETENTION_DAYS
+
+# Days ahead covered by the "almost expired" report
+DEFAULT_WINDOW_DAYS = 10
+
+class ExpirySweeper:
+    """Daily job that retires expired lots and precomputes the expiring-soon set
+    
+    sweep() can be called directly; start() runs it on a background thread
+    with its own database connection (one to every shard with DB_SHARDS),
+    once at start-up and then every interval_seconds.
+    """
+    
+    def __init__(self, db: Database = None, window_days=DEFAULT_WINDOW_DAYS,
+                 interval_seconds=24 * 60 * 60):
+        self.db = db
+        self.window_days = window_days
+        self.interval_seconds = interval_seconds
+        self._worker = BackgroundWorker('expiry-sweeper', self.sweep, interval_seconds, 'Expiry sweep')
+    
+    def sweep(self, db: Database = None):
+        """Run SweepExpiredLots and return the recorded ExpirySweep row
+        
+        Also purges idempotency keys past their retention period, and
+        inventory events past theirs that every change stream consumer
+        has handled.
+        """
+        db = db or self.db
+        db.execute_procedure('SweepExpiredLots', (self.window_days,))
+        db.execute_procedure('PurgeIdempotencyKeys', (DEFAULT_RETENTION_DAYS,))
+        ChangeStream(db).purge(EVENT_RETENTION_DAYS)
+        query = """
+            SELECT sweep_date, window_days, expired_lots, expiring_lots, swept_at
+            FROM ExpirySweep
+            WHERE sweep_date = CURDATE() AND window_days = %s
+        """
+        result = db.execute(query, (self.window_days,))
+        return result[0] if result else None
+    
+    def ensure_fresh(self, db: Database = None):
+        """Sweep now unless today's sweep for this window already ran"""
+        db = db or self.db
+        query = """
+            SELECT 1 FROM ExpirySweep
+            WHERE sweep_date = CURDATE() AND window_days = %s
+        """
+        if not db.execute(query, (self.window_days,)):
+            self.sweep(db)
+    
+    def expiring_lots(self, db: Database = None):
+        """Live lots with stock expiring within the window (precomputed)"""
+        db = db or self.db
+        self.ensure_fresh(db)
+        query = """
+            SELECT el.lot_number, i.name as ingredient_name,
+                   ib.quantity, el.expiration_date,
+                   DATEDIFF(el.expiration_date, CURDATE()) as days_until_expiry
+            FROM ExpiringLot el
+            JOIN IngredientBatch ib ON el.lot_number = ib.lot_number
+            JOIN Ingredient i ON el.ingredient_id = i.id
+            WHERE el.window_days = %s
+            AND el.expiration_date >= CURDATE()
+            AND ib.quantity > 0
+            ORDER BY el.expiration_date
+        """
+        return db.execute(query, (self.window_days,))
+    
+    def start(self):
+        """Start the background sweeper on a dedicated connection"""
+        self._worker.start()
+    
+    def stop(self, timeout=5):
+        """Stop the background sweeper"""
+        self._worker.stop(timeout)
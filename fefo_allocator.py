@@ -0,0 +1,150 @@
+import heapq
+from database import Database
+
+# Quantities below this are treated as zero (float rounding of oz)
+EPSILON = 1e-9
+
+class InsufficientStockError(Exception):
+    """Raised when live lots cannot cover a requirement
+    
+    shortages maps ingredient_id -> oz still missing.
+    """
+    
+    def __init__(self, shortages):
+        self.shortages = shortages
+        missing = ', '.join(f"ingredient {i}: {q} oz" for i, q in shortages.items())
+        super().__init__(f"Insufficient stock ({missing})")
+
+class AllocationPlan:
+    """Result of allocating many batches
+    
+    picks maps each allocated batch key to its (ingredient_id, lot_number,
+    quantity) picks; shortages maps each batch that could not be covered
+    to its missing oz per ingredient.
+    """
+    
+    def __init__(self):
+        self.picks = {}
+        self.shortages = {}
+
+class FEFOAllocator:
+    """First-expired-first-out lot allocation over in-memory priority queues
+    
+    Live lots are loaded once into one heap per ingredient keyed by
+    (expiration_date, lot_number). Each pick takes from the top lot; a
+    partially used lot stays on top with its remaining quantity and a
+    used-up lot is popped, so every pick costs O(log n). Allocation is
+    all-or-nothing per batch: a batch that cannot be covered leaves the
+    remaining quantities untouched.
+    """
+    
+    def __init__(self, lots=()):
+        self._heaps = {}
+        self._remaining = {}
+        self._totals = {}
+        self.add_lots(lots)
+    
+    @classmethod
+    def from_database(cls, db: Database, ingredient_ids=None):
+        """Load the live lots with unreserved stock (optionally for some ingredients)"""
+        query = """
+            SELECT lot_number, ingredient_id,
+                   quantity - reserved_quantity as available_quantity,
+                   expiration_date
+            FROM IngredientBatch
+            WHERE status = 'LIVE'
+            AND expiration_date >= CURDATE()
+            AND quantity - reserved_quantity > 0
+        """
+        params = None
+        if ingredient_ids is not None:
+            ingredient_ids = list(ingredient_ids)
+            if not ingredient_ids:
+                return cls()
+            placeholders = ','.join(['%s'] * len(ingredient_ids))
+            query += f" AND ingredient_id IN ({placeholders})"
+            params = ingredient_ids
+        return cls(db.execute(query, params))
+    
+    def add_lots(self, lots):
+        """Add lots (dicts with lot_number, ingredient_id, available_quantity, expiration_date)"""
+        touched = set()
+        for lot in lots:
+            quantity = lot['available_quantity']
+            if quantity <= EPSILON:
+                continue
+            ingredient_id = lot['ingredient_id']
+            self._heaps.setdefault(ingredient_id, []).append((lot['expiration_date'], lot['lot_number']))
+            self._remaining[lot['lot_number']] = quantity
+            self._totals[ingredient_id] = self._totals.get(ingredient_id, 0) + quantity
+            touched.add(ingredient_id)
+        for ingredient_id in touched:
+            heapq.heapify(self._heaps[ingredient_id])
+    
+    def available(self, ingredient_id):
+        """Unallocated oz of an ingredient"""
+        return self._totals.get(ingredient_id, 0)
+    
+    def remaining(self, lot_number):
+        """Unallocated oz left in a lot"""
+        return self._remaining.get(lot_number, 0)
+    
+    def allocate(self, requirements):
+        """Allocate {ingredient_id: oz} and return the (ingredient_id, lot_number, quantity) picks
+        
+        Raises InsufficientStockError, without allocating anything, if any
+        ingredient cannot be covered.
+        """
+        shortages = {}
+        for ingredient_id, quantity in requirements.items():
+            if quantity - self.available(ingredient_id) > EPSILON:
+                shortages[ingredient_id] = quantity - self.available(ingredient_id)
+        if shortages:
+            raise InsufficientStockError(shortages)
+        
+        picks = []
+        for ingredient_id, quantity in requirements.items():
+            heap = self._heaps.get(ingredient_id, [])
+            needed = quantity
+            while needed > EPSILON and heap:
+                _, lot_number = heap[0]
+                take = min(needed, self._remaining[lot_number])
+                self._remaining[lot_number] -= take
+                if self._remaining[lot_number] <= EPSILON:
+                    heapq.heappop(heap)
+                    del self._remaining[lot_number]
+                needed -= take
+                picks.append((ingredient_id, lot_number, take))
+            self._totals[ingredient_id] -= quantity - needed
+        return picks
+    
+    def allocate_batches(self, batches):
+        """Allocate [(batch_key, {ingredient_id: oz}), ...] in order
+        
+        Batches that cannot be covered are recorded as shortages and
+        skipped; later batches still get allocated.
+        """
+        plan = AllocationPlan()
+        for key, requirements in batches:
+            try:
+                plan.picks[key] = self.allocate(requirements)
+            except InsufficientStockError as e:
+                plan.shortages[key] = e.shortages
+        return plan
+    
+    @staticmethod
+    def apply(db: Database, product_lot_number, picks, idempotency_key=None):
+        """Consume the picks into a product batch in one transaction
+        
+        Either every pick is consumed or, if any consumption is rejected,
+        none is. With an idempotency_key, pick n is consumed under the key
+        "<idempotency_key>:<n>", so applying the same picks again with the
+        same key consumes nothing twice.
+        """
+        def work(db):
+            for n, (_, lot_number, quantity) in enumerate(picks):
+                key = f"{idempotency_key}:{n}" if idempotency_key else None
+                db.execute_procedure('ConsumeIngredientLot',
+                                     (product_lot_number, lot_number, quantity, key))
+        
+        db.run_transaction(work)
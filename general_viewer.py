@@ -1,8 +1,15 @@
 from database import Database
+from metrics import action
+from compatibility import CompatibilityMatrix
+from ingredient_closure import IngredientFlattener
 
 class GeneralViewer:
-    def __init__(self, db: Database):
+    def __init__(self, db: Database, shards=None):
         self.db = db
+        # sharding.ShardRouter: products and their recipes are read on the
+        # shards of their manufacturers; ingredients and do-not-combine
+        # pairs are reference data and are read from db
+        self.shards = shards
     
     def menu(self):
         """Main general viewer menu"""
@@ -11,7 +18,8 @@ class GeneralViewer:
             print("1. Browse Products")
             print("2. Product -> Ingredient List")
             print("3. (Grad) Compare Products")
-            print("4. Exit")
+            print("4. (Grad) Product Conflict Matrix")
+            print("5. Exit")
             
             choice = input("Select option: ").strip()
             
@@ -22,24 +30,16 @@ class GeneralViewer:
             elif choice == '3':
                 self.compare_products()
             elif choice == '4':
+                self.conflict_matrix()
+            elif choice == '5':
                 break
             else:
                 print("Invalid option")
     
+    @action
     def browse_products(self):
         """Browse available product types"""
-        query = """
-            SELECT p.id, p.name, p.number, c.name as category_name,
-                   GROUP_CONCAT(DISTINCT CONCAT(u.first_name, ' ', COALESCE(u.last_name, '')) 
-                                ORDER BY u.first_name SEPARATOR ', ') as manufacturers
-            FROM Product p
-            JOIN Category c ON p.category_id = c.id
-            JOIN ManufacturerProduct mp ON p.id = mp.product_id
-            JOIN UserDetails u ON mp.manufacturer_id = u.id
-            GROUP BY p.id, p.name, p.number, c.name
-            ORDER BY c.name, p.name
-        """
-        products = self.db.execute(query)
+        products = self.product_catalog()
         
         print("\n=== Available Products ===")
         if not products:
@@ -54,25 +54,131 @@ class GeneralViewer:
             print(f"  ID: {p['id']}, Name: {p['name']}, Number: {p['number']}")
             print(f"    Manufacturers: {p['manufacturers']}")
     
+    def product_catalog(self):
+        """Products with their category and manufacturers, by category"""
+        if not self.shards:
+            return self._catalog(self.db)
+        # Load the manufacturer list once, before the shards run in parallel
+        self.shards.manufacturers_on(self.shards.shards[0])
+        parts = self.shards.scatter(
+            lambda db, shard: self._catalog(db, self.shards.manufacturers_on(shard)))
+        return sorted((r for part in parts for r in part),
+                      key=lambda r: (r['category_name'], r['name']))
+    
+    def _catalog(self, db, manufacturer_ids=None):
+        # manufacturer_ids: only the products of these manufacturers (a shard's own)
+        condition, params = "", ()
+        if manufacturer_ids is not None:
+            if not manufacturer_ids:
+                return []
+            condition = f"WHERE mp.manufacturer_id IN ({','.join(['%s'] * len(manufacturer_ids))})"
+            params = tuple(manufacturer_ids)
+        query = f"""
+            SELECT p.id, p.name, p.number, c.name as category_name,
+                   GROUP_CONCAT(DISTINCT CONCAT(u.first_name, ' ', COALESCE(u.last_name, '')) 
+                                ORDER BY u.first_name SEPARATOR ', ') as manufacturers
+            FROM Product p
+            JOIN Category c ON p.category_id = c.id
+            JOIN ManufacturerProduct mp ON p.id = mp.product_id
+            JOIN UserDetails u ON mp.manufacturer_id = u.id
+            {condition}
+            GROUP BY p.id, p.name, p.number, c.name
+            ORDER BY c.name, p.name
+        """
+        return db.execute(query, params)
+    
+    def products(self):
+        """Every product as a dict of id, name, number, key and db (where its recipe is)
+        
+        key is what the menus ask for: the id, or shard number/id with
+        shards, where ids are only unique within a shard. A shard lists
+        the products of the manufacturers placed on it; products without
+        a manufacturer are listed once, from the home database (shard 0).
+        """
+        if not self.shards:
+            rows = self.db.execute("SELECT id, name, number FROM Product ORDER BY name")
+            return [dict(p, key=str(p['id']), db=self.db) for p in rows]
+        
+        def work(db, shard):
+            own = sorted(self.shards.manufacturers_on(shard))
+            if not own:
+                return []
+            number = self.shards.shards.index(shard) + 1
+            rows = db.execute(f"""
+                SELECT DISTINCT p.id, p.name, p.number
+                FROM Product p
+                JOIN ManufacturerProduct mp ON p.id = mp.product_id
+                WHERE mp.manufacturer_id IN ({','.join(['%s'] * len(own))})
+            """, own)
+            return [dict(p, key=f"{number}/{p['id']}", db=db, shard=number - 1) for p in rows]
+        
+        self.shards.manufacturers_on(self.shards.shards[0])
+        products = [p for part in self.shards.scatter(work) for p in part]
+        unowned = self.db.execute("""
+            SELECT p.id, p.name, p.number
+            FROM Product p
+            WHERE NOT EXISTS (SELECT 1 FROM ManufacturerProduct mp WHERE mp.product_id = p.id)
+        """)
+        products += [dict(p, key=f"0/{p['id']}", db=self.db, shard=None) for p in unowned]
+        return sorted(products, key=lambda p: (p['name'], p['key']))
+    
+    def _list_products(self, products):
+        print("\nAvailable products:")
+        for p in products:
+            print(f"  {p['key']}: {p['name']} ({p['number']})")
+    
+    def _select_product(self, products, prompt):
+        """The listed product whose key is entered (None, reported, otherwise)"""
+        label = "shard/ID" if self.shards else "ID"
+        key = input(f"{prompt} {label}: ").strip()
+        product = next((p for p in products if p['key'] == key), None)
+        if product is None:
+            print("Invalid product ID")
+        return product
+    
+    @action
     def generate_ingredient_list(self):
         """Generate flattened ingredient list for a product"""
         # List all products
-        products = self.db.execute("SELECT id, name, number FROM Product ORDER BY name")
+        products = self.products()
         
         if not products:
             print("No products available")
             return
         
-        print("\nAvailable products:")
-        for p in products:
-            print(f"  {p['id']}: {p['name']} ({p['number']})")
+        self._list_products(products)
         
-        try:
-            product_id = int(input("\nSelect product ID: "))
-        except ValueError:
-            print("Invalid product ID")
+        product = self._select_product(products, "\nSelect product")
+        if product is None:
+            return
+        
+        result = self.ingredient_list(product['id'], product['db'])
+        
+        if not result:
+            print("No recipe plan found for this product")
             return
         
+        product_name, version, flattened = result
+        print(f"\n=== Ingredient List for {product_name} (Plan v{version}) ===")
+        
+        if not flattened:
+            print("No ingredients found in recipe")
+            return
+        
+        print("\nFlattened ingredient list (sorted by quantity, largest first):")
+        print(f"{'Ingredient':<30} {'Quantity (oz)':>15}")
+        print("-" * 50)
+        for ing in flattened:
+            print(f"{ing['name']:<30} {ing['quantity']:>15.2f}")
+    
+    def ingredient_list(self, product_id, db: Database = None):
+        """Flattened ingredients of the latest recipe plan of a product
+        
+        Returns (product name, plan version, ingredient rows), or None if
+        the product has no recipe plan. db is where the product's recipe
+        is (its shard), self.db by default.
+        """
+        db = db or self.db
         # Get the latest recipe plan
         plan_query = """
             SELECT plan_id, version_number
@@ -81,185 +187,58 @@ class GeneralViewer:
             ORDER BY version_number DESC
             LIMIT 1
         """
-        plan_result = self.db.execute(plan_query, (product_id,))
+        plan_result = db.execute(plan_query, (product_id,))
         
         if not plan_result:
-            print("No recipe plan found for this product")
-            return
+            return None
         
-        plan_id = plan_result[0]['plan_id']
         version = plan_result[0]['version_number']
         
         # Get product name
         product_query = "SELECT name FROM Product WHERE id = %s"
-        product_info = self.db.execute(product_query, (product_id,))
+        product_info = db.execute(product_query, (product_id,))
         product_name = product_info[0]['name'] if product_info else f"Product {product_id}"
         
-        print(f"\n=== Ingredient List for {product_name} (Plan v{version}) ===")
-        
-        # Get direct ingredients from ProductBOM
-        direct_query = """
-            SELECT pb.ingredient_id, i.name, i.type, pb.quantity
-            FROM ProductBOM pb
-            JOIN Ingredient i ON pb.ingredient_id = i.id
-            WHERE pb.product_id = %s
-            ORDER BY pb.quantity DESC, i.name
-        """
-        direct_ingredients = self.db.execute(direct_query, (product_id,))
-        
-        if not direct_ingredients:
-            print("No ingredients found in recipe")
-            return
-        
-        # Flatten compound ingredients one level
-        all_ingredients = {}  # ingredient_id -> total quantity
-        
-        for ing in direct_ingredients:
-            if ing['type'] == 'ATOMIC':
-                # Direct atomic ingredient
-                if ing['ingredient_id'] not in all_ingredients:
-                    all_ingredients[ing['ingredient_id']] = {
-                        'name': ing['name'],
-                        'quantity': 0
-                    }
-                all_ingredients[ing['ingredient_id']]['quantity'] += ing['quantity']
-            else:
-                # COMPOUND - flatten one level
-                # Get materials from FormulationMaterial
-                # First, get the formulation for this compound ingredient
-                form_query = """
-                    SELECT fm.ingredient_id, i.name, fm.quantity
-                    FROM IngredientFormulation inf
-                    JOIN FormulationMaterial fm ON inf.id = fm.formulation_id
-                    JOIN Ingredient i ON fm.ingredient_id = i.id
-                    WHERE inf.ingredient_id = %s
-                    ORDER BY fm.quantity DESC
-                """
-                materials = self.db.execute(form_query, (ing['ingredient_id'],))
-                
-                if materials:
-                    # Calculate total quantity of materials
-                    total_material_qty = sum(m['quantity'] for m in materials)
-                    
-                    # Distribute the compound quantity proportionally
-                    for mat in materials:
-                        if mat['ingredient_id'] not in all_ingredients:
-                            all_ingredients[mat['ingredient_id']] = {
-                                'name': mat['name'],
-                                'quantity': 0
-                            }
-                        # Contribution = compound_qty * (material_qty / total_material_qty)
-                        contribution = ing['quantity'] * (mat['quantity'] / total_material_qty)
-                        all_ingredients[mat['ingredient_id']]['quantity'] += contribution
-                else:
-                    # No materials found, treat as atomic for display
-                    if ing['ingredient_id'] not in all_ingredients:
-                        all_ingredients[ing['ingredient_id']] = {
-                            'name': ing['name'],
-                            'quantity': 0
-                        }
-                    all_ingredients[ing['ingredient_id']]['quantity'] += ing['quantity']
-        
-        # Sort by quantity (descending), then by name
-        sorted_ingredients = sorted(
-            all_ingredients.items(),
-            key=lambda x: (-x[1]['quantity'], x[1]['name'])
-        )
-        
-        print("\nFlattened ingredient list (sorted by quantity, largest first):")
-        print(f"{'Ingredient':<30} {'Quantity (oz)':>15}")
-        print("-" * 50)
-        for ing_id, ing_data in sorted_ingredients:
-            print(f"{ing_data['name']:<30} {ing_data['quantity']:>15.2f}")
+        # Flatten compound ingredients through every level of nesting
+        flattener = IngredientFlattener(db)
+        return product_name, version, flattener.flatten_product(product_id, version)
     
+    @action
     def compare_products(self):
         """Compare two products for incompatibilities (Grad feature)"""
         print("\n=== Compare Products for Incompatibilities ===")
         
-        products = self.db.execute("SELECT id, name, number FROM Product ORDER BY name")
+        products = self.products()
         
         if len(products) < 2:
             print("Need at least 2 products to compare")
             return
         
-        print("\nAvailable products:")
-        for p in products:
-            print(f"  {p['id']}: {p['name']} ({p['number']})")
+        self._list_products(products)
         
-        try:
-            product1_id = int(input("\nFirst product ID: "))
-            product2_id = int(input("Second product ID: "))
-        except ValueError:
-            print("Invalid product ID")
+        product1 = self._select_product(products, "\nFirst product")
+        if product1 is None:
+            return
+        product2 = self._select_product(products, "Second product")
+        if product2 is None:
             return
         
-        if product1_id == product2_id:
+        if product1['key'] == product2['key']:
             print("Cannot compare a product with itself")
             return
         
         # Get product names
-        p1_name = next((p['name'] for p in products if p['id'] == product1_id), f"Product {product1_id}")
-        p2_name = next((p['name'] for p in products if p['id'] == product2_id), f"Product {product2_id}")
-        
-        def get_flattened_ingredients(prod_id):
-            """Get all ingredient IDs (flattened one level) for a product"""
-            # Get direct ingredients
-            query = """
-                SELECT DISTINCT pb.ingredient_id, i.type
-                FROM ProductBOM pb
-                JOIN Ingredient i ON pb.ingredient_id = i.id
-                WHERE pb.product_id = %s
-            """
-            ingredients = self.db.execute(query, (prod_id,))
-            
-            all_ids = set()
-            for ing in ingredients:
-                all_ids.add(ing['ingredient_id'])
-                
-                # If compound, add materials
-                if ing['type'] == 'COMPOUND':
-                    mat_query = """
-                        SELECT fm.ingredient_id
-                        FROM IngredientFormulation inf
-                        JOIN FormulationMaterial fm ON inf.id = fm.formulation_id
-                        WHERE inf.ingredient_id = %s
-                    """
-                    materials = self.db.execute(mat_query, (ing['ingredient_id'],))
-                    for mat in materials:
-                        all_ids.add(mat['ingredient_id'])
-            
-            return all_ids
-        
-        ing1 = get_flattened_ingredients(product1_id)
-        ing2 = get_flattened_ingredients(product2_id)
+        p1_name = product1['name']
+        p2_name = product2['name']
         
+        ing1, ing2, conflicts = self.product_incompatibilities(product1['id'], product2['id'],
+                                                               product1['db'], product2['db'])
         union = ing1.union(ing2)
         
         if len(union) < 2:
             print("Not enough ingredients to compare")
             return
         
-        # Check for incompatibilities in the union
-        if not union:
-            print("No ingredients found in either product")
-            return
-        
-        # Convert to list for SQL IN clause
-        ing_list = list(union)
-        placeholders = ','.join(['%s'] * len(ing_list))
-        
-        conflict_query = f"""
-            SELECT ii.ingredient_a, ii.ingredient_b,
-                   i1.name as name_a, i2.name as name_b
-            FROM IngredientIncompatibility ii
-            JOIN Ingredient i1 ON ii.ingredient_a = i1.id
-            JOIN Ingredient i2 ON ii.ingredient_b = i2.id
-            WHERE ii.ingredient_a IN ({placeholders})
-            AND ii.ingredient_b IN ({placeholders})
-        """
-        
-        conflicts = self.db.execute(conflict_query, ing_list * 2)
-        
         print(f"\n=== Comparison: {p1_name} vs {p2_name} ===")
         print(f"\nProduct 1 ({p1_name}) ingredients: {len(ing1)}")
         print(f"Product 2 ({p2_name}) ingredients: {len(ing2)}")
@@ -285,6 +264,112 @@ class GeneralViewer:
                 print(f"  {c['name_a']} <-> {c['name_b']} (in: {loc_str})")
         else:
             print("\n✓ No incompatibilities found in the union of ingredients")
-
-
-
+    
+    def product_incompatibilities(self, product1_id, product2_id, db1: Database = None,
+                                  db2: Database = None):
+        """Incompatible ingredient pairs in the union of two products' flattened BOMs
+        
+        db1 / db2 are where each product's recipe is (self.db by default).
+        Returns (product 1 ingredient ids, product 2 ingredient ids, conflict rows).
+        """
+        def get_flattened_ingredients(prod_id, db):
+            """Get all ingredient IDs (every nesting level) for a product"""
+            query = """
+                SELECT DISTINCT c.descendant_id as ingredient_id
+                FROM ProductBOM pb
+                JOIN IngredientClosure c ON c.ancestor_id = pb.ingredient_id
+                WHERE pb.product_id = %s
+            """
+            return {r['ingredient_id'] for r in (db or self.db).execute(query, (prod_id,))}
+        
+        ing1 = get_flattened_ingredients(product1_id, db1)
+        ing2 = get_flattened_ingredients(product2_id, db2)
+        
+        union = ing1.union(ing2)
+        
+        # Check for incompatibilities in the union
+        if len(union) < 2:
+            return ing1, ing2, []
+        
+        # Convert to list for SQL IN clause
+        ing_list = list(union)
+        placeholders = ','.join(['%s'] * len(ing_list))
+        
+        conflict_query = f"""
+            SELECT ii.ingredient_a, ii.ingredient_b,
+                   i1.name as name_a, i2.name as name_b
+            FROM IngredientIncompatibility ii
+            JOIN Ingredient i1 ON ii.ingredient_a = i1.id
+            JOIN Ingredient i2 ON ii.ingredient_b = i2.id
+            WHERE ii.ingredient_a IN ({placeholders})
+            AND ii.ingredient_b IN ({placeholders})
+        """
+        
+        return ing1, ing2, self.db.execute(conflict_query, ing_list * 2)
+    
+    @action
+    def conflict_matrix(self):
+        """Show every product a product conflicts with (Grad feature)"""
+        print("\n=== Product Conflict Matrix ===")
+        
+        matrix = CompatibilityMatrix(self.db)
+        
+        if not self.shards:
+            rebuild = input("Rebuild the full matrix first? (y/n): ").strip().lower()
+            if rebuild == 'y':
+                row_count = matrix.rebuild()
+                print(f"Matrix rebuilt ({row_count} conflict rows)")
+        
+        products = self.products()
+        if not products:
+            print("No products available")
+            return
+        
+        self._list_products(products)
+        
+        product = self._select_product(products, "\nSelect product")
+        if product is None:
+            return
+        
+        if self.shards:
+            product_id = product['key']
+            conflicts = self.shard_conflicts(product, products)
+        else:
+            product_id = product['id']
+            conflicts = matrix.conflicts_for_product(product_id)
+        
+        if not conflicts:
+            print("\n✓ No conflicts with any product")
+            return
+        
+        print("\n⚠️  CONFLICTS FOUND:")
+        for c in conflicts:
+            other = "itself" if c['product_b'] == product_id else c['product_name']
+            print(f"  With {other}: {c['name_a']} <-> {c['name_b']}")
+    
+    def shard_conflicts(self, product, products):
+        """Conflicts of a product with every product on every shard
+        
+        Each shard's stored matrix only pairs the products on that shard,
+        so these are computed from every shard's recipes instead. Rows are
+        shaped like CompatibilityMatrix.conflicts_for_product, with product
+        keys (see products()) as product_b.
+        """
+        matrix = CompatibilityMatrix(self.db)
+        ingredient_sets_by_shard = self.shards.scatter(
+            lambda db, shard: CompatibilityMatrix(db).load_ingredient_sets())
+        home_sets = matrix.load_ingredient_sets()
+        ingredient_sets = {
+            p['key']: (home_sets if p['shard'] is None else ingredient_sets_by_shard[p['shard']]).get(
+                p['id'], set())
+            for p in products
+        }
+        rows = matrix.compute(ingredient_sets, matrix.load_incompatibilities(), [product['key']])
+        
+        names = {r['id']: r['name'] for r in self.db.execute("SELECT id, name FROM Ingredient")}
+        by_key = {p['key']: p for p in products}
+        conflicts = [{'product_b': key_b, 'product_name': by_key[key_b]['name'],
+                      'ingredient_a': ing_a, 'ingredient_b': ing_b,
+                      'name_a': names[ing_a], 'name_b': names[ing_b]}
+                     for key_a, key_b, ing_a, ing_b in rows if key_a == product['key']]
+        return sorted(conflicts, key=lambda c: (c['product_name'], c['name_a'], c['name_b']))
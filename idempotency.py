@@ -0,0 +1,102 @@
+import random
+import time
+import uuid
+from mysql.connector import Error
+from database import Database, RetryableError, CONNECTION_ERRNOS
+
+# Days a key is kept; a request must not be retried after that
+DEFAULT_RETENTION_DAYS = 7
+
+def new_key():
+    """A fresh idempotency key for one client request"""
+    return uuid.uuid4().hex
+
+class IdempotentCall:
+    """Retry-safe calls to the procedures that take an idempotency key
+    
+    RecordProductionBatch, RecordIngredientIntake and ConsumeIngredientLot
+    store their outcome under the key in the same transaction as the work.
+    A call repeated with the same key (after a timeout, a lost connection
+    or a lost commit acknowledgement) does nothing and the stored outcome
+    is returned, so callers can retry without knowing whether the first
+    attempt went through.
+    """
+    
+    def __init__(self, db: Database, retries=3, base_delay=0.1):
+        self.db = db
+        self.retries = retries
+        self.base_delay = base_delay
+    
+    def call(self, procedure_name, params, key):
+        """Call a procedure with key appended to params and return its outcome
+        
+        The outcome is a dict with lot_number, quantity and replayed
+        (True when the key had already been used by an earlier attempt).
+        """
+        params = tuple(params) + (key,)
+        
+        def work(db):
+            db.execute_procedure(procedure_name, params)
+            return self.replayed(db)
+        
+        replayed = self.run(work)
+        outcome = self.outcome(key)
+        if outcome is None:
+            return None
+        return {'lot_number': outcome['result_lot_number'],
+                'quantity': outcome['result_quantity'],
+                'replayed': replayed}
+    
+    def run(self, work):
+        """Run work(db) in a transaction, reconnecting and re-running it if the connection drops
+        
+        work must pass idempotency keys to every write it makes, so that a
+        re-run after a commit that did reach the server replays instead
+        of writing twice. Deadlocks are retried by Database.run_transaction.
+        """
+        attempt = 0
+        while True:
+            try:
+                return self.db.run_transaction(work)
+            except Error as e:
+                if not self._connection_lost(e) or attempt >= self.retries:
+                    raise
+                delay = self.base_delay * (2 ** attempt)
+                time.sleep(delay + random.uniform(0, delay))
+                attempt += 1
+                # Database normally reconnected already (RetryableError)
+                if self.db.connection is None or not self.db.connection.is_connected():
+                    try:
+                        self.db.reconnect()
+                    except Error:
+                        # Still down: the next attempt fails fast and backs off again
+                        pass
+    
+    @staticmethod
+    def replayed(db: Database):
+        """Whether the last keyed procedure call on db was a replay"""
+        result = db.execute("SELECT @idempotency_replayed as replayed")
+        return bool(result and result[0]['replayed'])
+    
+    def outcome(self, key):
+        """The stored outcome of a key, or None if it was never used"""
+        query = """
+            SELECT idempotency_key, operation, result_lot_number, result_quantity,
+                   created_at, replay_count
+            FROM IdempotencyKey
+            WHERE idempotency_key = %s
+        """
+        result = self.db.execute(query, (key,))
+        return result[0] if result else None
+    
+    def purge(self, retention_days=DEFAULT_RETENTION_DAYS):
+        """Delete keys older than retention_days"""
+        self.db.execute_procedure('PurgeIdempotencyKeys', (retention_days,))
+    
+    def _connection_lost(self, error):
+        if isinstance(error, RetryableError) or error.errno in CONNECTION_ERRNOS:
+            return True
+        try:
+            return self.db.connection is None or not self.db.connection.is_connected()
+        except Error:
+            return True
@@ -0,0 +1,180 @@
+from database import Database
+from datetime import date
+
+# Formulation choice for compounds that have more than one formulation:
+#   latest_active - newest formulation valid today, newest overall if none is
+#   latest        - newest formulation regardless of its validity window
+FORMULATION_POLICIES = ('latest_active', 'latest')
+
+# (product_id, plan_version) -> flattened ingredient list
+# Cleared whenever the closure table is rewritten
+_flatten_cache = {}
+
+class FormulationCycleError(Exception):
+    """Raised when compound formulations contain each other"""
+
+class IngredientFlattener:
+    """Multi-level compound flattening backed by the IngredientClosure table"""
+    
+    def __init__(self, db: Database, policy='latest_active'):
+        if policy not in FORMULATION_POLICIES:
+            raise ValueError(f"Unknown formulation policy: {policy}")
+        self.db = db
+        self.policy = policy
+    
+    def load_graph(self):
+        """Return compound_id -> {material_id: share} using the chosen formulations"""
+        query = """
+            SELECT inf.id as formulation_id, inf.ingredient_id,
+                   inf.validity_start_date, inf.validity_end_date,
+                   fm.ingredient_id as material_id, fm.quantity
+            FROM IngredientFormulation inf
+            JOIN Ingredient i ON inf.ingredient_id = i.id AND i.type = 'COMPOUND'
+            JOIN FormulationMaterial fm ON inf.id = fm.formulation_id
+        """
+        rows = self.db.execute(query)
+        
+        formulations = {}  # compound_id -> formulation_id -> info
+        for r in rows:
+            form = formulations.setdefault(r['ingredient_id'], {}).setdefault(r['formulation_id'], {
+                'start': r['validity_start_date'],
+                'end': r['validity_end_date'],
+                'materials': {}
+            })
+            form['materials'][r['material_id']] = r['quantity']
+        
+        today = date.today()
+        graph = {}
+        for compound_id, candidates in formulations.items():
+            def rank(item):
+                form_id, form = item
+                active = ((form['start'] is None or form['start'] <= today)
+                          and (form['end'] is None or form['end'] >= today))
+                if self.policy == 'latest':
+                    active = True
+                return (active, form['start'] or date.min, form_id)
+            
+            _, chosen = max(candidates.items(), key=rank)
+            total = sum(chosen['materials'].values())
+            if total <= 0:
+                continue
+            # Shares are proportions of the formulation, as in the one-level list
+            graph[compound_id] = {
+                mat_id: qty / total for mat_id, qty in chosen['materials'].items()
+            }
+        return graph
+    
+    def compute(self, graph, ingredient_ids):
+        """Return closure rows (ancestor, descendant, quantity, depth, is_leaf)"""
+        done = {}
+        
+        def expand(ingredient_id, path):
+            if ingredient_id in done:
+                return done[ingredient_id]
+            if ingredient_id in path:
+                cycle = path[path.index(ingredient_id):] + [ingredient_id]
+                raise FormulationCycleError(
+                    "Formulation cycle: " + " -> ".join(str(i) for i in cycle))
+            
+            closure = {ingredient_id: [1.0, 0]}
+            for material_id, share in graph.get(ingredient_id, {}).items():
+                for desc_id, (qty, depth) in expand(material_id, path + [ingredient_id]).items():
+                    entry = closure.setdefault(desc_id, [0.0, depth + 1])
+                    entry[0] += share * qty
+                    entry[1] = min(entry[1], depth + 1)
+            done[ingredient_id] = closure
+            return closure
+        
+        rows = []
+        for ingredient_id in ingredient_ids:
+            for desc_id, (qty, depth) in expand(ingredient_id, []).items():
+                rows.append((ingredient_id, desc_id, qty, depth, desc_id not in graph))
+        return rows
+    
+    def rebuild(self):
+        """Recompute the closure of every ingredient"""
+        ingredient_ids = [r['id'] for r in self.db.execute("SELECT id FROM Ingredient")]
+        rows = self.compute(self.load_graph(), ingredient_ids)
+        self.db.execute("DELETE FROM IngredientClosure", fetch=False)
+        self._store(rows)
+        return len(rows)
+    
+    def refresh(self, ingredient_ids):
+        """Recompute closure rows of the ingredients and every compound containing them"""
+        ingredient_ids = list(set(ingredient_ids))
+        if not ingredient_ids:
+            return 0
+        placeholders = ','.join(['%s'] * len(ingredient_ids))
+        ancestor_query = f"""
+            SELECT DISTINCT ancestor_id
+            FROM IngredientClosure
+            WHERE descendant_id IN ({placeholders})
+        """
+        affected = set(ingredient_ids)
+        affected.update(r['ancestor_id'] for r in self.db.execute(ancestor_query, ingredient_ids))
+        affected = list(affected)
+        
+        rows = self.compute(self.load_graph(), affected)
+        placeholders = ','.join(['%s'] * len(affected))
+        self.db.execute(f"DELETE FROM IngredientClosure WHERE ancestor_id IN ({placeholders})",
+                        affected, fetch=False)
+        self._store(rows)
+        return len(rows)
+    
+    def latest_plan_version(self, product_id):
+        """Latest RecipePlan version of a product (None if there is no plan)"""
+        query = "SELECT MAX(version_number) as version FROM RecipePlan WHERE product_id = %s"
+        result = self.db.execute(query, (product_id,))
+        return result[0]['version'] if result else None
+    
+    def flatten_product(self, product_id, plan_version=None):
+        """Flattened leaf ingredient list of a product, largest quantity first
+        
+        Memoized per (product, plan version).
+        """
+        if plan_version is None:
+            plan_version = self.latest_plan_version(product_id)
+        
+        if plan_version is None:
+            # No plan yet: flatten the working BOM, which can still change
+            query = """
+                SELECT c.descendant_id as ingredient_id, i.name,
+                       SUM(pb.quantity * c.quantity) as quantity
+                FROM ProductBOM pb
+                JOIN IngredientClosure c ON c.ancestor_id = pb.ingredient_id AND c.is_leaf = 1
+                JOIN Ingredient i ON c.descendant_id = i.id
+                WHERE pb.product_id = %s
+                GROUP BY c.descendant_id, i.name
+                ORDER BY quantity DESC, i.name
+            """
+            return self.db.execute(query, (product_id,))
+        
+        key = (product_id, plan_version)
+        if key in _flatten_cache:
+            return _flatten_cache[key]
+        
+        query = """
+            SELECT c.descendant_id as ingredient_id, i.name,
+                   SUM(rb.quantity * c.quantity) as quantity
+            FROM RecipePlan rp
+            JOIN RecipePlanBOM rb ON rb.plan_id = rp.plan_id
+            JOIN IngredientClosure c ON c.ancestor_id = rb.ingredient_id AND c.is_leaf = 1
+            JOIN Ingredient i ON c.descendant_id = i.id
+            WHERE rp.product_id = %s AND rp.version_number = %s
+            GROUP BY c.descendant_id, i.name
+            ORDER BY quantity DESC, i.name
+        """
+        result = self.db.execute(query, (product_id, plan_version))
+        _flatten_cache[key] = result
+        return result
+    
+    def _store(self, rows):
+        """Insert closure rows in chunks and drop memoized flattenings"""
+        insert_query = """
+            INSERT INTO IngredientClosure (ancestor_id, descendant_id, quantity, depth, is_leaf)
+            VALUES (%s, %s, %s, %s, %s)
+        """
+        chunk_size = 1000
+        for start in range(0, len(rows), chunk_size):
+            self.db.execute_many(insert_query, rows[start:start + chunk_size])
+        _flatten_cache.clear()
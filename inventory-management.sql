@@ -101,6 +101,19 @@ CREATE TABLE IF NOT EXISTS
         FOREIGN KEY (ingredient_id) REFERENCES Ingredient (id) ON DELETE CASCADE ON UPDATE CASCADE
     );
 
+-- Immutable BOM snapshot of each recipe plan version
+-- Written once when the plan is created (see SnapshotRecipePlan);
+-- updates and deletes are rejected by triggers.
+CREATE TABLE IF NOT EXISTS
+    RecipePlanBOM (
+        plan_id INT NOT NULL,
+        ingredient_id INT NOT NULL,
+        quantity DOUBLE NOT NULL DEFAULT 0 CHECK (quantity >= 0),
+        PRIMARY KEY (plan_id, ingredient_id),
+        FOREIGN KEY (plan_id) REFERENCES RecipePlan (plan_id) ON DELETE CASCADE ON UPDATE CASCADE,
+        FOREIGN KEY (ingredient_id) REFERENCES Ingredient (id) ON DELETE RESTRICT ON UPDATE CASCADE
+    );
+
 -- Inventory of ingredient batches in the warehouse
 -- quantity + per_unit_cost are in the same unit as consumed_quantity_oz
 CREATE TABLE IF NOT EXISTS
@@ -112,6 +125,16 @@ CREATE TABLE IF NOT EXISTS
         quantity DOUBLE NOT NULL CHECK (quantity >= 0),
         per_unit_cost DOUBLE NOT NULL CHECK (per_unit_cost >= 0),
         expiration_date DATE NOT NULL,
+        -- LIVE lots can be consumed; the expiry sweeper moves lots past
+        -- their expiration_date to EXPIRED so live scans skip them
+        status ENUM('LIVE', 'EXPIRED') NOT NULL DEFAULT 'LIVE',
+        -- total of the OPEN LotReservation rows on this lot, maintained
+        -- by the LotReservation triggers; available = quantity - reserved
+        reserved_quantity DOUBLE NOT NULL DEFAULT 0 CHECK (reserved_quantity >= 0),
+        -- expiry calendar: FEFO candidates per ingredient, and the
+        -- date-ordered list of live lots used by the sweeper and reports
+        INDEX idx_ingredient_batch_fefo (ingredient_id, status, expiration_date),
+        INDEX idx_ingredient_batch_expiry (status, expiration_date),
         FOREIGN KEY (supplier_id) REFERENCES UserDetails (id) ON DELETE RESTRICT ON UPDATE CASCADE,
         FOREIGN KEY (ingredient_id) REFERENCES Ingredient (id) ON DELETE RESTRICT ON UPDATE CASCADE
     );
@@ -128,7 +151,10 @@ CREATE TABLE IF NOT EXISTS
         expiration_date DATE NOT NULL,
         batch_total_cost DOUBLE NOT NULL DEFAULT 0 CHECK (batch_total_cost >= 0),
         unit_cost DOUBLE NOT NULL DEFAULT 0 CHECK (unit_cost >= 0),
+        -- recipe plan version the batch was built from
+        plan_id INT,
         FOREIGN KEY (product_id) REFERENCES Product (id) ON DELETE RESTRICT ON UPDATE CASCADE,
+        FOREIGN KEY (plan_id) REFERENCES RecipePlan (plan_id) ON DELETE RESTRICT ON UPDATE CASCADE,
         FOREIGN KEY (manufacturer_id) REFERENCES UserDetails (id) ON DELETE RESTRICT ON UPDATE CASCADE,
         FOREIGN KEY (manufacturer_id, product_id) REFERENCES ManufacturerProduct (manufacturer_id, product_id) ON DELETE RESTRICT ON UPDATE CASCADE
     );
@@ -152,4 +178,218 @@ CREATE TABLE IF NOT EXISTS
         PRIMARY KEY (ingredient_a, ingredient_b),
         FOREIGN KEY (ingredient_a) REFERENCES Ingredient (id) ON DELETE RESTRICT ON UPDATE CASCADE,
         FOREIGN KEY (ingredient_b) REFERENCES Ingredient (id) ON DELETE RESTRICT ON UPDATE CASCADE
-    );
\ No newline at end of file
+    );
+
+-- Materialized product x product conflict matrix.
+-- One row per (product, other product, conflicting ingredient pair);
+-- rows are stored in both directions so lookups by product_a are enough.
+-- product_a = product_b records a conflict inside a single product.
+CREATE TABLE IF NOT EXISTS
+    ProductConflict (
+        product_a INT NOT NULL,
+        product_b INT NOT NULL,
+        ingredient_a INT NOT NULL,
+        ingredient_b INT NOT NULL,
+        PRIMARY KEY (product_a, product_b, ingredient_a, ingredient_b),
+        INDEX idx_product_conflict_b (product_b),
+        FOREIGN KEY (product_a) REFERENCES Product (id) ON DELETE CASCADE ON UPDATE CASCADE,
+        FOREIGN KEY (product_b) REFERENCES Product (id) ON DELETE CASCADE ON UPDATE CASCADE,
+        FOREIGN KEY (ingredient_a) REFERENCES Ingredient (id) ON DELETE CASCADE ON UPDATE CASCADE,
+        FOREIGN KEY (ingredient_b) REFERENCES Ingredient (id) ON DELETE CASCADE ON UPDATE CASCADE
+    );
+
+
+-- Transitive closure of compound ingredient composition.
+-- quantity is the oz of descendant contained in one oz of ancestor,
+-- following the chosen formulation of every compound on the path.
+-- Every ingredient has a depth-0 row pointing at itself; is_leaf marks
+-- descendants that are not expanded any further.
+CREATE TABLE IF NOT EXISTS
+    IngredientClosure (
+        ancestor_id INT NOT NULL,
+        descendant_id INT NOT NULL,
+        quantity DOUBLE NOT NULL CHECK (quantity >= 0),
+        depth INT NOT NULL,
+        is_leaf BOOLEAN NOT NULL,
+        PRIMARY KEY (ancestor_id, descendant_id),
+        INDEX idx_ingredient_closure_descendant (descendant_id),
+        FOREIGN KEY (ancestor_id) REFERENCES Ingredient (id) ON DELETE CASCADE ON UPDATE CASCADE,
+        FOREIGN KEY (descendant_id) REFERENCES Ingredient (id) ON DELETE CASCADE ON UPDATE CASCADE
+    );
+
+
+-- Materialized on-hand quantity per ingredient.
+-- Maintained by the IngredientBatch AFTER triggers (intake inserts and
+-- the quantity updates made by consumption); rebuilt/verified with
+-- RebuildInventorySummary.
+CREATE TABLE IF NOT EXISTS
+    IngredientOnHand (
+        ingredient_id INT PRIMARY KEY,
+        quantity DOUBLE NOT NULL DEFAULT 0,
+        -- part of quantity held by open lot reservations
+        reserved_quantity DOUBLE NOT NULL DEFAULT 0,
+        -- lots of this ingredient with quantity > 0
+        lot_count INT NOT NULL DEFAULT 0,
+        FOREIGN KEY (ingredient_id) REFERENCES Ingredient (id) ON DELETE CASCADE ON UPDATE CASCADE
+    );
+
+-- Same summary split by expiry month (expiry_bucket = first day of the month)
+CREATE TABLE IF NOT EXISTS
+    IngredientOnHandByExpiry (
+        ingredient_id INT NOT NULL,
+        expiry_bucket DATE NOT NULL,
+        quantity DOUBLE NOT NULL DEFAULT 0,
+        lot_count INT NOT NULL DEFAULT 0,
+        PRIMARY KEY (ingredient_id, expiry_bucket),
+        FOREIGN KEY (ingredient_id) REFERENCES Ingredient (id) ON DELETE CASCADE ON UPDATE CASCADE
+    );
+
+
+-- Live lots expiring within window_days of computed_on.
+-- Recomputed daily by SweepExpiredLots.
+CREATE TABLE IF NOT EXISTS
+    ExpiringLot (
+        window_days INT NOT NULL,
+        lot_number VARCHAR(255) NOT NULL,
+        ingredient_id INT NOT NULL,
+        expiration_date DATE NOT NULL,
+        computed_on DATE NOT NULL,
+        PRIMARY KEY (window_days, lot_number),
+        INDEX idx_expiring_lot_date (window_days, expiration_date),
+        FOREIGN KEY (lot_number) REFERENCES IngredientBatch (lot_number) ON DELETE CASCADE ON UPDATE CASCADE
+    );
+
+-- One row per expiry sweep run
+CREATE TABLE IF NOT EXISTS
+    ExpirySweep (
+        sweep_date DATE NOT NULL,
+        window_days INT NOT NULL,
+        expired_lots INT NOT NULL DEFAULT 0,
+        expiring_lots INT NOT NULL DEFAULT 0,
+        swept_at DATETIME NOT NULL,
+        PRIMARY KEY (sweep_date, window_days)
+    );
+
+-- Lineage edges for recall/traceability: one row per consumption,
+-- denormalized with the ingredient, supplier, product, manufacturer and
+-- production date so forward and backward traces are single index
+-- range scans. Maintained by the IngredientConsumption triggers.
+CREATE TABLE IF NOT EXISTS
+    LotLineage (
+        ingredient_lot_number VARCHAR(255) NOT NULL,
+        product_lot_number VARCHAR(255) NOT NULL,
+        ingredient_id INT NOT NULL,
+        supplier_id VARCHAR(255) NOT NULL,
+        product_id INT NOT NULL,
+        manufacturer_id VARCHAR(255) NOT NULL,
+        production_date DATE NOT NULL,
+        consumed_quantity_oz DOUBLE NOT NULL,
+        PRIMARY KEY (ingredient_lot_number, product_lot_number),
+        INDEX idx_lineage_lot_date (ingredient_lot_number, production_date),
+        INDEX idx_lineage_ingredient_date (ingredient_id, production_date),
+        INDEX idx_lineage_supplier_date (supplier_id, production_date),
+        INDEX idx_lineage_product_lot (product_lot_number),
+        FOREIGN KEY (ingredient_lot_number) REFERENCES IngredientBatch (lot_number) ON DELETE CASCADE ON UPDATE CASCADE,
+        FOREIGN KEY (product_lot_number) REFERENCES ProductBatch (lot_number) ON DELETE CASCADE ON UPDATE CASCADE
+    );
+
+-- Soft holds on ingredient lots for planned production.
+-- OPEN reservations count towards IngredientBatch.reserved_quantity
+-- (maintained by the LotReservation triggers) until they are converted
+-- into consumption (ConvertReservation), released, or expire
+-- (ExpireReservations: TTL passed or lot expired).
+-- ingredient_id and lot_expiration_date are copied from the lot by the
+-- insert trigger so expiry never has to join IngredientBatch.
+CREATE TABLE IF NOT EXISTS
+    LotReservation (
+        reservation_id INT AUTO_INCREMENT PRIMARY KEY,
+        lot_number VARCHAR(255) NOT NULL,
+        ingredient_id INT,
+        manufacturer_id VARCHAR(255) NOT NULL,
+        product_id INT,
+        quantity DOUBLE NOT NULL CHECK (quantity > 0),
+        status ENUM('OPEN', 'CONVERTED', 'RELEASED', 'EXPIRED') NOT NULL DEFAULT 'OPEN',
+        created_at DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP,
+        expires_at DATETIME NOT NULL,
+        lot_expiration_date DATE,
+        -- set when the reservation is converted
+        product_lot_number VARCHAR(255),
+        consumed_quantity_oz DOUBLE,
+        closed_at DATETIME,
+        INDEX idx_lot_reservation_open (status, expires_at),
+        INDEX idx_lot_reservation_lot_expiry (status, lot_expiration_date),
+        INDEX idx_lot_reservation_lot (lot_number, status),
+        INDEX idx_lot_reservation_owner (manufacturer_id, status),
+        FOREIGN KEY (lot_number) REFERENCES IngredientBatch (lot_number) ON DELETE CASCADE ON UPDATE CASCADE,
+        FOREIGN KEY (manufacturer_id) REFERENCES UserDetails (id) ON DELETE CASCADE ON UPDATE CASCADE,
+        FOREIGN KEY (product_id) REFERENCES Product (id) ON DELETE SET NULL ON UPDATE CASCADE,
+        FOREIGN KEY (product_lot_number) REFERENCES ProductBatch (lot_number) ON DELETE SET NULL ON UPDATE CASCADE
+    );
+
+-- Outcome of every production, consumption and intake request sent
+-- with a client-supplied idempotency key. A retry with the same key
+-- and arguments returns this outcome instead of repeating the work.
+-- Purged after a retention period (PurgeIdempotencyKeys).
+CREATE TABLE IF NOT EXISTS
+    IdempotencyKey (
+        idempotency_key VARCHAR(255) PRIMARY KEY,
+        operation VARCHAR(64) NOT NULL,
+        -- SHA-256 of the request arguments
+        request_hash CHAR(64) NOT NULL,
+        result_lot_number VARCHAR(255),
+        result_quantity DOUBLE,
+        created_at DATETIME NOT NULL,
+        replay_count INT NOT NULL DEFAULT 0,
+        last_replayed_at DATETIME,
+        INDEX idx_idempotency_key_created (created_at)
+    );
+
+-- Transactional outbox of inventory changes: one row per intake lot,
+-- production batch and consumption (or removed consumption), written
+-- by triggers in the same transaction as the change itself. No foreign
+-- keys: events outlive the rows they describe. Read in event_id order
+-- by change_stream.ChangeStream.
+CREATE TABLE IF NOT EXISTS
+    InventoryEvent (
+        event_id INT AUTO_INCREMENT PRIMARY KEY,
+        event_type ENUM('INTAKE', 'PRODUCTION', 'CONSUMPTION', 'CONSUMPTION_REVERSED') NOT NULL,
+        -- ingredient lot (INTAKE) or product lot (the others)
+        lot_number VARCHAR(255) NOT NULL,
+        -- consumed ingredient lot (CONSUMPTION, CONSUMPTION_REVERSED)
+        ingredient_lot_number VARCHAR(255),
+        ingredient_id INT,
+        supplier_id VARCHAR(255),
+        product_id INT,
+        manufacturer_id VARCHAR(255),
+        quantity DOUBLE NOT NULL,
+        created_at DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP,
+        INDEX idx_inventory_event_created (created_at)
+    );
+
+-- Position of each change stream consumer: the last event_id it has
+-- processed. Events up to it are not delivered to it again.
+CREATE TABLE IF NOT EXISTS
+    ChangeStreamCursor (
+        consumer VARCHAR(64) PRIMARY KEY,
+        last_event_id INT NOT NULL DEFAULT 0,
+        updated_at DATETIME NOT NULL
+    );
+
+-- Audit trail of every write made from a role session (Manufacturer,
+-- Supplier): who, what operation, with which parameters (JSON) and
+-- whether it succeeded. Written in batches by audit_log.AuditLog off
+-- the request path; no foreign keys, entries outlive what they name.
+CREATE TABLE IF NOT EXISTS
+    AuditEntry (
+        audit_id INT AUTO_INCREMENT PRIMARY KEY,
+        user_id VARCHAR(255) NOT NULL,
+        role_code ENUM('MANUFACTURER', 'SUPPLIER', 'VIEWER') NOT NULL,
+        operation VARCHAR(64) NOT NULL,
+        params TEXT,
+        outcome ENUM('OK', 'FAILED') NOT NULL,
+        error VARCHAR(255),
+        -- when the operation ran (not when the entry was written)
+        occurred_at DATETIME NOT NULL,
+        INDEX idx_audit_user (user_id, occurred_at),
+        INDEX idx_audit_operation (operation, occurred_at)
+    );
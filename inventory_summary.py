@@ -0,0 +1,110 @@
+from database import Database
+
+class InventorySummary:
+    """Reads and repairs the trigger-maintained on-hand summary tables"""
+    
+    def __init__(self, db: Database):
+        self.db = db
+    
+    def on_hand(self):
+        """On-hand, reserved and available quantity per ingredient"""
+        query = """
+            SELECT oh.ingredient_id, i.name as ingredient_name,
+                   oh.quantity, oh.reserved_quantity,
+                   oh.quantity - oh.reserved_quantity as available_quantity,
+                   oh.lot_count
+            FROM IngredientOnHand oh
+            JOIN Ingredient i ON oh.ingredient_id = i.id
+            WHERE oh.quantity > 0
+            ORDER BY i.name
+        """
+        return self.db.execute(query)
+    
+    def on_hand_by_expiry(self):
+        """On-hand quantity per ingredient and expiry month"""
+        query = """
+            SELECT e.ingredient_id, i.name as ingredient_name,
+                   e.expiry_bucket, e.quantity, e.lot_count
+            FROM IngredientOnHandByExpiry e
+            JOIN Ingredient i ON e.ingredient_id = i.id
+            WHERE e.quantity > 0
+            ORDER BY i.name, e.expiry_bucket
+        """
+        return self.db.execute(query)
+    
+    def rebuild(self):
+        """Recompute both summary tables from IngredientBatch"""
+        self.db.execute_procedure('RebuildInventorySummary')
+    
+    def verify(self):
+        """Return summary rows that disagree with IngredientBatch
+        
+        Each mismatch names the summary table, the ingredient, the expiry
+        bucket (None for IngredientOnHand) and both quantities; the
+        IngredientOnHand rows also compare the quantity held by open
+        reservations.
+        """
+        ingredient_query = """
+            SELECT t.ingredient_id, NULL as expiry_bucket,
+                   COALESCE(s.quantity, 0) as summary_quantity, t.quantity as actual_quantity,
+                   COALESCE(s.lot_count, 0) as summary_lots, t.lot_count as actual_lots,
+                   COALESCE(s.reserved_quantity, 0) as summary_reserved, t.reserved as actual_reserved
+            FROM (
+                SELECT ib.ingredient_id, SUM(ib.quantity) as quantity,
+                       SUM(ib.quantity > 0) as lot_count,
+                       COALESCE(SUM(r.reserved), 0) as reserved
+                FROM IngredientBatch ib
+                LEFT JOIN (
+                    SELECT lot_number, SUM(quantity) as reserved
+                    FROM LotReservation
+                    WHERE status = 'OPEN'
+                    GROUP BY lot_number
+                ) r ON r.lot_number = ib.lot_number
+                GROUP BY ib.ingredient_id
+            ) t
+            LEFT JOIN IngredientOnHand s ON s.ingredient_id = t.ingredient_id
+            WHERE s.ingredient_id IS NULL
+            OR ABS(s.quantity - t.quantity) > 0.0001
+            OR s.lot_count <> t.lot_count
+            OR ABS(s.reserved_quantity - t.reserved) > 0.0001
+            UNION ALL
+            SELECT s.ingredient_id, NULL, s.quantity, 0, s.lot_count, 0, s.reserved_quantity, 0
+            FROM IngredientOnHand s
+            WHERE (ABS(s.quantity) > 0.0001 OR s.lot_count <> 0)
+            AND NOT EXISTS (
+                SELECT 1 FROM IngredientBatch ib WHERE ib.ingredient_id = s.ingredient_id
+            )
+        """
+        bucket_query = """
+            SELECT t.ingredient_id, t.expiry_bucket,
+                   COALESCE(s.quantity, 0) as summary_quantity, t.quantity as actual_quantity,
+                   COALESCE(s.lot_count, 0) as summary_lots, t.lot_count as actual_lots
+            FROM (
+                SELECT ingredient_id,
+                       DATE_SUB(expiration_date, INTERVAL DAYOFMONTH(expiration_date) - 1 DAY) as expiry_bucket,
+                       SUM(quantity) as quantity, SUM(quantity > 0) as lot_count
+                FROM IngredientBatch
+                GROUP BY ingredient_id, expiry_bucket
+            ) t
+            LEFT JOIN IngredientOnHandByExpiry s
+                ON s.ingredient_id = t.ingredient_id AND s.expiry_bucket = t.expiry_bucket
+            WHERE s.ingredient_id IS NULL
+            OR ABS(s.quantity - t.quantity) > 0.0001
+            OR s.lot_count <> t.lot_count
+            UNION ALL
+            SELECT s.ingredient_id, s.expiry_bucket, s.quantity, 0, s.lot_count, 0
+            FROM IngredientOnHandByExpiry s
+            WHERE (ABS(s.quantity) > 0.0001 OR s.lot_count <> 0)
+            AND NOT EXISTS (
+                SELECT 1 FROM IngredientBatch ib
+                WHERE ib.ingredient_id = s.ingredient_id
+                AND ib.expiration_date BETWEEN s.expiry_bucket AND LAST_DAY(s.expiry_bucket)
+            )
+        """
+        mismatches = []
+        for table, query in (('IngredientOnHand', ingredient_query),
+                             ('IngredientOnHandByExpiry', bucket_query)):
+            for row in self.db.execute(query):
+                row['table'] = table
+                mismatches.append(row)
+        return mismatches
@@ -5,8 +5,12 @@ from supplier import Supplier
 from general_viewer import GeneralViewer
 from queries import Queries
 from database_setup import setup_database_menu
+from expiry_sweeper import ExpirySweeper
+from sharding import ShardRouter
+from audit_log import AuditLog
+from metrics import MetricsExporter
 
-def login(db: Database):
+def login(db: Database, shards=None):
     """Login and role selection"""
     print("\n=== Inventory Management System ===")
     print("Select role:")
@@ -27,7 +31,10 @@ def login(db: Database):
         if not user:
             print("Invalid manufacturer ID")
             return
-        manufacturer = Manufacturer(db, user_id)
+        if shards:
+            manufacturer = shards.manufacturer(user_id)
+        else:
+            manufacturer = Manufacturer(db, user_id)
         manufacturer.menu()
     
     elif role_choice == '2':
@@ -38,15 +45,25 @@ def login(db: Database):
         if not user:
             print("Invalid supplier ID")
             return
-        supplier = Supplier(db, user_id)
+        if shards:
+            # Lots are received into the shard of the manufacturer they are for
+            receiver_id = input("Enter receiving manufacturer ID: ").strip()
+            receiver = db.execute(
+                "SELECT id FROM UserDetails WHERE id = %s AND role_code = 'MANUFACTURER'", (receiver_id,))
+            if not receiver:
+                print("Invalid manufacturer ID")
+                return
+            supplier = shards.supplier(user_id, receiver_id, db)
+        else:
+            supplier = Supplier(db, user_id)
         supplier.menu()
     
     elif role_choice == '3':
-        viewer = GeneralViewer(db)
+        viewer = GeneralViewer(db, shards)
         viewer.menu()
     
     elif role_choice == '4':
-        queries = Queries(db)
+        queries = Queries(db, shards)
         queries.menu()
     
     elif role_choice == '5':
@@ -63,11 +80,33 @@ def login(db: Database):
 def main():
     """Main entry point"""
     db = None
+    sweeper = None
+    shards = None
+    exporter = None
     try:
         db = Database()
+        # Manufacturers partitioned across shard databases (DB_SHARDS)
+        shards = ShardRouter.from_env()
+        
+        # Retire expired lots and precompute the expiring-soon set daily
+        sweeper = ExpirySweeper()
+        try:
+            sweeper.start()
+        except Exception as e:
+            print(f"Warning: expiry sweeper not started: {e}")
+            sweeper = None
+        
+        # Operation and inventory metrics (METRICS_PORT / METRICS_FILE)
+        exporter = MetricsExporter.from_env()
+        if exporter:
+            try:
+                exporter.start()
+            except Exception as e:
+                print(f"Warning: metrics exporter not started: {e}")
+                exporter = None
         
         while True:
-            result = login(db)
+            result = login(db, shards)
             if result == 'exit':
                 break
             
@@ -79,6 +118,14 @@ def main():
         print(f"Error: {e}")
         print("\n💡 Tip: If this is your first time running, try option 5 (Database Setup)")
     finally:
+        if sweeper:
+            sweeper.stop()
+        if exporter:
+            exporter.stop()
+        # Write the audit entries still queued
+        AuditLog.shutdown()
+        if shards:
+            shards.close()
         if db:
             db.close()
 
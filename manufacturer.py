@@ -1,11 +1,30 @@
 from database import Database
+from metrics import action
+from compatibility import CompatibilityMatrix
+from recipe_bom import RecipeBOM
+from inventory_summary import InventorySummary
+from expiry_sweeper import ExpirySweeper
+from traceability import TraceabilityEngine
+from recall_report import RecallReport
+from reservations import ReservationManager, DEFAULT_TTL_HOURS
+from fefo_allocator import FEFOAllocator, InsufficientStockError
+from production_planner import ProductionPlanner
+from preflight import BatchPreflight
+from idempotency import IdempotentCall, new_key
+from bulk_import import BulkProductImport
+from audit_log import AuditLog
 from datetime import datetime, timedelta
 import sys
 
 class Manufacturer:
-    def __init__(self, db: Database, user_id: str):
+    def __init__(self, db: Database, user_id: str, audit: AuditLog = None):
         self.db = db
         self.user_id = user_id
+        # Every write below is recorded (asynchronously) in the audit trail
+        self.audit = audit or AuditLog.default()
+    
+    def _audit(self, operation, params, error=None):
+        self.audit.record(self.user_id, 'MANUFACTURER', operation, params, error)
     
     def menu(self):
         """Main manufacturer menu"""
@@ -15,9 +34,12 @@ class Manufacturer:
             print("2. Products -> Recipe Plans")
             print("3. Inventory -> Record Ingredient Receipt")
             print("4. Production -> Create Product Batch")
-            print("5. Reports")
-            print("6. (Grad) Recall & Traceability")
-            print("7. Exit")
+            print("5. Production -> Reserve Ingredients")
+            print("6. Production -> Plan Production (MRP)")
+            print("7. Reports")
+            print("8. (Grad) Recall & Traceability")
+            print("9. Products -> Bulk Import (JSON)")
+            print("10. Exit")
             
             choice = input("Select option: ").strip()
             
@@ -30,14 +52,21 @@ class Manufacturer:
             elif choice == '4':
                 self.create_product_batch()
             elif choice == '5':
-                self.reports_menu()
+                self.manage_reservations()
             elif choice == '6':
-                self.recall_traceability()
+                self.plan_production()
             elif choice == '7':
+                self.reports_menu()
+            elif choice == '8':
+                self.recall_traceability()
+            elif choice == '9':
+                self.bulk_import_products()
+            elif choice == '10':
                 break
             else:
                 print("Invalid option")
     
+    @action
     def create_update_product(self):
         """Create or update a product type"""
         print("\n=== Create/Update Product ===")
@@ -91,6 +120,9 @@ class Manufacturer:
                 VALUES (%s, %s)
             """
             self.db.execute(ownership_query, (self.user_id, product_id), fetch=False)
+            self._audit('update_product', {'product_id': product_id, 'name': product_name,
+                                           'number': product_number, 'category_id': category_id,
+                                           'standard_batch_units': standard_batch_units})
             print("Product updated successfully")
         else:
             # Create new product
@@ -99,7 +131,7 @@ class Manufacturer:
                 VALUES (%s, %s, %s, %s)
             """
             self.db.execute(insert_query, (product_name, product_number, category_id, standard_batch_units), fetch=False)
-            product_id = self.db.cursor.lastrowid
+            product_id = self.db.lastrowid
             
             # Assign ownership
             ownership_query = """
@@ -107,8 +139,12 @@ class Manufacturer:
                 VALUES (%s, %s)
             """
             self.db.execute(ownership_query, (self.user_id, product_id), fetch=False)
+            self._audit('create_product', {'product_id': product_id, 'name': product_name,
+                                           'number': product_number, 'category_id': category_id,
+                                           'standard_batch_units': standard_batch_units})
             print(f"Product created successfully with ID: {product_id}")
     
+    @action
     def manage_recipe_plans(self):
         """Create or update recipe plans"""
         print("\n=== Recipe Plans ===")
@@ -182,7 +218,7 @@ class Manufacturer:
             VALUES (%s, %s, CURDATE())
         """
         self.db.execute(plan_query, (product_id, new_version), fetch=False)
-        plan_id = self.db.cursor.lastrowid
+        plan_id = self.db.lastrowid
         
         # Add recipe ingredients (using ProductBOM for now, or create RecipeIngredient table)
         # Based on schema, we'll use ProductBOM
@@ -194,11 +230,61 @@ class Manufacturer:
             """
             self.db.execute(bom_query, (product_id, ing_id, qty, qty), fetch=False)
         
+        # Freeze the resulting BOM as this plan version's immutable snapshot
+        RecipeBOM(self.db).snapshot(plan_id)
+        self._audit('create_recipe_plan', {'product_id': product_id, 'plan_id': plan_id,
+                                           'version_number': new_version,
+                                           'ingredients': recipe_ingredients})
+        
         # Check for incompatibilities (Grad feature)
         self.check_incompatibilities(product_id)
         
+        # Keep the stored product conflict matrix in step with the new BOM
+        CompatibilityMatrix(self.db).refresh_products([product_id])
+        
         print(f"Recipe plan version {new_version} created successfully")
     
+    @action
+    def bulk_import_products(self):
+        """Import products and recipe plan versions from a JSON / JSON-lines file"""
+        print("\n=== Bulk Import Products ===")
+        print("File: JSON list of products or JSON lines, each with name, number, category,")
+        print("      standard_batch_units and recipes ([[{ingredient, quantity}, ...], ...])")
+        
+        path = input("File: ").strip()
+        if not path:
+            return
+        
+        importer = BulkProductImport(self.db, self.user_id)
+        try:
+            products = importer.read(path)
+        except (OSError, ValueError) as e:
+            print(f"Error reading file: {e}")
+            return
+        
+        report = importer.run(products)
+        totals = report['totals']
+        self._audit('bulk_import_products', {
+            'path': path,
+            'product_ids': [e['product_id'] for e in report['products'] if e['status'] == 'IMPORTED'],
+            'plans': totals['plans'], 'rejected': totals['rejected'], 'failed': totals['failed']
+        })
+        for entry in report['products']:
+            if entry['status'] == 'IMPORTED':
+                versions = ', '.join(str(v) for v in entry['versions']) or 'none'
+                print(f"  ✓ {entry['name']} ({entry['number']}): product {entry['product_id']}, "
+                      f"plan versions {versions}")
+                for name_a, name_b in entry['conflicts']:
+                    print(f"    ⚠️  {name_a} cannot be combined with {name_b}")
+            else:
+                print(f"  ✗ {entry['name']} ({entry['number']}): {entry['status']} - {entry['reason']}")
+        
+        print(f"\n{totals['products']} products, {totals['plans']} plan versions and "
+              f"{totals['bom_lines']} BOM lines imported in {totals['elapsed']:.2f}s "
+              f"({totals['products_per_sec']:.0f} products/s, {totals['rows_per_sec']:.0f} rows/s)")
+        print(f"{totals['rejected']} rejected, {totals['failed']} failed, "
+              f"{totals['conflicting_products']} with incompatible ingredients")
+    
     def check_incompatibilities(self, product_id):
         """Check for ingredient incompatibilities in a product"""
         query = """
@@ -223,6 +309,7 @@ class Manufacturer:
         else:
             print("✓ No incompatibilities detected")
     
+    @action
     def record_ingredient_receipt(self):
         """Record ingredient receipt (manufacturer receiving from supplier)"""
         print("\n=== Record Ingredient Receipt ===")
@@ -235,7 +322,8 @@ class Manufacturer:
             FROM IngredientBatch ib
             JOIN Ingredient i ON ib.ingredient_id = i.id
             JOIN UserDetails u ON ib.supplier_id = u.id
-            WHERE ib.quantity > 0
+            WHERE ib.status = 'LIVE'
+            AND ib.quantity > 0
             ORDER BY ib.expiration_date
         """
         batches = self.db.execute(query)
@@ -255,7 +343,7 @@ class Manufacturer:
         # Verify lot exists and not expired
         verify_query = """
             SELECT * FROM IngredientBatch
-            WHERE lot_number = %s AND expiration_date >= CURDATE()
+            WHERE lot_number = %s AND status = 'LIVE' AND expiration_date >= CURDATE()
         """
         lot_info = self.db.execute(verify_query, (lot_number,))
         
@@ -266,6 +354,7 @@ class Manufacturer:
         print(f"Receipt recorded for lot: {lot_number}")
         print("Note: Ingredient batches are created by suppliers. This function records manufacturer receipt.")
     
+    @action
     def create_product_batch(self):
         """Create a product batch with ingredient consumption"""
         print("\n=== Create Product Batch ===")
@@ -305,29 +394,18 @@ class Manufacturer:
             return
         
         # Get recipe plan (use latest version)
-        plan_query = """
-            SELECT plan_id, version_number
-            FROM RecipePlan
-            WHERE product_id = %s
-            ORDER BY version_number DESC
-            LIMIT 1
-        """
-        plan_result = self.db.execute(plan_query, (product_id,))
+        recipe_bom = RecipeBOM(self.db)
+        plan = recipe_bom.latest_plan(product_id)
         
-        if not plan_result:
+        if not plan:
             print("No recipe plan found. Create one first.")
             return
         
-        plan_id = plan_result[0]['plan_id']
+        plan_id = plan['plan_id']
+        print(f"Using recipe plan version {plan['version_number']}")
         
-        # Get required ingredients from ProductBOM
-        bom_query = """
-            SELECT pb.ingredient_id, i.name, pb.quantity
-            FROM ProductBOM pb
-            JOIN Ingredient i ON pb.ingredient_id = i.id
-            WHERE pb.product_id = %s
-        """
-        required_ingredients = self.db.execute(bom_query, (product_id,))
+        # Get required ingredients from the plan's BOM snapshot
+        required_ingredients = recipe_bom.plan_bom(plan_id)
         
         if not required_ingredients:
             print("No ingredients in recipe. Update recipe plan first.")
@@ -345,115 +423,320 @@ class Manufacturer:
         production_date = datetime.now().date()
         expiration_date = production_date + timedelta(days=90)  # Default 90 days
         
-        # Create product batch using stored procedure
-        try:
-            self.db.execute_procedure(
-                'RecordProductionBatch',
-                (self.user_id, product_id, batch_id, produced_quantity, production_date, expiration_date)
-            )
-            
-            # Get the lot number
-            lot_query = """
-                SELECT lot_number FROM ProductBatch
-                WHERE product_id = %s AND manufacturer_id = %s AND batch_id = %s
-                ORDER BY production_date DESC LIMIT 1
-            """
-            lot_result = self.db.execute(lot_query, (product_id, self.user_id, batch_id))
-            product_lot_number = lot_result[0]['lot_number']
-            
-            print(f"\nProduct batch created: {product_lot_number}")
-            
-            # Now consume ingredients
-            print("\nSelect ingredient lots to consume:")
+        # Choose lots for every ingredient before writing anything
+        print("\nSelect ingredient lots to consume:")
+        reservations = ReservationManager(self.db)
+        reservations.expire_stale()
+        allocator = FEFOAllocator.from_database(
+            self.db, [ing['ingredient_id'] for ing in required_ingredients]
+        )
+        # (lot_number, quantity, reservation_id or None)
+        allocation = []
+        
+        for ing in required_ingredients:
+            total_needed = ing['quantity'] * produced_quantity
+            print(f"\n{ing['name']}: Need {total_needed} oz")
+            remaining = total_needed
             
-            for ing in required_ingredients:
-                total_needed = ing['quantity'] * produced_quantity
-                print(f"\n{ing['name']}: Need {total_needed} oz")
-                
-                # List available lots (FEFO - earliest expiring first)
-                lots_query = """
-                    SELECT ib.lot_number, ib.quantity, ib.expiration_date, ib.per_unit_cost
-                    FROM IngredientBatch ib
-                    WHERE ib.ingredient_id = %s
-                    AND ib.quantity > 0
-                    AND ib.expiration_date >= CURDATE()
-                    ORDER BY ib.expiration_date ASC
-                """
-                available_lots = self.db.execute(lots_query, (ing['ingredient_id'],))
-                
-                if not available_lots:
-                    print(f"  No available lots for {ing['name']}")
-                    # Rollback?
-                    return
-                
-                print("  Available lots:")
-                for lot in available_lots:
-                    print(f"    {lot['lot_number']}: {lot['quantity']} oz, expires {lot['expiration_date']}")
-                
-                remaining = total_needed
-                lot_selections = []
-                
-                # Auto-select by FEFO (Grad feature)
-                use_fefo = input("  Use FEFO auto-select? (y/n): ").strip().lower() == 'y'
-                
-                if use_fefo:
-                    for lot in available_lots:
+            # Stock reserved for this product is used first
+            reserved = reservations.open_reservations(self.user_id, product_id, ing['ingredient_id'])
+            if reserved:
+                reserved_total = sum(r['quantity'] for r in reserved)
+                print(f"  You have {reserved_total} oz reserved in {len(reserved)} reservation(s)")
+                if input("  Use reservations first? (y/n): ").strip().lower() == 'y':
+                    for r in reserved:
                         if remaining <= 0:
                             break
-                        use_qty = min(remaining, lot['quantity'])
-                        lot_selections.append((lot['lot_number'], use_qty))
+                        use_qty = min(remaining, r['quantity'])
+                        allocation.append((r['lot_number'], use_qty, r['reservation_id']))
                         remaining -= use_qty
-                        print(f"  Selected {lot['lot_number']}: {use_qty} oz")
-                else:
-                    # Manual selection
-                    while remaining > 0:
-                        lot_num = input(f"  Enter lot number (need {remaining} oz more): ").strip()
-                        if not lot_num:
-                            break
-                        
-                        # Find lot
-                        selected_lot = [l for l in available_lots if l['lot_number'] == lot_num]
-                        if not selected_lot:
-                            print("  Invalid lot number")
-                            continue
-                        
-                        lot = selected_lot[0]
-                        use_qty = float(input(f"  Quantity to use (max {lot['quantity']}): "))
-                        use_qty = min(use_qty, lot['quantity'], remaining)
-                        
-                        lot_selections.append((lot_num, use_qty))
-                        remaining -= use_qty
-                
-                if remaining > 0:
-                    print(f"  Error: Insufficient quantity. Still need {remaining} oz")
+                        print(f"  Using reservation {r['reservation_id']} ({r['lot_number']}): {use_qty} oz")
+            
+            if remaining <= 0:
+                continue
+            
+            # List available (unreserved) lots (FEFO - earliest expiring first)
+            available_lots = reservations.available_lots(ing['ingredient_id'])
+            
+            if not available_lots:
+                print(f"  No available lots for {ing['name']}")
+                return
+            
+            print("  Available lots:")
+            for lot in available_lots:
+                print(f"    {lot['lot_number']}: {lot['available_quantity']} oz available, "
+                      f"expires {lot['expiration_date']}")
+            
+            # Auto-select by FEFO (Grad feature)
+            use_fefo = input("  Use FEFO auto-select? (y/n): ").strip().lower() == 'y'
+            
+            if use_fefo:
+                try:
+                    picks = allocator.allocate({ing['ingredient_id']: remaining})
+                except InsufficientStockError as e:
+                    print(f"  Error: Insufficient quantity. Still need "
+                          f"{e.shortages[ing['ingredient_id']]} oz")
                     return
-                
-                # Consume the lots
-                for lot_num, qty in lot_selections:
-                    try:
-                        self.db.execute_procedure(
-                            'ConsumeIngredientLot',
-                            (product_lot_number, lot_num, qty)
-                        )
-                    except Exception as e:
-                        print(f"  Error consuming {lot_num}: {e}")
-                        return
+                for _, lot_number, use_qty in picks:
+                    allocation.append((lot_number, use_qty, None))
+                    remaining -= use_qty
+                    print(f"  Selected {lot_number}: {use_qty} oz")
+            else:
+                # Manual selection
+                while remaining > 0:
+                    lot_num = input(f"  Enter lot number (need {remaining} oz more): ").strip()
+                    if not lot_num:
+                        break
+                    
+                    # Find lot
+                    selected_lot = [l for l in available_lots if l['lot_number'] == lot_num]
+                    if not selected_lot:
+                        print("  Invalid lot number")
+                        continue
+                    
+                    lot = selected_lot[0]
+                    # A lot picked again only has what the earlier picks left
+                    lot_available = lot['available_quantity'] - sum(
+                        q for l, q, r in allocation if l == lot_num and r is None)
+                    if lot_available <= 0:
+                        print("  Lot already fully used in this batch")
+                        continue
+                    use_qty = float(input(f"  Quantity to use (max {lot_available}): "))
+                    use_qty = min(use_qty, lot_available, remaining)
+                    
+                    allocation.append((lot_num, use_qty, None))
+                    remaining -= use_qty
             
-            # Get final cost
-            cost_query = """
-                SELECT batch_total_cost, unit_cost, produced_quantity
-                FROM ProductBatch
-                WHERE lot_number = %s
-            """
-            cost_info = self.db.execute(cost_query, (product_lot_number,))
-            if cost_info:
-                print(f"\n✓ Batch created successfully!")
-                print(f"  Total cost: ${cost_info[0]['batch_total_cost']:.2f}")
-                print(f"  Unit cost: ${cost_info[0]['unit_cost']:.2f}")
-                print(f"  Produced quantity: {cost_info[0]['produced_quantity']}")
+            if remaining > 0:
+                print(f"  Error: Insufficient quantity. Still need {remaining} oz")
+                return
+        
+        # Validate the whole batch in one query; a failing batch writes nothing
+        problems = BatchPreflight(self.db).check(
+            self.user_id, product_id, batch_id, produced_quantity,
+            production_date, expiration_date, plan_id, allocation
+        )
+        if problems:
+            print("\n✗ Batch rejected (nothing was written):")
+            for problem in problems:
+                print(f"  [{problem['check']}] {problem['detail']}")
+            return
+        
+        # Record the batch and consume its lots in one transaction
+        product_lot_number = f"{product_id}-{self.user_id}-{batch_id}"
+        idempotency_key = new_key()
+        audit_params = {'lot_number': product_lot_number, 'product_id': product_id,
+                        'batch_id': batch_id, 'produced_quantity': produced_quantity,
+                        'production_date': production_date, 'expiration_date': expiration_date,
+                        'plan_id': plan_id, 'allocation': allocation}
         
+        def record_batch(db):
+            db.execute_procedure(
+                'RecordProductionBatch',
+                (self.user_id, product_id, batch_id, produced_quantity, production_date, expiration_date,
+                 plan_id, idempotency_key)
+            )
+            if IdempotentCall.replayed(db):
+                # An earlier attempt committed the batch and all its consumption
+                return
+            # A batch has one consumption row per lot. A lot drawn through
+            # several reservations, or a reservation plus unreserved stock,
+            # has its reservations closed and is consumed once for the sum
+            by_lot = {}
+            for lot_number, quantity, reservation_id in allocation:
+                by_lot.setdefault(lot_number, []).append((quantity, reservation_id))
+            for lot_number, entries in by_lot.items():
+                if len(entries) == 1 and entries[0][1] is not None:
+                    quantity, reservation_id = entries[0]
+                    db.execute_procedure('ConvertReservation', (reservation_id, product_lot_number, quantity))
+                    continue
+                for quantity, reservation_id in entries:
+                    if reservation_id is not None and not ReservationManager(db).mark_converted(
+                            reservation_id, self.user_id, product_lot_number, quantity):
+                        raise ValueError(f"Reservation {reservation_id} cannot cover {quantity} oz")
+                db.execute_procedure('ConsumeIngredientLot',
+                                     (product_lot_number, lot_number, sum(q for q, _ in entries), None))
+        
+        try:
+            # Safe to re-run after a dropped connection: the key replays a committed batch
+            IdempotentCall(self.db).run(record_batch)
         except Exception as e:
+            self._audit('create_product_batch', audit_params, e)
             print(f"Error creating batch: {e}")
+            return
+        self._audit('create_product_batch', audit_params)
+        
+        print(f"\nProduct batch created: {product_lot_number}")
+        
+        # Get final cost
+        cost_query = """
+            SELECT batch_total_cost, unit_cost, produced_quantity
+            FROM ProductBatch
+            WHERE lot_number = %s
+        """
+        cost_info = self.db.execute(cost_query, (product_lot_number,))
+        if cost_info:
+            print(f"\n✓ Batch created successfully!")
+            print(f"  Total cost: ${cost_info[0]['batch_total_cost']:.2f}")
+            print(f"  Unit cost: ${cost_info[0]['unit_cost']:.2f}")
+            print(f"  Produced quantity: {cost_info[0]['produced_quantity']}")
+    
+    @action
+    def manage_reservations(self):
+        """Reserve ingredient lots for planned batches and manage open reservations"""
+        reservations = ReservationManager(self.db)
+        reservations.expire_stale()
+        
+        while True:
+            print("\n=== Ingredient Reservations ===")
+            print("1. Reserve ingredients for a planned batch")
+            print("2. View open reservations")
+            print("3. Release a reservation")
+            print("4. Back")
+            
+            choice = input("Select option: ").strip()
+            
+            if choice == '1':
+                self.reserve_for_planned_batch(reservations)
+            elif choice == '2':
+                open_rows = reservations.open_reservations(self.user_id)
+                if not open_rows:
+                    print("No open reservations")
+                for r in open_rows:
+                    print(f"  #{r['reservation_id']}: {r['quantity']} oz of {r['ingredient_name']} "
+                          f"from lot {r['lot_number']} (product {r['product_id']}), "
+                          f"held until {r['expires_at']}")
+            elif choice == '3':
+                try:
+                    reservation_id = int(input("Reservation ID: ").strip())
+                except ValueError:
+                    print("Invalid reservation ID")
+                    continue
+                if reservations.release(reservation_id, self.user_id):
+                    self._audit('release_reservation', {'reservation_id': reservation_id})
+                    print("Reservation released")
+                else:
+                    print("No open reservation with that ID")
+            elif choice == '4':
+                break
+            else:
+                print("Invalid option")
+    
+    def reserve_for_planned_batch(self, reservations):
+        """Hold FEFO lots for every ingredient of a planned batch"""
+        query = """
+            SELECT p.id, p.name, p.standard_batch_units
+            FROM Product p
+            JOIN ManufacturerProduct mp ON p.id = mp.product_id
+            WHERE mp.manufacturer_id = %s
+        """
+        products = self.db.execute(query, (self.user_id,))
+        if not products:
+            print("No products found. Create a product first.")
+            return
+        
+        print("\nYour products:")
+        for p in products:
+            print(f"  {p['id']}: {p['name']} (Standard batch: {p['standard_batch_units']})")
+        
+        try:
+            product_id = int(input("Select product ID: "))
+            product_info = [p for p in products if p['id'] == product_id]
+            if not product_info:
+                print("Invalid product ID")
+                return
+            standard_batch = product_info[0]['standard_batch_units']
+            produced_quantity = int(input(f"Planned quantity (must be multiple of {standard_batch}): "))
+            ttl_input = input(f"Hold for how many hours? (default {DEFAULT_TTL_HOURS}): ").strip()
+            ttl_hours = float(ttl_input) if ttl_input else DEFAULT_TTL_HOURS
+        except ValueError:
+            print("Invalid input")
+            return
+        
+        if produced_quantity <= 0 or produced_quantity % standard_batch != 0:
+            print(f"Error: Quantity must be a positive multiple of {standard_batch}")
+            return
+        
+        audit_params = {'product_id': product_id, 'produced_quantity': produced_quantity,
+                        'ttl_hours': ttl_hours}
+        try:
+            created = reservations.reserve_for_batch(self.user_id, product_id, produced_quantity, ttl_hours)
+        except Exception as e:
+            self._audit('reserve_ingredients', audit_params, e)
+            print(f"Reservation failed: {e}")
+            return
+        audit_params['reservations'] = created
+        self._audit('reserve_ingredients', audit_params)
+        
+        print(f"\n✓ {len(created)} reservation(s) created:")
+        for reservation_id, ingredient_id, lot_number, quantity in created:
+            print(f"  #{reservation_id}: {quantity} oz of ingredient {ingredient_id} from lot {lot_number}")
+    
+    @action
+    def plan_production(self):
+        """Plan batches for a demand list across products and report shortages"""
+        print("\n=== Production Planning (MRP) ===")
+        query = """
+            SELECT p.id, p.name, p.standard_batch_units
+            FROM Product p
+            JOIN ManufacturerProduct mp ON p.id = mp.product_id
+            WHERE mp.manufacturer_id = %s
+        """
+        products = {p['id']: p for p in self.db.execute(query, (self.user_id,))}
+        if not products:
+            print("No products found. Create a product first.")
+            return
+        
+        print("\nYour products:")
+        for p in products.values():
+            print(f"  {p['id']}: {p['name']} (Standard batch: {p['standard_batch_units']})")
+        
+        print("\nEnter demand as '<product ID> <quantity>', highest priority first (blank to finish):")
+        demand = []
+        while True:
+            line = input("  Demand: ").strip()
+            if not line:
+                break
+            try:
+                product_id, quantity = line.split()
+                product_id, quantity = int(product_id), float(quantity)
+            except ValueError:
+                print("  Invalid input")
+                continue
+            if product_id not in products:
+                print("  Not one of your products")
+                continue
+            demand.append((product_id, quantity))
+        
+        if not demand:
+            return
+        
+        plan = ProductionPlanner.from_database(self.db).plan(demand)
+        names = {i['id']: i['name'] for i in self.db.execute("SELECT id, name FROM Ingredient")}
+        
+        print("\nPlanned batches:")
+        if not plan.batches:
+            print("  None")
+        for b in plan.batches:
+            print(f"  {b['product_name']}: {b['batch_count']} batch(es) = {b['quantity']} units "
+                  f"(requested {b['requested_quantity']})")
+        
+        for row in plan.infeasible:
+            print(f"  ✗ Product {row['product_id']}: {row['reason']}")
+        
+        if plan.shortages:
+            print("\nShortages:")
+            for row in plan.shortages:
+                print(f"  Product {row['product_id']}: {names.get(row['ingredient_id'])} short "
+                      f"{row['short_quantity']:.2f} oz ({row['missing_batches']} batch(es) blocked)")
+        if plan.material_shortages:
+            print("\nMaterials needed for short compound ingredients:")
+            for ingredient_id, quantity in plan.material_shortages.items():
+                print(f"  {names.get(ingredient_id)}: {quantity:.2f} oz")
+        if plan.expiring_allocated:
+            print("\nUse first (allocated stock expiring soon):")
+            for ingredient_id, quantity in plan.expiring_allocated.items():
+                print(f"  {names.get(ingredient_id)}: {quantity:.2f} oz")
     
     def reports_menu(self):
         """Manufacturer reports menu"""
@@ -463,7 +746,8 @@ class Manufacturer:
             print("2. Nearly out of stock")
             print("3. Almost expired ingredient lots")
             print("4. Batch Cost Summary")
-            print("5. Back")
+            print("5. Rebuild/Verify Inventory Summary")
+            print("6. Back")
             
             choice = input("Select option: ").strip()
             
@@ -476,37 +760,70 @@ class Manufacturer:
             elif choice == '4':
                 self.batch_cost_summary()
             elif choice == '5':
+                self.maintain_inventory_summary()
+            elif choice == '6':
                 break
             else:
                 print("Invalid option")
     
+    @action
     def on_hand_report(self):
-        """Report on-hand inventory by item/lot"""
+        """Report on-hand inventory by item, expiry month and (optionally) lot"""
+        summary = InventorySummary(self.db)
+        totals = summary.on_hand()
+        buckets = summary.on_hand_by_expiry()
+        
+        print("\n=== On-Hand Inventory ===")
+        if not totals:
+            print("No ingredients on hand")
+            return
+        
+        by_ingredient = {}
+        for b in buckets:
+            by_ingredient.setdefault(b['ingredient_id'], []).append(b)
+        
+        for t in totals:
+            print(f"{t['ingredient_name']} (ID: {t['ingredient_id']}): "
+                  f"{t['quantity']} oz in {t['lot_count']} lot(s), "
+                  f"{t['reserved_quantity']} oz reserved, {t['available_quantity']} oz available")
+            for b in by_ingredient.get(t['ingredient_id'], []):
+                print(f"    Expiring {b['expiry_bucket'].strftime('%Y-%m')}: "
+                      f"{b['quantity']} oz ({b['lot_count']} lot(s))")
+        
+        ingredient_id = input("\nShow lots for ingredient ID (Enter to skip): ").strip()
+        if not ingredient_id:
+            return
+        
         query = """
             SELECT ib.lot_number, i.name as ingredient_name,
-                   ib.quantity, ib.expiration_date, ib.per_unit_cost
+                   ib.quantity, ib.reserved_quantity, ib.expiration_date, ib.per_unit_cost
             FROM IngredientBatch ib
             JOIN Ingredient i ON ib.ingredient_id = i.id
-            WHERE ib.quantity > 0
-            ORDER BY i.name, ib.expiration_date
+            WHERE ib.ingredient_id = %s
+            AND ib.quantity > 0
+            ORDER BY ib.expiration_date
         """
-        results = self.db.execute(query)
+        try:
+            results = self.db.execute(query, (int(ingredient_id),))
+        except ValueError:
+            print("Invalid ingredient ID")
+            return
         
-        print("\n=== On-Hand Inventory ===")
         for r in results:
             print(f"Lot: {r['lot_number']}, Ingredient: {r['ingredient_name']}, "
-                  f"Qty: {r['quantity']} oz, Expires: {r['expiration_date']}, "
-                  f"Cost: ${r['per_unit_cost']:.2f}/oz")
+                  f"Qty: {r['quantity']} oz ({r['reserved_quantity']} reserved), "
+                  f"Expires: {r['expiration_date']}, Cost: ${r['per_unit_cost']:.2f}/oz")
     
+    @action
     def nearly_out_of_stock(self):
         """Report items below standard batch size"""
         query = """
             SELECT p.id, p.name, p.standard_batch_units,
-                   COALESCE(SUM(ib.quantity), 0) as total_on_hand
+                   COALESCE(SUM(oh.quantity), 0) as total_on_hand
             FROM Product p
             JOIN ManufacturerProduct mp ON p.id = mp.product_id
             LEFT JOIN ProductBOM pb ON p.id = pb.product_id
-            LEFT JOIN IngredientBatch ib ON pb.ingredient_id = ib.ingredient_id AND ib.quantity > 0
+            LEFT JOIN IngredientOnHand oh ON pb.ingredient_id = oh.ingredient_id
             WHERE mp.manufacturer_id = %s
             GROUP BY p.id, p.name, p.standard_batch_units
             HAVING total_on_hand < p.standard_batch_units
@@ -522,21 +839,13 @@ class Manufacturer:
                       f"On-hand: {r['total_on_hand']}, "
                       f"Standard batch: {r['standard_batch_units']}")
     
+    @action
     def almost_expired(self):
         """Report ingredient lots expiring within 10 days"""
-        query = """
-            SELECT ib.lot_number, i.name as ingredient_name,
-                   ib.quantity, ib.expiration_date,
-                   DATEDIFF(ib.expiration_date, CURDATE()) as days_until_expiry
-            FROM IngredientBatch ib
-            JOIN Ingredient i ON ib.ingredient_id = i.id
-            WHERE ib.quantity > 0
-            AND ib.expiration_date BETWEEN CURDATE() AND DATE_ADD(CURDATE(), INTERVAL 10 DAY)
-            ORDER BY ib.expiration_date
-        """
-        results = self.db.execute(query)
+        sweeper = ExpirySweeper(self.db)
+        results = sweeper.expiring_lots()
         
-        print("\n=== Almost Expired (within 10 days) ===")
+        print(f"\n=== Almost Expired (within {sweeper.window_days} days) ===")
         if not results:
             print("No items expiring soon")
         else:
@@ -544,14 +853,39 @@ class Manufacturer:
                 print(f"Lot: {r['lot_number']}, Ingredient: {r['ingredient_name']}, "
                       f"Qty: {r['quantity']} oz, Expires in {r['days_until_expiry']} days")
     
+    @action
+    def maintain_inventory_summary(self):
+        """Verify the on-hand summary against the lots and rebuild it if needed"""
+        print("\n=== Inventory Summary Maintenance ===")
+        summary = InventorySummary(self.db)
+        
+        mismatches = summary.verify()
+        if not mismatches:
+            print("✓ Summary matches ingredient lots")
+            return
+        
+        print(f"⚠️  {len(mismatches)} summary row(s) out of date:")
+        for m in mismatches:
+            bucket = f", expiry {m['expiry_bucket']}" if m['expiry_bucket'] else ""
+            print(f"  {m['table']} ingredient {m['ingredient_id']}{bucket}: "
+                  f"summary {m['summary_quantity']} oz vs actual {m['actual_quantity']} oz")
+        
+        if input("Rebuild summary now? (y/n): ").strip().lower() == 'y':
+            summary.rebuild()
+            self._audit('rebuild_inventory_summary', {'mismatches': len(mismatches)})
+            print("Summary rebuilt")
+    
+    @action
     def batch_cost_summary(self):
         """Batch cost summary for a selected product batch"""
         # List product batches
         query = """
             SELECT pb.lot_number, p.name as product_name,
-                   pb.produced_quantity, pb.batch_total_cost, pb.unit_cost
+                   pb.produced_quantity, pb.batch_total_cost, pb.unit_cost,
+                   rp.version_number as plan_version
             FROM ProductBatch pb
             JOIN Product p ON pb.product_id = p.id
+            LEFT JOIN RecipePlan rp ON pb.plan_id = rp.plan_id
             WHERE pb.manufacturer_id = %s
             ORDER BY pb.production_date DESC
         """
@@ -585,6 +919,8 @@ class Manufacturer:
             b = batch_info[0]
             print(f"\n=== Batch Cost Summary: {lot_number} ===")
             print(f"Product: {b['product_name']}")
+            if b['plan_version'] is not None:
+                print(f"Recipe Plan Version: {b['plan_version']}")
             print(f"Produced Quantity: {b['produced_quantity']}")
             print(f"\nIngredient Costs:")
             total = 0
@@ -595,49 +931,104 @@ class Manufacturer:
             print(f"\nTotal Batch Cost: ${b['batch_total_cost']:.2f}")
             print(f"Unit Cost: ${b['unit_cost']:.2f}")
     
+    @action
     def recall_traceability(self):
         """Recall & traceability (Grad feature)"""
         print("\n=== Recall & Traceability ===")
+        print("1. Forward trace from ingredient")
+        print("2. Forward trace from ingredient lot")
+        print("3. Forward trace from supplier")
+        print("4. Backward trace from product lot")
         
-        ingredient_id = input("Enter ingredient ID (or press Enter for lot number): ").strip()
-        lot_number = None
+        choice = input("Select option: ").strip()
+        engine = TraceabilityEngine(self.db)
         
-        if not ingredient_id:
-            lot_number = input("Enter ingredient lot number: ").strip()
-        
-        # Date window (20 days)
-        days_back = 20
-        
-        if ingredient_id:
-            # Find all product batches using this ingredient
-            query = """
-                SELECT DISTINCT pb.lot_number, p.name as product_name,
-                       pb.production_date, pb.expiration_date
-                FROM ProductBatch pb
-                JOIN IngredientConsumption ic ON pb.lot_number = ic.product_lot_number
-                JOIN IngredientBatch ib ON ic.ingredient_lot_number = ib.lot_number
-                JOIN Product p ON pb.product_id = p.id
-                WHERE ib.ingredient_id = %s
-                AND pb.production_date >= DATE_SUB(CURDATE(), INTERVAL %s DAY)
-            """
-            results = self.db.execute(query, (int(ingredient_id), days_back))
-        else:
-            # Find product batches using this specific lot
-            query = """
-                SELECT DISTINCT pb.lot_number, p.name as product_name,
-                       pb.production_date, pb.expiration_date
-                FROM ProductBatch pb
-                JOIN IngredientConsumption ic ON pb.lot_number = ic.product_lot_number
-                JOIN Product p ON pb.product_id = p.id
-                WHERE ic.ingredient_lot_number = %s
-                AND pb.production_date >= DATE_SUB(CURDATE(), INTERVAL %s DAY)
-            """
-            results = self.db.execute(query, (lot_number, days_back))
+        if choice == '4':
+            self.backward_trace(engine)
+            return
+        
+        kinds = {'1': ('ingredient', "Enter ingredient ID: "),
+                 '2': ('lot', "Enter ingredient lot number: "),
+                 '3': ('supplier', "Enter supplier ID: ")}
+        if choice not in kinds:
+            print("Invalid option")
+            return
+        
+        kind, prompt = kinds[choice]
+        key = input(prompt).strip()
+        
+        # Date window (defaults to the last 20 days)
+        try:
+            start_input = input("Produced on/after (YYYY-MM-DD, Enter for 20 days ago): ").strip()
+            end_input = input("Produced on/before (YYYY-MM-DD, Enter for today): ").strip()
+            start_date = (datetime.strptime(start_input, '%Y-%m-%d').date() if start_input
+                          else datetime.now().date() - timedelta(days=20))
+            end_date = (datetime.strptime(end_input, '%Y-%m-%d').date() if end_input
+                        else datetime.now().date())
+            
+            # Large recalls go straight to files instead of the terminal
+            if input("Export recall report to CSV/JSON-lines files? (y/n): ").strip().lower() == 'y':
+                out_dir = input("Output directory (Enter for current): ").strip() or '.'
+                self.export_recall_report(kind, key, start_date, end_date, out_dir)
+                return
+            
+            results = engine.forward(kind, key, start_date, end_date)
+        except ValueError:
+            print("Invalid input")
+            return
         
-        print(f"\n=== Affected Product Batches (last {days_back} days) ===")
+        print(f"\n=== Affected Product Batches ({start_date} to {end_date}) ===")
         if not results:
             print("No affected product batches found")
         else:
             for r in results:
                 print(f"Lot: {r['lot_number']}, Product: {r['product_name']}, "
+                      f"Manufacturer: {r['manufacturer_id']}, "
                       f"Produced: {r['production_date']}, Expires: {r['expiration_date']}")
+    
+    def export_recall_report(self, kind, key, start_date, end_date, out_dir):
+        """Stream a forward trace into report files and print the summary"""
+        summary = RecallReport(self.db).export(kind, key, start_date, end_date, out_dir)
+        totals = summary['totals']
+        
+        print(f"\n=== Recall Report ({start_date} to {end_date}) ===")
+        print(f"Affected lots: {totals['lots']}")
+        print(f"Produced quantity: {totals['produced_quantity']}")
+        print(f"Downstream cost: ${totals['downstream_cost']:.2f}")
+        print("\nBy manufacturer:")
+        for manufacturer_id, m in summary['by_manufacturer'].items():
+            print(f"  {manufacturer_id} ({m['manufacturer_name']}): {m['lots']} lot(s), "
+                  f"${m['downstream_cost']:.2f}")
+        print("\nBy product:")
+        for product_id, p in summary['by_product'].items():
+            print(f"  {product_id} ({p['product_name']}): {p['lots']} lot(s), "
+                  f"${p['downstream_cost']:.2f}")
+        print("\nFiles written:")
+        for path in summary['files'].values():
+            print(f"  {path}")
+    
+    def backward_trace(self, engine):
+        """List every supplier lot and supplier behind a product lot"""
+        product_lot_number = input("Enter product lot number: ").strip()
+        lots = engine.backward(product_lot_number)
+        
+        print(f"\n=== Supplier Lots in {product_lot_number} ===")
+        if not lots:
+            print("No ingredient lots found")
+            return
+        
+        for l in lots:
+            print(f"Lot: {l['ingredient_lot_number']}, Ingredient: {l['ingredient_name']}, "
+                  f"Supplier: {l['supplier_name'].strip()} ({l['supplier_id']}), "
+                  f"Consumed: {l['consumed_quantity_oz']} oz")
+        
+        materials = engine.backward_materials(product_lot_number)
+        if materials:
+            print("\nCompound lot materials (by supplier formulation):")
+            for m in materials:
+                print(f"  {m['ingredient_lot_number']} (v{m['version_number']}): {m['material_name']}")
+        
+        suppliers = sorted({(l['supplier_id'], l['supplier_name'].strip()) for l in lots})
+        print("\nSuppliers:")
+        for supplier_id, supplier_name in suppliers:
+            print(f"  {supplier_id}: {supplier_name}")
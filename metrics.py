@@ -0,0 +1,282 @@
+import functools
+import os
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from dotenv import load_dotenv
+from background import BackgroundWorker
+
+load_dotenv()
+
+# Upper bounds (seconds) of the latency histogram buckets
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+# Days ahead counted by the expiring-lots gauge (as the "almost expired" report)
+EXPIRING_WINDOW_DAYS = 10
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+class Metrics:
+    """Per-operation call counters and latency histograms
+    
+    Operations are labelled by kind (menu, procedure) and name. Each
+    thread counts into its own series, so observe() takes no lock: it is
+    a dictionary lookup, a bisect and a few additions, cheap enough to
+    run on every call. snapshot() adds up the threads' series. Set
+    enabled = False (or METRICS_ENABLED=0) to make observe() a no-op.
+    """
+    
+    def __init__(self, enabled=True):
+        self.enabled = enabled
+        self._local = threading.local()
+        # Series dicts of every thread that has observed something
+        self._threads = []
+        self._lock = threading.Lock()
+    
+    def observe(self, kind, operation, seconds, error=False):
+        """Record one call of operation that took seconds"""
+        if not self.enabled:
+            return
+        try:
+            series = self._local.series
+        except AttributeError:
+            series = self._local.series = {}
+            with self._lock:
+                self._threads.append(series)
+        entry = series.get((kind, operation))
+        if entry is None:
+            # [per-bucket counts (not cumulative, the last is +Inf), sum, count, errors]
+            entry = series[(kind, operation)] = [[0] * (len(LATENCY_BUCKETS) + 1), 0.0, 0, 0]
+        entry[0][bisect_left(LATENCY_BUCKETS, seconds)] += 1
+        entry[1] += seconds
+        entry[2] += 1
+        if error:
+            entry[3] += 1
+    
+    @contextmanager
+    def timed(self, kind, operation):
+        """Record the duration of the with block (as failed if it raises)"""
+        start = time.perf_counter()
+        try:
+            yield
+        except BaseException:
+            self.observe(kind, operation, time.perf_counter() - start, error=True)
+            raise
+        self.observe(kind, operation, time.perf_counter() - start)
+    
+    def snapshot(self):
+        """{(kind, operation): (buckets, sum, count, errors)} over every thread"""
+        with self._lock:
+            threads = list(self._threads)
+        totals = {}
+        for series in threads:
+            # A thread may add an operation while it is read
+            for key, (buckets, total, count, errors) in list(series.items()):
+                merged = totals.get(key)
+                if merged is None:
+                    totals[key] = (list(buckets), total, count, errors)
+                else:
+                    totals[key] = ([a + b for a, b in zip(merged[0], buckets)],
+                                   merged[1] + total, merged[2] + count, merged[3] + errors)
+        return totals
+    
+    def reset(self):
+        with self._lock:
+            for series in self._threads:
+                series.clear()
+    
+    def render(self):
+        """The counters and histograms in Prometheus text format"""
+        snapshot = sorted(self.snapshot().items())
+        lines = [
+            '# HELP inventory_operations_total Calls of each menu action and stored procedure.',
+            '# TYPE inventory_operations_total counter',
+        ]
+        for (kind, operation), (_, _, count, errors) in snapshot:
+            labels = f'kind="{kind}",operation="{_escape(operation)}"'
+            lines.append(f'inventory_operations_total{{{labels},outcome="ok"}} {count - errors}')
+            lines.append(f'inventory_operations_total{{{labels},outcome="error"}} {errors}')
+        lines += [
+            '# HELP inventory_operation_duration_seconds Latency of each menu action and stored procedure.',
+            '# TYPE inventory_operation_duration_seconds histogram',
+        ]
+        for (kind, operation), (buckets, total, count, _) in snapshot:
+            labels = f'kind="{kind}",operation="{_escape(operation)}"'
+            cumulative = 0
+            for bound, bucket in zip(LATENCY_BUCKETS + ('+Inf',), buckets):
+                cumulative += bucket
+                lines.append(f'inventory_operation_duration_seconds_bucket{{{labels},le="{bound}"}} {cumulative}')
+            lines.append(f'inventory_operation_duration_seconds_sum{{{labels}}} {total:.6f}')
+            lines.append(f'inventory_operation_duration_seconds_count{{{labels}}} {count}')
+        return '\n'.join(lines) + '\n'
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+# Process-wide registry used by Database.execute_procedure and @action
+REGISTRY = Metrics(enabled=os.getenv('METRICS_ENABLED', '1') != '0')
+
+def action(method):
+    """Decorator: record a menu action under kind "menu" as <Class>.<method>
+    
+    The duration includes the time spent at the action's prompts.
+    """
+    operation = method.__qualname__
+    
+    @functools.wraps(method)
+    def wrapper(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            result = method(*args, **kwargs)
+        except BaseException:
+            REGISTRY.observe('menu', operation, time.perf_counter() - start, error=True)
+            raise
+        REGISTRY.observe('menu', operation, time.perf_counter() - start)
+        return result
+    
+    return wrapper
+
+class MetricsExporter:
+    """Publishes REGISTRY and inventory health gauges in Prometheus text format
+    
+    With a port, serves GET /metrics on 127.0.0.1:port; with a path,
+    rewrites that file every interval_seconds (atomically, for a node
+    exporter textfile collector). The gauges (live lots, lots expiring
+    within EXPIRING_WINDOW_DAYS, consumption rows and rows/sec since the
+    previous collection) are queried at collection time on the
+    exporter's own connections: one to every shard with DB_SHARDS, summed.
+    """
+    
+    def __init__(self, registry: Metrics = REGISTRY, port=None, path=None, interval_seconds=15):
+        self.registry = registry
+        self.port = port
+        self.path = path
+        self.interval_seconds = interval_seconds
+        self._db_lock = threading.Lock()
+        # (monotonic time, consumption rows) of the previous collection
+        self._last_consumption = None
+        self._server = None
+        self._server_thread = None
+        # Holds the gauges' connection; with a path, also rewrites the file
+        self._worker = BackgroundWorker('metrics-file', self.write_file if path else None,
+                                        interval_seconds, 'Metrics file write', each_database=False,
+                                        on_stop=self.write_file if path else None)
+    
+    @classmethod
+    def from_env(cls):
+        """An exporter for METRICS_PORT / METRICS_FILE, or None when neither is set"""
+        port = os.getenv('METRICS_PORT')
+        path = os.getenv('METRICS_FILE')
+        if not port and not path:
+            return None
+        return cls(port=int(port) if port else None, path=path or None,
+                   interval_seconds=float(os.getenv('METRICS_INTERVAL_SECONDS', '15')))
+    
+    def collect_gauges(self, db=None):
+        """The inventory health gauges in Prometheus text format
+        
+        Summed over the exporter's connections (every shard with
+        DB_SHARDS), or taken from db when given.
+        """
+        databases = [db] if db else self._worker.databases
+        live_lots = expiring_lots = rows = 0
+        with self._db_lock:
+            for db in databases:
+                lots = db.execute("""
+                    SELECT
+                        COALESCE(SUM(status = 'LIVE' AND quantity > 0 AND expiration_date >= CURDATE()), 0)
+                            as live_lots,
+                        COALESCE(SUM(status = 'LIVE' AND quantity > 0
+                            AND expiration_date BETWEEN CURDATE() AND DATE_ADD(CURDATE(), INTERVAL %s DAY)), 0)
+                            as expiring_lots
+                    FROM IngredientBatch
+                """, (EXPIRING_WINDOW_DAYS,))[0]
+                consumption = db.execute("SELECT COUNT(*) as consumption_rows FROM IngredientConsumption")[0]
+                live_lots += int(lots['live_lots'])
+                expiring_lots += int(lots['expiring_lots'])
+                rows += int(consumption['consumption_rows'])
+            
+            now = time.monotonic()
+            rate = 0.0
+            if self._last_consumption:
+                last_time, last_rows = self._last_consumption
+                if now > last_time:
+                    rate = max(rows - last_rows, 0) / (now - last_time)
+            self._last_consumption = (now, rows)
+        
+        return '\n'.join([
+            '# HELP inventory_live_lots Live ingredient lots with stock that have not expired.',
+            '# TYPE inventory_live_lots gauge',
+            f'inventory_live_lots {live_lots}',
+            '# HELP inventory_expiring_lots Live ingredient lots with stock expiring within the window.',
+            '# TYPE inventory_expiring_lots gauge',
+            f'inventory_expiring_lots{{window_days="{EXPIRING_WINDOW_DAYS}"}} {expiring_lots}',
+            '# HELP inventory_consumption_rows IngredientConsumption rows.',
+            '# TYPE inventory_consumption_rows gauge',
+            f'inventory_consumption_rows {rows}',
+            '# HELP inventory_consumption_rows_per_second Consumption rows added per second since the previous collection.',
+            '# TYPE inventory_consumption_rows_per_second gauge',
+            f'inventory_consumption_rows_per_second {rate:.3f}',
+        ]) + '\n'
+    
+    def render(self):
+        """Everything exported, in Prometheus text format"""
+        text = self.registry.render()
+        try:
+            text += self.collect_gauges()
+        except Exception as e:
+            # The operation metrics are still worth serving without the database
+            text += f'# gauges unavailable: {_escape(e)}\n'
+        return text
+    
+    def write_file(self):
+        """Write render() to path (via a temporary file, so readers never see half of it)"""
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            f.write(self.render())
+        os.replace(tmp_path, self.path)
+    
+    def start(self):
+        """Start serving and/or writing the file on background threads"""
+        if self._worker.databases is not None:
+            return
+        self._worker.start()
+        if self.port:
+            self._server = ThreadingHTTPServer(('127.0.0.1', self.port), self._handler())
+            self._server.daemon_threads = True
+            self._server_thread = threading.Thread(target=self._server.serve_forever,
+                                                   name='metrics-http', daemon=True)
+            self._server_thread.start()
+    
+    def stop(self, timeout=5):
+        """Stop serving; the file gets one last write"""
+        if self._server:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+            self._server_thread.join(timeout)
+            self._server_thread = None
+        self._worker.stop(timeout)
+    
+    def _handler(self):
+        exporter = self
+        
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split('?')[0] not in ('/', '/metrics'):
+                    self.send_error(404)
+                    return
+                body = exporter.render().encode()
+                self.send_response(200)
+                self.send_header('Content-Type', CONTENT_TYPE)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+            
+            def log_message(self, format, *args):
+                # Scrapes would interleave with the menus otherwise
+                pass
+        
+        return Handler
@@ -0,0 +1,172 @@
+from database import Database
+
+# Problems with an allocation tolerate this much float rounding (oz)
+QUANTITY_TOLERANCE = 1e-6
+
+class BatchPreflight:
+    """Checks a proposed production batch and its lot allocation without writing
+    
+    check() runs a single read-only query that applies the rules the
+    procedures and triggers enforce when the batch is recorded and its
+    lots consumed, so a batch that would fail is rejected before any
+    ProductBatch or IngredientConsumption row is written.
+    """
+    
+    def __init__(self, db: Database):
+        self.db = db
+    
+    def check(self, manufacturer_id, product_id, batch_id, produced_quantity,
+              production_date, expiration_date, plan_id=None, allocation=()):
+        """Return the problems of a proposed batch ([] when it would go through)
+        
+        allocation is a list of (lot_number, quantity, reservation_id)
+        tuples; reservation_id is None for unreserved stock. Entries may
+        share a lot (they are consumed as one row). Each problem is a dict
+        with 'check' and 'detail'.
+        """
+        allocation = list(allocation)
+        params = [manufacturer_id, product_id, batch_id, produced_quantity,
+                  production_date, expiration_date, plan_id]
+        
+        if allocation:
+            alloc_rows = " UNION ALL ".join(
+                ["SELECT CAST(%s AS CHAR(255)), CAST(%s AS DECIMAL(30, 10)), CAST(%s AS SIGNED)"]
+                * len(allocation)
+            )
+            for lot_number, quantity, reservation_id in allocation:
+                params.extend([lot_number, quantity, reservation_id])
+        else:
+            alloc_rows = "SELECT CAST(NULL AS CHAR(255)), CAST(NULL AS DECIMAL(30, 10)), CAST(NULL AS SIGNED) FROM DUAL WHERE FALSE"
+        
+        query = f"""
+            WITH req AS (
+                SELECT CAST(%s AS CHAR(255)) as manufacturer_id, CAST(%s AS SIGNED) as product_id,
+                       CAST(%s AS SIGNED) as batch_id, CAST(%s AS DECIMAL(30, 10)) as produced_quantity,
+                       CAST(%s AS DATE) as production_date, CAST(%s AS DATE) as expiration_date,
+                       CAST(%s AS SIGNED) as plan_id
+            ),
+            alloc (lot_number, quantity, reservation_id) AS (
+                {alloc_rows}
+            ),
+            bom_plan AS (
+                SELECT COALESCE(req.plan_id, (
+                    SELECT rp.plan_id FROM RecipePlan rp
+                    WHERE rp.product_id = req.product_id
+                    ORDER BY rp.version_number DESC LIMIT 1
+                )) as plan_id
+                FROM req
+            ),
+            lots AS (
+                SELECT a.lot_number, a.quantity, a.reservation_id,
+                       ib.ingredient_id, ib.quantity as lot_quantity, ib.reserved_quantity,
+                       ib.expiration_date, ib.status
+                FROM alloc a
+                LEFT JOIN IngredientBatch ib ON ib.lot_number = a.lot_number
+            ),
+            lot_use AS (
+                SELECT lot_number,
+                       SUM(CASE WHEN reservation_id IS NULL THEN quantity ELSE 0 END) as free_quantity,
+                       MAX(lot_quantity - reserved_quantity) as unreserved
+                FROM lots
+                GROUP BY lot_number
+            )
+            SELECT 'product' as check_name, 'Product does not exist' as detail
+            FROM req
+            WHERE NOT EXISTS (SELECT 1 FROM Product p WHERE p.id = req.product_id)
+            UNION ALL
+            SELECT 'ownership', 'Manufacturer does not own this product'
+            FROM req
+            WHERE NOT EXISTS (
+                SELECT 1 FROM ManufacturerProduct mp
+                WHERE mp.manufacturer_id = req.manufacturer_id AND mp.product_id = req.product_id
+            )
+            UNION ALL
+            SELECT 'standard_units',
+                   CONCAT('Produced quantity must be a positive multiple of ', p.standard_batch_units)
+            FROM req
+            JOIN Product p ON p.id = req.product_id
+            WHERE req.produced_quantity <= 0
+            OR MOD(req.produced_quantity, p.standard_batch_units) <> 0
+            UNION ALL
+            SELECT 'dates', 'Expiration date must be after production date'
+            FROM req
+            WHERE req.expiration_date <= req.production_date
+            UNION ALL
+            SELECT 'batch', CONCAT('Product lot ', pb.lot_number, ' already exists')
+            FROM req
+            JOIN ProductBatch pb
+                ON pb.lot_number = CONCAT(req.product_id, '-', req.manufacturer_id, '-', req.batch_id)
+            UNION ALL
+            SELECT 'plan', 'Recipe plan does not belong to this product'
+            FROM req
+            WHERE req.plan_id IS NOT NULL
+            AND NOT EXISTS (
+                SELECT 1 FROM RecipePlan rp
+                WHERE rp.plan_id = req.plan_id AND rp.product_id = req.product_id
+            )
+            UNION ALL
+            SELECT 'lot', CONCAT('Lot ', l.lot_number, ' does not exist')
+            FROM lots l
+            WHERE l.ingredient_id IS NULL
+            UNION ALL
+            SELECT 'quantity', CONCAT('Quantity for lot ', l.lot_number, ' must be positive')
+            FROM lots l
+            WHERE l.quantity <= 0
+            UNION ALL
+            SELECT 'expiry', CONCAT('Lot ', l.lot_number, ' has expired')
+            FROM lots l
+            WHERE l.status = 'EXPIRED' OR l.expiration_date < CURDATE()
+            UNION ALL
+            SELECT 'sufficiency',
+                   CONCAT('Lot ', u.lot_number, ' has ', u.unreserved, ' oz unreserved, ',
+                          u.free_quantity, ' oz requested')
+            FROM lot_use u
+            WHERE u.free_quantity > u.unreserved + {QUANTITY_TOLERANCE}
+            UNION ALL
+            SELECT 'reservation', CONCAT('Reservation ', l.reservation_id, ' cannot cover lot ',
+                                         l.lot_number, ' for ', l.quantity, ' oz')
+            FROM lots l
+            CROSS JOIN req
+            LEFT JOIN LotReservation lr ON lr.reservation_id = l.reservation_id
+            WHERE l.reservation_id IS NOT NULL
+            AND (lr.reservation_id IS NULL
+                 OR lr.status <> 'OPEN'
+                 OR lr.expires_at <= NOW()
+                 OR lr.manufacturer_id <> req.manufacturer_id
+                 OR lr.lot_number <> l.lot_number
+                 OR l.quantity > lr.quantity + {QUANTITY_TOLERANCE})
+            UNION ALL
+            SELECT 'coverage',
+                   CONCAT(i.name, ': ', COALESCE(SUM(l.quantity), 0), ' oz allocated, ',
+                          rb.quantity * req.produced_quantity, ' oz required')
+            FROM bom_plan
+            CROSS JOIN req
+            JOIN RecipePlanBOM rb ON rb.plan_id = bom_plan.plan_id
+            JOIN Ingredient i ON i.id = rb.ingredient_id
+            LEFT JOIN lots l ON l.ingredient_id = rb.ingredient_id
+            GROUP BY rb.ingredient_id, i.name, rb.quantity, req.produced_quantity
+            HAVING COALESCE(SUM(l.quantity), 0) < rb.quantity * req.produced_quantity - {QUANTITY_TOLERANCE}
+            UNION ALL
+            SELECT 'recipe', CONCAT('Lot ', l.lot_number, ' is not an ingredient of the recipe plan')
+            FROM lots l
+            CROSS JOIN bom_plan
+            WHERE l.ingredient_id IS NOT NULL
+            AND bom_plan.plan_id IS NOT NULL
+            AND NOT EXISTS (
+                SELECT 1 FROM RecipePlanBOM rb
+                WHERE rb.plan_id = bom_plan.plan_id AND rb.ingredient_id = l.ingredient_id
+            )
+            UNION ALL
+            SELECT DISTINCT 'incompatibility',
+                   CONCAT('Ingredients ', ia.name, ' and ', ib.name, ' cannot be combined')
+            FROM (SELECT DISTINCT ingredient_id FROM lots WHERE ingredient_id IS NOT NULL) a
+            JOIN (SELECT DISTINCT ingredient_id FROM lots WHERE ingredient_id IS NOT NULL) b
+                ON a.ingredient_id < b.ingredient_id
+            JOIN IngredientIncompatibility ii
+                ON (ii.ingredient_a = a.ingredient_id AND ii.ingredient_b = b.ingredient_id)
+                OR (ii.ingredient_a = b.ingredient_id AND ii.ingredient_b = a.ingredient_id)
+            JOIN Ingredient ia ON ia.id = a.ingredient_id
+            JOIN Ingredient ib ON ib.id = b.ingredient_id
+        """
+        rows = self.db.execute(query, params)
+        return [{'check': r['check_name'], 'detail': r['detail']} for r in rows]
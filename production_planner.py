@@ -0,0 +1,196 @@
+from datetime import datetime, timedelta
+from database import Database
+from expiry_sweeper import DEFAULT_WINDOW_DAYS
+from fefo_allocator import EPSILON
+
+class ProductionPlan:
+    """Result of ProductionPlanner.plan
+    
+    batches: one row per demand line that can be (partly) produced
+    shortages: one row per (demand line, ingredient) that blocks batches
+    infeasible: demand lines that cannot be produced at all, with reason
+    ingredient_shortages: missing oz per ingredient over the whole plan
+        (what the short lines still need less the stock left over)
+    material_shortages: compound shortages exploded to leaf materials
+    expiring_allocated: allocated oz per ingredient that sits in lots
+        expiring soon after the production date (consume those first)
+    """
+    
+    def __init__(self):
+        self.batches = []
+        self.shortages = []
+        self.infeasible = []
+        self.ingredient_shortages = {}
+        self.material_shortages = {}
+        self.expiring_allocated = {}
+
+class ProductionPlanner:
+    """Material requirements planning over recipe BOMs and inventory
+    
+    Demand lines are expanded through the latest recipe plan BOM of each
+    product, rounded up to whole standard batches and netted, in demand
+    order, against the usable unreserved stock. A line gets as many whole
+    batches as the remaining stock covers; the rest is reported as
+    shortages, with compound shortages also exploded into the leaf
+    materials a supplier would need.
+    
+    The planner works on plain dicts, so it can be built from the database
+    (from_database) or from prepared data.
+    """
+    
+    def __init__(self, products, boms, available, conflicting_products=(),
+                 closure=None, expiring=None):
+        # products: {product_id: {'name', 'standard_batch_units'}}
+        # boms: {product_id: {ingredient_id: oz per unit}}
+        # available: {ingredient_id: usable oz}
+        # closure: {compound_id: {leaf_id: oz per oz of compound}}
+        # expiring: {ingredient_id: usable oz expiring soon}
+        self.products = products
+        self.boms = boms
+        self.available = available
+        self.conflicting_products = set(conflicting_products)
+        self.closure = closure or {}
+        self.expiring = expiring or {}
+    
+    @classmethod
+    def from_database(cls, db: Database, production_date=None, window_days=DEFAULT_WINDOW_DAYS):
+        """Load products, latest plan BOMs, usable stock and conflicts
+        
+        Lots that expire before production_date (default today) are not
+        usable; lots expiring within window_days after it are reported
+        in expiring_allocated.
+        """
+        production_date = production_date or datetime.now().date()
+        
+        products = {
+            r['id']: r for r in db.execute(
+                "SELECT id, name, standard_batch_units FROM Product")
+        }
+        
+        boms = {}
+        bom_query = """
+            SELECT rp.product_id, rb.ingredient_id, rb.quantity
+            FROM RecipePlan rp
+            JOIN RecipePlanBOM rb ON rb.plan_id = rp.plan_id
+            WHERE rp.version_number = (
+                SELECT MAX(r2.version_number) FROM RecipePlan r2
+                WHERE r2.product_id = rp.product_id
+            )
+        """
+        for r in db.execute(bom_query):
+            boms.setdefault(r['product_id'], {})[r['ingredient_id']] = r['quantity']
+        
+        stock_query = """
+            SELECT ingredient_id,
+                   SUM(quantity - reserved_quantity) as available_quantity,
+                   SUM(CASE WHEN expiration_date <= %s
+                            THEN quantity - reserved_quantity ELSE 0 END) as expiring_quantity
+            FROM IngredientBatch
+            WHERE status = 'LIVE'
+            AND expiration_date >= %s
+            AND quantity - reserved_quantity > 0
+            GROUP BY ingredient_id
+        """
+        available = {}
+        expiring = {}
+        stock = db.execute(stock_query, (production_date + timedelta(days=window_days),
+                                         production_date))
+        for r in stock:
+            available[r['ingredient_id']] = r['available_quantity']
+            if r['expiring_quantity']:
+                expiring[r['ingredient_id']] = r['expiring_quantity']
+        
+        # Products whose own recipe contains an incompatible pair
+        conflicting = [r['product_a'] for r in db.execute(
+            "SELECT DISTINCT product_a FROM ProductConflict WHERE product_a = product_b")]
+        
+        closure = {}
+        closure_query = """
+            SELECT ancestor_id, descendant_id, quantity
+            FROM IngredientClosure
+            WHERE is_leaf AND depth > 0
+        """
+        for r in db.execute(closure_query):
+            closure.setdefault(r['ancestor_id'], {})[r['descendant_id']] = r['quantity']
+        
+        return cls(products, boms, available, conflicting, closure, expiring)
+    
+    def plan(self, demand):
+        """Plan [(product_id, quantity), ...] in priority order and return a ProductionPlan"""
+        result = ProductionPlan()
+        remaining = dict(self.available)
+        allocated = {}
+        # Oz the unproduced batches of short lines need, per ingredient
+        unmet = {}
+        
+        for product_id, quantity in demand:
+            product = self.products.get(product_id)
+            reason = None
+            if product is None:
+                reason = 'Unknown product'
+            elif product_id in self.conflicting_products:
+                reason = 'Recipe contains incompatible ingredients'
+            elif not self.boms.get(product_id):
+                reason = 'No recipe plan'
+            elif not product['standard_batch_units'] or product['standard_batch_units'] <= 0:
+                reason = 'Invalid standard batch size'
+            elif quantity <= 0:
+                reason = 'Quantity must be positive'
+            if reason:
+                result.infeasible.append({'product_id': product_id, 'quantity': quantity,
+                                          'reason': reason})
+                continue
+            
+            standard = product['standard_batch_units']
+            batches_needed = int(-(-quantity // standard))
+            per_batch = {i: q * standard for i, q in self.boms[product_id].items() if q > 0}
+            
+            # Whole batches the remaining stock covers for every ingredient
+            feasible = batches_needed
+            for ingredient_id, need in per_batch.items():
+                feasible = min(feasible, int((remaining.get(ingredient_id, 0) + EPSILON) // need))
+            
+            if feasible > 0:
+                for ingredient_id, need in per_batch.items():
+                    remaining[ingredient_id] = remaining.get(ingredient_id, 0) - need * feasible
+                    allocated[ingredient_id] = allocated.get(ingredient_id, 0) + need * feasible
+                result.batches.append({
+                    'product_id': product_id,
+                    'product_name': product['name'],
+                    'requested_quantity': quantity,
+                    'batch_count': feasible,
+                    'quantity': feasible * standard,
+                })
+            
+            if feasible < batches_needed:
+                missing_batches = batches_needed - feasible
+                for ingredient_id, need in per_batch.items():
+                    unmet[ingredient_id] = unmet.get(ingredient_id, 0) + need * missing_batches
+                    short = need * missing_batches - max(remaining.get(ingredient_id, 0), 0)
+                    if short <= EPSILON:
+                        continue
+                    result.shortages.append({
+                        'product_id': product_id,
+                        'ingredient_id': ingredient_id,
+                        'short_quantity': short,
+                        'missing_batches': missing_batches,
+                    })
+        
+        # A line's short_quantity is netted against all the stock left at
+        # that line; over the plan, leftover stock is netted only once
+        for ingredient_id, need in unmet.items():
+            short = need - max(remaining.get(ingredient_id, 0), 0)
+            if short > EPSILON:
+                result.ingredient_shortages[ingredient_id] = short
+        
+        for ingredient_id, short in result.ingredient_shortages.items():
+            for leaf_id, share in self.closure.get(ingredient_id, {}).items():
+                result.material_shortages[leaf_id] = (
+                    result.material_shortages.get(leaf_id, 0) + short * share)
+        
+        for ingredient_id, quantity in allocated.items():
+            expiring = self.expiring.get(ingredient_id, 0)
+            if expiring > 0:
+                result.expiring_allocated[ingredient_id] = min(expiring, quantity)
+        
+        return result
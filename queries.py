@@ -1,8 +1,12 @@
 from database import Database
+from metrics import action
 
 class Queries:
-    def __init__(self, db: Database):
+    def __init__(self, db: Database, shards=None):
         self.db = db
+        # sharding.ShardRouter: manufacturer queries run on the manufacturer's
+        # shard and query 5 on every shard
+        self.shards = shards
     
     def menu(self):
         """Queries menu"""
@@ -32,66 +36,31 @@ class Queries:
             else:
                 print("Invalid option")
     
+    @action
     def query1(self):
         """List ingredients and lot number of last batch of product type Steak Dinner (100) made by manufacturer MFG001"""
         print("\n=== Query 1: Last batch of Steak Dinner (100) by MFG001 ===")
         
-        # Get the latest batch first
-        batch_query = """
-            SELECT lot_number, production_date
-            FROM ProductBatch
-            WHERE product_id = 100 AND manufacturer_id = 'MFG001'
-            ORDER BY production_date DESC, batch_id DESC
-            LIMIT 1
-        """
-        batch_result = self.db.execute(batch_query)
+        batch, ingredients = self._on('MFG001').last_batch_ingredients(100, 'MFG001')
         
-        if not batch_result:
+        if not batch:
             print("No batches found for Steak Dinner (100) by MFG001")
             return
         
-        lot_number = batch_result[0]['lot_number']
-        production_date = batch_result[0]['production_date']
-        
-        print(f"Product Lot Number: {lot_number}")
-        print(f"Production Date: {production_date}")
-        
-        # Get ingredients and their lot numbers
-        query = """
-            SELECT i.name as ingredient_name, 
-                   ic.ingredient_lot_number,
-                   ic.consumed_quantity_oz
-            FROM IngredientConsumption ic
-            JOIN IngredientBatch ib ON ic.ingredient_lot_number = ib.lot_number
-            JOIN Ingredient i ON ib.ingredient_id = i.id
-            WHERE ic.product_lot_number = %s
-            ORDER BY i.name
-        """
-        ingredients = self.db.execute(query, (lot_number,))
+        print(f"Product Lot Number: {batch['lot_number']}")
+        print(f"Production Date: {batch['production_date']}")
         
         print("\nIngredients used:")
         for ing in ingredients:
             print(f"  {ing['ingredient_name']}: Lot {ing['ingredient_lot_number']} "
                   f"({ing['consumed_quantity_oz']} oz)")
     
+    @action
     def query2(self):
         """For manufacturer MFG002, list all suppliers and total amount spent"""
         print("\n=== Query 2: Suppliers and Total Spent by MFG002 ===")
         
-        query = """
-            SELECT u.id as supplier_id, 
-                   CONCAT(u.first_name, ' ', COALESCE(u.last_name, '')) as supplier_name,
-                   SUM(ic.consumed_quantity_oz * ib.per_unit_cost) as total_spent
-            FROM ProductBatch pb
-            JOIN IngredientConsumption ic ON pb.lot_number = ic.product_lot_number
-            JOIN IngredientBatch ib ON ic.ingredient_lot_number = ib.lot_number
-            JOIN UserDetails u ON ib.supplier_id = u.id
-            WHERE pb.manufacturer_id = 'MFG002'
-            GROUP BY u.id, u.first_name, u.last_name
-            ORDER BY total_spent DESC
-        """
-        
-        results = self.db.execute(query)
+        results = self._on('MFG002').supplier_spend('MFG002')
         
         if not results:
             print("No suppliers found or no purchases made by MFG002")
@@ -108,29 +77,16 @@ class Queries:
                 print()
             print(f"Grand Total: ${total_all:.2f}")
     
+    @action
     def query3(self):
         """Find unit cost for product lot 100-MFG001-B0901"""
         print("\n=== Query 3: Unit Cost for 100-MFG001-B0901 ===")
         
-        query = """
-            SELECT pb.lot_number, 
-                   p.name as product_name,
-                   pb.unit_cost, 
-                   pb.batch_total_cost, 
-                   pb.produced_quantity,
-                   pb.production_date,
-                   pb.expiration_date
-            FROM ProductBatch pb
-            JOIN Product p ON pb.product_id = p.id
-            WHERE pb.lot_number = '100-MFG001-B0901'
-        """
-        
-        results = self.db.execute(query)
+        r = self._on('MFG001').lot_unit_cost('100-MFG001-B0901')
         
-        if not results:
+        if not r:
             print("Lot number 100-MFG001-B0901 not found")
         else:
-            r = results[0]
             print(f"Lot Number: {r['lot_number']}")
             print(f"Product: {r['product_name']}")
             print(f"Unit Cost: ${r['unit_cost']:.2f}")
@@ -139,33 +95,137 @@ class Queries:
             print(f"Production Date: {r['production_date']}")
             print(f"Expiration Date: {r['expiration_date']}")
     
+    @action
     def query4(self):
         """Based on ingredients in product lot 100-MFG001-B0901, find conflicting ingredients"""
         print("\n=== Query 4: Conflicting Ingredients for 100-MFG001-B0901 ===")
         
-        # First, get all ingredients currently in the product batch
-        current_ingredients_query = """
-            SELECT DISTINCT ib.ingredient_id, i.name as ingredient_name
-            FROM IngredientConsumption ic
-            JOIN IngredientBatch ib ON ic.ingredient_lot_number = ib.lot_number
-            JOIN Ingredient i ON ib.ingredient_id = i.id
-            WHERE ic.product_lot_number = '100-MFG001-B0901'
-        """
-        current_ingredients = self.db.execute(current_ingredients_query)
+        current_ingredients, conflicts = self._on('MFG001').lot_conflicts('100-MFG001-B0901')
         
         if not current_ingredients:
             print("No ingredients found for this product lot")
             return
         
         print("Current ingredients in the batch:")
-        current_ids = []
         for ing in current_ingredients:
-            current_ids.append(ing['ingredient_id'])
             print(f"  {ing['ingredient_id']}: {ing['ingredient_name']}")
         
+        print("\nIngredients that CANNOT be included (conflicts):")
+        if not conflicts:
+            print("  No conflicting ingredients found")
+        else:
+            for c in conflicts:
+                print(f"  {c['conflicting_ingredient_id']}: {c['conflicting_ingredient_name']}")
+    
+    @action
+    def query5(self):
+        """Which manufacturers has supplier James Miller (21) NOT supplied to?"""
+        print("\n=== Query 5: Manufacturers NOT supplied by James Miller (21) ===")
+        
+        if self.shards:
+            results = self.shards.manufacturers_not_supplied_by('21')
+        else:
+            results = self.manufacturers_not_supplied_by('21')
+        
+        if not results:
+            print("All manufacturers have been supplied by supplier 21 (James Miller)")
+        else:
+            print(f"Manufacturers NOT supplied by supplier 21:")
+            for r in results:
+                print(f"  {r['manufacturer_id']}: {r['manufacturer_name']}")
+    
+    def _on(self, manufacturer_id):
+        # Queries against the manufacturer's shard (this database when unsharded)
+        if self.shards:
+            return Queries(self.shards.db_for(manufacturer_id))
+        return self
+    
+    # The queries behind the reports; they only read and return rows, so
+    # they can also be run concurrently through AsyncDatabase.run
+    
+    def last_batch_ingredients(self, product_id, manufacturer_id):
+        """Latest batch of a product by a manufacturer and the ingredient lots it used
+        
+        Returns (batch row, ingredient rows), or (None, []) if there is no batch.
+        """
+        # Get the latest batch first
+        batch_query = """
+            SELECT lot_number, production_date
+            FROM ProductBatch
+            WHERE product_id = %s AND manufacturer_id = %s
+            ORDER BY production_date DESC, batch_id DESC
+            LIMIT 1
+        """
+        batch_result = self.db.execute(batch_query, (product_id, manufacturer_id))
+        
+        if not batch_result:
+            return None, []
+        
+        # Get ingredients and their lot numbers
+        query = """
+            SELECT i.name as ingredient_name, 
+                   ic.ingredient_lot_number,
+                   ic.consumed_quantity_oz
+            FROM IngredientConsumption ic
+            JOIN IngredientBatch ib ON ic.ingredient_lot_number = ib.lot_number
+            JOIN Ingredient i ON ib.ingredient_id = i.id
+            WHERE ic.product_lot_number = %s
+            ORDER BY i.name
+        """
+        ingredients = self.db.execute(query, (batch_result[0]['lot_number'],))
+        return batch_result[0], ingredients
+    
+    def supplier_spend(self, manufacturer_id):
+        """Suppliers of a manufacturer with the total spent on their lots"""
+        query = """
+            SELECT u.id as supplier_id, 
+                   CONCAT(u.first_name, ' ', COALESCE(u.last_name, '')) as supplier_name,
+                   SUM(ic.consumed_quantity_oz * ib.per_unit_cost) as total_spent
+            FROM ProductBatch pb
+            JOIN IngredientConsumption ic ON pb.lot_number = ic.product_lot_number
+            JOIN IngredientBatch ib ON ic.ingredient_lot_number = ib.lot_number
+            JOIN UserDetails u ON ib.supplier_id = u.id
+            WHERE pb.manufacturer_id = %s
+            GROUP BY u.id, u.first_name, u.last_name
+            ORDER BY total_spent DESC
+        """
+        return self.db.execute(query, (manufacturer_id,))
+    
+    def lot_unit_cost(self, lot_number):
+        """Cost details of a product lot, or None if it does not exist"""
+        query = """
+            SELECT pb.lot_number, 
+                   p.name as product_name,
+                   pb.unit_cost, 
+                   pb.batch_total_cost, 
+                   pb.produced_quantity,
+                   pb.production_date,
+                   pb.expiration_date
+            FROM ProductBatch pb
+            JOIN Product p ON pb.product_id = p.id
+            WHERE pb.lot_number = %s
+        """
+        results = self.db.execute(query, (lot_number,))
+        return results[0] if results else None
+    
+    def lot_conflicts(self, lot_number):
+        """Ingredients of a product lot and the ingredients that conflict with them
+        
+        Returns (current ingredient rows, conflicting ingredient rows).
+        """
+        # First, get all ingredients currently in the product batch
+        current_ingredients_query = """
+            SELECT DISTINCT ib.ingredient_id, i.name as ingredient_name
+            FROM IngredientConsumption ic
+            JOIN IngredientBatch ib ON ic.ingredient_lot_number = ib.lot_number
+            JOIN Ingredient i ON ib.ingredient_id = i.id
+            WHERE ic.product_lot_number = %s
+        """
+        current_ingredients = self.db.execute(current_ingredients_query, (lot_number,))
+        
+        current_ids = [ing['ingredient_id'] for ing in current_ingredients]
         if not current_ids:
-            print("No ingredients to check conflicts for")
-            return
+            return current_ingredients, []
         
         # Find all ingredients that conflict with any current ingredient
         # but are NOT already in the batch
@@ -192,19 +252,10 @@ class Queries:
         
         # Execute with parameters
         params = current_ids * 7  # Used 7 times in the query
-        conflicts = self.db.execute(conflict_query, params)
-        
-        print("\nIngredients that CANNOT be included (conflicts):")
-        if not conflicts:
-            print("  No conflicting ingredients found")
-        else:
-            for c in conflicts:
-                print(f"  {c['conflicting_ingredient_id']}: {c['conflicting_ingredient_name']}")
+        return current_ingredients, self.db.execute(conflict_query, params)
     
-    def query5(self):
-        """Which manufacturers has supplier James Miller (21) NOT supplied to?"""
-        print("\n=== Query 5: Manufacturers NOT supplied by James Miller (21) ===")
-        
+    def manufacturers_not_supplied_by(self, supplier_id):
+        """Manufacturers that have never used a lot from the supplier"""
         query = """
             SELECT DISTINCT u.id as manufacturer_id, 
                    CONCAT(u.first_name, ' ', COALESCE(u.last_name, '')) as manufacturer_name
@@ -215,19 +266,8 @@ class Queries:
                 FROM ProductBatch pb
                 JOIN IngredientConsumption ic ON pb.lot_number = ic.product_lot_number
                 JOIN IngredientBatch ib ON ic.ingredient_lot_number = ib.lot_number
-                WHERE ib.supplier_id = '21'
+                WHERE ib.supplier_id = %s
             )
             ORDER BY u.id
         """
-        
-        results = self.db.execute(query)
-        
-        if not results:
-            print("All manufacturers have been supplied by supplier 21 (James Miller)")
-        else:
-            print(f"Manufacturers NOT supplied by supplier 21:")
-            for r in results:
-                print(f"  {r['manufacturer_id']}: {r['manufacturer_name']}")
-
-
-
+        return self.db.execute(query, (supplier_id,))
\ No newline at end of file
@@ -0,0 +1,84 @@
+import csv
+import json
+import os
+from datetime import datetime
+from database import Database
+from traceability import TraceabilityEngine
+
+# Columns written for every affected product lot
+REPORT_COLUMNS = [
+    'lot_number', 'product_id', 'product_name', 'manufacturer_id', 'manufacturer_name',
+    'produced_quantity', 'production_date', 'expiration_date',
+    'batch_total_cost', 'unit_cost', 'implicated_quantity_oz', 'implicated_lots'
+]
+
+class RecallReport:
+    """Streams a forward recall trace into CSV and JSON-lines files
+    
+    Affected lots are read from the server in chunks and written as they
+    arrive; only the per-manufacturer and per-product aggregates are kept
+    in memory.
+    """
+    
+    def __init__(self, db: Database, chunk_size=5000):
+        self.db = db
+        self.chunk_size = chunk_size
+        self.engine = TraceabilityEngine(db)
+    
+    def export(self, kind, key, start_date=None, end_date=None, out_dir='.'):
+        """Write <base>.csv, <base>.jsonl and <base>_summary.json; return the summary"""
+        query, params = self.engine.forward_query(kind, key, start_date, end_date)
+        
+        os.makedirs(out_dir, exist_ok=True)
+        stamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+        safe_key = ''.join(ch if ch.isalnum() or ch in '-_' else '_' for ch in str(key))
+        base = os.path.join(out_dir, f"recall_{kind}_{safe_key}_{stamp}")
+        
+        by_manufacturer = {}
+        by_product = {}
+        totals = {'lots': 0, 'produced_quantity': 0.0, 'downstream_cost': 0.0}
+        
+        with open(base + '.csv', 'w', newline='', encoding='utf-8') as csv_file, \
+                open(base + '.jsonl', 'w', encoding='utf-8') as jsonl_file:
+            writer = csv.DictWriter(csv_file, fieldnames=REPORT_COLUMNS, extrasaction='ignore')
+            writer.writeheader()
+            
+            for rows in self.db.execute_iter(query, params, self.chunk_size):
+                writer.writerows(rows)
+                jsonl_file.writelines(json.dumps(r, default=str) + '\n' for r in rows)
+                
+                for r in rows:
+                    cost = r['batch_total_cost'] or 0
+                    quantity = r['produced_quantity'] or 0
+                    self._add(by_manufacturer, r['manufacturer_id'],
+                              {'manufacturer_name': r['manufacturer_name'].strip()}, quantity, cost)
+                    self._add(by_product, r['product_id'],
+                              {'product_name': r['product_name']}, quantity, cost)
+                    totals['lots'] += 1
+                    totals['produced_quantity'] += quantity
+                    totals['downstream_cost'] += cost
+        
+        summary = {
+            'trace': {'kind': kind, 'key': key,
+                      'start_date': start_date, 'end_date': end_date},
+            'generated_at': datetime.now(),
+            'totals': totals,
+            'by_manufacturer': by_manufacturer,
+            'by_product': by_product,
+            'files': {'csv': base + '.csv', 'jsonl': base + '.jsonl',
+                      'summary': base + '_summary.json'}
+        }
+        with open(base + '_summary.json', 'w', encoding='utf-8') as summary_file:
+            json.dump(summary, summary_file, default=str, indent=2)
+        return summary
+    
+    @staticmethod
+    def _add(groups, group_key, labels, quantity, cost):
+        """Accumulate one affected lot into a summary group"""
+        group = groups.get(str(group_key))
+        if group is None:
+            group = dict(labels, lots=0, produced_quantity=0.0, downstream_cost=0.0)
+            groups[str(group_key)] = group
+        group['lots'] += 1
+        group['produced_quantity'] += quantity
+        group['downstream_cost'] += cost
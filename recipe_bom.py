@@ -0,0 +1,45 @@
+from database import Database
+
+# plan_id -> BOM rows of that plan version
+# Snapshots never change once written, so entries are never invalidated
+_plan_bom_cache = {}
+
+class RecipeBOM:
+    """Access to the immutable per-version BOM snapshots in RecipePlanBOM"""
+    
+    def __init__(self, db: Database):
+        self.db = db
+    
+    def latest_plan(self, product_id):
+        """Latest RecipePlan row of a product, or None"""
+        query = """
+            SELECT plan_id, version_number
+            FROM RecipePlan
+            WHERE product_id = %s
+            ORDER BY version_number DESC
+            LIMIT 1
+        """
+        result = self.db.execute(query, (product_id,))
+        return result[0] if result else None
+    
+    def snapshot(self, plan_id):
+        """Freeze the product's current BOM as the BOM of plan_id"""
+        self.db.execute_procedure('SnapshotRecipePlan', (plan_id,))
+    
+    def plan_bom(self, plan_id):
+        """BOM rows (ingredient_id, name, type, quantity) of a plan version"""
+        if plan_id in _plan_bom_cache:
+            return _plan_bom_cache[plan_id]
+        
+        query = """
+            SELECT rb.ingredient_id, i.name, i.type, rb.quantity
+            FROM RecipePlanBOM rb
+            JOIN Ingredient i ON rb.ingredient_id = i.id
+            WHERE rb.plan_id = %s
+            ORDER BY rb.quantity DESC, i.name
+        """
+        rows = self.db.execute(query, (plan_id,))
+        # An empty result may be a plan whose snapshot is not written yet
+        if rows:
+            _plan_bom_cache[plan_id] = rows
+        return rows
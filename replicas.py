@@ -0,0 +1,197 @@
+import os
+import time
+import mysql.connector
+from mysql.connector import Error
+from row_formats import format_rows
+from statement_cache import StatementCache
+
+# Seconds an unreachable replica is skipped before it is tried again
+REPLICA_RETRY_SECONDS = 30
+
+# Seconds a measured replication lag is trusted before it is checked again
+# (the check also proves the replica connection is still alive)
+LAG_CHECK_SECONDS = 1.0
+
+# Reads that depend on the session (variables, ids, locks) and so must run
+# on the primary connection that made them
+PRIMARY_ONLY_MARKERS = ('@', 'LAST_INSERT_ID', 'CONNECTION_ID', 'FOUND_ROWS', 'ROW_COUNT',
+                        'GET_LOCK', 'FOR UPDATE', 'FOR SHARE', 'LOCK IN SHARE MODE')
+
+class Replica:
+    """One read-only replica endpoint, with its own connection and statement cache"""
+    
+    def __init__(self, host, port, cache_size):
+        self.host = host
+        self.port = port
+        self.connection = None
+        self.cursor = None
+        self.tuple_cursor = None
+        self.statements = StatementCache(cache_size)
+        self.lag = None
+        self.down_until = 0.0
+        self._lag_checked = 0.0
+    
+    @property
+    def name(self):
+        return f"{self.host}:{self.port}"
+    
+    def connect(self):
+        """Open a fresh connection (no retries: reads fall back to the primary)
+        
+        Autocommit, so each read is its own transaction: under REPEATABLE
+        READ an open one would keep serving its first read's snapshot.
+        """
+        self.close()
+        self.connection = mysql.connector.connect(
+            host=self.host,
+            port=self.port,
+            database=os.getenv('DB_NAME', 'inventory_management'),
+            user=os.getenv('DB_USER', 'root'),
+            password=os.getenv('DB_PASSWORD', ''),
+            connection_timeout=5,
+            autocommit=True
+        )
+        self.cursor = self.connection.cursor(dictionary=True)
+        self.tuple_cursor = self.connection.cursor()
+        self._lag_checked = 0.0
+    
+    def execute(self, query, params, row_format):
+        """Run a read and return its rows in row_format (as Database.execute)"""
+        if self.statements.cacheable(query, params):
+            cursor = self.statements.execute(self.connection, query, params)
+        else:
+            cursor = self.cursor if row_format == 'dict' else self.tuple_cursor
+            if params:
+                cursor.execute(query, params)
+            else:
+                cursor.execute(query)
+        if cursor is self.cursor:
+            return cursor.fetchall()
+        return format_rows(cursor.fetchall(), cursor.column_names, row_format)
+    
+    def current_lag(self):
+        """Seconds behind the primary (checked at most every LAG_CHECK_SECONDS)
+        
+        None when replication is stopped or the server is not a replica.
+        """
+        now = time.monotonic()
+        if now - self._lag_checked < LAG_CHECK_SECONDS:
+            return self.lag
+        self.lag = None
+        for statement, column in (("SHOW REPLICA STATUS", 'Seconds_Behind_Source'),
+                                  ("SHOW SLAVE STATUS", 'Seconds_Behind_Master')):
+            try:
+                self.cursor.execute(statement)
+            except Error as e:
+                # Servers before 8.0.22 only know SHOW SLAVE STATUS
+                if e.errno == 1064:
+                    continue
+                raise
+            rows = self.cursor.fetchall()
+            if rows:
+                self.lag = rows[0].get(column)
+            break
+        self._lag_checked = now
+        return self.lag
+    
+    def close(self):
+        self.statements.clear()
+        if self.connection is not None:
+            try:
+                self.connection.close()
+            except Error:
+                # Already dead; nothing to close on the server
+                pass
+        self.connection = None
+        self.cursor = None
+        self.tuple_cursor = None
+
+class ReplicaRouter:
+    """Picks the replica for each read of a Database
+    
+    Replicas come from DB_REPLICA_HOSTS (comma separated host[:port],
+    same database and credentials as the primary) and are used round
+    robin. A replica more than max_lag seconds behind (DB_REPLICA_MAX_LAG,
+    default 5; -1 skips the check for servers that cannot report lag),
+    with replication stopped, or unreachable is skipped, and when none is
+    usable the read goes to the primary. After a write, reads stay on the
+    primary for sticky_seconds (DB_REPLICA_STICKY_SECONDS, default 5) so
+    a session reads its own writes.
+    """
+    
+    def __init__(self, hosts, max_lag=5.0, sticky_seconds=5.0, cache_size=64):
+        self.replicas = []
+        for host in hosts:
+            name, _, port = host.partition(':')
+            self.replicas.append(Replica(name, int(port or 3306), cache_size))
+        self.max_lag = max_lag
+        self.sticky_seconds = sticky_seconds
+        self._next = 0
+        self._stats = {
+            'replica_lag_skips': 0,
+            'replica_errors': 0,
+        }
+    
+    @classmethod
+    def from_env(cls, cache_size=64):
+        hosts = [h.strip() for h in os.getenv('DB_REPLICA_HOSTS', '').split(',') if h.strip()]
+        return cls(hosts,
+                   max_lag=float(os.getenv('DB_REPLICA_MAX_LAG', '5')),
+                   sticky_seconds=float(os.getenv('DB_REPLICA_STICKY_SECONDS', '5')),
+                   cache_size=cache_size)
+    
+    def __bool__(self):
+        return bool(self.replicas)
+    
+    @staticmethod
+    def replica_safe(query):
+        """Whether a read can run on another connection than the one that wrote"""
+        upper = query.upper()
+        return not any(marker in upper for marker in PRIMARY_ONLY_MARKERS)
+    
+    def pick(self):
+        """The next connected replica within max_lag, or None for the primary"""
+        now = time.monotonic()
+        for _ in range(len(self.replicas)):
+            replica = self.replicas[self._next]
+            self._next = (self._next + 1) % len(self.replicas)
+            if replica.down_until > now:
+                continue
+            try:
+                lag = self._lag(replica)
+            except Error:
+                # Usually an idle connection the server dropped: one fresh try
+                try:
+                    replica.connect()
+                    lag = self._lag(replica)
+                except Error as e:
+                    self.mark_down(replica, e)
+                    continue
+            if lag is None or lag > self.max_lag:
+                self._stats['replica_lag_skips'] += 1
+                continue
+            return replica
+        return None
+    
+    def mark_down(self, replica, error):
+        """Skip a replica for REPLICA_RETRY_SECONDS after a connection failure"""
+        print(f"Replica {replica.name} unavailable: {error}")
+        replica.close()
+        replica.down_until = time.monotonic() + REPLICA_RETRY_SECONDS
+        self._stats['replica_errors'] += 1
+    
+    def stats(self):
+        stats = dict(self._stats)
+        stats['replica_lag'] = {r.name: r.lag for r in self.replicas}
+        return stats
+    
+    def close(self):
+        for replica in self.replicas:
+            replica.close()
+    
+    def _lag(self, replica):
+        if replica.connection is None:
+            replica.connect()
+        if self.max_lag < 0:
+            return 0
+        return replica.current_lag()
@@ -0,0 +1,152 @@
+from datetime import datetime, timedelta
+from database import Database
+from recipe_bom import RecipeBOM
+
+# Hours an unconverted reservation holds its stock
+DEFAULT_TTL_HOURS = 24
+
+class ReservationManager:
+    """Soft holds on ingredient lots for planned production
+    
+    A reservation lowers the lot's available quantity (quantity minus
+    reserved_quantity) until it is converted into consumption, released
+    or expires. Validation and the reserved totals live in the
+    LotReservation triggers; this class only issues the statements.
+    """
+    
+    def __init__(self, db: Database):
+        self.db = db
+    
+    def reserve(self, manufacturer_id, lot_number, quantity, product_id=None,
+                ttl_hours=DEFAULT_TTL_HOURS):
+        """Reserve quantity oz of a lot and return the reservation id"""
+        def work(db):
+            db.execute("""
+                INSERT INTO LotReservation
+                    (lot_number, manufacturer_id, product_id, quantity, expires_at)
+                VALUES (%s, %s, %s, %s, %s)
+            """, (lot_number, manufacturer_id, product_id, quantity,
+                  datetime.now() + timedelta(hours=ttl_hours)), fetch=False)
+            return db.execute("SELECT LAST_INSERT_ID() as reservation_id")[0]['reservation_id']
+        
+        return self.db.run_transaction(work)
+    
+    def reserve_for_batch(self, manufacturer_id, product_id, produced_quantity,
+                          ttl_hours=DEFAULT_TTL_HOURS):
+        """Reserve FEFO lots for every ingredient of a planned batch
+        
+        Uses the product's latest recipe plan. Either every ingredient is
+        fully reserved or nothing is. Returns the created reservations as
+        (reservation_id, ingredient_id, lot_number, quantity) tuples.
+        """
+        recipe_bom = RecipeBOM(self.db)
+        plan = recipe_bom.latest_plan(product_id)
+        if not plan:
+            raise ValueError("No recipe plan found for this product")
+        bom = recipe_bom.plan_bom(plan['plan_id'])
+        if not bom:
+            raise ValueError("Recipe plan has no ingredients")
+        
+        self.expire_stale()
+        expires_at = datetime.now() + timedelta(hours=ttl_hours)
+        
+        def work(db):
+            created = []
+            for ing in bom:
+                remaining = ing['quantity'] * produced_quantity
+                for lot in self.available_lots(ing['ingredient_id'], db):
+                    if remaining <= 0:
+                        break
+                    use_qty = min(remaining, lot['available_quantity'])
+                    db.execute("""
+                        INSERT INTO LotReservation
+                            (lot_number, manufacturer_id, product_id, quantity, expires_at)
+                        VALUES (%s, %s, %s, %s, %s)
+                    """, (lot['lot_number'], manufacturer_id, product_id, use_qty, expires_at),
+                        fetch=False)
+                    reservation_id = db.execute(
+                        "SELECT LAST_INSERT_ID() as reservation_id")[0]['reservation_id']
+                    created.append((reservation_id, ing['ingredient_id'], lot['lot_number'], use_qty))
+                    remaining -= use_qty
+                
+                if remaining > 1e-9:
+                    # Raising rolls back the reservations made so far
+                    raise ValueError(f"Insufficient available quantity of {ing['name']}: "
+                                     f"short {remaining} oz")
+            return created
+        
+        return self.db.run_transaction(work)
+    
+    def available_lots(self, ingredient_id, db: Database = None):
+        """Live lots of an ingredient with unreserved stock, earliest expiry first"""
+        db = db or self.db
+        query = """
+            SELECT ib.lot_number, ib.quantity, ib.reserved_quantity,
+                   ib.quantity - ib.reserved_quantity as available_quantity,
+                   ib.expiration_date, ib.per_unit_cost
+            FROM IngredientBatch ib
+            WHERE ib.ingredient_id = %s
+            AND ib.status = 'LIVE'
+            AND ib.quantity - ib.reserved_quantity > 0
+            AND ib.expiration_date >= CURDATE()
+            ORDER BY ib.expiration_date ASC, ib.lot_number
+        """
+        return db.execute(query, (ingredient_id,))
+    
+    def open_reservations(self, manufacturer_id, product_id=None, ingredient_id=None):
+        """OPEN, unexpired reservations of a manufacturer, earliest lot expiry first"""
+        conditions = ["lr.manufacturer_id = %s", "lr.status = 'OPEN'", "lr.expires_at > NOW()"]
+        params = [manufacturer_id]
+        if product_id is not None:
+            conditions.append("lr.product_id = %s")
+            params.append(product_id)
+        if ingredient_id is not None:
+            conditions.append("lr.ingredient_id = %s")
+            params.append(ingredient_id)
+        
+        query = f"""
+            SELECT lr.reservation_id, lr.lot_number, lr.ingredient_id,
+                   i.name as ingredient_name, lr.product_id, lr.quantity,
+                   lr.lot_expiration_date, lr.expires_at
+            FROM LotReservation lr
+            JOIN Ingredient i ON lr.ingredient_id = i.id
+            WHERE {' AND '.join(conditions)}
+            ORDER BY lr.lot_expiration_date, lr.reservation_id
+        """
+        return self.db.execute(query, params)
+    
+    def convert(self, reservation_id, product_lot_number, quantity=None):
+        """Consume a reservation into a product batch (quantity None = all of it)"""
+        self.db.execute_procedure('ConvertReservation',
+                                  (reservation_id, product_lot_number, quantity))
+    
+    def mark_converted(self, reservation_id, manufacturer_id, product_lot_number, quantity):
+        """Close an open reservation as converted into a product batch, without consuming
+        
+        For a lot the batch also draws through other reservations or
+        unreserved stock: the caller consumes the lot once for the total
+        after closing its reservations. Returns False unless the
+        reservation is open, unexpired, the manufacturer's and covers
+        quantity.
+        """
+        query = """
+            UPDATE LotReservation
+            SET status = 'CONVERTED', product_lot_number = %s, consumed_quantity_oz = %s
+            WHERE reservation_id = %s AND manufacturer_id = %s AND status = 'OPEN'
+            AND expires_at > NOW() AND %s > 0 AND quantity >= %s
+        """
+        return self.db.execute(query, (product_lot_number, quantity, reservation_id, manufacturer_id,
+                                       quantity, quantity), fetch=False) > 0
+    
+    def release(self, reservation_id, manufacturer_id):
+        """Release an open reservation; returns False if it was not open"""
+        query = """
+            UPDATE LotReservation
+            SET status = 'RELEASED'
+            WHERE reservation_id = %s AND manufacturer_id = %s AND status = 'OPEN'
+        """
+        return self.db.execute(query, (reservation_id, manufacturer_id), fetch=False) > 0
+    
+    def expire_stale(self):
+        """Expire reservations past their TTL or on expired lots"""
+        self.db.execute_procedure('ExpireReservations')
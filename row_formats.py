@@ -0,0 +1,75 @@
+import keyword
+from array import array
+
+# Row formats accepted by Database.execute / execute_iter
+#   dict:     one dict per row (default, what every caller expects)
+#   tuple:    one tuple per row, in column order
+#   record:   one __slots__ object per row (r.name or r['name'])
+#   columnar: {column: values}; all-int / all-float columns are arrays
+ROW_FORMATS = ('dict', 'tuple', 'record', 'columnar')
+
+# column names -> generated record class
+_record_classes = {}
+
+class Record:
+    """Base of the generated record classes; attributes are the columns"""
+    
+    __slots__ = ()
+    
+    def __getitem__(self, name):
+        return getattr(self, name)
+    
+    def _asdict(self):
+        return {name: getattr(self, name) for name in self.__slots__}
+    
+    def __eq__(self, other):
+        return type(self) is type(other) and self._asdict() == other._asdict()
+    
+    def __repr__(self):
+        fields = ', '.join(f"{name}={getattr(self, name)!r}" for name in self.__slots__)
+        return f"Record({fields})"
+
+def record_class(columns):
+    """The record class of a column set (generated once, then cached)
+    
+    Columns that are not valid identifiers (e.g. an unaliased COUNT(*))
+    become col_<position>, and a repeated column name gets _<position>.
+    """
+    columns = tuple(columns)
+    cls = _record_classes.get(columns)
+    if cls is None:
+        names = []
+        for i, c in enumerate(columns):
+            name = c if c.isidentifier() and not keyword.iskeyword(c) else f"col_{i}"
+            names.append(f"{name}_{i}" if name in names else name)
+        body = ''.join(f"    self.{n} = {n}\n" for n in names) or "    pass\n"
+        namespace = {}
+        exec(f"def __init__(self, {', '.join(names)}):\n{body}", namespace)
+        cls = type('Record', (Record,), {'__slots__': tuple(names), '__init__': namespace['__init__']})
+        _record_classes[columns] = cls
+    return cls
+
+def format_rows(rows, columns, row_format):
+    """Convert fetched tuples into row_format"""
+    if row_format == 'tuple':
+        return rows
+    if row_format == 'dict':
+        return [dict(zip(columns, row)) for row in rows]
+    if row_format == 'record':
+        cls = record_class(columns)
+        return [cls(*row) for row in rows]
+    if row_format == 'columnar':
+        return {column: _column_array(values)
+                for column, values in zip(columns, zip(*rows) if rows else [()] * len(columns))}
+    raise ValueError(f"Unknown row format '{row_format}' (expected one of {', '.join(ROW_FORMATS)})")
+
+def _column_array(values):
+    # Typed arrays store numbers unboxed; anything else stays a list
+    if values and all(type(v) is float for v in values):
+        return array('d', values)
+    if values and all(type(v) is int for v in values):
+        try:
+            return array('q', values)
+        except OverflowError:
+            pass
+    return list(values)
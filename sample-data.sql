@@ -77,6 +77,19 @@ VALUES
   (101, 102, 2.0)
 ON DUPLICATE KEY UPDATE quantity = VALUES(quantity);
 
+-- 7b) RecipePlan + frozen BOM snapshot of each plan
+INSERT INTO RecipePlan (plan_id, product_id, version_number, creation_date)
+VALUES
+  (1, 100, 1, '2025-09-01'),
+  (2, 101, 1, '2025-09-01')
+ON DUPLICATE KEY UPDATE creation_date = VALUES(creation_date);
+
+INSERT IGNORE INTO RecipePlanBOM (plan_id, ingredient_id, quantity)
+SELECT rp.plan_id, pb.ingredient_id, pb.quantity
+FROM RecipePlan rp
+JOIN ProductBOM pb ON pb.product_id = rp.product_id
+WHERE rp.plan_id IN (1, 2);
+
 -- 8) IngredientBatch
 -- UPDATED: Expiration dates set to late 2026 to satisfy the "90 days from now" trigger rule.
 -- Current date is assumed to be Nov 2025, so expiration > Feb 2026 is required.
@@ -100,10 +113,10 @@ ON DUPLICATE KEY UPDATE
 -- 9) ProductBatch
 -- Production dates kept in late 2025. Expiration dates pushed to 2026.
 INSERT INTO ProductBatch
-(lot_number, product_id, manufacturer_id, batch_id, produced_quantity, production_date, expiration_date, batch_total_cost, unit_cost)
+(lot_number, product_id, manufacturer_id, batch_id, produced_quantity, production_date, expiration_date, batch_total_cost, unit_cost, plan_id)
 VALUES
-  ('100-MFG001-B0901', 100, 'MFG001', 901, 100, '2025-09-26', '2026-09-26', 0, 0),
-  ('101-MFG002-B0101', 101, 'MFG002', 101, 300, '2025-09-10', '2026-09-10', 0, 0)
+  ('100-MFG001-B0901', 100, 'MFG001', 901, 100, '2025-09-26', '2026-09-26', 0, 0, 1),
+  ('101-MFG002-B0101', 101, 'MFG002', 101, 300, '2025-09-10', '2026-09-10', 0, 0, 2)
 ON DUPLICATE KEY UPDATE
   produced_quantity = VALUES(produced_quantity),
   production_date = VALUES(production_date),
@@ -127,6 +140,9 @@ ON DUPLICATE KEY UPDATE consumed_quantity_oz = VALUES(consumed_quantity_oz);
 CALL RecalculateBatchCost('100-MFG001-B0901');
 CALL RecalculateBatchCost('101-MFG002-B0101');
 
+-- 11b) On-hand summary (normally maintained by triggers)
+CALL RebuildInventorySummary();
+
 -- 12) IngredientIncompatibility
 INSERT INTO IngredientIncompatibility (ingredient_a, ingredient_b)
 VALUES
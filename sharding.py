@@ -0,0 +1,216 @@
+import os
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from database import Database
+from database_setup import DatabaseSetup
+from compatibility import CompatibilityMatrix
+from ingredient_closure import IngredientFlattener
+from manufacturer import Manufacturer
+from supplier import Supplier
+from queries import Queries
+
+# Shared reference data copied from the home database to every shard, in
+# foreign key order (UserDetails too, since tenant rows reference user ids;
+# formulations, since lots for any manufacturer are received against them)
+REFERENCE_TABLES = ('UserDetails', 'Category', 'Ingredient', 'IngredientIncompatibility',
+                    'IngredientFormulation', 'FormulationMaterial')
+
+class Shard:
+    """One shard database: [host[:port]/]database"""
+    
+    def __init__(self, spec):
+        location, _, database = spec.rpartition('/')
+        host, _, port = location.partition(':')
+        self.host = host or None
+        self.port = int(port) if port else None
+        self.database = database
+        self.name = spec
+        self.db = None
+    
+    def connect(self):
+        """The shard's Database (opened on first use)"""
+        if self.db is None:
+            self.db = Database(self.host, self.port, self.database)
+        return self.db
+    
+    def close(self):
+        if self.db is not None:
+            self.db.close()
+            self.db = None
+
+class ShardRouter:
+    """Maps manufacturers to shard databases and routes their work there
+    
+    Shards come from DB_SHARDS, comma separated [host[:port]/]database
+    (a schema on the DB_HOST server when no host is given), so several
+    local schemas are enough to try it:
+        
+        DB_SHARDS=inventory_shard_a,inventory_shard_b
+    
+    A manufacturer lives on the shard given in DB_SHARD_MAP
+    (MFG001=inventory_shard_a,...), otherwise on the shard picked by a
+    stable hash of its id. Hash placement changes when a shard is added,
+    so pin the existing manufacturers in DB_SHARD_MAP first.
+    
+    Every shard has the full schema. The reference data in
+    REFERENCE_TABLES is written only to the home database (DB_NAME) and
+    copied to the shards by sync_reference_data; a manufacturer's products, plans, batches,
+    consumption and reservations, and the supplier lots received for it,
+    live only on its shard. Reads across manufacturers are sent to every
+    shard in parallel and merged (scatter).
+    """
+    
+    def __init__(self, shards, shard_map=None):
+        self.shards = [Shard(spec) for spec in shards]
+        by_name = {s.name: s for s in self.shards}
+        by_name.update({s.database: s for s in self.shards})
+        self.shard_map = {}
+        for manufacturer_id, name in (shard_map or {}).items():
+            if name not in by_name:
+                raise ValueError(f"DB_SHARD_MAP: unknown shard '{name}' for {manufacturer_id}")
+            self.shard_map[manufacturer_id] = by_name[name]
+        self._manufacturers = None
+    
+    @classmethod
+    def from_env(cls):
+        """The router configured by DB_SHARDS / DB_SHARD_MAP, or None without shards"""
+        shards = [s.strip() for s in os.getenv('DB_SHARDS', '').split(',') if s.strip()]
+        if not shards:
+            return None
+        shard_map = {}
+        for entry in os.getenv('DB_SHARD_MAP', '').split(','):
+            if '=' in entry:
+                manufacturer_id, name = entry.split('=', 1)
+                shard_map[manufacturer_id.strip()] = name.strip()
+        return cls(shards, shard_map)
+    
+    def shard_for(self, manufacturer_id):
+        """The shard holding a manufacturer's data"""
+        shard = self.shard_map.get(manufacturer_id)
+        if shard is None:
+            shard = self.shards[zlib.crc32(str(manufacturer_id).encode()) % len(self.shards)]
+        return shard
+    
+    def db_for(self, manufacturer_id):
+        """The Database of a manufacturer's shard"""
+        return self.shard_for(manufacturer_id).connect()
+    
+    def manufacturer(self, manufacturer_id):
+        """The Manufacturer role bound to its shard"""
+        return Manufacturer(self.db_for(manufacturer_id), manufacturer_id)
+    
+    def supplier(self, supplier_id, receiver_id, home: Database):
+        """The Supplier role receiving lots into receiver_id's shard
+        
+        Its reference data writes go to home and are synced to every shard.
+        """
+        return Supplier(self.db_for(receiver_id), supplier_id, reference_db=home,
+                        on_reference_change=lambda ids: self.reference_changed(ids, home))
+    
+    def reference_changed(self, ingredient_ids, source: Database):
+        """Sync reference data after a write at home and refresh the shards' conflict matrices"""
+        self.sync_reference_data(source)
+        self.scatter(lambda db, shard: CompatibilityMatrix(db).refresh_ingredients(ingredient_ids))
+    
+    def scatter(self, work):
+        """Run work(db, shard) on every shard in parallel; results in shard order"""
+        if len(self.shards) == 1:
+            return [work(self.shards[0].connect(), self.shards[0])]
+        with ThreadPoolExecutor(max_workers=len(self.shards)) as pool:
+            futures = [pool.submit(lambda s: work(s.connect(), s), shard) for shard in self.shards]
+            return [f.result() for f in futures]
+    
+    def manufacturers_on(self, shard):
+        """Ids of the manufacturers placed on a shard"""
+        if self._manufacturers is None:
+            # UserDetails is reference data, so any shard has every manufacturer
+            rows = self.shards[0].connect().execute(
+                "SELECT id FROM UserDetails WHERE role_code = 'MANUFACTURER'")
+            self._manufacturers = [r['id'] for r in rows]
+        return {m for m in self._manufacturers if self.shard_for(m) is shard}
+    
+    def manufacturers_not_supplied_by(self, supplier_id):
+        """Queries.manufacturers_not_supplied_by across every shard
+        
+        Each shard answers for the manufacturers placed on it, so every
+        manufacturer is reported once, from its own data.
+        """
+        def work(db, shard):
+            own = self.manufacturers_on(shard)
+            return [r for r in Queries(db).manufacturers_not_supplied_by(supplier_id)
+                    if r['manufacturer_id'] in own]
+        
+        # Load the manufacturer list once, before the shards run in parallel
+        self.manufacturers_on(self.shards[0])
+        rows = [r for part in self.scatter(work) for r in part]
+        return sorted(rows, key=lambda r: r['manufacturer_id'])
+    
+    def sync_reference_data(self, source=None):
+        """Copy REFERENCE_TABLES from the home database to every shard
+        
+        Rows are upserted, so ids stay the same everywhere. Incompatible
+        pairs removed at home are removed from the shards too; other rows
+        are never deleted, since tenant rows may reference them. The
+        ingredient closure of each shard is rebuilt afterwards. Returns
+        {table: rows copied}.
+        """
+        own_source = source is None
+        source = source or Database()
+        try:
+            tables = {}
+            # A replica may not have the write that triggered the sync yet
+            with source.use_primary():
+                for table in REFERENCE_TABLES:
+                    rows = source.execute(f"SELECT * FROM {table}", row_format='columnar')
+                    tables[table] = rows
+        finally:
+            if own_source:
+                source.close()
+        
+        def work(db, shard):
+            def copy(db):
+                for table, columns in tables.items():
+                    names = list(columns)
+                    values = list(zip(*columns.values()))
+                    if not values:
+                        continue
+                    updates = ', '.join(f"{c} = VALUES({c})" for c in names)
+                    db.execute_many(f"""
+                        INSERT INTO {table} ({', '.join(names)})
+                        VALUES ({', '.join(['%s'] * len(names))})
+                        ON DUPLICATE KEY UPDATE {updates}
+                    """, values)
+                pairs = set(zip(tables['IngredientIncompatibility']['ingredient_a'],
+                                tables['IngredientIncompatibility']['ingredient_b']))
+                stale = [(r['ingredient_a'], r['ingredient_b']) for r in db.execute(
+                    "SELECT ingredient_a, ingredient_b FROM IngredientIncompatibility")
+                    if (r['ingredient_a'], r['ingredient_b']) not in pairs]
+                if stale:
+                    db.execute_many("""
+                        DELETE FROM IngredientIncompatibility
+                        WHERE ingredient_a = %s AND ingredient_b = %s
+                    """, stale)
+            
+            db.run_transaction(copy)
+            IngredientFlattener(db).rebuild()
+        
+        self.scatter(work)
+        self._manufacturers = None
+        return {table: len(next(iter(columns.values()), [])) for table, columns in tables.items()}
+    
+    def setup(self):
+        """Drop and recreate every shard schema (with sample data), then sync reference data
+        
+        For local testing: every shard starts from the sample data, and
+        the router only ever reads a manufacturer's rows on its own shard.
+        """
+        self.close()
+        for shard in self.shards:
+            if not DatabaseSetup(shard.host, shard.port, shard.database).setup_database():
+                return False
+        self.sync_reference_data()
+        return True
+    
+    def close(self):
+        for shard in self.shards:
+            shard.close()
@@ -0,0 +1,641 @@
+import itertools
+import os
+import random
+import re
+import sqlite3
+import threading
+import time
+import weakref
+from datetime import date, datetime, timedelta
+from decimal import Decimal
+from functools import lru_cache
+from mysql.connector import errors
+
+# Errors are raised as the mysql.connector errors (and errnos) the MySQL
+# backend produces, so callers handle both backends the same way:
+# 1644 = SIGNAL (trigger / procedure rule), 1062 = duplicate key,
+# 1452 = foreign key, 3819 = check constraint, 1048 = NOT NULL column,
+# 1205 = lock wait timeout, 1317 = query interrupted, 2013 = lost connection
+SIGNAL_ERRNO = 1644
+
+# Seconds a statement waits for another connection's write lock
+BUSY_TIMEOUT_SECONDS = 10.0
+
+# Shown for the server side of an embedded connection
+SERVER_HOST = 'sqlite'
+
+_connection_ids = itertools.count(1)
+_connections = weakref.WeakValueDictionary()
+
+# In-memory databases live as long as one connection to them is open;
+# this one stays open for the life of the process
+_anchors = {}
+
+# Held while a new database is created (see Database.connect)
+setup_lock = threading.RLock()
+
+def location(database):
+    """(sqlite3 path or URI, is in-memory) of a database name
+
+    DB_SQLITE_PATH is ':memory:' (default; shared by every connection of
+    the process) or a directory holding one <database>.sqlite3 file per
+    database name.
+    """
+    path = os.getenv('DB_SQLITE_PATH', ':memory:')
+    if path == ':memory:':
+        return f"file:{database}?mode=memory&cache=shared", True
+    os.makedirs(path, exist_ok=True)
+    return os.path.join(path, f"{database}.sqlite3"), False
+
+def connect(database):
+    """Open an SQLiteConnection to a database name (created empty if missing)"""
+    return SQLiteConnection(database)
+
+def signal(message):
+    """The error SIGNAL SQLSTATE '45000' raises on MySQL"""
+    return errors.DatabaseError(msg=message, errno=SIGNAL_ERRNO, sqlstate='45000')
+
+def sql_text(value):
+    """A value as MySQL's CONCAT renders it"""
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    if isinstance(value, datetime):
+        return value.strftime('%Y-%m-%d %H:%M:%S')
+    if isinstance(value, bytes):
+        return value.decode()
+    return str(value)
+
+def now():
+    """NOW() as stored in DATETIME columns"""
+    return datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+
+def today():
+    """CURDATE() as stored in DATE columns"""
+    return date.today().isoformat()
+
+# Parameters are stored as MySQL stores them: dates as 'YYYY-MM-DD',
+# datetimes to the second, decimals as doubles
+sqlite3.register_adapter(date, date.isoformat)
+sqlite3.register_adapter(datetime, lambda value: value.strftime('%Y-%m-%d %H:%M:%S'))
+sqlite3.register_adapter(Decimal, float)
+
+_DATE = re.compile(r'\d{4}-\d{2}-\d{2}$')
+_DATETIME = re.compile(r'\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2}$')
+
+def _value(value):
+    # Dates come back as date / datetime objects, as from the MySQL connector
+    if type(value) is str and len(value) in (10, 19) and value[4:5] == '-':
+        if len(value) == 10 and _DATE.match(value):
+            return date.fromisoformat(value)
+        if _DATETIME.match(value):
+            return datetime.fromisoformat(value)
+    return value
+
+def _parse_date(value):
+    if value is None:
+        return None
+    if isinstance(value, (date, datetime)):
+        return value
+    value = str(value)
+    return datetime.fromisoformat(value) if len(value) > 10 else date.fromisoformat(value)
+
+# ---------------------------------------------------------------------
+# MySQL functions used by the application SQL, as SQLite functions
+# ---------------------------------------------------------------------
+
+_INTERVAL_UNITS = {'SECOND': 'seconds', 'MINUTE': 'minutes', 'HOUR': 'hours',
+                   'DAY': 'days', 'WEEK': 'weeks'}
+
+def _date_add(value, amount, unit):
+    value = _parse_date(value)
+    if value is None or amount is None:
+        return None
+    result = value + timedelta(**{_INTERVAL_UNITS[unit.upper()]: amount})
+    return sql_text(result) if isinstance(result, datetime) else result.isoformat()
+
+def _datediff(a, b):
+    a, b = _parse_date(a), _parse_date(b)
+    if a is None or b is None:
+        return None
+    return (a.toordinal() if isinstance(a, date) else a.date().toordinal()) - \
+        (b.toordinal() if isinstance(b, date) else b.date().toordinal())
+
+def _timestampdiff(unit, a, b):
+    a, b = _parse_date(a), _parse_date(b)
+    if a is None or b is None:
+        return None
+    if not isinstance(a, datetime):
+        a = datetime.combine(a, datetime.min.time())
+    if not isinstance(b, datetime):
+        b = datetime.combine(b, datetime.min.time())
+    # Whole units, truncated toward zero as MySQL does
+    return int((b - a) / timedelta(**{_INTERVAL_UNITS[unit.upper()]: 1}))
+
+def _last_day(value):
+    value = _parse_date(value)
+    if value is None:
+        return None
+    following = date(value.year + value.month // 12, value.month % 12 + 1, 1)
+    return (following - timedelta(days=1)).isoformat()
+
+def _concat(*values):
+    if any(v is None for v in values):
+        return None
+    return ''.join(sql_text(v) for v in values)
+
+def _mod(a, b):
+    if a is None or b is None or b == 0:
+        return None
+    result = abs(a) % abs(b)
+    return -result if a < 0 else result
+
+def _extreme(pick):
+    def extreme(*values):
+        return None if any(v is None for v in values) else pick(values)
+    return extreme
+
+class _GroupConcatSorted:
+    """GROUP_CONCAT(... ORDER BY ... SEPARATOR ...): values sorted, optionally distinct"""
+
+    def __init__(self):
+        self.values = []
+        self.separator = ','
+        self.distinct = False
+
+    def step(self, value, separator, distinct):
+        if value is not None:
+            self.values.append(sql_text(value))
+        self.separator = separator
+        self.distinct = bool(distinct)
+
+    def finalize(self):
+        if not self.values:
+            return None
+        values = sorted(set(self.values) if self.distinct else self.values)
+        return self.separator.join(values)
+
+# ---------------------------------------------------------------------
+# SQL translation
+# ---------------------------------------------------------------------
+
+_LITERAL = re.compile(r"('(?:[^'\\]|\\.|'')*')")
+
+_GROUP_CONCAT = re.compile(
+    r"\bGROUP_CONCAT\s*\(\s*(DISTINCT\s+)?(.*?)(?:\s+ORDER\s+BY\s+.*?)?\s+SEPARATOR\s+('(?:[^']|'')*')\s*\)",
+    re.I | re.S)
+
+_REWRITES = (
+    (re.compile(r'\bINSERT\s+IGNORE\b', re.I), 'INSERT OR IGNORE'),
+    (re.compile(r'\bINTERVAL\s+(.+?)\s+(SECOND|MINUTE|HOUR|DAY|WEEK)\b', re.I | re.S), r"\1, '\2'"),
+    (re.compile(r'\bTIMESTAMPDIFF\s*\(\s*(SECOND|MINUTE|HOUR|DAY|WEEK)\s*,', re.I), r"TIMESTAMPDIFF('\1',"),
+    (re.compile(r'\bAS\s+(?:SIGNED|UNSIGNED)(?:\s+INTEGER)?\b', re.I), 'AS INTEGER'),
+    (re.compile(r'\bAS\s+DECIMAL\s*\([^)]*\)', re.I), 'AS REAL'),
+    (re.compile(r'\bAS\s+(?:CHAR|DATE|DATETIME)(?:\s*\(\s*\d+\s*\))?(?=\s*\))', re.I), 'AS TEXT'),
+    (re.compile(r'\bFROM\s+DUAL\b', re.I), ''),
+    (re.compile(r'\s+(?:FOR\s+UPDATE|FOR\s+SHARE|LOCK\s+IN\s+SHARE\s+MODE)\b', re.I), ''),
+    (re.compile(r'\bLAST_INSERT_ID\s*\(\s*\)', re.I), 'last_insert_rowid()'),
+    (re.compile(r'@(\w+)'), r"session_variable('\1')"),
+    # (a, b) IN ((%s, %s), ...): SQLite compares row values with a VALUES list
+    (re.compile(r'\bIN\s*\(\s*(?=\(\s*%s)', re.I), 'IN (VALUES '),
+)
+
+_UPSERT = re.compile(r'\bON\s+DUPLICATE\s+KEY\s+UPDATE\b', re.I)
+_UPSERT_VALUES = re.compile(r'\bVALUES\s*\(\s*([A-Za-z_]\w*)\s*\)', re.I)
+_FOREIGN_KEY_CHECKS = re.compile(r'\s*SET\s+FOREIGN_KEY_CHECKS\s*=\s*([01])\s*;?\s*$', re.I)
+_CREATE_TABLE = re.compile(r'\s*CREATE\s+TABLE\s+(?:IF\s+NOT\s+EXISTS\s+)?(\w+)\s*\((.*)\)\s*;?\s*$',
+                           re.I | re.S)
+
+@lru_cache(maxsize=1024)
+def translate(sql, has_params=True):
+    """The SQLite statements for one MySQL statement
+
+    Covers the MySQL dialect the application and the sample data use:
+    %s parameters, INSERT IGNORE, ON DUPLICATE KEY UPDATE (an upsert on
+    any unique key), DATE_ADD / DATE_SUB intervals, TIMESTAMPDIFF units,
+    MySQL casts, GROUP_CONCAT separators, locking clauses (SQLite locks
+    the whole database on write, so they are dropped), LAST_INSERT_ID(),
+    @session variables and CREATE TABLE with inline indexes, ENUM and AUTO_INCREMENT.
+    MySQL functions with no SQLite equivalent (CONCAT, CURDATE, NOW,
+    DATEDIFF, SLEEP, ...) are registered on the connection instead.
+    """
+    foreign_keys = _FOREIGN_KEY_CHECKS.match(sql)
+    if foreign_keys:
+        return (f"PRAGMA foreign_keys = {'ON' if foreign_keys.group(1) == '1' else 'OFF'}",)
+    table = _CREATE_TABLE.match(sql)
+    if table:
+        return _create_table(*table.groups())
+
+    sql = _GROUP_CONCAT.sub(
+        lambda m: f"group_concat_sorted({m.group(2)}, {m.group(3)}, {1 if m.group(1) else 0})", sql)
+    parts = _LITERAL.split(sql)
+    upsert = False
+    for i in range(0, len(parts), 2):
+        part = parts[i]
+        for pattern, replacement in _REWRITES:
+            part = pattern.sub(replacement, part)
+        if upsert:
+            part = _UPSERT_VALUES.sub(r'excluded.\1', part)
+        elif _UPSERT.search(part):
+            head, tail = _UPSERT.split(part, 1)
+            part = head + 'ON CONFLICT DO UPDATE SET' + _UPSERT_VALUES.sub(r'excluded.\1', tail)
+            upsert = True
+        if has_params:
+            part = part.replace('%s', '?')
+        parts[i] = part
+    if has_params:
+        # The MySQL connector formats the whole statement, literals included
+        parts = [p.replace('%%', '%') for p in parts]
+    return (''.join(parts),)
+
+def _split_top_level(body):
+    # Split a column list on the commas outside parentheses and literals
+    items, depth, quoted, current = [], 0, False, []
+    for ch in body:
+        if ch == "'":
+            quoted = not quoted
+        elif not quoted and ch == '(':
+            depth += 1
+        elif not quoted and ch == ')':
+            depth -= 1
+        elif not quoted and ch == ',' and depth == 0:
+            items.append(''.join(current))
+            current = []
+            continue
+        current.append(ch)
+    items.append(''.join(current))
+    return [item.strip() for item in items if item.strip()]
+
+def _create_table(name, body):
+    body = re.sub(r'--.*$', '', body, flags=re.M)
+    columns, indexes = [], []
+    for item in _split_top_level(body):
+        index = re.match(r'(UNIQUE\s+)?(?:INDEX|KEY)\s+(\w+)\s*(\(.*\))$', item, re.I | re.S)
+        if index:
+            unique, index_name, index_columns = index.groups()
+            indexes.append(f"CREATE {'UNIQUE ' if unique else ''}INDEX IF NOT EXISTS "
+                           f"{index_name} ON {name} {index_columns}")
+            continue
+        item = re.sub(r'\bINT\s+AUTO_INCREMENT\s+PRIMARY\s+KEY\b',
+                      'INTEGER PRIMARY KEY AUTOINCREMENT', item, flags=re.I)
+        item = re.sub(r'^(\w+)\s+ENUM\s*\(([^)]*)\)', r'\1 TEXT CHECK (\1 IN (\2))', item, flags=re.I)
+        # Text compares case-insensitively, as in the MySQL *_ci collations
+        item = re.sub(r'\b((?:VAR)?CHAR\s*\(\s*\d+\s*\))', r'\1 COLLATE NOCASE', item, flags=re.I)
+        item = re.sub(r'\bDEFAULT\s+CURRENT_TIMESTAMP\b', "DEFAULT (datetime('now', 'localtime'))",
+                      item, flags=re.I)
+        columns.append(item)
+    table = f"CREATE TABLE IF NOT EXISTS {name} (\n    " + ',\n    '.join(columns) + "\n)"
+    return (table, *indexes)
+
+def _keyword(sql):
+    words = sql.lstrip().split(None, 1)
+    return words[0].upper() if words else ''
+
+def _error(e):
+    # The mysql.connector error matching an sqlite3 error
+    message = str(e)
+    if isinstance(e, sqlite3.IntegrityError):
+        if message.startswith('Error:'):
+            # RAISE(ABORT, ...) in a trigger: SIGNAL on MySQL
+            return signal(message)
+        for prefix, errno in (('UNIQUE', 1062), ('FOREIGN KEY', 1452),
+                              ('CHECK', 3819), ('NOT NULL', 1048)):
+            if message.startswith(prefix):
+                return errors.IntegrityError(msg=message, errno=errno, sqlstate='23000')
+        return errors.IntegrityError(msg=message, errno=1105)
+    if _busy(e):
+        return errors.DatabaseError(msg=f"Lock wait timeout exceeded; try restarting transaction ({message})",
+                                    errno=1205, sqlstate='HY000')
+    if message == 'interrupted':
+        return errors.DatabaseError(msg='Query execution was interrupted', errno=1317, sqlstate='70100')
+    if message.startswith('no such table'):
+        return errors.ProgrammingError(msg=message, errno=1146, sqlstate='42S02')
+    if 'syntax error' in message or message.startswith('no such column'):
+        return errors.ProgrammingError(msg=message, errno=1064, sqlstate='42000')
+    return errors.DatabaseError(msg=message, errno=1105)
+
+def _busy(e):
+    return isinstance(e, sqlite3.OperationalError) and 'locked' in str(e)
+
+def _table_locked(e):
+    # A shared-cache table lock (in-memory databases). Every transaction
+    # holds the write lock, so inside one the lock is a read outside any
+    # transaction, which ends with its statement: safe to wait for
+    return isinstance(e, sqlite3.OperationalError) and str(e).startswith('database table is locked')
+
+class SQLiteConnection:
+    """An embedded SQLite database behind the mysql.connector connection API
+
+    Implements the part of the connector's connection and cursor API that
+    Database uses (cursors with dictionary / prepared flags, commit,
+    rollback, ping, ...), so Database and everything built on it run
+    unchanged. Statements are translated from MySQL (see translate), CALL
+    runs the Python ports of the stored procedures (sqlite_procedures),
+    and KILL QUERY / KILL CONNECTION <id> interrupt or drop another
+    connection of this process.
+
+    Transactions start with begin() (Database.transaction) or else at
+    the first write, always as BEGIN IMMEDIATE: the write lock is taken
+    up front, so the reads MySQL runs under FOR UPDATE are serialized
+    and writers queue instead of deadlocking. They end at commit /
+    rollback. Reads see committed data only; on an in-memory database a
+    read waits while another connection's transaction holds the tables,
+    and a transaction waits for the reads running on a table it writes.
+    """
+
+    def __init__(self, database):
+        self.database = database
+        self.connection_id = next(_connection_ids)
+        self.server_host = SERVER_HOST
+        self.server_port = None
+        # @session variables (set by the procedures)
+        self.variables = {}
+        self._interrupted = threading.Event()
+        self._killed = False
+
+        path, memory = location(database)
+        self._raw = self._open(path)
+        if memory:
+            with setup_lock:
+                if database not in _anchors:
+                    _anchors[database] = sqlite3.connect(path, uri=True, check_same_thread=False)
+        elif self._raw.execute("PRAGMA journal_mode").fetchone()[0] != 'wal':
+            # Readers and the writer do not block each other
+            self._raw.execute("PRAGMA journal_mode = WAL")
+        self._raw.execute("PRAGMA foreign_keys = ON")
+        self._register_functions()
+        _connections[self.connection_id] = self
+
+    @staticmethod
+    def _open(path):
+        try:
+            return sqlite3.connect(path, uri=path.startswith('file:'), timeout=BUSY_TIMEOUT_SECONDS,
+                                   isolation_level='IMMEDIATE', check_same_thread=False)
+        except sqlite3.Error as e:
+            raise errors.InterfaceError(msg=f"Can't open SQLite database {path}: {e}", errno=2003) from e
+
+    def _register_functions(self):
+        raw = self._raw
+        raw.create_function('CONCAT', -1, _concat, deterministic=True)
+        raw.create_function('CURDATE', 0, today)
+        raw.create_function('NOW', 0, now)
+        raw.create_function('DATE_ADD', 3, _date_add, deterministic=True)
+        raw.create_function('DATE_SUB', 3, lambda value, amount, unit: _date_add(
+            value, None if amount is None else -amount, unit), deterministic=True)
+        raw.create_function('DATEDIFF', 2, _datediff, deterministic=True)
+        raw.create_function('TIMESTAMPDIFF', 3, _timestampdiff, deterministic=True)
+        raw.create_function('DAYOFMONTH', 1, lambda value: None if value is None else _parse_date(value).day,
+                            deterministic=True)
+        raw.create_function('LAST_DAY', 1, _last_day, deterministic=True)
+        raw.create_function('MOD', 2, _mod, deterministic=True)
+        raw.create_function('GREATEST', -1, _extreme(max), deterministic=True)
+        raw.create_function('LEAST', -1, _extreme(min), deterministic=True)
+        raw.create_function('SLEEP', 1, self._sleep)
+        raw.create_function('CONNECTION_ID', 0, lambda: self.connection_id)
+        raw.create_function('session_variable', 1, self.variables.get)
+        raw.create_aggregate('group_concat_sorted', 3, _GroupConcatSorted)
+
+    def _sleep(self, seconds):
+        # Like MySQL, SLEEP returns 1 early when the query is killed
+        return 1 if self._interrupted.wait(seconds or 0) else 0
+
+    def cursor(self, dictionary=False, prepared=False, buffered=None):
+        """A cursor; prepared statements are cached by SQLite itself"""
+        self._check()
+        return SQLiteCursor(self, dictionary)
+
+    def begin(self):
+        """Open a transaction now, with the write lock (BEGIN IMMEDIATE)"""
+        if not self._raw.in_transaction:
+            self._execute(self._raw.cursor(), "BEGIN IMMEDIATE", ())
+
+    def commit(self):
+        self._check()
+        self._call_raw(self._raw.commit)
+
+    def rollback(self):
+        self._check()
+        self._call_raw(self._raw.rollback)
+
+    def is_connected(self):
+        return self._raw is not None and not self._killed
+
+    def ping(self, reconnect=False, attempts=1, delay=0):
+        self._check()
+
+    def consume_results(self):
+        # SQLite cursors need no draining
+        pass
+
+    def interrupt(self):
+        """Abort the statement in progress (callable from any thread)"""
+        self._interrupted.set()
+        if self._raw is not None:
+            self._raw.interrupt()
+
+    def kill(self):
+        """Drop the connection as KILL CONNECTION does: its next call fails"""
+        self._killed = True
+        self.interrupt()
+
+    def close(self):
+        _connections.pop(self.connection_id, None)
+        raw, self._raw = self._raw, None
+        if raw is not None:
+            try:
+                raw.close()
+            except sqlite3.Error:
+                pass
+
+    def has_schema(self):
+        """Whether the database has been created (see DatabaseSetup)"""
+        return bool(self.query("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'UserDetails'"))
+
+    def reset(self):
+        """Drop every table, index and trigger (DROP DATABASE)"""
+        self._raw.commit()
+        self._raw.execute("PRAGMA foreign_keys = OFF")
+        try:
+            for kind, name in self.query("""
+                SELECT type, name FROM sqlite_master
+                WHERE type IN ('trigger', 'table') AND name NOT LIKE 'sqlite_%'
+                ORDER BY type = 'table'
+            """):
+                self._raw.execute(f"DROP {kind.upper()} IF EXISTS {name}")
+            self._raw.commit()
+        finally:
+            self._raw.execute("PRAGMA foreign_keys = ON")
+
+    def query(self, sql, params=()):
+        """Rows (tuples, values as stored) of an SQLite statement"""
+        cursor = self._raw.cursor()
+        self._execute(cursor, sql, params)
+        return self._call_raw(cursor.fetchall)
+
+    def run(self, sql, params=()):
+        """Run an SQLite statement; returns the affected row count"""
+        cursor = self._raw.cursor()
+        self._execute(cursor, sql, params)
+        return cursor.rowcount
+
+    def call(self, statement, params):
+        """Run CALL name(args) with the Python procedure of that name"""
+        from sqlite_procedures import PROCEDURES
+
+        match = re.match(r'\s*CALL\s+(\w+)\s*\((.*)\)\s*;?\s*$', statement, re.I | re.S)
+        if not match:
+            raise errors.ProgrammingError(msg=f"Malformed CALL: {statement.strip()}", errno=1064)
+        name, args = match.groups()
+        procedure = PROCEDURES.get(name.lower())
+        if procedure is None:
+            raise errors.ProgrammingError(msg=f"PROCEDURE {self.database}.{name} does not exist",
+                                          errno=1305, sqlstate='42000')
+        values = ()
+        if args.strip():
+            # The arguments are evaluated like a SELECT list (literals, %s, NULL)
+            values = self.query(translate(f"SELECT {args}", bool(params))[0], params or ())[0]
+        if len(values) != procedure.__code__.co_argcount - 1:
+            raise errors.ProgrammingError(
+                msg=f"Incorrect number of arguments for PROCEDURE {self.database}.{name}; "
+                    f"expected {procedure.__code__.co_argcount - 1}, got {len(values)}",
+                errno=1318, sqlstate='42000')
+        procedure(self, *values)
+
+    def kill_statement(self, statement):
+        """KILL [QUERY | CONNECTION] <id> for a connection of this process"""
+        match = re.match(r'\s*KILL\s+(QUERY\s+|CONNECTION\s+)?(\d+)\s*;?\s*$', statement, re.I)
+        if not match:
+            raise errors.ProgrammingError(msg=f"Malformed KILL: {statement.strip()}", errno=1064)
+        target = _connections.get(int(match.group(2)))
+        if target is None:
+            raise errors.DatabaseError(msg=f"Unknown thread id: {match.group(2)}", errno=1094)
+        if (match.group(1) or '').strip().upper() == 'QUERY':
+            target.interrupt()
+        else:
+            target.kill()
+
+    def _check(self):
+        if self._raw is not None and not self._killed:
+            return
+        if self._raw is not None:
+            # Killed: the open transaction is lost with the connection
+            self.close()
+        raise errors.OperationalError(msg="Lost connection to SQLite database (connection killed or closed)",
+                                      errno=2013, sqlstate='HY000')
+
+    def _execute(self, cursor, sql, params, many=False):
+        self._check()
+        self._interrupted.clear()
+        started = self._raw.in_transaction
+        deadline = time.monotonic() + BUSY_TIMEOUT_SECONDS
+        while True:
+            try:
+                if many:
+                    cursor.executemany(sql, params)
+                else:
+                    cursor.execute(sql, params)
+                return
+            except sqlite3.Error as e:
+                if self._killed:
+                    self._check()
+                # A transaction that could not start yet waits for the
+                # writer ahead of it; inside one, waiting could deadlock,
+                # except on a table another connection is reading (see
+                # _table_locked)
+                if not _busy(e) or (started and not _table_locked(e)) \
+                        or time.monotonic() >= deadline:
+                    raise _error(e) from e
+                if not started and self._raw.in_transaction:
+                    self._raw.rollback()
+                time.sleep(random.uniform(0.001, 0.01))
+
+    def _call_raw(self, fn, *args):
+        try:
+            return fn(*args)
+        except sqlite3.Error as e:
+            if self._killed:
+                self._check()
+            raise _error(e) from e
+
+class SQLiteCursor:
+    """The mysql.connector cursor API over an sqlite3 cursor"""
+
+    def __init__(self, connection, dictionary):
+        self._connection = connection
+        self._dictionary = dictionary
+        self._cursor = None
+        self.column_names = ()
+        self.rowcount = -1
+        self.lastrowid = None
+
+    def execute(self, operation, params=None):
+        connection = self._connection
+        self._cursor = None
+        self.column_names = ()
+        self.rowcount = -1
+        keyword = _keyword(operation)
+        if keyword == 'CALL':
+            connection.call(operation, params)
+            self.rowcount = 0
+            return
+        if keyword == 'KILL':
+            connection.kill_statement(operation)
+            self.rowcount = 0
+            return
+
+        cursor = None
+        for sql in translate(operation, bool(params)):
+            if sql.startswith('PRAGMA foreign_keys') and connection._raw.in_transaction:
+                # SQLite only switches foreign key checks between transactions
+                connection.commit()
+            cursor = connection._raw.cursor()
+            connection._execute(cursor, sql, params or ())
+        self._cursor = cursor
+        if cursor.description:
+            self.column_names = tuple(d[0] for d in cursor.description)
+        self.rowcount = cursor.rowcount
+        self.lastrowid = cursor.lastrowid
+
+    def executemany(self, operation, seq_params):
+        seq_params = list(seq_params)
+        if _keyword(operation) == 'CALL':
+            for params in seq_params:
+                self.execute(operation, params)
+            self.rowcount = len(seq_params)
+            return
+        statements = translate(operation, True)
+        for sql in statements[:-1]:
+            self._connection._execute(self._connection._raw.cursor(), sql, ())
+        cursor = self._connection._raw.cursor()
+        self._connection._execute(cursor, statements[-1], seq_params, many=True)
+        self._cursor = cursor
+        self.rowcount = cursor.rowcount
+        self.lastrowid = cursor.lastrowid
+
+    def fetchall(self):
+        if self._cursor is None:
+            return []
+        return self._rows(self._connection._call_raw(self._cursor.fetchall))
+
+    def fetchmany(self, size=1):
+        if self._cursor is None:
+            return []
+        return self._rows(self._connection._call_raw(self._cursor.fetchmany, size))
+
+    def fetchone(self):
+        rows = self.fetchmany(1)
+        return rows[0] if rows else None
+
+    def close(self):
+        if self._cursor is not None:
+            try:
+                self._cursor.close()
+            except sqlite3.Error:
+                # The connection is already closed (e.g. killed)
+                pass
+            self._cursor = None
+
+    def _rows(self, rows):
+        rows = [tuple(_value(v) for v in row) for row in rows]
+        if self._dictionary:
+            return [dict(zip(self.column_names, row)) for row in rows]
+        return rows
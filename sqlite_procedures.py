@@ -0,0 +1,362 @@
+import hashlib
+import math
+from datetime import date, datetime
+from mysql.connector import errors
+from sqlite_backend import signal, sql_text, now, today
+
+# Python ports of stored_procedures.sql for the SQLite backend. Each
+# procedure takes the SQLiteConnection and the CALL arguments, runs in
+# the caller's transaction and raises signal(...) where the MySQL
+# procedure SIGNALs, with the same messages. The IngredientBatch,
+# IngredientConsumption and LotReservation rules stay in the triggers
+# (triggers_sqlite.sql), so both backends share one set of checks.
+
+def _int(value):
+    if value is None:
+        return None
+    try:
+        return int(round(float(value)))
+    except (TypeError, ValueError):
+        raise errors.DatabaseError(msg=f"Incorrect integer value: '{value}'", errno=1366) from None
+
+def _float(value):
+    if value is None:
+        return None
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        raise errors.DatabaseError(msg=f"Incorrect double value: '{value}'", errno=1366) from None
+
+def _date(value):
+    if value is None:
+        return None
+    if isinstance(value, (date, datetime)):
+        return value.strftime('%Y-%m-%d')
+    try:
+        return date.fromisoformat(str(value)[:10]).isoformat()
+    except ValueError:
+        raise errors.DatabaseError(msg=f"Incorrect date value: '{value}'", errno=1292) from None
+
+def _request_hash(*values):
+    # SHA2(CONCAT_WS('|', ...), 256): CONCAT_WS skips NULLs
+    text = '|'.join(sql_text(v) for v in values if v is not None)
+    return hashlib.sha256(text.encode()).hexdigest()
+
+def _one(db, sql, params=()):
+    rows = db.query(sql, params)
+    return rows[0] if rows else None
+
+def recalculate_batch_cost(db, product_lot_number):
+    """RecalculateBatchCost: batch_total_cost / unit_cost from the consumption"""
+    row = _one(db, "SELECT produced_quantity FROM ProductBatch WHERE lot_number = ?",
+               (product_lot_number,))
+    if row is None or row[0] is None:
+        raise signal('Error: Product batch lot does not exist for cost calculation.')
+    produced_quantity = row[0]
+
+    total_cost = _one(db, """
+        SELECT SUM(ic.consumed_quantity_oz * ib.per_unit_cost)
+        FROM IngredientConsumption ic
+        JOIN IngredientBatch ib ON ic.ingredient_lot_number = ib.lot_number
+        WHERE ic.product_lot_number = ?
+    """, (product_lot_number,))[0] or 0
+
+    db.run("""
+        UPDATE ProductBatch
+        SET batch_total_cost = ?, unit_cost = ?
+        WHERE lot_number = ?
+    """, (total_cost, total_cost / produced_quantity if produced_quantity > 0 else 0,
+          product_lot_number))
+
+def record_production_batch(db, manufacturer_id, product_id, batch_id, produced_quantity,
+                            production_date, expiration_date, plan_id, idempotency_key):
+    """RecordProductionBatch: a new ProductBatch <product_id>-<manufacturer_id>-<batch_id>"""
+    product_id, batch_id, plan_id = _int(product_id), _int(batch_id), _int(plan_id)
+    produced_quantity = _float(produced_quantity)
+    production_date, expiration_date = _date(production_date), _date(expiration_date)
+
+    request_hash = _request_hash(manufacturer_id, product_id, batch_id, produced_quantity,
+                                 production_date, expiration_date,
+                                 '' if plan_id is None else plan_id)
+    if claim_idempotency_key(db, idempotency_key, 'RecordProductionBatch', request_hash):
+        return
+
+    row = _one(db, "SELECT standard_batch_units FROM Product WHERE id = ?", (product_id,))
+    if row is None or row[0] is None:
+        raise signal('Error: Product does not exist.')
+    standard_units = row[0]
+    if produced_quantity is None or produced_quantity <= 0:
+        raise signal('Error: produced_quantity must be positive.')
+    # MOD(x, 0) is NULL on MySQL, so a zero batch size passes
+    if standard_units != 0 and math.fmod(produced_quantity, standard_units) != 0:
+        raise signal('Error: produced_quantity must be a multiple of standard_batch_units.')
+    if expiration_date <= production_date:
+        raise signal('Error: expiration_date must be after production_date.')
+
+    if plan_id is None:
+        row = _one(db, """
+            SELECT plan_id FROM RecipePlan
+            WHERE product_id = ?
+            ORDER BY version_number DESC
+            LIMIT 1
+        """, (product_id,))
+    else:
+        row = _one(db, "SELECT plan_id FROM RecipePlan WHERE plan_id = ? AND product_id = ?",
+                   (plan_id, product_id))
+        if row is None:
+            raise signal('Error: Recipe plan does not belong to this product.')
+
+    # The FK (manufacturer_id, product_id) -> ManufacturerProduct
+    # ensures that this manufacturer actually owns this product
+    lot_number = f"{product_id}-{manufacturer_id}-{batch_id}"
+    db.run("""
+        INSERT INTO ProductBatch
+            (lot_number, product_id, manufacturer_id, batch_id, produced_quantity,
+             production_date, expiration_date, plan_id)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+    """, (lot_number, product_id, manufacturer_id, batch_id, produced_quantity,
+          production_date, expiration_date, row[0] if row else None))
+
+    save_idempotency_result(db, idempotency_key, 'RecordProductionBatch', request_hash,
+                            lot_number, produced_quantity)
+
+def record_ingredient_intake(db, ingredient_id, supplier_id, batch_id, packs_received,
+                             expiration_date, version_number, idempotency_key):
+    """RecordIngredientIntake: a new IngredientBatch from a formulation's pack size and price"""
+    ingredient_id, batch_id = _int(ingredient_id), _int(batch_id)
+    packs_received = _float(packs_received)
+    expiration_date = _date(expiration_date)
+    version_number = None if version_number is None else sql_text(version_number)
+
+    request_hash = _request_hash(ingredient_id, supplier_id, batch_id, packs_received,
+                                 expiration_date, '' if version_number is None else version_number)
+    if claim_idempotency_key(db, idempotency_key, 'RecordIngredientIntake', request_hash):
+        return
+
+    if packs_received is None or packs_received <= 0:
+        raise signal('Error: packs_received must be positive.')
+
+    row = _one(db, """
+        SELECT pack_size, unit_price
+        FROM IngredientFormulation
+        WHERE ingredient_id = ? AND supplier_id = ? AND version_number = ?
+    """, (ingredient_id, supplier_id, version_number))
+    if row is None or row[0] is None:
+        raise signal('Error: No matching ingredient formulation found for given ingredient, '
+                     'supplier, and version.')
+    pack_size, unit_price = row
+    if pack_size <= 0:
+        raise signal('Error: formulation pack_size must be positive.')
+
+    # lot_number is set by the trg_ingredient_batch_lot_number trigger
+    quantity = pack_size * packs_received
+    db.run("""
+        INSERT INTO IngredientBatch
+            (ingredient_id, supplier_id, batch_id, quantity, per_unit_cost, expiration_date)
+        VALUES (?, ?, ?, ?, ?, ?)
+    """, (ingredient_id, supplier_id, batch_id, quantity,
+          None if unit_price is None else unit_price / pack_size, expiration_date))
+
+    save_idempotency_result(db, idempotency_key, 'RecordIngredientIntake', request_hash,
+                            f"{ingredient_id}-{supplier_id}-{batch_id}", quantity)
+
+def consume_ingredient_lot(db, product_lot_number, ingredient_lot_number, consumed_quantity_oz,
+                           idempotency_key):
+    """ConsumeIngredientLot: consumption checked and booked by the IngredientConsumption trigger"""
+    consumed_quantity_oz = _float(consumed_quantity_oz)
+    request_hash = _request_hash(product_lot_number, ingredient_lot_number, consumed_quantity_oz)
+    if claim_idempotency_key(db, idempotency_key, 'ConsumeIngredientLot', request_hash):
+        return
+
+    if consumed_quantity_oz is None or consumed_quantity_oz <= 0:
+        raise signal('Error: consumed_quantity_oz must be positive.')
+    if _one(db, "SELECT 1 FROM ProductBatch WHERE lot_number = ?", (product_lot_number,)) is None:
+        raise signal('Error: Product batch lot does not exist.')
+
+    db.run("""
+        INSERT INTO IngredientConsumption (product_lot_number, ingredient_lot_number, consumed_quantity_oz)
+        VALUES (?, ?, ?)
+    """, (product_lot_number, ingredient_lot_number, consumed_quantity_oz))
+    recalculate_batch_cost(db, product_lot_number)
+
+    save_idempotency_result(db, idempotency_key, 'ConsumeIngredientLot', request_hash,
+                            ingredient_lot_number, consumed_quantity_oz)
+
+def snapshot_recipe_plan(db, plan_id):
+    """SnapshotRecipePlan: freeze the product's ProductBOM as the plan's BOM"""
+    row = _one(db, "SELECT product_id FROM RecipePlan WHERE plan_id = ?", (plan_id,))
+    if row is None:
+        raise signal('Error: Recipe plan does not exist.')
+    if _one(db, "SELECT 1 FROM RecipePlanBOM WHERE plan_id = ?", (plan_id,)) is not None:
+        raise signal('Error: Recipe plan BOM has already been snapshotted.')
+    db.run("""
+        INSERT INTO RecipePlanBOM (plan_id, ingredient_id, quantity)
+        SELECT ?, ingredient_id, quantity FROM ProductBOM WHERE product_id = ?
+    """, (plan_id, row[0]))
+
+def rebuild_inventory_summary(db):
+    """RebuildInventorySummary: reserved quantities and on-hand summaries from the lots"""
+    db.run("""
+        UPDATE IngredientBatch
+        SET reserved_quantity = COALESCE((
+            SELECT SUM(r.quantity) FROM LotReservation r
+            WHERE r.lot_number = IngredientBatch.lot_number AND r.status = 'OPEN'
+        ), 0)
+        WHERE reserved_quantity <> COALESCE((
+            SELECT SUM(r.quantity) FROM LotReservation r
+            WHERE r.lot_number = IngredientBatch.lot_number AND r.status = 'OPEN'
+        ), 0)
+    """)
+    db.run("DELETE FROM IngredientOnHandByExpiry")
+    db.run("DELETE FROM IngredientOnHand")
+    db.run("""
+        INSERT INTO IngredientOnHand (ingredient_id, quantity, reserved_quantity, lot_count)
+        SELECT ingredient_id, SUM(quantity), SUM(reserved_quantity), SUM(quantity > 0)
+        FROM IngredientBatch
+        GROUP BY ingredient_id
+    """)
+    db.run("""
+        INSERT INTO IngredientOnHandByExpiry (ingredient_id, expiry_bucket, quantity, lot_count)
+        SELECT ingredient_id, date(expiration_date, 'start of month'), SUM(quantity), SUM(quantity > 0)
+        FROM IngredientBatch
+        GROUP BY ingredient_id, date(expiration_date, 'start of month')
+    """)
+
+def sweep_expired_lots(db, window_days):
+    """SweepExpiredLots: expire lots, recompute ExpiringLot, log the run, expire reservations"""
+    window_days = _int(window_days)
+    expired = db.run("""
+        UPDATE IngredientBatch SET status = 'EXPIRED'
+        WHERE status = 'LIVE' AND expiration_date < CURDATE()
+    """)
+    db.run("DELETE FROM ExpiringLot WHERE window_days = ?", (window_days,))
+    expiring = db.run("""
+        INSERT INTO ExpiringLot (lot_number, ingredient_id, expiration_date, computed_on, window_days)
+        SELECT lot_number, ingredient_id, expiration_date, CURDATE(), ?
+        FROM IngredientBatch
+        WHERE status = 'LIVE'
+        AND quantity > 0
+        AND expiration_date BETWEEN CURDATE() AND DATE_ADD(CURDATE(), ?, 'DAY')
+    """, (window_days, window_days))
+    db.run("""
+        INSERT INTO ExpirySweep (sweep_date, window_days, expired_lots, expiring_lots, swept_at)
+        VALUES (?, ?, ?, ?, ?)
+        ON CONFLICT (sweep_date, window_days) DO UPDATE SET
+            expired_lots = expired_lots + excluded.expired_lots,
+            expiring_lots = excluded.expiring_lots,
+            swept_at = excluded.swept_at
+    """, (today(), window_days, expired, expiring, now()))
+    expire_reservations(db)
+
+def rebuild_lot_lineage(db):
+    """RebuildLotLineage: LotLineage from IngredientConsumption"""
+    db.run("DELETE FROM LotLineage")
+    db.run("""
+        INSERT INTO LotLineage
+            (ingredient_lot_number, product_lot_number, ingredient_id, supplier_id,
+             product_id, manufacturer_id, production_date, consumed_quantity_oz)
+        SELECT ic.ingredient_lot_number, ic.product_lot_number, ib.ingredient_id, ib.supplier_id,
+               pb.product_id, pb.manufacturer_id, pb.production_date, ic.consumed_quantity_oz
+        FROM IngredientConsumption ic
+        JOIN IngredientBatch ib ON ic.ingredient_lot_number = ib.lot_number
+        JOIN ProductBatch pb ON ic.product_lot_number = pb.lot_number
+    """)
+
+def convert_reservation(db, reservation_id, product_lot_number, quantity):
+    """ConvertReservation: an OPEN reservation into consumption for a product batch"""
+    reservation_id, quantity = _int(reservation_id), _float(quantity)
+    row = _one(db, "SELECT manufacturer_id FROM ProductBatch WHERE lot_number = ?",
+               (product_lot_number,))
+    if row is None:
+        raise signal('Error: Product batch lot does not exist.')
+    product_manufacturer = row[0]
+
+    row = _one(db, """
+        SELECT manufacturer_id, lot_number, quantity, status, expires_at
+        FROM LotReservation
+        WHERE reservation_id = ?
+    """, (reservation_id,))
+    if row is None:
+        raise signal('Error: Reservation does not exist.')
+    manufacturer_id, lot_number, reserved, status, expires_at = row
+    if status != 'OPEN':
+        raise signal('Error: Reservation is not open.')
+    if expires_at <= now():
+        raise signal('Error: Reservation has expired.')
+    if manufacturer_id.lower() != product_manufacturer.lower():
+        raise signal('Error: Reservation belongs to a different manufacturer than the product batch.')
+    if quantity is None:
+        quantity = reserved
+    if quantity <= 0 or quantity > reserved:
+        raise signal('Error: Converted quantity must be positive and at most the reserved quantity.')
+
+    # Close the reservation first so its hold no longer blocks the consumption
+    db.run("""
+        UPDATE LotReservation
+        SET status = 'CONVERTED', product_lot_number = ?, consumed_quantity_oz = ?
+        WHERE reservation_id = ?
+    """, (product_lot_number, quantity, reservation_id))
+    db.run("""
+        INSERT INTO IngredientConsumption (product_lot_number, ingredient_lot_number, consumed_quantity_oz)
+        VALUES (?, ?, ?)
+    """, (product_lot_number, lot_number, quantity))
+    recalculate_batch_cost(db, product_lot_number)
+
+def expire_reservations(db):
+    """ExpireReservations: close OPEN reservations past their TTL or on expired lots"""
+    db.run("UPDATE LotReservation SET status = 'EXPIRED' WHERE status = 'OPEN' AND expires_at <= ?",
+           (now(),))
+    db.run("UPDATE LotReservation SET status = 'EXPIRED' WHERE status = 'OPEN' AND lot_expiration_date < ?",
+           (today(),))
+
+def claim_idempotency_key(db, key, operation, request_hash):
+    """ClaimIdempotencyKey: True when the keyed request already ran (a replay)
+
+    Sets @idempotency_replayed. SQLite has no OUT parameters, so this
+    one is called from the other procedures only, not through CALL.
+    """
+    db.variables['idempotency_replayed'] = 0
+    if key is None:
+        return False
+    row = _one(db, "SELECT operation, request_hash FROM IdempotencyKey WHERE idempotency_key = ?", (key,))
+    if row is None:
+        return False
+    if row[0] != operation or row[1] != request_hash:
+        raise signal('Error: Idempotency key was already used for a different request.')
+    db.run("""
+        UPDATE IdempotencyKey
+        SET replay_count = replay_count + 1, last_replayed_at = ?
+        WHERE idempotency_key = ?
+    """, (now(), key))
+    db.variables['idempotency_replayed'] = 1
+    return True
+
+def save_idempotency_result(db, key, operation, request_hash, result_lot_number, result_quantity):
+    """SaveIdempotencyResult: store the outcome of a keyed request"""
+    if key is None:
+        return
+    db.run("""
+        INSERT INTO IdempotencyKey
+            (idempotency_key, operation, request_hash, result_lot_number, result_quantity, created_at)
+        VALUES (?, ?, ?, ?, ?, ?)
+    """, (key, operation, request_hash, result_lot_number, _float(result_quantity), now()))
+
+def purge_idempotency_keys(db, days):
+    """PurgeIdempotencyKeys: delete keys older than days"""
+    db.run("DELETE FROM IdempotencyKey WHERE created_at < DATE_SUB(?, ?, 'DAY')", (now(), _int(days)))
+
+# CALL name -> procedure (names are case-insensitive, as on MySQL)
+PROCEDURES = {
+    'recalculatebatchcost': recalculate_batch_cost,
+    'recordproductionbatch': record_production_batch,
+    'recordingredientintake': record_ingredient_intake,
+    'consumeingredientlot': consume_ingredient_lot,
+    'snapshotrecipeplan': snapshot_recipe_plan,
+    'rebuildinventorysummary': rebuild_inventory_summary,
+    'sweepexpiredlots': sweep_expired_lots,
+    'rebuildlotlineage': rebuild_lot_lineage,
+    'convertreservation': convert_reservation,
+    'expirereservations': expire_reservations,
+    'saveidempotencyresult': save_idempotency_result,
+    'purgeidempotencykeys': purge_idempotency_keys,
+}
@@ -0,0 +1,122 @@
+import time
+from collections import OrderedDict
+from mysql.connector import Error
+
+# Statements worth preparing: single DML / query statements with parameters
+# (CALLs can return several result sets, which prepared cursors do not read)
+PREPARABLE_KEYWORDS = ('SELECT', 'WITH', 'INSERT', 'UPDATE', 'DELETE', 'REPLACE')
+
+# Server errors meaning a cached statement is gone or stale and must be
+# prepared again: 1243 = unknown prepared statement handler,
+# 1615 = prepared statement needs to be re-prepared
+STALE_STATEMENT_ERRNOS = (1243, 1615)
+
+class StatementCache:
+    """Bounded LRU cache of server-side prepared statements keyed by SQL text
+    
+    Each cached statement owns a prepared cursor, so re-running the same
+    SQL skips the server's parse and plan step and only sends the
+    parameters. The least recently used statement is closed on the
+    server when the cache is full. The cache belongs to one connection
+    and is cleared when the connection is replaced.
+    """
+    
+    def __init__(self, size):
+        self.size = size
+        # sql -> prepared cursor; the key object itself is passed to the
+        # cursor, which re-prepares whenever it gets a different string
+        self._entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._hit_time = 0.0
+        self._miss_time = 0.0
+    
+    def cacheable(self, sql, params):
+        """Whether a statement should go through the cache"""
+        if self.size <= 0 or not params or '%%' in sql:
+            return False
+        keyword = sql.lstrip().split(None, 1)[0].upper() if sql.strip() else ''
+        return keyword in PREPARABLE_KEYWORDS
+    
+    def get(self, connection, sql):
+        """Return (cursor, sql_key, hit) for sql, preparing a cursor on a miss"""
+        entry = self._entries.get(sql)
+        if entry is not None:
+            self._entries.move_to_end(sql)
+            return entry[1], entry[0], True
+        
+        if len(self._entries) >= self.size:
+            _, (_, old_cursor) = self._entries.popitem(last=False)
+            self._close(old_cursor)
+            self.evictions += 1
+        cursor = connection.cursor(prepared=True)
+        self._entries[sql] = (sql, cursor)
+        return cursor, sql, False
+    
+    def execute(self, connection, sql, params):
+        """Run sql through its cached statement on connection; return the cursor"""
+        cursor, key, hit = self.get(connection, sql)
+        start = time.perf_counter()
+        try:
+            cursor.execute(key, params)
+        except Error as e:
+            if e.errno not in STALE_STATEMENT_ERRNOS:
+                raise
+            # The server dropped or invalidated the statement: prepare it again
+            self.discard(sql)
+            cursor, key, hit = self.get(connection, sql)
+            start = time.perf_counter()
+            cursor.execute(key, params)
+        self.record(hit, time.perf_counter() - start)
+        return cursor
+    
+    def record(self, hit, elapsed):
+        """Count one execution and its duration"""
+        if hit:
+            self.hits += 1
+            self._hit_time += elapsed
+        else:
+            self.misses += 1
+            self._miss_time += elapsed
+    
+    def discard(self, sql):
+        """Drop one statement (e.g. after the server forgot it)"""
+        entry = self._entries.pop(sql, None)
+        if entry is not None:
+            self._close(entry[1])
+    
+    def clear(self):
+        """Drop every statement (the connection is being replaced)"""
+        for _, cursor in self._entries.values():
+            self._close(cursor)
+        self._entries.clear()
+    
+    def stats(self):
+        """Hit rate and the estimated parse time saved by cache hits
+        
+        A miss pays prepare + execute and a hit only execute, so the time
+        saved per hit is estimated as the mean miss time minus the mean
+        hit time.
+        """
+        lookups = self.hits + self.misses
+        saved = 0.0
+        if self.hits and self.misses:
+            per_hit = self._miss_time / self.misses - self._hit_time / self.hits
+            saved = max(per_hit, 0.0) * self.hits
+        return {
+            'statement_cache_size': len(self._entries),
+            'statement_cache_hits': self.hits,
+            'statement_cache_misses': self.misses,
+            'statement_cache_evictions': self.evictions,
+            'statement_cache_hit_rate': self.hits / lookups if lookups else 0.0,
+            'statement_parse_time_saved': saved,
+        }
+    
+    @staticmethod
+    def _close(cursor):
+        try:
+            cursor.close()
+        except Error:
+            # The connection is already gone; so is the statement
+            pass
@@ -5,6 +5,12 @@
 --  - Recording ingredient intake from formulations
 --  - Consuming ingredients into product batches
 --  - Recalculating batch costs
+--  - Snapshotting recipe plan BOMs
+--  - Rebuilding the on-hand inventory summary
+--  - Sweeping expired lots
+--  - Rebuilding recall lineage edges
+--  - Converting and expiring lot reservations
+--  - Idempotency keys for production, consumption and intake
 -- =========================================================
 DELIMITER $$
 -- ---------------------------------------------------------
@@ -66,7 +72,12 @@ END $$
 --        * produced_quantity > 0
 --        * produced_quantity is multiple of standard_batch_units
 --        * expiration_date > production_date
+--        * p_plan_id (if given) is a recipe plan of this product;
+--          when NULL the latest plan version is recorded
 --    - lot_number is generated as <product_id>-<manufacturer_id>-<batch_id>
+--    - p_idempotency_key (optional): a retried call with the same
+--      key and arguments returns without doing anything again
+--      (see ClaimIdempotencyKey)
 -- ---------------------------------------------------------
 CREATE PROCEDURE RecordProductionBatch (
     IN p_manufacturer_id VARCHAR(255),
@@ -74,8 +85,43 @@ CREATE PROCEDURE RecordProductionBatch (
     IN p_batch_id INT,
     IN p_produced_quantity DOUBLE,
     IN p_production_date DATE,
-    IN p_expiration_date DATE
-) BEGIN DECLARE v_standard_units INT;
+    IN p_expiration_date DATE,
+    IN p_plan_id INT,
+    IN p_idempotency_key VARCHAR(255)
+) proc: BEGIN DECLARE v_standard_units INT;
+
+DECLARE v_plan_id INT;
+
+DECLARE v_request_hash CHAR(64);
+
+DECLARE v_replay BOOLEAN;
+
+-- Replay a request that already succeeded under this key
+SET
+    v_request_hash = SHA2(
+        CONCAT_WS(
+            '|',
+            p_manufacturer_id,
+            p_product_id,
+            p_batch_id,
+            p_produced_quantity,
+            p_production_date,
+            p_expiration_date,
+            COALESCE(p_plan_id, '')
+        ),
+        256
+    );
+
+CALL ClaimIdempotencyKey (
+    p_idempotency_key,
+    'RecordProductionBatch',
+    v_request_hash,
+    v_replay
+);
+
+IF v_replay THEN LEAVE proc;
+
+END IF;
 
 -- Make sure the product exists and get its standard batch size
 SELECT
@@ -112,6 +158,36 @@ SET
 
 END IF;
 
+-- Resolve the recipe plan version this batch is built from
+IF p_plan_id IS NULL THEN
+SELECT
+    plan_id INTO v_plan_id
+FROM
+    RecipePlan
+WHERE
+    product_id = p_product_id
+ORDER BY
+    version_number DESC
+LIMIT
+    1;
+
+ELSE
+SELECT
+    plan_id INTO v_plan_id
+FROM
+    RecipePlan
+WHERE
+    plan_id = p_plan_id
+    AND product_id = p_product_id;
+
+IF v_plan_id IS NULL THEN SIGNAL SQLSTATE '45000'
+SET
+    MESSAGE_TEXT = 'Error: Recipe plan does not belong to this product.';
+
+END IF;
+
+END IF;
+
 -- Insert the product batch
 -- The FK (manufacturer_id, product_id) -> ManufacturerProduct
 -- ensures that this manufacturer actually owns this product.
@@ -123,7 +199,8 @@ INSERT INTO
         batch_id,
         produced_quantity,
         production_date,
-        expiration_date
+        expiration_date,
+        plan_id
     )
 VALUES
     (
@@ -139,9 +216,24 @@ VALUES
         p_batch_id,
         p_produced_quantity,
         p_production_date,
-        p_expiration_date
+        p_expiration_date,
+        v_plan_id
     );
 
+CALL SaveIdempotencyResult (
+    p_idempotency_key,
+    'RecordProductionBatch',
+    v_request_hash,
+    CONCAT(
+        p_product_id,
+        '-',
+        p_manufacturer_id,
+        '-',
+        p_batch_id
+    ),
+    p_produced_quantity
+);
+
 END $$
 -- ---------------------------------------------------------
 -- 3) RecordIngredientIntake
@@ -158,6 +250,7 @@ END $$
 --        * Computes quantity = pack_size * packs_received
 --        * Computes per_unit_cost = unit_price / pack_size
 --        * Inserts IngredientBatch (lot_number is set by trigger)
+--    - p_idempotency_key (optional): see RecordProductionBatch
 -- ---------------------------------------------------------
 CREATE PROCEDURE RecordIngredientIntake (
     IN p_ingredient_id INT,
@@ -165,11 +258,42 @@ CREATE PROCEDURE RecordIngredientIntake (
     IN p_batch_id INT,
     IN p_packs_received DOUBLE,
     IN p_expiration_date DATE,
-    IN p_version_number VARCHAR(255)
-) BEGIN DECLARE v_pack_size INT;
+    IN p_version_number VARCHAR(255),
+    IN p_idempotency_key VARCHAR(255)
+) proc: BEGIN DECLARE v_pack_size INT;
 
 DECLARE v_unit_price DOUBLE;
 
+DECLARE v_request_hash CHAR(64);
+
+DECLARE v_replay BOOLEAN;
+
+-- Replay a request that already succeeded under this key
+SET
+    v_request_hash = SHA2(
+        CONCAT_WS(
+            '|',
+            p_ingredient_id,
+            p_supplier_id,
+            p_batch_id,
+            p_packs_received,
+            p_expiration_date,
+            COALESCE(p_version_number, '')
+        ),
+        256
+    );
+
+CALL ClaimIdempotencyKey (
+    p_idempotency_key,
+    'RecordIngredientIntake',
+    v_request_hash,
+    v_replay
+);
+
+IF v_replay THEN LEAVE proc;
+
+END IF;
+
 -- Sanity check on packs received
 IF p_packs_received <= 0 THEN SIGNAL SQLSTATE '45000'
 SET
@@ -221,6 +345,20 @@ VALUES
         p_expiration_date
     );
 
+CALL SaveIdempotencyResult (
+    p_idempotency_key,
+    'RecordIngredientIntake',
+    v_request_hash,
+    CONCAT(
+        p_ingredient_id,
+        '-',
+        p_supplier_id,
+        '-',
+        p_batch_id
+    ),
+    v_pack_size * p_packs_received
+);
+
 END $$
 -- ---------------------------------------------------------
 -- 4) ConsumeIngredientLot
@@ -230,7 +368,9 @@ END $$
 --        * p_ingredient_lot_number  : IngredientBatch.lot_number
 --        * p_consumed_quantity_oz   : Quantity consumed from that lot
 --    - Logic:
---        * Validates product batch exists
+--        * Validates product batch exists and locks its row, so
+--          consumptions into the same batch run one at a time
+--          (keeps the incompatibility check race-free)
 --        * Inserts into IngredientConsumption
 --        * BEFORE INSERT trigger checks:
 --            - lot existence
@@ -239,12 +379,42 @@ END $$
 --            - incompatibility rules
 --            - decrements IngredientBatch.quantity
 --        * Calls RecalculateBatchCost to update batch_total_cost/unit_cost
+--    - p_idempotency_key (optional): see RecordProductionBatch
 -- ---------------------------------------------------------
 CREATE PROCEDURE ConsumeIngredientLot (
     IN p_product_lot_number VARCHAR(255),
     IN p_ingredient_lot_number VARCHAR(255),
-    IN p_consumed_quantity_oz DOUBLE
-) BEGIN
+    IN p_consumed_quantity_oz DOUBLE,
+    IN p_idempotency_key VARCHAR(255)
+) proc: BEGIN DECLARE v_product_lot VARCHAR(255);
+
+DECLARE v_request_hash CHAR(64);
+
+DECLARE v_replay BOOLEAN;
+
+-- Replay a request that already succeeded under this key
+SET
+    v_request_hash = SHA2(
+        CONCAT_WS(
+            '|',
+            p_product_lot_number,
+            p_ingredient_lot_number,
+            p_consumed_quantity_oz
+        ),
+        256
+    );
+
+CALL ClaimIdempotencyKey (
+    p_idempotency_key,
+    'ConsumeIngredientLot',
+    v_request_hash,
+    v_replay
+);
+
+IF v_replay THEN LEAVE proc;
+
+END IF;
+
 -- Basic sanity checks
 IF p_consumed_quantity_oz <= 0 THEN SIGNAL SQLSTATE '45000'
 SET
@@ -252,15 +422,18 @@ SET
 
 END IF;
 
--- Ensure product batch exists (FK would also catch it, but this gives clearer error)
-IF NOT EXISTS (
-    SELECT
-        1
-    FROM
-        ProductBatch
-    WHERE
-        lot_number = p_product_lot_number
-) THEN SIGNAL SQLSTATE '45000'
+-- Ensure product batch exists (FK would also catch it, but this gives clearer error).
+-- The product batch row is locked before the ingredient lot (taken by the
+-- trigger), so every consumption acquires locks in the same order.
+SELECT
+    lot_number INTO v_product_lot
+FROM
+    ProductBatch
+WHERE
+    lot_number = p_product_lot_number FOR
+UPDATE;
+
+IF v_product_lot IS NULL THEN SIGNAL SQLSTATE '45000'
 SET
     MESSAGE_TEXT = 'Error: Product batch lot does not exist.';
 
@@ -289,4 +462,459 @@ VALUES
 -- After successful consumption, recompute the cost for this product batch
 CALL RecalculateBatchCost (p_product_lot_number);
 
+CALL SaveIdempotencyResult (
+    p_idempotency_key,
+    'ConsumeIngredientLot',
+    v_request_hash,
+    p_ingredient_lot_number,
+    p_consumed_quantity_oz
+);
+
+END $$
+-- ---------------------------------------------------------
+-- 5) SnapshotRecipePlan
+--    - Freezes the product's current ProductBOM as the BOM of a
+--      recipe plan version (RecipePlanBOM)
+--    - A plan can only be snapshotted once; snapshots are immutable
+-- ---------------------------------------------------------
+CREATE PROCEDURE SnapshotRecipePlan (IN p_plan_id INT) BEGIN DECLARE v_product_id INT;
+
+SELECT
+    product_id INTO v_product_id
+FROM
+    RecipePlan
+WHERE
+    plan_id = p_plan_id;
+
+IF v_product_id IS NULL THEN SIGNAL SQLSTATE '45000'
+SET
+    MESSAGE_TEXT = 'Error: Recipe plan does not exist.';
+
+END IF;
+
+IF EXISTS (
+    SELECT
+        1
+    FROM
+        RecipePlanBOM
+    WHERE
+        plan_id = p_plan_id
+) THEN SIGNAL SQLSTATE '45000'
+SET
+    MESSAGE_TEXT = 'Error: Recipe plan BOM has already been snapshotted.';
+
+END IF;
+
+INSERT INTO
+    RecipePlanBOM (plan_id, ingredient_id, quantity)
+SELECT
+    p_plan_id,
+    ingredient_id,
+    quantity
+FROM
+    ProductBOM
+WHERE
+    product_id = v_product_id;
+
+END $$
+-- ---------------------------------------------------------
+-- 6) RebuildInventorySummary
+--    - Recomputes IngredientBatch.reserved_quantity from the OPEN
+--      LotReservation rows
+--    - Recomputes IngredientOnHand and IngredientOnHandByExpiry
+--      from IngredientBatch (repair after a bulk load or a
+--      failed verification)
+-- ---------------------------------------------------------
+CREATE PROCEDURE RebuildInventorySummary () BEGIN
+UPDATE IngredientBatch ib
+LEFT JOIN (
+    SELECT
+        lot_number,
+        SUM(quantity) AS reserved
+    FROM
+        LotReservation
+    WHERE
+        status = 'OPEN'
+    GROUP BY
+        lot_number
+) r ON r.lot_number = ib.lot_number
+SET
+    ib.reserved_quantity = COALESCE(r.reserved, 0)
+WHERE
+    ib.reserved_quantity <> COALESCE(r.reserved, 0);
+
+DELETE FROM IngredientOnHandByExpiry;
+
+DELETE FROM IngredientOnHand;
+
+INSERT INTO
+    IngredientOnHand (ingredient_id, quantity, reserved_quantity, lot_count)
+SELECT
+    ingredient_id,
+    SUM(quantity),
+    SUM(reserved_quantity),
+    SUM(quantity > 0)
+FROM
+    IngredientBatch
+GROUP BY
+    ingredient_id;
+
+INSERT INTO
+    IngredientOnHandByExpiry (ingredient_id, expiry_bucket, quantity, lot_count)
+SELECT
+    ingredient_id,
+    DATE_SUB(expiration_date, INTERVAL DAYOFMONTH(expiration_date) - 1 DAY),
+    SUM(quantity),
+    SUM(quantity > 0)
+FROM
+    IngredientBatch
+GROUP BY
+    ingredient_id,
+    DATE_SUB(expiration_date, INTERVAL DAYOFMONTH(expiration_date) - 1 DAY);
+
+END $$
+-- ---------------------------------------------------------
+-- 7) SweepExpiredLots
+--    - Moves LIVE lots past their expiration_date to EXPIRED
+--    - Recomputes ExpiringLot: live lots with stock that expire
+--      within p_window_days of today
+--    - Records the run in ExpirySweep
+--    - Expires open reservations (ExpireReservations)
+-- ---------------------------------------------------------
+CREATE PROCEDURE SweepExpiredLots (IN p_window_days INT) BEGIN DECLARE v_expired INT;
+
+DECLARE v_expiring INT;
+
+UPDATE IngredientBatch
+SET
+    status = 'EXPIRED'
+WHERE
+    status = 'LIVE'
+    AND expiration_date < CURDATE();
+
+SET
+    v_expired = ROW_COUNT();
+
+DELETE FROM ExpiringLot
+WHERE
+    window_days = p_window_days;
+
+INSERT INTO
+    ExpiringLot (
+        lot_number,
+        ingredient_id,
+        expiration_date,
+        computed_on,
+        window_days
+    )
+SELECT
+    lot_number,
+    ingredient_id,
+    expiration_date,
+    CURDATE(),
+    p_window_days
+FROM
+    IngredientBatch
+WHERE
+    status = 'LIVE'
+    AND quantity > 0
+    AND expiration_date BETWEEN CURDATE() AND DATE_ADD(CURDATE(), INTERVAL p_window_days DAY);
+
+SET
+    v_expiring = ROW_COUNT();
+
+INSERT INTO
+    ExpirySweep (
+        sweep_date,
+        window_days,
+        expired_lots,
+        expiring_lots,
+        swept_at
+    )
+VALUES
+    (CURDATE(), p_window_days, v_expired, v_expiring, NOW()) ON DUPLICATE KEY
+UPDATE
+    expired_lots = expired_lots + v_expired,
+    expiring_lots = v_expiring,
+    swept_at = NOW();
+
+CALL ExpireReservations ();
+
+END $$
+-- ---------------------------------------------------------
+-- 8) RebuildLotLineage
+--    - Recomputes LotLineage from IngredientConsumption
+-- ---------------------------------------------------------
+CREATE PROCEDURE RebuildLotLineage () BEGIN
+DELETE FROM LotLineage;
+
+INSERT INTO
+    LotLineage (
+        ingredient_lot_number,
+        product_lot_number,
+        ingredient_id,
+        supplier_id,
+        product_id,
+        manufacturer_id,
+        production_date,
+        consumed_quantity_oz
+    )
+SELECT
+    ic.ingredient_lot_number,
+    ic.product_lot_number,
+    ib.ingredient_id,
+    ib.supplier_id,
+    pb.product_id,
+    pb.manufacturer_id,
+    pb.production_date,
+    ic.consumed_quantity_oz
+FROM
+    IngredientConsumption ic
+    JOIN IngredientBatch ib ON ic.ingredient_lot_number = ib.lot_number
+    JOIN ProductBatch pb ON ic.product_lot_number = pb.lot_number;
+
+END $$
+-- ---------------------------------------------------------
+-- 9) ConvertReservation
+--    - Turns an OPEN lot reservation into consumption for a
+--      product batch of the same manufacturer, in one call
+--    - p_quantity: oz to consume (NULL = the whole reservation);
+--      any remainder is released with the reservation
+--    - Locks the product batch, then the reservation, then (via
+--      the consumption trigger) the lot, matching the lock order
+--      of ConsumeIngredientLot
+-- ---------------------------------------------------------
+CREATE PROCEDURE ConvertReservation (
+    IN p_reservation_id INT,
+    IN p_product_lot_number VARCHAR(255),
+    IN p_quantity DOUBLE
+) BEGIN DECLARE v_product_manufacturer VARCHAR(255);
+
+DECLARE v_manufacturer VARCHAR(255);
+
+DECLARE v_lot_number VARCHAR(255);
+
+DECLARE v_quantity DOUBLE;
+
+DECLARE v_status VARCHAR(16);
+
+DECLARE v_expires_at DATETIME;
+
+SELECT
+    manufacturer_id INTO v_product_manufacturer
+FROM
+    ProductBatch
+WHERE
+    lot_number = p_product_lot_number FOR
+UPDATE;
+
+IF v_product_manufacturer IS NULL THEN SIGNAL SQLSTATE '45000'
+SET
+    MESSAGE_TEXT = 'Error: Product batch lot does not exist.';
+
+END IF;
+
+SELECT
+    manufacturer_id,
+    lot_number,
+    quantity,
+    status,
+    expires_at INTO v_manufacturer,
+    v_lot_number,
+    v_quantity,
+    v_status,
+    v_expires_at
+FROM
+    LotReservation
+WHERE
+    reservation_id = p_reservation_id FOR
+UPDATE;
+
+IF v_status IS NULL THEN SIGNAL SQLSTATE '45000'
+SET
+    MESSAGE_TEXT = 'Error: Reservation does not exist.';
+
+END IF;
+
+IF v_status <> 'OPEN' THEN SIGNAL SQLSTATE '45000'
+SET
+    MESSAGE_TEXT = 'Error: Reservation is not open.';
+
+END IF;
+
+IF v_expires_at <= NOW() THEN SIGNAL SQLSTATE '45000'
+SET
+    MESSAGE_TEXT = 'Error: Reservation has expired.';
+
+END IF;
+
+IF v_manufacturer <> v_product_manufacturer THEN SIGNAL SQLSTATE '45000'
+SET
+    MESSAGE_TEXT = 'Error: Reservation belongs to a different manufacturer than the product batch.';
+
+END IF;
+
+IF p_quantity IS NULL THEN
+SET
+    p_quantity = v_quantity;
+
+END IF;
+
+IF p_quantity <= 0
+OR p_quantity > v_quantity THEN SIGNAL SQLSTATE '45000'
+SET
+    MESSAGE_TEXT = 'Error: Converted quantity must be positive and at most the reserved quantity.';
+
+END IF;
+
+-- Close the reservation first so its hold no longer blocks the consumption
+UPDATE LotReservation
+SET
+    status = 'CONVERTED',
+    product_lot_number = p_product_lot_number,
+    consumed_quantity_oz = p_quantity
+WHERE
+    reservation_id = p_reservation_id;
+
+-- Same path as ConsumeIngredientLot: the trigger validates and decrements
+INSERT INTO
+    IngredientConsumption (
+        product_lot_number,
+        ingredient_lot_number,
+        consumed_quantity_oz
+    )
+VALUES
+    (p_product_lot_number, v_lot_number, p_quantity);
+
+CALL RecalculateBatchCost (p_product_lot_number);
+
+END $$
+-- ---------------------------------------------------------
+-- 10) ExpireReservations
+--    - Closes OPEN reservations whose TTL has passed or whose lot
+--      has expired; the LotReservation trigger releases the hold
+--    - Both scans use an index on (status, ...) so the cost follows
+--      the number of reservations due, not all open ones
+-- ---------------------------------------------------------
+CREATE PROCEDURE ExpireReservations () BEGIN
+UPDATE LotReservation
+SET
+    status = 'EXPIRED'
+WHERE
+    status = 'OPEN'
+    AND expires_at <= NOW();
+
+UPDATE LotReservation
+SET
+    status = 'EXPIRED'
+WHERE
+    status = 'OPEN'
+    AND lot_expiration_date < CURDATE();
+
+END $$
+-- ---------------------------------------------------------
+-- 11) ClaimIdempotencyKey
+--    - Called first by the procedures that take an idempotency key
+--    - p_key NULL: no idempotency, p_replay = FALSE
+--    - Key already recorded for the same operation and request
+--      hash: p_replay = TRUE and the caller returns without doing
+--      anything; the stored outcome is in IdempotencyKey
+--    - Key recorded for a different operation or arguments: error
+--    - Sets @idempotency_replayed (0/1) for the client to read
+--    - The key row (or its gap) stays locked until commit, so a
+--      concurrent duplicate waits and then replays (or is retried
+--      after a deadlock by Database.run_transaction)
+-- ---------------------------------------------------------
+CREATE PROCEDURE ClaimIdempotencyKey (
+    IN p_key VARCHAR(255),
+    IN p_operation VARCHAR(64),
+    IN p_request_hash CHAR(64),
+    OUT p_replay BOOLEAN
+) BEGIN DECLARE v_operation VARCHAR(64);
+
+DECLARE v_request_hash CHAR(64);
+
+SET
+    p_replay = FALSE,
+    @idempotency_replayed = 0;
+
+IF p_key IS NOT NULL THEN
+SELECT
+    operation,
+    request_hash INTO v_operation,
+    v_request_hash
+FROM
+    IdempotencyKey
+WHERE
+    idempotency_key = p_key FOR
+UPDATE;
+
+IF v_operation IS NOT NULL THEN IF v_operation <> p_operation
+OR v_request_hash <> p_request_hash THEN SIGNAL SQLSTATE '45000'
+SET
+    MESSAGE_TEXT = 'Error: Idempotency key was already used for a different request.';
+
+END IF;
+
+UPDATE IdempotencyKey
+SET
+    replay_count = replay_count + 1,
+    last_replayed_at = NOW()
+WHERE
+    idempotency_key = p_key;
+
+SET
+    p_replay = TRUE,
+    @idempotency_replayed = 1;
+
+END IF;
+
+END IF;
+
+END $$
+-- ---------------------------------------------------------
+-- 12) SaveIdempotencyResult
+--    - Called last by the same procedures; stores the outcome
+--      (lot created or consumed, and its quantity) under the key
+--      in the same transaction as the work itself
+-- ---------------------------------------------------------
+CREATE PROCEDURE SaveIdempotencyResult (
+    IN p_key VARCHAR(255),
+    IN p_operation VARCHAR(64),
+    IN p_request_hash CHAR(64),
+    IN p_result_lot_number VARCHAR(255),
+    IN p_result_quantity DOUBLE
+) BEGIN IF p_key IS NOT NULL THEN
+INSERT INTO
+    IdempotencyKey (
+        idempotency_key,
+        operation,
+        request_hash,
+        result_lot_number,
+        result_quantity,
+        created_at
+    )
+VALUES
+    (
+        p_key,
+        p_operation,
+        p_request_hash,
+        p_result_lot_number,
+        p_result_quantity,
+        NOW()
+    );
+
+END IF;
+
+END $$
+-- ---------------------------------------------------------
+-- 13) PurgeIdempotencyKeys
+--    - Deletes keys older than p_days; clients must not retry a
+--      request longer than that
+-- ---------------------------------------------------------
+CREATE PROCEDURE PurgeIdempotencyKeys (IN p_days INT) BEGIN
+DELETE FROM IdempotencyKey
+WHERE
+    created_at < DATE_SUB(NOW(), INTERVAL p_days DAY);
+
 END $$ DELIMITER;
\ No newline at end of file
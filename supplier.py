@@ -1,10 +1,27 @@
 from database import Database
+from metrics import action
+from compatibility import CompatibilityMatrix
+from ingredient_closure import IngredientFlattener, FormulationCycleError
+from idempotency import IdempotentCall, new_key
+from bulk_intake import BulkIntake
+from audit_log import AuditLog
 from datetime import datetime, timedelta
 
 class Supplier:
-    def __init__(self, db: Database, user_id: str):
+    def __init__(self, db: Database, user_id: str, audit: AuditLog = None,
+                 reference_db: Database = None, on_reference_change=None):
         self.db = db
         self.user_id = user_id
+        # Ingredients, formulations and do-not-combine pairs are shared
+        # reference data: with shards they are written to the home database
+        # and on_reference_change(ingredient_ids) copies them to the shards
+        self.reference_db = reference_db or db
+        self.on_reference_change = on_reference_change
+        # Every write below is recorded (asynchronously) in the audit trail
+        self.audit = audit or AuditLog.default()
+    
+    def _audit(self, operation, params, error=None):
+        self.audit.record(self.user_id, 'SUPPLIER', operation, params, error)
     
     def menu(self):
         """Main supplier menu"""
@@ -14,7 +31,8 @@ class Supplier:
             print("2. Ingredients -> Create/Update")
             print("3. Ingredients -> Do-Not-Combine")
             print("4. Inventory -> Receive Ingredient Batch")
-            print("5. Exit")
+            print("5. Inventory -> Bulk Receive (CSV)")
+            print("6. Exit")
             
             choice = input("Select option: ").strip()
             
@@ -27,10 +45,13 @@ class Supplier:
             elif choice == '4':
                 self.receive_ingredient_batch()
             elif choice == '5':
+                self.bulk_receive_ingredient_batches()
+            elif choice == '6':
                 break
             else:
                 print("Invalid option")
     
+    @action
     def manage_ingredients_supplied(self):
         """Manage which ingredients this supplier can provide"""
         print("\n=== Manage Ingredients Supplied ===")
@@ -44,7 +65,7 @@ class Supplier:
             WHERE iform.supplier_id = %s
             GROUP BY i.id, i.name, i.type
         """
-        supplied = self.db.execute(query, (self.user_id,))
+        supplied = self.reference_db.execute(query, (self.user_id,))
         
         print("\nCurrently supplied ingredients:")
         if supplied:
@@ -54,7 +75,7 @@ class Supplier:
             print("  None")
         
         # List all ingredients
-        all_ingredients = self.db.execute("SELECT id, name, type FROM Ingredient ORDER BY name")
+        all_ingredients = self.reference_db.execute("SELECT id, name, type FROM Ingredient ORDER BY name")
         print("\nAll available ingredients:")
         for ing in all_ingredients:
             print(f"  {ing['id']}: {ing['name']} ({ing['type']})")
@@ -66,7 +87,7 @@ class Supplier:
                 
                 # Verify ingredient exists
                 verify_query = "SELECT id, name FROM Ingredient WHERE id = %s"
-                ing_check = self.db.execute(verify_query, (ingredient_id,))
+                ing_check = self.reference_db.execute(verify_query, (ingredient_id,))
                 if not ing_check:
                     print("Ingredient not found")
                     return
@@ -97,22 +118,29 @@ class Supplier:
                      validity_start_date, validity_end_date)
                     VALUES (%s, %s, %s, %s, %s, %s, %s)
                 """
+                audit_params = {'ingredient_id': ingredient_id, 'version_number': version,
+                                'unit_price': unit_price, 'pack_size': pack_size,
+                                'validity_start_date': validity_start, 'validity_end_date': validity_end}
                 try:
-                    self.db.execute(insert_query, 
+                    self.reference_db.execute(insert_query, 
                         (ingredient_id, self.user_id, version, unit_price, pack_size, 
                          validity_start, validity_end), fetch=False)
+                    self._audit('add_formulation', audit_params)
                     print(f"Ingredient '{ingredient_name}' added to supplied list")
+                    self.refresh_derived_tables([ingredient_id])
                 except Exception as e:
+                    self._audit('add_formulation', audit_params, e)
                     print(f"Error: {e}")
             except ValueError:
                 print("Invalid input")
     
+    @action
     def create_update_ingredient(self):
         """Create or update an ingredient (atomic or compound)"""
         print("\n=== Create/Update Ingredient ===")
         
         # List existing ingredients
-        ingredients = self.db.execute("SELECT id, name, type FROM Ingredient ORDER BY name")
+        ingredients = self.reference_db.execute("SELECT id, name, type FROM Ingredient ORDER BY name")
         print("\nExisting ingredients:")
         for ing in ingredients:
             print(f"  {ing['id']}: {ing['name']} ({ing['type']})")
@@ -133,21 +161,24 @@ class Supplier:
             
             insert_query = "INSERT INTO Ingredient (name, type) VALUES (%s, %s)"
             try:
-                self.db.execute(insert_query, (name, ing_type), fetch=False)
-                ingredient_id = self.db.cursor.lastrowid
+                self.reference_db.execute(insert_query, (name, ing_type), fetch=False)
+                ingredient_id = self.reference_db.lastrowid
+                self._audit('create_ingredient', {'ingredient_id': ingredient_id, 'name': name, 'type': ing_type})
                 print(f"Ingredient created with ID: {ingredient_id}")
+                self.refresh_derived_tables([ingredient_id])
                 
                 # If compound, add materials
                 if ing_type == 'COMPOUND':
                     self.add_compound_materials(ingredient_id)
             except Exception as e:
+                self._audit('create_ingredient', {'name': name, 'type': ing_type}, e)
                 print(f"Error creating ingredient: {e}")
         elif action == 'u':
             try:
                 ingredient_id = int(input("Enter ingredient ID to update: "))
                 # For now, just confirm it exists
                 verify_query = "SELECT id, name, type FROM Ingredient WHERE id = %s"
-                ing = self.db.execute(verify_query, (ingredient_id,))
+                ing = self.reference_db.execute(verify_query, (ingredient_id,))
                 if ing:
                     print(f"Found: {ing[0]['name']} ({ing[0]['type']})")
                     print("Note: Direct ingredient updates not implemented. Use formulations to manage compound materials.")
@@ -156,15 +187,28 @@ class Supplier:
             except ValueError:
                 print("Invalid ingredient ID")
     
+    def refresh_derived_tables(self, ingredient_ids):
+        """Bring the ingredient closure and product conflict matrix up to date"""
+        try:
+            IngredientFlattener(self.reference_db).refresh(ingredient_ids)
+            CompatibilityMatrix(self.reference_db).refresh_ingredients(ingredient_ids)
+            if self.on_reference_change:
+                self.on_reference_change(ingredient_ids)
+        except FormulationCycleError as e:
+            print(f"Warning: {e}")
+        except Exception as e:
+            # The write itself is committed; a later sync copies it
+            print(f"Warning: reference data not synced: {e}")
+    
     def add_compound_materials(self, compound_id):
         """Add materials to a compound ingredient"""
-        print("\nAdd materials (one level only):")
+        print("\nAdd materials (compounds may contain other compounds):")
         
-        atomic_ingredients = self.db.execute(
-            "SELECT id, name FROM Ingredient WHERE type = 'ATOMIC' ORDER BY name"
+        material_ingredients = self.reference_db.execute(
+            "SELECT id, name FROM Ingredient WHERE id <> %s ORDER BY name", (compound_id,)
         )
-        print("\nAvailable atomic ingredients:")
-        for ing in atomic_ingredients:
+        print("\nAvailable ingredients:")
+        for ing in material_ingredients:
             print(f"  {ing['id']}: {ing['name']}")
         
         materials = []
@@ -187,6 +231,7 @@ class Supplier:
             print("Note: Materials should be added via formulation.")
             print("Create a formulation for this compound ingredient to define its materials.")
     
+    @action
     def maintain_do_not_combine(self):
         """Maintain do-not-combine list (Grad feature)"""
         print("\n=== Do-Not-Combine List ===")
@@ -200,7 +245,7 @@ class Supplier:
             JOIN Ingredient i2 ON ii.ingredient_b = i2.id
             ORDER BY i1.name, i2.name
         """
-        incompatibilities = self.db.execute(query)
+        incompatibilities = self.reference_db.execute(query)
         
         print("\nCurrent incompatibilities:")
         if incompatibilities:
@@ -211,7 +256,7 @@ class Supplier:
         
         action = input("\nAdd new incompatibility? (y/n): ").strip().lower()
         if action == 'y':
-            ingredients = self.db.execute("SELECT id, name FROM Ingredient ORDER BY name")
+            ingredients = self.reference_db.execute("SELECT id, name FROM Ingredient ORDER BY name")
             print("\nAvailable ingredients:")
             for ing in ingredients:
                 print(f"  {ing['id']}: {ing['name']}")
@@ -233,14 +278,19 @@ class Supplier:
                     VALUES (%s, %s)
                     ON DUPLICATE KEY UPDATE ingredient_a = ingredient_a
                 """
+                audit_params = {'ingredient_a': ing_a, 'ingredient_b': ing_b}
                 try:
-                    self.db.execute(insert_query, (ing_a, ing_b), fetch=False)
+                    self.reference_db.execute(insert_query, (ing_a, ing_b), fetch=False)
+                    self._audit('add_incompatibility', audit_params)
                     print("Incompatibility added successfully")
+                    self.refresh_derived_tables([ing_a, ing_b])
                 except Exception as e:
+                    self._audit('add_incompatibility', audit_params, e)
                     print(f"Error: {e}")
             except ValueError:
                 print("Invalid ingredient ID")
     
+    @action
     def receive_ingredient_batch(self):
         """Receive/create an ingredient batch"""
         print("\n=== Receive Ingredient Batch ===")
@@ -304,23 +354,32 @@ class Supplier:
             expiration_date_str = input("Expiration date (YYYY-MM-DD): ").strip()
             expiration_date = datetime.strptime(expiration_date_str, '%Y-%m-%d').date()
             
-            # Use stored procedure
+            # Use stored procedure (retried safely if the connection drops)
+            audit_params = {'ingredient_id': ingredient_id, 'batch_id': batch_id,
+                            'packs_received': packs_received, 'expiration_date': expiration_date,
+                            'version_number': form['version_number']}
             try:
-                self.db.execute_procedure(
+                outcome = IdempotentCall(self.db).call(
                     'RecordIngredientIntake',
                     (ingredient_id, self.user_id, batch_id, packs_received, 
-                     expiration_date, str(form['version_number']))
+                     expiration_date, str(form['version_number'])),
+                    new_key()
                 )
-                
-                # Get the created lot number
+            except Exception as e:
+                self._audit('receive_ingredient_batch', audit_params, e)
+                print(f"Error: {e}")
+                return
+            audit_params['lot_number'] = outcome['lot_number'] if outcome else None
+            self._audit('receive_ingredient_batch', audit_params)
+            
+            try:
+                # Get the created lot
                 lot_query = """
                     SELECT lot_number, quantity, per_unit_cost
                     FROM IngredientBatch
-                    WHERE ingredient_id = %s AND supplier_id = %s AND batch_id = %s
-                    ORDER BY expiration_date DESC
-                    LIMIT 1
+                    WHERE lot_number = %s
                 """
-                lot_result = self.db.execute(lot_query, (ingredient_id, self.user_id, batch_id))
+                lot_result = self.db.execute(lot_query, (outcome['lot_number'],)) if outcome else []
                 
                 if lot_result:
                     lot = lot_result[0]
@@ -336,6 +395,44 @@ class Supplier:
             print("Invalid input")
         except Exception as e:
             print(f"Error: {e}")
-
-
-
+    
+    @action
+    def bulk_receive_ingredient_batches(self):
+        """Receive many ingredient batches from a CSV file"""
+        print("\n=== Bulk Receive Ingredient Batches ===")
+        print("CSV columns: ingredient (ID or name), batch_id, packs, expiration_date (YYYY-MM-DD),")
+        print("             version (blank = latest active formulation)")
+        
+        path = input("CSV file: ").strip()
+        if not path:
+            return
+        
+        intake = BulkIntake(self.db, self.user_id)
+        try:
+            report = intake.validate(intake.read_csv(path))
+        except (OSError, ValueError) as e:
+            print(f"Error reading file: {e}")
+            return
+        
+        accepted = [e for e in report if e['status'] == 'ACCEPTED']
+        rejected = [e for e in report if e['status'] == 'REJECTED']
+        print(f"\n{len(report)} rows: {len(accepted)} accepted, {len(rejected)} rejected")
+        for e in rejected:
+            print(f"  Line {e['line']}: {e['reason']}")
+        
+        if accepted and input(f"Receive the {len(accepted)} accepted lots? (y/n): ").strip().lower() == 'y':
+            audit_params = {'path': path, 'lot_numbers': [e['lot_number'] for e in accepted],
+                            'rejected': len(rejected)}
+            try:
+                intake.load(report)
+                self._audit('bulk_receive_ingredient_batches', audit_params)
+                print(f"✓ {len(accepted)} lots received")
+            except Exception as e:
+                self._audit('bulk_receive_ingredient_batches', audit_params, e)
+                print(f"Error: {e} (no lots were received)")
+                return
+        
+        report_path = input("Save report to (blank to skip): ").strip()
+        if report_path:
+            BulkIntake.write_report(report, report_path)
+            print(f"Report written to {report_path}")
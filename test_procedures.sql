@@ -4,11 +4,20 @@ CALL RecordProductionBatch (
     1, -- batch_id
     1000, -- produced_quantity
     '2025-11-15',
-    '2026-01-15'
+    '2026-01-15',
+    NULL, -- plan_id (latest recipe plan)
+    NULL -- idempotency_key (none)
 );
 
 -- Suppose that created lot_number '100-MFG001-1'
 -- and you already have an IngredientBatch with lot_number '5-SUP001-10'
-CALL ConsumeIngredientLot ('100-MFG001-1', '5-SUP001-10', 20.0);
+CALL ConsumeIngredientLot ('100-MFG001-1', '5-SUP001-10', 20.0, NULL);
+
+-- Same call with a key: running it twice consumes only once
+CALL ConsumeIngredientLot ('100-MFG001-1', '5-SUP001-11', 20.0, 'example-key-1');
+
+CALL ConsumeIngredientLot ('100-MFG001-1', '5-SUP001-11', 20.0, 'example-key-1');
+
+SELECT @idempotency_replayed;
 
 CALL RecalculateBatchCost ('<product_lot>');
\ No newline at end of file
@@ -0,0 +1,111 @@
+from database import Database
+
+# Forward trace starting points
+TRACE_KINDS = ('ingredient', 'lot', 'supplier')
+
+class TraceabilityEngine:
+    """Forward and backward recall traces over the LotLineage edges"""
+    
+    def __init__(self, db: Database):
+        self.db = db
+    
+    def forward_query(self, kind, key, start_date=None, end_date=None):
+        """Return (query, params) listing every product lot affected by kind/key
+        
+        kind is 'ingredient' (ingredient id, including every compound that
+        contains it through any formulation), 'lot' (ingredient lot number)
+        or 'supplier' (supplier id). The optional dates bound production_date.
+        """
+        if kind not in TRACE_KINDS:
+            raise ValueError(f"Unknown trace kind: {kind}")
+        
+        prefix = ""
+        params = []
+        if kind == 'ingredient':
+            # Compounds that contain the ingredient at any depth, in any formulation
+            prefix = """
+                WITH RECURSIVE containing (ingredient_id) AS (
+                    SELECT %s
+                    UNION
+                    SELECT inf.ingredient_id
+                    FROM containing c
+                    JOIN FormulationMaterial fm ON fm.ingredient_id = c.ingredient_id
+                    JOIN IngredientFormulation inf ON fm.formulation_id = inf.id
+                )
+            """
+            params.append(int(key))
+            conditions = ["ll.ingredient_id IN (SELECT ingredient_id FROM containing)"]
+        elif kind == 'lot':
+            conditions = ["ll.ingredient_lot_number = %s"]
+            params.append(key)
+        else:
+            conditions = ["ll.supplier_id = %s"]
+            params.append(key)
+        
+        if start_date is not None:
+            conditions.append("ll.production_date >= %s")
+            params.append(start_date)
+        if end_date is not None:
+            conditions.append("ll.production_date <= %s")
+            params.append(end_date)
+        
+        query = prefix + f"""
+            SELECT pb.lot_number, pb.product_id, p.name as product_name,
+                   pb.manufacturer_id,
+                   CONCAT(u.first_name, ' ', COALESCE(u.last_name, '')) as manufacturer_name,
+                   pb.produced_quantity, pb.production_date, pb.expiration_date,
+                   pb.batch_total_cost, pb.unit_cost,
+                   SUM(ll.consumed_quantity_oz) as implicated_quantity_oz,
+                   COUNT(*) as implicated_lots
+            FROM LotLineage ll
+            JOIN ProductBatch pb ON ll.product_lot_number = pb.lot_number
+            JOIN Product p ON pb.product_id = p.id
+            JOIN UserDetails u ON pb.manufacturer_id = u.id
+            WHERE {' AND '.join(conditions)}
+            GROUP BY pb.lot_number, pb.product_id, p.name, pb.manufacturer_id,
+                     u.first_name, u.last_name, pb.produced_quantity,
+                     pb.production_date, pb.expiration_date,
+                     pb.batch_total_cost, pb.unit_cost
+            ORDER BY pb.production_date, pb.lot_number
+        """
+        return query, params
+    
+    def forward(self, kind, key, start_date=None, end_date=None):
+        """Every product lot affected by an ingredient, ingredient lot or supplier"""
+        query, params = self.forward_query(kind, key, start_date, end_date)
+        return self.db.execute(query, params)
+    
+    def backward(self, product_lot_number):
+        """Every ingredient lot (with its supplier) that went into a product lot"""
+        query = """
+            SELECT ll.ingredient_lot_number, ll.ingredient_id, i.name as ingredient_name,
+                   i.type as ingredient_type, ll.supplier_id,
+                   CONCAT(u.first_name, ' ', COALESCE(u.last_name, '')) as supplier_name,
+                   ll.consumed_quantity_oz, ib.expiration_date
+            FROM LotLineage ll
+            JOIN IngredientBatch ib ON ll.ingredient_lot_number = ib.lot_number
+            JOIN Ingredient i ON ll.ingredient_id = i.id
+            JOIN UserDetails u ON ll.supplier_id = u.id
+            WHERE ll.product_lot_number = %s
+            ORDER BY i.name, ll.ingredient_lot_number
+        """
+        return self.db.execute(query, (product_lot_number,))
+    
+    def backward_materials(self, product_lot_number):
+        """Materials of the compound lots in a product lot, per supplier formulation"""
+        query = """
+            SELECT ll.ingredient_lot_number, inf.version_number,
+                   fm.ingredient_id as material_id, i.name as material_name
+            FROM LotLineage ll
+            JOIN IngredientFormulation inf
+                ON inf.ingredient_id = ll.ingredient_id AND inf.supplier_id = ll.supplier_id
+            JOIN FormulationMaterial fm ON fm.formulation_id = inf.id
+            JOIN Ingredient i ON fm.ingredient_id = i.id
+            WHERE ll.product_lot_number = %s
+            ORDER BY ll.ingredient_lot_number, inf.version_number, i.name
+        """
+        return self.db.execute(query, (product_lot_number,))
+    
+    def rebuild(self):
+        """Recompute LotLineage from IngredientConsumption"""
+        self.db.execute_procedure('RebuildLotLineage')
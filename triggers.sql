@@ -1,7 +1,8 @@
 -- =========================================================
 -- triggers.sql
 -- All triggers: lot numbering, role validation, inventory,
--- expiry rules, and incompatibility checks.
+-- expiry rules, incompatibility checks, lot reservations and the
+-- inventory event outbox.
 -- =========================================================
 DELIMITER $$
 -- ---------------------------------------------------------
@@ -32,11 +33,14 @@ END IF;
 END $$
 -- ---------------------------------------------------------
 -- 2) IngredientConsumption: BEFORE INSERT
+--    - Locks the ingredient lot row (SELECT ... FOR UPDATE) so
+--      concurrent consumptions of the same lot are serialized
 --    - Validates ingredient lot exists
 --    - Rejects expired lots
---    - Ensures sufficient quantity
+--    - Ensures sufficient unreserved quantity
 --    - Enforces IngredientIncompatibility rules per product batch
---    - Decrements IngredientBatch.quantity for the consumed lot
+--    - Decrements IngredientBatch.quantity for the consumed lot with
+--      a conditional UPDATE, so the lot can never go negative
 -- ---------------------------------------------------------
 CREATE TRIGGER trg_prevent_expired_consumption BEFORE
 INSERT
@@ -44,21 +48,32 @@ INSERT
 
 DECLARE current_quantity DOUBLE;
 
+DECLARE v_reserved DOUBLE;
+
+DECLARE v_status VARCHAR(16);
+
 DECLARE v_new_ingredient_id INT;
 
 DECLARE v_conflicts INT;
 
--- Look up expiration, remaining quantity, and ingredient id
+-- Look up expiration, remaining quantity, and ingredient id.
+-- FOR UPDATE holds the lot row until commit: a concurrent consumption
+-- of the same lot waits here and then sees the decremented quantity.
 SELECT
     expiration_date,
     quantity,
-    ingredient_id INTO expiration_date_check,
+    reserved_quantity,
+    ingredient_id,
+    status INTO expiration_date_check,
     current_quantity,
-    v_new_ingredient_id
+    v_reserved,
+    v_new_ingredient_id,
+    v_status
 FROM
     IngredientBatch
 WHERE
-    lot_number = NEW.ingredient_lot_number;
+    lot_number = NEW.ingredient_lot_number FOR
+UPDATE;
 
 -- Ingredient lot must exist
 IF expiration_date_check IS NULL THEN SIGNAL SQLSTATE '45000'
@@ -67,15 +82,17 @@ SET
 
 END IF;
 
--- Reject if the lot is already expired
-IF CURDATE() > expiration_date_check THEN SIGNAL SQLSTATE '45000'
+-- Reject if the lot is already expired (or swept to EXPIRED)
+IF CURDATE() > expiration_date_check
+OR v_status = 'EXPIRED' THEN SIGNAL SQLSTATE '45000'
 SET
     MESSAGE_TEXT = 'Error: Consumption rejected because the ingredient lot has expired.';
 
 END IF;
 
--- Reject if there is not enough quantity left
-IF current_quantity < NEW.consumed_quantity_oz THEN SIGNAL SQLSTATE '45000'
+-- Reject if there is not enough quantity left outside open reservations
+-- (ConvertReservation closes its reservation before consuming)
+IF current_quantity - v_reserved < NEW.consumed_quantity_oz THEN SIGNAL SQLSTATE '45000'
 SET
     MESSAGE_TEXT = 'Error: Insufficient quantity in ingredient lot for this consumption.';
 
@@ -105,12 +122,20 @@ SET
 
 END IF;
 
--- Reserve the quantity by decrementing the lot
+-- Reserve the quantity by decrementing the lot. The quantity guard
+-- makes the decrement atomic even if the lock above is ever bypassed.
 UPDATE IngredientBatch
 SET
     quantity = quantity - NEW.consumed_quantity_oz
 WHERE
-    lot_number = NEW.ingredient_lot_number;
+    lot_number = NEW.ingredient_lot_number
+    AND quantity - reserved_quantity >= NEW.consumed_quantity_oz;
+
+IF ROW_COUNT() = 0 THEN SIGNAL SQLSTATE '45000'
+SET
+    MESSAGE_TEXT = 'Error: Insufficient quantity in ingredient lot for this consumption.';
+
+END IF;
 
 END $$
 -- ---------------------------------------------------------
@@ -290,4 +315,396 @@ SET
 
 END IF;
 
+END $$
+-- ---------------------------------------------------------
+-- 11) RecipePlanBOM: BEFORE UPDATE / BEFORE DELETE
+--     - Plan BOM snapshots are immutable once written; create a
+--       new RecipePlan version instead of editing an old one
+-- ---------------------------------------------------------
+CREATE TRIGGER trg_recipe_plan_bom_pre_update BEFORE
+UPDATE ON RecipePlanBOM FOR EACH ROW BEGIN SIGNAL SQLSTATE '45000'
+SET
+    MESSAGE_TEXT = 'Error: Recipe plan BOM snapshots are immutable. Create a new plan version instead.';
+
+END $$
+CREATE TRIGGER trg_recipe_plan_bom_pre_delete BEFORE DELETE ON RecipePlanBOM FOR EACH ROW BEGIN SIGNAL SQLSTATE '45000'
+SET
+    MESSAGE_TEXT = 'Error: Recipe plan BOM snapshots are immutable. Create a new plan version instead.';
+
+END $$
+-- ---------------------------------------------------------
+-- 12) IngredientBatch: AFTER INSERT / AFTER UPDATE / AFTER DELETE
+--     - Keep IngredientOnHand and IngredientOnHandByExpiry in step
+--       with every lot change in the same transaction. Intake
+--       inserts lots; consumption (and its roll-back) updates
+--       IngredientBatch.quantity, so both paths land here.
+--     - Reservation changes to IngredientBatch.reserved_quantity
+--       are carried into IngredientOnHand.reserved_quantity
+-- ---------------------------------------------------------
+CREATE TRIGGER trg_ingredient_batch_summary_insert
+AFTER
+INSERT
+    ON IngredientBatch FOR EACH ROW BEGIN
+INSERT INTO
+    IngredientOnHand (ingredient_id, quantity, lot_count)
+VALUES
+    (NEW.ingredient_id, NEW.quantity, NEW.quantity > 0) ON DUPLICATE KEY
+UPDATE
+    quantity = quantity + NEW.quantity,
+    lot_count = lot_count + (NEW.quantity > 0);
+
+INSERT INTO
+    IngredientOnHandByExpiry (ingredient_id, expiry_bucket, quantity, lot_count)
+VALUES
+    (
+        NEW.ingredient_id,
+        DATE_SUB(NEW.expiration_date, INTERVAL DAYOFMONTH(NEW.expiration_date) - 1 DAY),
+        NEW.quantity,
+        NEW.quantity > 0
+    ) ON DUPLICATE KEY
+UPDATE
+    quantity = quantity + NEW.quantity,
+    lot_count = lot_count + (NEW.quantity > 0);
+
+END $$
+CREATE TRIGGER trg_ingredient_batch_summary_update
+AFTER
+UPDATE ON IngredientBatch FOR EACH ROW BEGIN
+-- Status-only changes (expiry sweeps) leave the summary untouched
+IF OLD.quantity <> NEW.quantity
+OR OLD.ingredient_id <> NEW.ingredient_id
+OR OLD.expiration_date <> NEW.expiration_date THEN
+-- Remove the old row image ...
+UPDATE IngredientOnHand
+SET
+    quantity = quantity - OLD.quantity,
+    lot_count = lot_count - (OLD.quantity > 0)
+WHERE
+    ingredient_id = OLD.ingredient_id;
+
+UPDATE IngredientOnHandByExpiry
+SET
+    quantity = quantity - OLD.quantity,
+    lot_count = lot_count - (OLD.quantity > 0)
+WHERE
+    ingredient_id = OLD.ingredient_id
+    AND expiry_bucket = DATE_SUB(OLD.expiration_date, INTERVAL DAYOFMONTH(OLD.expiration_date) - 1 DAY);
+
+-- ... and add the new one (handles ingredient / expiry changes too)
+INSERT INTO
+    IngredientOnHand (ingredient_id, quantity, lot_count)
+VALUES
+    (NEW.ingredient_id, NEW.quantity, NEW.quantity > 0) ON DUPLICATE KEY
+UPDATE
+    quantity = quantity + NEW.quantity,
+    lot_count = lot_count + (NEW.quantity > 0);
+
+INSERT INTO
+    IngredientOnHandByExpiry (ingredient_id, expiry_bucket, quantity, lot_count)
+VALUES
+    (
+        NEW.ingredient_id,
+        DATE_SUB(NEW.expiration_date, INTERVAL DAYOFMONTH(NEW.expiration_date) - 1 DAY),
+        NEW.quantity,
+        NEW.quantity > 0
+    ) ON DUPLICATE KEY
+UPDATE
+    quantity = quantity + NEW.quantity,
+    lot_count = lot_count + (NEW.quantity > 0);
+
+END IF;
+
+IF OLD.reserved_quantity <> NEW.reserved_quantity THEN
+UPDATE IngredientOnHand
+SET
+    reserved_quantity = reserved_quantity + NEW.reserved_quantity - OLD.reserved_quantity
+WHERE
+    ingredient_id = NEW.ingredient_id;
+
+END IF;
+
+END $$
+CREATE TRIGGER trg_ingredient_batch_summary_delete
+AFTER DELETE ON IngredientBatch FOR EACH ROW BEGIN
+UPDATE IngredientOnHand
+SET
+    quantity = quantity - OLD.quantity,
+    reserved_quantity = reserved_quantity - OLD.reserved_quantity,
+    lot_count = lot_count - (OLD.quantity > 0)
+WHERE
+    ingredient_id = OLD.ingredient_id;
+
+UPDATE IngredientOnHandByExpiry
+SET
+    quantity = quantity - OLD.quantity,
+    lot_count = lot_count - (OLD.quantity > 0)
+WHERE
+    ingredient_id = OLD.ingredient_id
+    AND expiry_bucket = DATE_SUB(OLD.expiration_date, INTERVAL DAYOFMONTH(OLD.expiration_date) - 1 DAY);
+
+END $$
+-- ---------------------------------------------------------
+-- 13) IngredientConsumption: AFTER INSERT / AFTER DELETE
+--     - Maintain the LotLineage edge of every consumption row
+-- ---------------------------------------------------------
+CREATE TRIGGER trg_ingredient_consumption_lineage_insert
+AFTER
+INSERT
+    ON IngredientConsumption FOR EACH ROW BEGIN
+INSERT INTO
+    LotLineage (
+        ingredient_lot_number,
+        product_lot_number,
+        ingredient_id,
+        supplier_id,
+        product_id,
+        manufacturer_id,
+        production_date,
+        consumed_quantity_oz
+    )
+SELECT
+    ib.lot_number,
+    pb.lot_number,
+    ib.ingredient_id,
+    ib.supplier_id,
+    pb.product_id,
+    pb.manufacturer_id,
+    pb.production_date,
+    NEW.consumed_quantity_oz
+FROM
+    IngredientBatch ib
+    JOIN ProductBatch pb ON pb.lot_number = NEW.product_lot_number
+WHERE
+    ib.lot_number = NEW.ingredient_lot_number;
+
+END $$
+CREATE TRIGGER trg_ingredient_consumption_lineage_delete
+AFTER DELETE ON IngredientConsumption FOR EACH ROW BEGIN
+DELETE FROM LotLineage
+WHERE
+    ingredient_lot_number = OLD.ingredient_lot_number
+    AND product_lot_number = OLD.product_lot_number;
+
+END $$
+-- ---------------------------------------------------------
+-- 14) LotReservation: BEFORE INSERT
+--     - Locks the ingredient lot row (same lock as consumption)
+--     - Lot must exist, be LIVE and not expired
+--     - Quantity must fit in the lot's unreserved quantity
+--     - expires_at must be in the future
+--     - Copies ingredient_id / lot_expiration_date from the lot
+-- ---------------------------------------------------------
+CREATE TRIGGER trg_lot_reservation_pre_insert BEFORE
+INSERT
+    ON LotReservation FOR EACH ROW BEGIN DECLARE v_quantity DOUBLE;
+
+DECLARE v_reserved DOUBLE;
+
+DECLARE v_expiration DATE;
+
+DECLARE v_status VARCHAR(16);
+
+DECLARE v_ingredient_id INT;
+
+SELECT
+    quantity,
+    reserved_quantity,
+    expiration_date,
+    status,
+    ingredient_id INTO v_quantity,
+    v_reserved,
+    v_expiration,
+    v_status,
+    v_ingredient_id
+FROM
+    IngredientBatch
+WHERE
+    lot_number = NEW.lot_number FOR
+UPDATE;
+
+IF v_expiration IS NULL THEN SIGNAL SQLSTATE '45000'
+SET
+    MESSAGE_TEXT = 'Error: Ingredient lot does not exist.';
+
+END IF;
+
+IF CURDATE() > v_expiration
+OR v_status = 'EXPIRED' THEN SIGNAL SQLSTATE '45000'
+SET
+    MESSAGE_TEXT = 'Error: Reservation rejected because the ingredient lot has expired.';
+
+END IF;
+
+IF v_quantity - v_reserved < NEW.quantity THEN SIGNAL SQLSTATE '45000'
+SET
+    MESSAGE_TEXT = 'Error: Insufficient unreserved quantity in ingredient lot for this reservation.';
+
+END IF;
+
+IF NEW.expires_at <= NOW() THEN SIGNAL SQLSTATE '45000'
+SET
+    MESSAGE_TEXT = 'Error: Reservation expires_at must be in the future.';
+
+END IF;
+
+SET
+    NEW.status = 'OPEN',
+    NEW.ingredient_id = v_ingredient_id,
+    NEW.lot_expiration_date = v_expiration;
+
+END $$
+-- ---------------------------------------------------------
+-- 15) LotReservation: BEFORE UPDATE
+--     - Only OPEN reservations change, and only their status
+--       (plus the conversion / closing columns)
+-- ---------------------------------------------------------
+CREATE TRIGGER trg_lot_reservation_pre_update BEFORE
+UPDATE ON LotReservation FOR EACH ROW BEGIN IF OLD.status <> 'OPEN' THEN SIGNAL SQLSTATE '45000'
+SET
+    MESSAGE_TEXT = 'Error: Reservation is already closed.';
+
+END IF;
+
+IF NEW.lot_number <> OLD.lot_number
+OR NEW.quantity <> OLD.quantity THEN SIGNAL SQLSTATE '45000'
+SET
+    MESSAGE_TEXT = 'Error: Reservation lot and quantity cannot change. Release it and reserve again.';
+
+END IF;
+
+IF NEW.status <> 'OPEN'
+AND NEW.closed_at IS NULL THEN
+SET
+    NEW.closed_at = NOW();
+
+END IF;
+
+END $$
+-- ---------------------------------------------------------
+-- 16) LotReservation: AFTER INSERT / AFTER UPDATE / AFTER DELETE
+--     - Keep IngredientBatch.reserved_quantity equal to the sum of
+--       the lot's OPEN reservations
+-- ---------------------------------------------------------
+CREATE TRIGGER trg_lot_reservation_insert
+AFTER
+INSERT
+    ON LotReservation FOR EACH ROW BEGIN
+UPDATE IngredientBatch
+SET
+    reserved_quantity = reserved_quantity + NEW.quantity
+WHERE
+    lot_number = NEW.lot_number;
+
+END $$
+CREATE TRIGGER trg_lot_reservation_update
+AFTER
+UPDATE ON LotReservation FOR EACH ROW BEGIN IF OLD.status = 'OPEN'
+AND NEW.status <> 'OPEN' THEN
+UPDATE IngredientBatch
+SET
+    reserved_quantity = GREATEST(reserved_quantity - OLD.quantity, 0)
+WHERE
+    lot_number = OLD.lot_number;
+
+END IF;
+
+END $$
+CREATE TRIGGER trg_lot_reservation_delete
+AFTER DELETE ON LotReservation FOR EACH ROW BEGIN IF OLD.status = 'OPEN' THEN
+UPDATE IngredientBatch
+SET
+    reserved_quantity = GREATEST(reserved_quantity - OLD.quantity, 0)
+WHERE
+    lot_number = OLD.lot_number;
+
+END IF;
+
+END $$
+-- ---------------------------------------------------------
+-- 17) IngredientBatch / ProductBatch / IngredientConsumption:
+--     AFTER INSERT / AFTER DELETE
+--     - Append every intake, production and consumption (and
+--       removed consumption) to the InventoryEvent outbox in the
+--       same transaction, so an event exists exactly when the
+--       change commits
+-- ---------------------------------------------------------
+CREATE TRIGGER trg_ingredient_batch_outbox
+AFTER
+INSERT
+    ON IngredientBatch FOR EACH ROW BEGIN
+INSERT INTO
+    InventoryEvent (event_type, lot_number, ingredient_id, supplier_id, quantity)
+VALUES
+    ('INTAKE', NEW.lot_number, NEW.ingredient_id, NEW.supplier_id, NEW.quantity);
+
+END $$
+CREATE TRIGGER trg_product_batch_outbox
+AFTER
+INSERT
+    ON ProductBatch FOR EACH ROW BEGIN
+INSERT INTO
+    InventoryEvent (event_type, lot_number, product_id, manufacturer_id, quantity)
+VALUES
+    ('PRODUCTION', NEW.lot_number, NEW.product_id, NEW.manufacturer_id, NEW.produced_quantity);
+
+END $$
+CREATE TRIGGER trg_ingredient_consumption_outbox_insert
+AFTER
+INSERT
+    ON IngredientConsumption FOR EACH ROW BEGIN
+INSERT INTO
+    InventoryEvent (
+        event_type,
+        lot_number,
+        ingredient_lot_number,
+        ingredient_id,
+        supplier_id,
+        product_id,
+        manufacturer_id,
+        quantity
+    )
+SELECT
+    'CONSUMPTION',
+    NEW.product_lot_number,
+    NEW.ingredient_lot_number,
+    ib.ingredient_id,
+    ib.supplier_id,
+    pb.product_id,
+    pb.manufacturer_id,
+    NEW.consumed_quantity_oz
+FROM
+    IngredientBatch ib
+    JOIN ProductBatch pb ON pb.lot_number = NEW.product_lot_number
+WHERE
+    ib.lot_number = NEW.ingredient_lot_number;
+
+END $$
+CREATE TRIGGER trg_ingredient_consumption_outbox_delete
+AFTER DELETE ON IngredientConsumption FOR EACH ROW BEGIN
+INSERT INTO
+    InventoryEvent (
+        event_type,
+        lot_number,
+        ingredient_lot_number,
+        ingredient_id,
+        supplier_id,
+        product_id,
+        manufacturer_id,
+        quantity
+    )
+SELECT
+    'CONSUMPTION_REVERSED',
+    OLD.product_lot_number,
+    OLD.ingredient_lot_number,
+    ib.ingredient_id,
+    ib.supplier_id,
+    pb.product_id,
+    pb.manufacturer_id,
+    OLD.consumed_quantity_oz
+FROM
+    IngredientBatch ib
+    JOIN ProductBatch pb ON pb.lot_number = OLD.product_lot_number
+WHERE
+    ib.lot_number = OLD.ingredient_lot_number;
+
 END $$ DELIMITER;
\ No newline at end of file
@@ -0,0 +1,669 @@
+-- =========================================================
+-- triggers_sqlite.sql
+-- The triggers of triggers.sql for the embedded SQLite backend
+-- (DB_BACKEND=sqlite). Same names, same rules and the same error
+-- messages; keep the two files in step.
+--
+-- SQLite differences:
+--  - RAISE(ABORT, 'Error: ...') instead of SIGNAL (reported as
+--    errno 1644 by sqlite_backend)
+--  - BEFORE triggers cannot SET NEW columns, so generated columns
+--    (lot_number, the reservation copies, closed_at) are written by
+--    AFTER triggers
+--  - foreign key cascades fire triggers on SQLite but not on MySQL;
+--    the triggers that would react to a cascade are guarded
+--  - triggers for the same event fire in reverse creation order
+--  - no row locks: a write transaction locks the whole database
+-- =========================================================
+DELIMITER $$
+-- ---------------------------------------------------------
+-- 1) IngredientBatch: BEFORE INSERT / AFTER INSERT
+--    - Enforces: expiration_date must be at least 90 days from today
+--    - Generates lot_number = <ingredient_id>-<supplier_id>-<batch_id>
+-- ---------------------------------------------------------
+CREATE TRIGGER trg_ingredient_batch_pre_insert BEFORE INSERT ON IngredientBatch FOR EACH ROW BEGIN
+SELECT
+    RAISE(ABORT, 'Error: Ingredient intake rejected. Expiration date must be at least 90 days from the intake date.')
+WHERE
+    NEW.expiration_date < DATE_ADD(CURDATE(), 90, 'DAY');
+
+END $$
+CREATE TRIGGER trg_ingredient_batch_lot_number AFTER INSERT ON IngredientBatch FOR EACH ROW BEGIN
+UPDATE IngredientBatch
+SET
+    lot_number = CONCAT(NEW.ingredient_id, '-', NEW.supplier_id, '-', NEW.batch_id)
+WHERE
+    rowid = NEW.rowid;
+
+END $$
+-- ---------------------------------------------------------
+-- 2) IngredientConsumption: BEFORE INSERT
+--    - Validates ingredient lot exists
+--    - Rejects expired lots
+--    - Ensures sufficient unreserved quantity
+--    - Enforces IngredientIncompatibility rules per product batch
+--    - Decrements IngredientBatch.quantity for the consumed lot
+-- ---------------------------------------------------------
+CREATE TRIGGER trg_prevent_expired_consumption BEFORE INSERT ON IngredientConsumption FOR EACH ROW BEGIN
+SELECT
+    RAISE(ABORT, 'Error: Ingredient lot does not exist.')
+WHERE
+    NOT EXISTS (
+        SELECT
+            1
+        FROM
+            IngredientBatch
+        WHERE
+            lot_number = NEW.ingredient_lot_number
+    );
+
+SELECT
+    RAISE(ABORT, 'Error: Consumption rejected because the ingredient lot has expired.')
+FROM
+    IngredientBatch
+WHERE
+    lot_number = NEW.ingredient_lot_number
+    AND (
+        CURDATE() > expiration_date
+        OR status = 'EXPIRED'
+    );
+
+SELECT
+    RAISE(ABORT, 'Error: Insufficient quantity in ingredient lot for this consumption.')
+FROM
+    IngredientBatch
+WHERE
+    lot_number = NEW.ingredient_lot_number
+    AND quantity - reserved_quantity < NEW.consumed_quantity_oz;
+
+SELECT
+    RAISE(ABORT, 'Error: Ingredient is incompatible with another ingredient already used in this product batch.')
+WHERE
+    EXISTS (
+        SELECT
+            1
+        FROM
+            IngredientBatch nb
+            JOIN IngredientConsumption ic ON ic.product_lot_number = NEW.product_lot_number
+            JOIN IngredientBatch ib ON ic.ingredient_lot_number = ib.lot_number
+            JOIN IngredientIncompatibility ii ON (
+                ii.ingredient_a = nb.ingredient_id
+                AND ii.ingredient_b = ib.ingredient_id
+            )
+            OR (
+                ii.ingredient_b = nb.ingredient_id
+                AND ii.ingredient_a = ib.ingredient_id
+            )
+        WHERE
+            nb.lot_number = NEW.ingredient_lot_number
+    );
+
+UPDATE IngredientBatch
+SET
+    quantity = quantity - NEW.consumed_quantity_oz
+WHERE
+    lot_number = NEW.ingredient_lot_number;
+
+END $$
+-- ---------------------------------------------------------
+-- 3) IngredientConsumption: BEFORE UPDATE
+--    - Disallow updates to keep consumption as an append-only ledger
+-- ---------------------------------------------------------
+CREATE TRIGGER trg_ingredient_consumption_pre_update BEFORE UPDATE ON IngredientConsumption FOR EACH ROW BEGIN
+SELECT
+    RAISE(ABORT, 'Error: Updates to IngredientConsumption are not allowed. Delete and re-insert instead.');
+
+END $$
+-- ---------------------------------------------------------
+-- 4) IngredientConsumption: BEFORE DELETE
+--    - Restores IngredientBatch.quantity when a consumption row
+--      is removed (not when the product batch delete cascades)
+-- ---------------------------------------------------------
+CREATE TRIGGER trg_ingredient_consumption_pre_delete BEFORE DELETE ON IngredientConsumption FOR EACH ROW
+WHEN EXISTS (
+    SELECT
+        1
+    FROM
+        ProductBatch
+    WHERE
+        lot_number = OLD.product_lot_number
+) BEGIN
+UPDATE IngredientBatch
+SET
+    quantity = quantity + OLD.consumed_quantity_oz
+WHERE
+    lot_number = OLD.ingredient_lot_number;
+
+END $$
+-- ---------------------------------------------------------
+-- 5) ManufacturerProduct: BEFORE INSERT
+--    - Validates that manufacturer_id exists and has role MANUFACTURER
+-- ---------------------------------------------------------
+CREATE TRIGGER trg_manufacturer_product_role_check BEFORE INSERT ON ManufacturerProduct FOR EACH ROW BEGIN
+SELECT
+    CASE
+        WHEN role_code IS NULL THEN RAISE(ABORT, 'Error: manufacturer_id does not reference an existing user.')
+        WHEN role_code <> 'MANUFACTURER' THEN RAISE(ABORT, 'Error: manufacturer_id must belong to a MANUFACTURER user.')
+    END
+FROM
+    (
+        SELECT
+            (
+                SELECT
+                    role_code
+                FROM
+                    UserDetails
+                WHERE
+                    id = NEW.manufacturer_id
+            ) AS role_code
+    );
+
+END $$
+-- ---------------------------------------------------------
+-- 6) ManufacturerProduct: BEFORE UPDATE
+--    - Same validation as insert when manufacturer_id is changed
+-- ---------------------------------------------------------
+CREATE TRIGGER trg_manufacturer_product_role_check_update BEFORE UPDATE ON ManufacturerProduct FOR EACH ROW BEGIN
+SELECT
+    CASE
+        WHEN role_code IS NULL THEN RAISE(ABORT, 'Error: manufacturer_id does not reference an existing user.')
+        WHEN role_code <> 'MANUFACTURER' THEN RAISE(ABORT, 'Error: manufacturer_id must belong to a MANUFACTURER user.')
+    END
+FROM
+    (
+        SELECT
+            (
+                SELECT
+                    role_code
+                FROM
+                    UserDetails
+                WHERE
+                    id = NEW.manufacturer_id
+            ) AS role_code
+    );
+
+END $$
+-- ---------------------------------------------------------
+-- 7) IngredientFormulation: BEFORE INSERT
+--    - Validates that supplier_id belongs to a SUPPLIER user
+-- ---------------------------------------------------------
+CREATE TRIGGER trg_ingredient_formulation_role_check BEFORE INSERT ON IngredientFormulation FOR EACH ROW BEGIN
+SELECT
+    CASE
+        WHEN role_code IS NULL THEN RAISE(ABORT, 'Error: supplier_id does not reference an existing user.')
+        WHEN role_code <> 'SUPPLIER' THEN RAISE(ABORT, 'Error: supplier_id must belong to a SUPPLIER user.')
+    END
+FROM
+    (
+        SELECT
+            (
+                SELECT
+                    role_code
+                FROM
+                    UserDetails
+                WHERE
+                    id = NEW.supplier_id
+            ) AS role_code
+    );
+
+END $$
+-- ---------------------------------------------------------
+-- 8) IngredientFormulation: BEFORE UPDATE
+--    - Same validation as insert when supplier_id is changed
+-- ---------------------------------------------------------
+CREATE TRIGGER trg_ingredient_formulation_role_check_update BEFORE UPDATE ON IngredientFormulation FOR EACH ROW BEGIN
+SELECT
+    CASE
+        WHEN role_code IS NULL THEN RAISE(ABORT, 'Error: supplier_id does not reference an existing user (update).')
+        WHEN role_code <> 'SUPPLIER' THEN RAISE(ABORT, 'Error: supplier_id must belong to a SUPPLIER user (update).')
+    END
+FROM
+    (
+        SELECT
+            (
+                SELECT
+                    role_code
+                FROM
+                    UserDetails
+                WHERE
+                    id = NEW.supplier_id
+            ) AS role_code
+    );
+
+END $$
+-- ---------------------------------------------------------
+-- 9) IngredientBatch: BEFORE INSERT
+--    - Validates that supplier_id belongs to a SUPPLIER user
+--    (additional to the 90-day trigger above)
+-- ---------------------------------------------------------
+CREATE TRIGGER trg_ingredient_batch_role_check BEFORE INSERT ON IngredientBatch FOR EACH ROW BEGIN
+SELECT
+    CASE
+        WHEN role_code IS NULL THEN RAISE(ABORT, 'Error: supplier_id does not reference an existing user.')
+        WHEN role_code <> 'SUPPLIER' THEN RAISE(ABORT, 'Error: supplier_id must belong to a SUPPLIER user.')
+    END
+FROM
+    (
+        SELECT
+            (
+                SELECT
+                    role_code
+                FROM
+                    UserDetails
+                WHERE
+                    id = NEW.supplier_id
+            ) AS role_code
+    );
+
+END $$
+-- ---------------------------------------------------------
+-- 10) IngredientBatch: BEFORE UPDATE
+--     - Keeps the supplier_id restricted to SUPPLIER when changed
+-- ---------------------------------------------------------
+CREATE TRIGGER trg_ingredient_batch_role_check_update BEFORE UPDATE OF supplier_id ON IngredientBatch FOR EACH ROW BEGIN
+SELECT
+    CASE
+        WHEN role_code IS NULL THEN RAISE(ABORT, 'Error: supplier_id does not reference an existing user (update).')
+        WHEN role_code <> 'SUPPLIER' THEN RAISE(ABORT, 'Error: supplier_id must belong to a SUPPLIER user (update).')
+    END
+FROM
+    (
+        SELECT
+            (
+                SELECT
+                    role_code
+                FROM
+                    UserDetails
+                WHERE
+                    id = NEW.supplier_id
+            ) AS role_code
+    );
+
+END $$
+-- ---------------------------------------------------------
+-- 11) RecipePlanBOM: BEFORE UPDATE / BEFORE DELETE
+--     - Plan BOM snapshots are immutable once written; create a
+--       new RecipePlan version instead of editing an old one
+--     - Deleting the plan itself still cascades
+-- ---------------------------------------------------------
+CREATE TRIGGER trg_recipe_plan_bom_pre_update BEFORE UPDATE ON RecipePlanBOM FOR EACH ROW BEGIN
+SELECT
+    RAISE(ABORT, 'Error: Recipe plan BOM snapshots are immutable. Create a new plan version instead.');
+
+END $$
+CREATE TRIGGER trg_recipe_plan_bom_pre_delete BEFORE DELETE ON RecipePlanBOM FOR EACH ROW
+WHEN EXISTS (
+    SELECT
+        1
+    FROM
+        RecipePlan
+    WHERE
+        plan_id = OLD.plan_id
+) BEGIN
+SELECT
+    RAISE(ABORT, 'Error: Recipe plan BOM snapshots are immutable. Create a new plan version instead.');
+
+END $$
+-- ---------------------------------------------------------
+-- 12) IngredientBatch: AFTER INSERT / AFTER UPDATE / AFTER DELETE
+--     - Keep IngredientOnHand and IngredientOnHandByExpiry in step
+--       with every lot change in the same transaction
+--     - Reservation changes to IngredientBatch.reserved_quantity
+--       are carried into IngredientOnHand.reserved_quantity
+-- ---------------------------------------------------------
+CREATE TRIGGER trg_ingredient_batch_summary_insert AFTER INSERT ON IngredientBatch FOR EACH ROW BEGIN
+INSERT INTO
+    IngredientOnHand (ingredient_id, quantity, lot_count)
+VALUES
+    (NEW.ingredient_id, NEW.quantity, NEW.quantity > 0) ON CONFLICT (ingredient_id) DO
+UPDATE
+SET
+    quantity = quantity + excluded.quantity,
+    lot_count = lot_count + excluded.lot_count;
+
+INSERT INTO
+    IngredientOnHandByExpiry (ingredient_id, expiry_bucket, quantity, lot_count)
+VALUES
+    (
+        NEW.ingredient_id,
+        date(NEW.expiration_date, 'start of month'),
+        NEW.quantity,
+        NEW.quantity > 0
+    ) ON CONFLICT (ingredient_id, expiry_bucket) DO
+UPDATE
+SET
+    quantity = quantity + excluded.quantity,
+    lot_count = lot_count + excluded.lot_count;
+
+END $$
+-- Status-only changes (expiry sweeps) leave the summary untouched
+CREATE TRIGGER trg_ingredient_batch_summary_update AFTER UPDATE ON IngredientBatch FOR EACH ROW
+WHEN OLD.quantity <> NEW.quantity
+OR OLD.ingredient_id <> NEW.ingredient_id
+OR OLD.expiration_date <> NEW.expiration_date BEGIN
+-- Remove the old row image ...
+UPDATE IngredientOnHand
+SET
+    quantity = quantity - OLD.quantity,
+    lot_count = lot_count - (OLD.quantity > 0)
+WHERE
+    ingredient_id = OLD.ingredient_id;
+
+UPDATE IngredientOnHandByExpiry
+SET
+    quantity = quantity - OLD.quantity,
+    lot_count = lot_count - (OLD.quantity > 0)
+WHERE
+    ingredient_id = OLD.ingredient_id
+    AND expiry_bucket = date(OLD.expiration_date, 'start of month');
+
+-- ... and add the new one (handles ingredient / expiry changes too)
+INSERT INTO
+    IngredientOnHand (ingredient_id, quantity, lot_count)
+VALUES
+    (NEW.ingredient_id, NEW.quantity, NEW.quantity > 0) ON CONFLICT (ingredient_id) DO
+UPDATE
+SET
+    quantity = quantity + excluded.quantity,
+    lot_count = lot_count + excluded.lot_count;
+
+INSERT INTO
+    IngredientOnHandByExpiry (ingredient_id, expiry_bucket, quantity, lot_count)
+VALUES
+    (
+        NEW.ingredient_id,
+        date(NEW.expiration_date, 'start of month'),
+        NEW.quantity,
+        NEW.quantity > 0
+    ) ON CONFLICT (ingredient_id, expiry_bucket) DO
+UPDATE
+SET
+    quantity = quantity + excluded.quantity,
+    lot_count = lot_count + excluded.lot_count;
+
+END $$
+CREATE TRIGGER trg_ingredient_batch_summary_reserved AFTER UPDATE OF reserved_quantity ON IngredientBatch FOR EACH ROW
+WHEN OLD.reserved_quantity <> NEW.reserved_quantity BEGIN
+UPDATE IngredientOnHand
+SET
+    reserved_quantity = reserved_quantity + NEW.reserved_quantity - OLD.reserved_quantity
+WHERE
+    ingredient_id = NEW.ingredient_id;
+
+END $$
+CREATE TRIGGER trg_ingredient_batch_summary_delete AFTER DELETE ON IngredientBatch FOR EACH ROW BEGIN
+UPDATE IngredientOnHand
+SET
+    quantity = quantity - OLD.quantity,
+    reserved_quantity = reserved_quantity - OLD.reserved_quantity,
+    lot_count = lot_count - (OLD.quantity > 0)
+WHERE
+    ingredient_id = OLD.ingredient_id;
+
+UPDATE IngredientOnHandByExpiry
+SET
+    quantity = quantity - OLD.quantity,
+    lot_count = lot_count - (OLD.quantity > 0)
+WHERE
+    ingredient_id = OLD.ingredient_id
+    AND expiry_bucket = date(OLD.expiration_date, 'start of month');
+
+END $$
+-- ---------------------------------------------------------
+-- 13) IngredientConsumption: AFTER INSERT / AFTER DELETE
+--     - Maintain the LotLineage edge of every consumption row
+-- ---------------------------------------------------------
+CREATE TRIGGER trg_ingredient_consumption_lineage_insert AFTER INSERT ON IngredientConsumption FOR EACH ROW BEGIN
+INSERT INTO
+    LotLineage (
+        ingredient_lot_number,
+        product_lot_number,
+        ingredient_id,
+        supplier_id,
+        product_id,
+        manufacturer_id,
+        production_date,
+        consumed_quantity_oz
+    )
+SELECT
+    ib.lot_number,
+    pb.lot_number,
+    ib.ingredient_id,
+    ib.supplier_id,
+    pb.product_id,
+    pb.manufacturer_id,
+    pb.production_date,
+    NEW.consumed_quantity_oz
+FROM
+    IngredientBatch ib
+    JOIN ProductBatch pb ON pb.lot_number = NEW.product_lot_number
+WHERE
+    ib.lot_number = NEW.ingredient_lot_number;
+
+END $$
+CREATE TRIGGER trg_ingredient_consumption_lineage_delete AFTER DELETE ON IngredientConsumption FOR EACH ROW BEGIN
+DELETE FROM LotLineage
+WHERE
+    ingredient_lot_number = OLD.ingredient_lot_number
+    AND product_lot_number = OLD.product_lot_number;
+
+END $$
+-- ---------------------------------------------------------
+-- 14) LotReservation: BEFORE INSERT / AFTER INSERT
+--     - Lot must exist, be LIVE and not expired
+--     - Quantity must fit in the lot's unreserved quantity
+--     - expires_at must be in the future
+--     - Copies ingredient_id / lot_expiration_date from the lot
+-- ---------------------------------------------------------
+CREATE TRIGGER trg_lot_reservation_pre_insert BEFORE INSERT ON LotReservation FOR EACH ROW BEGIN
+SELECT
+    RAISE(ABORT, 'Error: Ingredient lot does not exist.')
+WHERE
+    NOT EXISTS (
+        SELECT
+            1
+        FROM
+            IngredientBatch
+        WHERE
+            lot_number = NEW.lot_number
+    );
+
+SELECT
+    RAISE(ABORT, 'Error: Reservation rejected because the ingredient lot has expired.')
+FROM
+    IngredientBatch
+WHERE
+    lot_number = NEW.lot_number
+    AND (
+        CURDATE() > expiration_date
+        OR status = 'EXPIRED'
+    );
+
+SELECT
+    RAISE(ABORT, 'Error: Insufficient unreserved quantity in ingredient lot for this reservation.')
+FROM
+    IngredientBatch
+WHERE
+    lot_number = NEW.lot_number
+    AND quantity - reserved_quantity < NEW.quantity;
+
+SELECT
+    RAISE(ABORT, 'Error: Reservation expires_at must be in the future.')
+WHERE
+    NEW.expires_at <= NOW();
+
+END $$
+CREATE TRIGGER trg_lot_reservation_copy_lot AFTER INSERT ON LotReservation FOR EACH ROW BEGIN
+UPDATE LotReservation
+SET
+    ingredient_id = (
+        SELECT
+            ingredient_id
+        FROM
+            IngredientBatch
+        WHERE
+            lot_number = NEW.lot_number
+    ),
+    lot_expiration_date = (
+        SELECT
+            expiration_date
+        FROM
+            IngredientBatch
+        WHERE
+            lot_number = NEW.lot_number
+    )
+WHERE
+    reservation_id = NEW.reservation_id;
+
+END $$
+-- ---------------------------------------------------------
+-- 15) LotReservation: BEFORE UPDATE / AFTER UPDATE
+--     - Only OPEN reservations change, and only their status
+--       (plus the conversion / closing columns)
+--     - Closing a reservation stamps closed_at
+--     - Not fired by the SET NULL cascade of product_lot_number
+-- ---------------------------------------------------------
+CREATE TRIGGER trg_lot_reservation_pre_update BEFORE UPDATE OF status, lot_number, quantity ON LotReservation FOR EACH ROW BEGIN
+SELECT
+    RAISE(ABORT, 'Error: Reservation is already closed.')
+WHERE
+    OLD.status <> 'OPEN';
+
+SELECT
+    RAISE(ABORT, 'Error: Reservation lot and quantity cannot change. Release it and reserve again.')
+WHERE
+    NEW.lot_number <> OLD.lot_number
+    OR NEW.quantity <> OLD.quantity;
+
+END $$
+CREATE TRIGGER trg_lot_reservation_closed_at AFTER UPDATE OF status ON LotReservation FOR EACH ROW
+WHEN NEW.status <> 'OPEN'
+AND NEW.closed_at IS NULL BEGIN
+UPDATE LotReservation
+SET
+    closed_at = NOW()
+WHERE
+    reservation_id = NEW.reservation_id;
+
+END $$
+-- ---------------------------------------------------------
+-- 16) LotReservation: AFTER INSERT / AFTER UPDATE / AFTER DELETE
+--     - Keep IngredientBatch.reserved_quantity equal to the sum of
+--       the lot's OPEN reservations
+-- ---------------------------------------------------------
+CREATE TRIGGER trg_lot_reservation_insert AFTER INSERT ON LotReservation FOR EACH ROW BEGIN
+UPDATE IngredientBatch
+SET
+    reserved_quantity = reserved_quantity + NEW.quantity
+WHERE
+    lot_number = NEW.lot_number;
+
+END $$
+CREATE TRIGGER trg_lot_reservation_update AFTER UPDATE OF status ON LotReservation FOR EACH ROW
+WHEN OLD.status = 'OPEN'
+AND NEW.status <> 'OPEN' BEGIN
+UPDATE IngredientBatch
+SET
+    reserved_quantity = MAX(reserved_quantity - OLD.quantity, 0)
+WHERE
+    lot_number = OLD.lot_number;
+
+END $$
+CREATE TRIGGER trg_lot_reservation_delete AFTER DELETE ON LotReservation FOR EACH ROW
+WHEN OLD.status = 'OPEN' BEGIN
+UPDATE IngredientBatch
+SET
+    reserved_quantity = MAX(reserved_quantity - OLD.quantity, 0)
+WHERE
+    lot_number = OLD.lot_number;
+
+END $$
+-- ---------------------------------------------------------
+-- 17) IngredientBatch / ProductBatch / IngredientConsumption:
+--     AFTER INSERT / AFTER DELETE
+--     - Append every intake, production and consumption (and
+--       removed consumption) to the InventoryEvent outbox in the
+--       same transaction, so an event exists exactly when the
+--       change commits
+--     - lot_number is set by trg_ingredient_batch_lot_number (an
+--       AFTER trigger here), so the intake event builds it itself
+--     - no reversal event when the product batch delete cascades
+-- ---------------------------------------------------------
+CREATE TRIGGER trg_ingredient_batch_outbox AFTER INSERT ON IngredientBatch FOR EACH ROW BEGIN
+INSERT INTO
+    InventoryEvent (event_type, lot_number, ingredient_id, supplier_id, quantity)
+VALUES
+    ('INTAKE', CONCAT(NEW.ingredient_id, '-', NEW.supplier_id, '-', NEW.batch_id), NEW.ingredient_id, NEW.supplier_id, NEW.quantity);
+
+END $$
+CREATE TRIGGER trg_product_batch_outbox AFTER INSERT ON ProductBatch FOR EACH ROW BEGIN
+INSERT INTO
+    InventoryEvent (event_type, lot_number, product_id, manufacturer_id, quantity)
+VALUES
+    ('PRODUCTION', NEW.lot_number, NEW.product_id, NEW.manufacturer_id, NEW.produced_quantity);
+
+END $$
+CREATE TRIGGER trg_ingredient_consumption_outbox_insert AFTER INSERT ON IngredientConsumption FOR EACH ROW BEGIN
+INSERT INTO
+    InventoryEvent (
+        event_type,
+        lot_number,
+        ingredient_lot_number,
+        ingredient_id,
+        supplier_id,
+        product_id,
+        manufacturer_id,
+        quantity
+    )
+SELECT
+    'CONSUMPTION',
+    NEW.product_lot_number,
+    NEW.ingredient_lot_number,
+    ib.ingredient_id,
+    ib.supplier_id,
+    pb.product_id,
+    pb.manufacturer_id,
+    NEW.consumed_quantity_oz
+FROM
+    IngredientBatch ib
+    JOIN ProductBatch pb ON pb.lot_number = NEW.product_lot_number
+WHERE
+    ib.lot_number = NEW.ingredient_lot_number;
+
+END $$
+CREATE TRIGGER trg_ingredient_consumption_outbox_delete AFTER DELETE ON IngredientConsumption FOR EACH ROW
+WHEN EXISTS (
+    SELECT
+        1
+    FROM
+        ProductBatch
+    WHERE
+        lot_number = OLD.product_lot_number
+) BEGIN
+INSERT INTO
+    InventoryEvent (
+        event_type,
+        lot_number,
+        ingredient_lot_number,
+        ingredient_id,
+        supplier_id,
+        product_id,
+        manufacturer_id,
+        quantity
+    )
+SELECT
+    'CONSUMPTION_REVERSED',
+    OLD.product_lot_number,
+    OLD.ingredient_lot_number,
+    ib.ingredient_id,
+    ib.supplier_id,
+    pb.product_id,
+    pb.manufacturer_id,
+    OLD.consumed_quantity_oz
+FROM
+    IngredientBatch ib
+    JOIN ProductBatch pb ON pb.lot_number = OLD.product_lot_number
+WHERE
+    ib.lot_number = OLD.ingredient_lot_number;
+
+END $$ DELIMITER;